@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Chế độ ETL asyncio: chạy chồng các bước extract / transform / load thay vì tuần tự từng chunk
+
+    reader ──(raw, tối đa QUEUE_SIZE chunk)──▶ transform ──(transformed)──▶ writer
+
+- reader: đọc chunk CSV trên 1 thread riêng (pd.read_csv là blocking)
+- transform: transform_data chạy trong ThreadPoolExecutor, tối đa transform_workers chunk cùng lúc;
+  hàng đợi transformed chứa future theo đúng thứ tự chunk nên writer vẫn ghi tuần tự
+- writer: 1 thread riêng giữ connection psycopg2 (connection không dùng chung giữa các thread),
+  trong lúc chờ round-trip tới PostgreSQL thì reader/transform vẫn chạy
+- Hàng đợi có giới hạn => backpressure: writer chậm thì transform và reader dừng chờ, bộ nhớ không tăng
+- Độ sâu của từng hàng đợi được lấy mẫu định kỳ, thời gian chờ put/get được cộng dồn (etl_metrics)
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+import etl_metrics
+
+load_dotenv()
+
+# Số chunk tối đa trong mỗi hàng đợi
+QUEUE_SIZE = int(os.getenv("ETL_QUEUE_SIZE", "4"))
+# Số chunk được transform song song
+TRANSFORM_WORKERS = int(os.getenv("ETL_TRANSFORM_WORKERS", "2"))
+# Chu kỳ lấy mẫu độ sâu hàng đợi (giây)
+QUEUE_SAMPLE_INTERVAL = float(os.getenv("ETL_QUEUE_SAMPLE_INTERVAL", "0.1"))
+
+# Đánh dấu hết dữ liệu trong hàng đợi
+_DONE = None
+
+async def _put(queue, name, item):
+    start = time.perf_counter()
+    await queue.put(item)
+    etl_metrics.queue_wait(name, 'put', time.perf_counter() - start)
+    etl_metrics.observe_queue(name, queue.qsize(), queue.maxsize)
+
+async def _get(queue, name):
+    start = time.perf_counter()
+    item = await queue.get()
+    etl_metrics.queue_wait(name, 'get', time.perf_counter() - start)
+    etl_metrics.observe_queue(name, queue.qsize(), queue.maxsize)
+    return item
+
+def _in_chunk(index, func, *args):
+    """Chạy func trên thread của executor, gắn số chunk cho metric của thread đó"""
+    etl_metrics.set_chunk(index)
+    return func(*args)
+
+async def _reader(chunks, raw, executor):
+    loop = asyncio.get_running_loop()
+    # timed_chunks đánh số chunk và ghi metric 'extract' trên thread đọc
+    iterator = etl_metrics.timed_chunks(chunks)
+    index = 0
+    while True:
+        chunk = await loop.run_in_executor(executor, next, iterator, _DONE)
+        if chunk is _DONE:
+            break
+        index += 1
+        await _put(raw, 'raw', (index, chunk))
+    await _put(raw, 'raw', _DONE)
+
+async def _transformer(transform, raw, transformed, executor):
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await _get(raw, 'raw')
+        if item is _DONE:
+            break
+        index, chunk = item
+        future = loop.run_in_executor(executor, _in_chunk, index, transform, chunk)
+        await _put(transformed, 'transformed', (index, future))
+    await _put(transformed, 'transformed', _DONE)
+
+async def _writer(load, transformed, executor):
+    loop = asyncio.get_running_loop()
+    count = 0
+    while True:
+        item = await _get(transformed, 'transformed')
+        if item is _DONE:
+            return count
+        index, future = item
+        cleaned = await future
+        await loop.run_in_executor(executor, _in_chunk, index, load, cleaned, index)
+        count += 1
+
+async def _sample_queues(queues):
+    while True:
+        for name, queue in queues.items():
+            etl_metrics.observe_queue(name, queue.qsize(), queue.maxsize)
+        await asyncio.sleep(QUEUE_SAMPLE_INTERVAL)
+
+async def run_async(chunks, transform, load, queue_size=None, transform_workers=None):
+    """
+    Chạy pipeline trên iterator chunks:
+    - transform(chunk) -> DataFrame đã làm sạch (chạy trên thread của executor transform)
+    - load(cleaned, chunk_index) ghi 1 chunk vào database và commit (luôn trên cùng 1 thread)
+    Trả về số chunk đã load. Lỗi ở bất kỳ stage nào sẽ hủy các stage còn lại và được raise lại.
+    """
+    queue_size = queue_size or QUEUE_SIZE
+    transform_workers = transform_workers or TRANSFORM_WORKERS
+    queues = {
+        'raw': asyncio.Queue(maxsize=queue_size),
+        # Mỗi phần tử là 1 future transform đang chạy hoặc đã xong => giới hạn cả số chunk đang transform
+        'transformed': asyncio.Queue(maxsize=max(queue_size, transform_workers)),
+    }
+    with ThreadPoolExecutor(1, thread_name_prefix='etl-reader') as reader_pool, \
+            ThreadPoolExecutor(transform_workers, thread_name_prefix='etl-transform') as transform_pool, \
+            ThreadPoolExecutor(1, thread_name_prefix='etl-writer') as writer_pool:
+        sampler = asyncio.create_task(_sample_queues(queues))
+        tasks = [
+            asyncio.create_task(_reader(chunks, queues['raw'], reader_pool)),
+            asyncio.create_task(_transformer(transform, queues['raw'], queues['transformed'], transform_pool)),
+            asyncio.create_task(_writer(load, queues['transformed'], writer_pool)),
+        ]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            sampler.cancel()
+    return results[-1]
+
+def run_pipeline(chunks, transform, load, queue_size=None, transform_workers=None):
+    """Bản đồng bộ của run_async (gọi từ create_warehouse.main)"""
+    return asyncio.run(run_async(chunks, transform, load, queue_size, transform_workers))
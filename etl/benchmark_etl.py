@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+================================================================================
+BENCHMARK THROUGHPUT CỦA ETL
+================================================================================
+Chạy các bước extract_data → transform_data → load_dimensions → load_facts của
+create_warehouse.py trên 1 file CSV (thường sinh bằng generate_synthetic_data.py) với
+PostgreSQL local, đo cho từng bước:
+- rows/s  : số dòng đầu vào của bước / thời gian
+- MB/s    : extract tính theo byte CSV đọc được, các bước sau theo kích thước DataFrame đầu vào
+- peak RSS: RSS lớn nhất của process trong lúc bước đó chạy (lấy mẫu /proc/self/status)
+
+Kết quả ghi ra JSON (baseline) để so sánh giữa các commit:
+    python generate_synthetic_data.py --rows 1000000 --output bench.csv
+    python benchmark_etl.py --csv bench.csv --output baseline.json
+    python benchmark_etl.py --csv bench.csv --compare baseline.json
+
+--elt đo chế độ ELT (elt_warehouse.py) với cùng các bước để so với đường Python:
+extract = COPY vào etl_landing, transform = SQL làm sạch/kiểm tra, load_* = INSERT ... SELECT.
+MB của các bước sau extract là kích thước bảng đầu vào trong PostgreSQL; peak RSS chỉ tính
+process Python (bộ nhớ của server không nằm trong số đo)
+    python benchmark_etl.py --csv bench.csv --elt --compare baseline.json
+
+Benchmark tạo lại schema (DROP + CREATE) trong database riêng BENCH_DB_NAME (mặc định <DB_NAME>_bench,
+tạo nếu chưa có; --database để đổi), không đụng kho dữ liệu dashboard đang đọc. Nếu trỏ vào chính kho
+dữ liệu đó thì data_version được tăng để result cache / figure cache / query service bỏ kết quả cũ
+================================================================================
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+import pandas as pd
+import psycopg2
+from psycopg2 import sql
+
+import chart_history
+import create_warehouse
+from create_warehouse import (
+    create_tables, extract_data, transform_data, load_calendar, load_dimensions, load_facts, bump_data_version
+)
+
+STAGES = ['extract', 'transform', 'load_dimensions', 'load_facts']
+
+# Database riêng của benchmark (schema bị tạo lại mỗi lần chạy)
+BENCH_DB_NAME = os.getenv("BENCH_DB_NAME") or f"{create_warehouse.DB_NAME}_bench"
+
+def connect(dbname=None):
+    """Connection tới database benchmark (mặc định BENCH_DB_NAME), tạo database nếu chưa có"""
+    dbname = dbname or BENCH_DB_NAME
+    params = dict(host=create_warehouse.DB_HOST, port=create_warehouse.DB_PORT,
+                  user=create_warehouse.DB_USER, password=create_warehouse.DB_PASS)
+    admin = psycopg2.connect(dbname=create_warehouse.DB_NAME, **params)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (dbname,))
+            if cur.fetchone() is None:
+                cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(dbname)))
+    finally:
+        admin.close()
+    return psycopg2.connect(dbname=dbname, **params)
+
+def recreate_schema(cur):
+    """
+    Tạo lại schema; tăng data_version như create_warehouse.main() để cache của dashboard
+    không coi kết quả trước benchmark là còn hiệu lực (khi database benchmark là kho dữ liệu thật)
+    """
+    create_tables(cur)
+    bump_data_version(cur)
+
+# ========================================
+# ĐO RSS
+# ========================================
+
+def current_rss_mb():
+    """RSS hiện tại của process (MB); ngoài Linux dùng ru_maxrss (đỉnh từ đầu process)"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 / 1024 if sys.platform == 'darwin' else maxrss / 1024
+
+class RssSampler:
+    """Thread nền lấy mẫu RSS, ghi lại giá trị lớn nhất cho bước đang chạy"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stage = None
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.record()
+            time.sleep(self.interval)
+
+    def record(self):
+        stage = self.stage
+        if stage is not None:
+            self.peaks[stage] = max(self.peaks.get(stage, 0.0), current_rss_mb())
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        """Đặt bước hiện tại; lấy mẫu ngay lúc bắt đầu và kết thúc để bước ngắn vẫn có số liệu"""
+        self.stage = stage
+        self.record()
+        try:
+            yield
+        finally:
+            self.record()
+            self.stage = None
+
+# ========================================
+# CHẠY BENCHMARK
+# ========================================
+
+def frame_mb(df):
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(csv_file, chunk_size=10000, max_chunks=None, verbose=False, dbname=None):
+    """Chạy ETL trên csv_file trong database dbname (mặc định BENCH_DB_NAME), trả về dict kết quả (meta + từng bước)"""
+    totals = {stage: {'rows': 0, 'seconds': 0.0, 'mb': 0.0} for stage in STAGES}
+    csv_mb = os.path.getsize(csv_file) / 1024 / 1024
+    # Log của ETL bị ẩn mặc định để không ảnh hưởng thời gian đo
+    quiet = contextlib.nullcontext if verbose else lambda: contextlib.redirect_stdout(io.StringIO())
+
+    conn = connect(dbname)
+    cur = conn.cursor()
+    cur.execute("SELECT current_setting('server_version')")
+    server_version = cur.fetchone()[0]
+
+    with quiet():
+        recreate_schema(cur)
+        load_calendar(csv_file, cur)
+    conn.commit()
+    history = chart_history.ChartHistory()
+
+    sampler = RssSampler().start()
+    started = time.perf_counter()
+    chunk_count = 0
+    try:
+        with quiet():
+            chunk_iterator = extract_data(csv_file, chunk_size)
+        while max_chunks is None or chunk_count < max_chunks:
+            with sampler.measure('extract'):
+                start = time.perf_counter()
+                chunk = next(chunk_iterator, None)
+                elapsed = time.perf_counter() - start
+            if chunk is None:
+                break
+            chunk_count += 1
+            totals['extract']['rows'] += len(chunk)
+            totals['extract']['seconds'] += elapsed
+
+            stage_input = chunk
+            for stage, step in [('transform', lambda df: transform_data(df)),
+                                ('load_dimensions', lambda df: load_dimensions(df, cur)),
+                                ('load_facts', lambda df: load_facts(df, cur, history=history))]:
+                mb = frame_mb(stage_input)
+                with sampler.measure(stage), quiet():
+                    start = time.perf_counter()
+                    result = step(stage_input)
+                    totals[stage]['seconds'] += time.perf_counter() - start
+                totals[stage]['rows'] += len(stage_input)
+                totals[stage]['mb'] += mb
+                if stage == 'transform':
+                    stage_input = result
+            conn.commit()
+            print(f"   📦 chunk {chunk_count}: {totals['extract']['rows']:,} dòng", end='\r')
+    finally:
+        sampler.stop()
+        cur.close()
+        conn.close()
+    wall = time.perf_counter() - started
+    print()
+
+    # Extract đọc toàn bộ file khi chạy hết các chunk; nếu dừng sớm thì ước lượng theo tỉ lệ dòng
+    total_rows = sum(1 for _ in open(csv_file, 'rb')) - 1 if max_chunks else totals['extract']['rows']
+    totals['extract']['mb'] = csv_mb * totals['extract']['rows'] / max(total_rows, 1)
+
+    stages = {}
+    for stage in STAGES:
+        item = totals[stage]
+        seconds = item['seconds']
+        stages[stage] = {
+            'rows': item['rows'],
+            'seconds': round(seconds, 4),
+            'rows_per_s': round(item['rows'] / seconds, 1) if seconds else None,
+            'mb': round(item['mb'], 2),
+            'mb_per_s': round(item['mb'] / seconds, 2) if seconds else None,
+            'peak_rss_mb': round(sampler.peaks.get(stage, 0.0), 1),
+        }
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'mode': 'python',
+            'csv': os.path.abspath(csv_file),
+            'csv_mb': round(csv_mb, 2),
+            'chunk_size': chunk_size,
+            'chunks': chunk_count,
+            'key_strategy': create_warehouse.KEY_STRATEGY,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'postgres': server_version,
+        },
+        'total': {
+            'rows': totals['extract']['rows'],
+            'seconds': round(wall, 4),
+            'rows_per_s': round(totals['extract']['rows'] / wall, 1) if wall else None,
+            'peak_rss_mb': round(max(sampler.peaks.values(), default=0.0), 1),
+        },
+        'stages': stages,
+    }
+
+def relation_mb(cur, table):
+    cur.execute("SELECT pg_total_relation_size(%s)", (table,))
+    return cur.fetchone()[0] / 1024 / 1024
+
+def run_benchmark_elt(csv_file, chunk_size=10000, verbose=False, dbname=None):
+    """Chạy chế độ ELT trên csv_file với cùng các bước của run_benchmark (không dựng wide table/sketch)"""
+    import elt_warehouse
+    csv_mb = os.path.getsize(csv_file) / 1024 / 1024
+    quiet = contextlib.nullcontext if verbose else lambda: contextlib.redirect_stdout(io.StringIO())
+
+    conn = connect(dbname)
+    cur = conn.cursor()
+    cur.execute("SELECT current_setting('server_version')")
+    server_version = cur.fetchone()[0]
+    with quiet():
+        recreate_schema(cur)
+    conn.commit()
+
+    sampler = RssSampler().start()
+    started = time.perf_counter()
+    stages = {}
+
+    def measure(stage, step, rows=None, mb=0.0):
+        """Chạy 1 bước, ghi số liệu; rows=None => số dòng là kết quả của bước (COPY)"""
+        with sampler.measure(stage), quiet():
+            start = time.perf_counter()
+            result = step()
+            seconds = time.perf_counter() - start
+        rows = result if rows is None else rows
+        stages[stage] = {
+            'rows': rows,
+            'seconds': round(seconds, 4),
+            'rows_per_s': round(rows / seconds, 1) if seconds else None,
+            'mb': round(mb, 2),
+            'mb_per_s': round(mb / seconds, 2) if seconds else None,
+            'peak_rss_mb': round(sampler.peaks.get(stage, 0.0), 1),
+        }
+        return result
+
+    try:
+        elt_warehouse.set_parallel_workers(cur)
+        rows = measure('extract', lambda: elt_warehouse.copy_landing(cur, csv_file), mb=csv_mb)
+        kept, _ = measure('transform', lambda: elt_warehouse.elt_transform(cur, chunk_size, csv_file),
+                          rows, relation_mb(cur, 'etl_landing'))
+        clean_mb = relation_mb(cur, 'etl_elt_clean')
+        measure('load_dimensions', lambda: elt_warehouse.elt_load_dimensions(cur), kept, clean_mb)
+        measure('load_facts', lambda: elt_warehouse.elt_load_facts(cur), kept, clean_mb)
+        elt_warehouse.drop_work_tables(cur)
+        conn.commit()
+    finally:
+        sampler.stop()
+        cur.close()
+        conn.close()
+    wall = time.perf_counter() - started
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'mode': 'elt',
+            'elt_sql_version': elt_warehouse.ELT_SQL_VERSION,
+            'csv': os.path.abspath(csv_file),
+            'csv_mb': round(csv_mb, 2),
+            'chunk_size': chunk_size,
+            'chunks': -(-rows // chunk_size),
+            'key_strategy': create_warehouse.KEY_STRATEGY,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'postgres': server_version,
+        },
+        'total': {
+            'rows': rows,
+            'seconds': round(wall, 4),
+            'rows_per_s': round(rows / wall, 1) if wall else None,
+            'peak_rss_mb': round(max(sampler.peaks.values(), default=0.0), 1),
+        },
+        'stages': stages,
+    }
+
+# ========================================
+# BÁO CÁO & SO SÁNH
+# ========================================
+
+def print_report(result):
+    meta, total = result['meta'], result['total']
+    print("\n" + "=" * 80)
+    print(f"⏱️  ETL BENCHMARK • {meta['csv_mb']:,.1f} MB CSV • {meta['chunks']} chunk × {meta['chunk_size']:,} dòng"
+          f" • key {meta.get('key_strategy', 'serial')} • {meta.get('mode', 'python')}"
+          f" • commit {meta['git_commit'] or '-'}")
+    print("=" * 80)
+    print(f"  {'Bước':<18}{'rows':>12}{'giây':>10}{'rows/s':>12}{'MB':>10}{'MB/s':>9}{'peak RSS':>12}")
+    print("-" * 80)
+    for stage, item in result['stages'].items():
+        print(f"  {stage:<18}{item['rows']:>12,}{item['seconds']:>10.2f}{item['rows_per_s'] or 0:>12,.0f}"
+              f"{item['mb']:>10.1f}{item['mb_per_s'] or 0:>9.1f}{item['peak_rss_mb']:>9.1f} MB")
+    print("-" * 80)
+    print(f"  {'TỔNG':<18}{total['rows']:>12,}{total['seconds']:>10.2f}{total['rows_per_s'] or 0:>12,.0f}"
+          f"{'':>19}{total['peak_rss_mb']:>9.1f} MB")
+
+def compare(result, baseline, tolerance=0.10):
+    """
+    So sánh với baseline: thay đổi rows/s và peak RSS của từng bước
+    Trả về danh sách bước bị chậm đi (rows/s giảm) hoặc tốn bộ nhớ hơn quá `tolerance`
+    """
+    print(f"\n📊 SO SÁNH VỚI BASELINE ({baseline['meta'].get('mode', 'python')}, "
+          f"commit {baseline['meta'].get('git_commit') or '-'}, "
+          f"{baseline['meta'].get('timestamp')}, ngưỡng {tolerance:.0%})")
+    print("-" * 80)
+    if baseline['total']['rows'] != result['total']['rows']:
+        print(f"  ⚠️  Số dòng khác baseline ({baseline['total']['rows']:,} vs {result['total']['rows']:,})")
+    regressions = []
+    for stage, item in result['stages'].items():
+        base = baseline['stages'].get(stage)
+        if not base or not base.get('rows_per_s') or not item['rows_per_s']:
+            continue
+        speed = item['rows_per_s'] / base['rows_per_s'] - 1
+        memory = item['peak_rss_mb'] / base['peak_rss_mb'] - 1 if base.get('peak_rss_mb') else 0.0
+        slower, heavier = speed < -tolerance, memory > tolerance
+        if slower or heavier:
+            regressions.append(stage)
+        print(f"  {'✗' if slower or heavier else '✓'} {stage:<18} rows/s {base['rows_per_s']:>12,.0f} → "
+              f"{item['rows_per_s']:>12,.0f} ({speed:+.1%}) • peak RSS {memory:+.1%}")
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark throughput của ETL (rows/s, MB/s, peak RSS theo từng bước)")
+    parser.add_argument('--csv', default='universal_top_spotify_songs.csv', help="File CSV đầu vào")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="Số dòng mỗi chunk (mặc định 10,000 như ETL)")
+    parser.add_argument('--max-chunks', type=int, help="Chỉ chạy N chunk đầu")
+    parser.add_argument('--output', help="Ghi kết quả ra file JSON (baseline)")
+    parser.add_argument('--compare', help="So sánh với file JSON baseline")
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="Ngưỡng chậm đi/tốn bộ nhớ hơn để coi là regression (mặc định 0.10)")
+    parser.add_argument('--key-strategy', choices=['serial', 'hash'],
+                        help="Cách sinh surrogate key (mặc định ETL_KEY_STRATEGY=serial)")
+    parser.add_argument('--elt', action='store_true',
+                        help="Đo chế độ ELT (COPY + SQL trong PostgreSQL) thay cho đường Python")
+    parser.add_argument('--database', default=BENCH_DB_NAME,
+                        help="Database chạy benchmark, tạo nếu chưa có (mặc định BENCH_DB_NAME hoặc <DB_NAME>_bench)")
+    parser.add_argument('--verbose', action='store_true', help="Hiện log của các bước ETL")
+    args = parser.parse_args()
+    if args.elt and (args.max_chunks or args.key_strategy == 'hash'):
+        parser.error("--elt chạy cả file với key serial, không dùng chung với --max-chunks / --key-strategy hash")
+    return args
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.key_strategy:
+        create_warehouse.KEY_STRATEGY = args.key_strategy
+    print(f"⚠️  Benchmark sẽ tạo lại schema trong database {args.database}")
+    if args.elt:
+        result = run_benchmark_elt(args.csv, args.chunk_size, args.verbose, args.database)
+    else:
+        result = run_benchmark(args.csv, args.chunk_size, args.max_chunks, args.verbose, args.database)
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Đã ghi kết quả: {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ Regression: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n✅ Không có regression")
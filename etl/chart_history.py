@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Lịch sử BXH giữ qua các chunk và các lần chạy ETL: rank của N ngày gần nhất cho mỗi (bài hát, quốc gia)
+
+- Trạng thái là ma trận ranks (số key × HISTORY_DAYS, 0 = ngày đó không có trong BXH), cột cuối là
+  end_day (ngày mới nhất đã gặp); chunk có ngày mới hơn thì cửa sổ trượt sang phải
+- streak_before: số ngày liên tiếp trong BXH tính tới ngày ngay trước cột đầu tiên, nên chuỗi dài hơn
+  cửa sổ vẫn đếm đúng; key không còn ngày nào trong cửa sổ thì bị bỏ khỏi trạng thái
+- apply(): ghi rank của 1 chunk vào trạng thái rồi tính cho từng dòng (NumPy, không lặp theo dòng)
+  rank hôm trước, rank 7 ngày trước và số ngày liên tiếp trong BXH => previous_rank, daily_movement,
+  weekly_movement, chart_streak thật thay vì suy ra từ CSV (không cần self-join / window query sau khi load)
+- Trạng thái lưu trong etl_chart_history (1 dòng BYTEA) cùng transaction với fact của chunk;
+  kho dữ liệu chưa có trạng thái thì dựng lại từ N ngày cuối của fact_chart_position
+
+Dữ liệu cần đến gần đúng thứ tự ngày (file theo ngày, CSV sắp theo ngày): dòng cũ hơn cửa sổ không
+ghi được vào trạng thái, giữ movement của CSV như trước.
+"""
+
+import io
+import os
+import numpy as np
+import pandas as pd
+import psycopg2
+from psycopg2 import extras
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Số ngày giữ trong trạng thái (>= 8 để có rank 7 ngày trước)
+HISTORY_DAYS = int(os.getenv("ETL_CHART_HISTORY_DAYS", "14"))
+WEEK = 7
+
+HISTORY_DDL = """
+    CREATE TABLE IF NOT EXISTS etl_chart_history (
+        history_id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (history_id = 1),
+        end_day DATE NOT NULL,
+        n_days SMALLINT NOT NULL,
+        n_keys INTEGER NOT NULL,
+        state BYTEA NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    COMMENT ON TABLE etl_chart_history IS 'Metadata: Rank N ngày gần nhất của mỗi (bài hát, quốc gia), dùng cho previous_rank / movement / chart_streak';
+"""
+
+# Thứ tự cột trong các tuple fact_chart_position của build_fact_rows
+CHART_COLUMNS = [
+    'song_id', 'date_id', 'country_id', 'current_rank', 'previous_rank', 'daily_movement', 'weekly_movement',
+    'is_rising', 'is_falling', 'movement_magnitude', 'trend_strength', 'chart_streak', 'created_at',
+]
+# Vị trí viral_coefficient trong tuple fact_streaming_metrics
+VIRAL_POSITION = 7
+
+def to_days(dates):
+    """Ngày => số ngày tính từ 1970-01-01 (int64)"""
+    return pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+class ChartHistory:
+    """Rank N ngày gần nhất của mỗi (song_id, country_id)"""
+
+    def __init__(self, n_days=None):
+        self.n_days = max(n_days or HISTORY_DAYS, WEEK + 1)
+        self.end_day = None
+        self.song_ids = np.zeros(0, dtype=np.int64)
+        self.country_ids = np.zeros(0, dtype=np.int64)
+        self.ranks = np.zeros((0, self.n_days), dtype=np.int32)
+        self.streak_before = np.zeros(0, dtype=np.int32)
+        self._index = pd.MultiIndex.from_arrays([self.song_ids, self.country_ids])
+
+    def __len__(self):
+        return len(self.song_ids)
+
+    # ---------- trạng thái ----------
+
+    def _keep(self, mask):
+        self.song_ids, self.country_ids = self.song_ids[mask], self.country_ids[mask]
+        self.ranks, self.streak_before = self.ranks[mask], self.streak_before[mask]
+        self._index = pd.MultiIndex.from_arrays([self.song_ids, self.country_ids])
+
+    def _slide(self, end_day):
+        """Trượt cửa sổ để cột cuối là end_day; các ngày rời cửa sổ được cộng vào streak_before"""
+        if self.end_day is None or end_day <= self.end_day:
+            self.end_day = end_day if self.end_day is None else self.end_day
+            return
+        shift = end_day - self.end_day
+        for column in range(min(shift, self.n_days)):
+            self.streak_before = np.where(self.ranks[:, column] > 0, self.streak_before + 1, 0).astype(np.int32)
+        if shift > self.n_days:
+            # Khoảng trống giữa cửa sổ cũ và mới: không có dữ liệu => chuỗi bị ngắt
+            self.streak_before[:] = 0
+        keep = max(self.n_days - shift, 0)
+        ranks = np.zeros_like(self.ranks)
+        ranks[:, :keep] = self.ranks[:, self.n_days - keep:]
+        self.ranks = ranks
+        self.end_day = end_day
+        # Key không còn ngày nào trong cửa sổ và không có chuỗi đang chạy => bỏ
+        active = (self.ranks > 0).any(axis=1) | (self.streak_before > 0)
+        if not active.all():
+            self._keep(active)
+
+    def _slots(self, song_ids, country_ids):
+        """Dòng trạng thái của từng key (key mới được thêm vào cuối)"""
+        keys = pd.MultiIndex.from_arrays([song_ids, country_ids])
+        slots = self._index.get_indexer(keys)
+        new = slots < 0
+        if new.any():
+            fresh = keys[new].unique()
+            self.song_ids = np.concatenate([self.song_ids, fresh.get_level_values(0).to_numpy(dtype=np.int64)])
+            self.country_ids = np.concatenate([self.country_ids, fresh.get_level_values(1).to_numpy(dtype=np.int64)])
+            self.ranks = np.vstack([self.ranks, np.zeros((len(fresh), self.n_days), dtype=np.int32)])
+            self.streak_before = np.concatenate([self.streak_before, np.zeros(len(fresh), dtype=np.int32)])
+            self._index = pd.MultiIndex.from_arrays([self.song_ids, self.country_ids])
+            slots[new] = self._index.get_indexer(keys[new])
+        return slots
+
+    def _runs(self, slots):
+        """Số ngày liên tiếp trong BXH tính tới từng cột của cửa sổ, cho các dòng trạng thái `slots`"""
+        present = self.ranks[slots] > 0
+        runs = np.zeros(present.shape, dtype=np.int32)
+        current = self.streak_before[slots]
+        for column in range(self.n_days):
+            current = np.where(present[:, column], current + 1, 0)
+            runs[:, column] = current
+        return runs
+
+    def apply(self, song_ids, country_ids, days, ranks):
+        """
+        Ghi rank của các dòng vào trạng thái rồi tính cho từng dòng
+        (rank hôm trước, rank 7 ngày trước, số ngày liên tiếp trong BXH), 0 = không biết
+        Ô đã có rank thì giữ nguyên và trong các dòng trùng (key, ngày) chỉ dòng đầu được ghi,
+        giống ON CONFLICT DO NOTHING của bảng fact
+        """
+        n = len(days)
+        previous = np.zeros(n, dtype=np.int64)
+        week = np.zeros(n, dtype=np.int64)
+        streak = np.zeros(n, dtype=np.int64)
+        if n == 0:
+            return previous, week, streak
+        days = np.asarray(days, dtype=np.int64)
+        song_ids, country_ids, ranks = np.asarray(song_ids), np.asarray(country_ids), np.asarray(ranks)
+        # Xử lý lần lượt từng khối ngày (từ cũ tới mới), đủ ngắn để rank 7 ngày trước của mọi dòng
+        # trong khối vẫn nằm trong cửa sổ
+        # (khối đầu gồm cả các ngày cũ hơn start; mọi ngày đều cũ hơn start vẫn chạy đúng 1 khối)
+        step = self.n_days - WEEK
+        start = days.min() if self.end_day is None else max(days.min(), self.end_day - step + 1)
+        for block_start in range(int(start), max(int(days.max()), int(start)) + 1, step):
+            block = np.flatnonzero((days < block_start + step) & ((days >= block_start) | (block_start == start)))
+            if len(block):
+                results = self._apply_window(song_ids[block], country_ids[block], days[block], ranks[block])
+                for values, result in zip((previous, week, streak), results):
+                    values[block] = result
+        return previous, week, streak
+
+    def _apply_window(self, song_ids, country_ids, days, ranks):
+        """apply() cho 1 khối ngày: cửa sổ trượt tới ngày mới nhất của khối"""
+        n = len(days)
+        previous = np.zeros(n, dtype=np.int64)
+        week = np.zeros(n, dtype=np.int64)
+        streak = np.zeros(n, dtype=np.int64)
+        self._slide(int(days.max()))
+        columns = days - (self.end_day - self.n_days + 1)
+        inside = np.flatnonzero(columns >= 0)
+        if not len(inside):
+            return previous, week, streak
+        slots = self._slots(song_ids[inside], country_ids[inside])
+        columns = columns[inside]
+
+        cells, first = np.unique(slots * self.n_days + columns, return_index=True)
+        empty = self.ranks.flat[cells] == 0
+        self.ranks.flat[cells[empty]] = ranks[inside][first[empty]]
+
+        for lag, values in ((1, previous), (WEEK, week)):
+            known = columns >= lag
+            values[inside[known]] = self.ranks[slots[known], columns[known] - lag]
+        unique_slots, position = np.unique(slots, return_inverse=True)
+        streak[inside] = self._runs(unique_slots)[position, columns]
+        return previous, week, streak
+
+    # ---------- dòng fact ----------
+
+    def apply_to_rows(self, rows):
+        """
+        Các tuple fact_chart_position (CHART_COLUMNS) => tuple mới: previous_rank / daily_movement /
+        weekly_movement lấy từ lịch sử khi biết (còn lại giữ giá trị đang có), tính lại các chỉ số
+        movement và chart_streak. Trả về (rows mới, viral_coefficient của từng dòng)
+        """
+        chart = pd.DataFrame.from_records(rows, columns=CHART_COLUMNS)
+        rank = chart['current_rank'].to_numpy(dtype=np.int64)
+        previous, week, streak = self.apply(chart['song_id'].to_numpy(dtype=np.int64),
+                                            chart['country_id'].to_numpy(dtype=np.int64),
+                                            to_days(chart['created_at']), rank)
+
+        previous_rank = np.where(previous > 0, previous, chart['previous_rank'].to_numpy(dtype=np.int64))
+        daily = np.where(previous > 0, previous - rank, chart['daily_movement'].to_numpy(dtype=np.int64))
+        weekly = np.where(week > 0, week - rank, chart['weekly_movement'].to_numpy(dtype=np.int64))
+        magnitude = np.abs(daily) + np.abs(weekly)
+        # Không biết streak (dòng cũ hơn cửa sổ) => giữ giá trị đang có (None với dòng mới)
+        chart_streak = [value if value else (None if pd.isna(previous_value) else int(previous_value))
+                        for value, previous_value in zip(streak.tolist(), chart['chart_streak'].tolist())]
+
+        values = zip(previous_rank.tolist(), daily.tolist(), weekly.tolist(),
+                     ((daily > 0) | (weekly > 0)).tolist(), ((daily < 0) | (weekly < 0)).tolist(),
+                     magnitude.tolist(), np.minimum(10.0, magnitude / 10.0).tolist(), chart_streak)
+        rows = [row[:4] + tuple(new) + row[-1:] for row, new in zip(rows, values)]
+        return rows, np.minimum(1.0, magnitude / 100.0).tolist()
+
+    def apply_to_facts(self, facts):
+        """
+        Áp lịch sử lên các dòng fact của build_fact_rows (chạy ở writer, đúng thứ tự chunk):
+        fact_chart_position và viral_coefficient của fact_streaming_metrics (2 danh sách cùng thứ tự dòng)
+        """
+        chart_rows = facts['fact_chart_position']
+        if not chart_rows:
+            return facts
+        chart_rows, viral = self.apply_to_rows(chart_rows)
+        facts['fact_chart_position'] = chart_rows
+        facts['fact_streaming_metrics'] = [
+            row[:VIRAL_POSITION] + (coefficient,) + row[VIRAL_POSITION + 1:]
+            for row, coefficient in zip(facts['fact_streaming_metrics'], viral)
+        ]
+        return facts
+
+    def refresh_facts(self, cur, dates):
+        """
+        Cho ingest_files.py (fact của lô được các worker ghi song song, không qua apply_to_facts):
+        đọc lại fact_chart_position của các ngày trong lô theo thứ tự ngày, cập nhật trạng thái rồi
+        UPDATE các dòng. Trả về số dòng đã cập nhật
+        """
+        dates = sorted(set(pd.to_datetime(pd.Series(dates)).dt.date))
+        cur.execute(f"""
+            SELECT {', '.join('f.' + column for column in CHART_COLUMNS[:-1])}, d.full_date
+            FROM fact_chart_position f
+            JOIN dim_date d ON d.date_id = f.date_id
+            WHERE d.full_date = ANY(%s)
+            ORDER BY d.full_date
+        """, (dates,))
+        rows = cur.fetchall()
+        if not rows:
+            return 0
+        rows, viral = self.apply_to_rows([row[:10] + (float(row[10]),) + row[11:] for row in rows])
+        values = [row[:-1] + (coefficient,) for row, coefficient in zip(rows, viral)]
+        extras.execute_values(cur, """
+            UPDATE fact_chart_position f SET
+                previous_rank = v.previous_rank, daily_movement = v.daily_movement,
+                weekly_movement = v.weekly_movement, is_rising = v.is_rising, is_falling = v.is_falling,
+                movement_magnitude = v.movement_magnitude, trend_strength = v.trend_strength,
+                chart_streak = v.chart_streak
+            FROM (VALUES %s) AS v (song_id, date_id, country_id, current_rank, previous_rank, daily_movement,
+                                   weekly_movement, is_rising, is_falling, movement_magnitude, trend_strength,
+                                   chart_streak, viral_coefficient)
+            WHERE f.song_id = v.song_id AND f.date_id = v.date_id AND f.country_id = v.country_id
+        """, values, template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s::INTEGER, %s)", page_size=5000)
+        extras.execute_values(cur, """
+            UPDATE fact_streaming_metrics f SET viral_coefficient = v.viral_coefficient
+            FROM (VALUES %s) AS v (song_id, date_id, country_id, viral_coefficient)
+            WHERE f.song_id = v.song_id AND f.date_id = v.date_id AND f.country_id = v.country_id
+        """, [row[:3] + row[-1:] for row in values], page_size=5000)
+        return len(values)
+
+    # ---------- lưu / đọc ----------
+
+    def save(self, cur):
+        """Ghi trạng thái vào etl_chart_history (gọi trong transaction của chunk)"""
+        if self.end_day is None:
+            return
+        buffer = io.BytesIO()
+        np.savez(buffer, song_ids=self.song_ids, country_ids=self.country_ids,
+                 ranks=self.ranks, streak_before=self.streak_before)
+        cur.execute("""
+            INSERT INTO etl_chart_history (history_id, end_day, n_days, n_keys, state)
+            VALUES (1, %s, %s, %s, %s)
+            ON CONFLICT (history_id) DO UPDATE SET
+                end_day = EXCLUDED.end_day, n_days = EXCLUDED.n_days, n_keys = EXCLUDED.n_keys,
+                state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP
+        """, (np.datetime64(self.end_day, 'D').astype(object), self.n_days, len(self),
+              psycopg2.Binary(buffer.getvalue())))
+
+    def rebuild(self, cur):
+        """Dựng trạng thái từ N ngày cuối của fact_chart_position (chart_streak của ngày liền trước cửa sổ)"""
+        cur.execute("""
+            SELECT MAX(d.full_date) FROM dim_date d
+            WHERE EXISTS (SELECT 1 FROM fact_chart_position f WHERE f.date_id = d.date_id)
+        """)
+        last_day = cur.fetchone()[0]
+        if last_day is None:
+            return self
+        cur.execute("""
+            SELECT f.song_id, f.country_id, d.full_date, f.current_rank, f.chart_streak
+            FROM fact_chart_position f
+            JOIN dim_date d ON d.date_id = f.date_id
+            WHERE d.full_date >= %s::DATE - %s
+        """, (last_day, self.n_days))
+        rows = pd.DataFrame(cur.fetchall(), columns=['song_id', 'country_id', 'full_date', 'rank', 'chart_streak'])
+        days = to_days(rows['full_date'])
+        self.end_day = int(to_days([last_day])[0])
+        before = days == self.end_day - self.n_days
+        if before.any():
+            slots = self._slots(rows['song_id'].to_numpy(dtype=np.int64)[before],
+                                rows['country_id'].to_numpy(dtype=np.int64)[before])
+            self.streak_before[slots] = rows['chart_streak'][before].fillna(0).to_numpy(dtype=np.int32)
+        window = ~before
+        self.apply(rows['song_id'].to_numpy(dtype=np.int64)[window], rows['country_id'].to_numpy(dtype=np.int64)[window],
+                   days[window], rows['rank'].to_numpy(dtype=np.int64)[window])
+        return self
+
+    @classmethod
+    def load(cls, cur, n_days=None):
+        """Đọc trạng thái đã lưu; chưa có (hoặc đổi số ngày) thì dựng lại từ fact_chart_position"""
+        history = cls(n_days)
+        cur.execute("SELECT end_day, n_days, state FROM etl_chart_history WHERE history_id = 1")
+        row = cur.fetchone()
+        if row is None or row[1] != history.n_days:
+            return history.rebuild(cur)
+        end_day, _, state = row
+        with np.load(io.BytesIO(bytes(state))) as arrays:
+            history.song_ids, history.country_ids = arrays['song_ids'], arrays['country_ids']
+            history.ranks, history.streak_before = arrays['ranks'], arrays['streak_before']
+        history.end_day = int(to_days([end_day])[0])
+        history._index = pd.MultiIndex.from_arrays([history.song_ids, history.country_ids])
+        return history
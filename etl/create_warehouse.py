@@ -2,10 +2,20 @@ import psycopg2
 from psycopg2 import sql, extras
 import pandas as pd
 import numpy as np
+import io
 import os
+import sys
+import argparse
 from dotenv import load_dotenv
 from datetime import datetime
 import re
+import hashlib
+
+import etl_metrics
+import async_pipeline
+import chart_history
+import hll_sketch
+import trend_state
 
 load_dotenv()
 
@@ -16,6 +26,13 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
+# Kiểu số gọn: SMALLINT/REAL trong schema, int8/int16/float32 trong DataFrame (--compact-types)
+COMPACT_TYPES = os.getenv("ETL_COMPACT_TYPES", "0") == "1"
+
+# Cách sinh surrogate key của dimension (--key-strategy):
+# 'serial' = SERIAL của PostgreSQL, 'hash' = hash 64-bit của natural key tính ngay trong process
+KEY_STRATEGY = os.getenv("ETL_KEY_STRATEGY", "serial").lower()
+
 """
 ================================================================================
 SPOTIFY DATA WAREHOUSE - STUDENT PROJECT VERSION
@@ -39,20 +56,6 @@ def clean_text(text):
     text = re.sub(r'\s+', ' ', text)
     return text if text else None
 
-def clean_numeric(value, min_val=None, max_val=None, default=None):
-    """Làm sạch và validate số"""
-    if pd.isna(value):
-        return default
-    try:
-        value = float(value)
-        if min_val is not None and value < min_val:
-            return default
-        if max_val is not None and value > max_val:
-            return default
-        return value
-    except:
-        return default
-
 def clean_boolean(value):
     """Làm sạch boolean"""
     if pd.isna(value):
@@ -79,97 +82,253 @@ def extract_and_clean_artists(artists_str):
     return [a for a in artists if a is not None]
 
 def categorize_mood(valence, energy):
-    """Phân loại mood dựa trên valence và energy"""
-    if valence >= 0.6 and energy >= 0.6:
-        return 'Happy'
-    elif valence >= 0.6 and energy < 0.6:
-        return 'Calm'
-    elif valence < 0.4 and energy >= 0.6:
-        return 'Energetic'
-    elif valence < 0.4 and energy < 0.6:
-        return 'Sad'
-    else:
-        return 'Neutral'
+    """Phân loại mood dựa trên valence và energy (cả cột, np.select)"""
+    valence, energy = np.asarray(valence, dtype=np.float64), np.asarray(energy, dtype=np.float64)
+    return np.select(
+        [(valence >= 0.6) & (energy >= 0.6), (valence >= 0.6) & (energy < 0.6),
+         (valence < 0.4) & (energy >= 0.6), (valence < 0.4) & (energy < 0.6)],
+        ['Happy', 'Calm', 'Energetic', 'Sad'],
+        default='Neutral'
+    ).astype(object)
+
+def _levels(values, thresholds, labels):
+    """Nhãn theo ngưỡng (tăng dần): values < thresholds[0] => labels[0], ..., NaN => labels[0]"""
+    codes = np.digitize(values, thresholds)
+    codes[np.isnan(values)] = 0
+    return np.asarray(labels, dtype=object)[codes]
 
 def categorize_audio_features(energy, danceability, valence, acousticness, tempo):
     """
-    Phân loại đặc điểm audio thành các level categories
-    Returns: tuple (energy_level, danceability_level, valence_level, tempo_category, acousticness_level)
-    """
-    # Convert to float with defaults
-    energy = float(energy) if energy else 0.5
-    danceability = float(danceability) if danceability else 0.5
-    valence = float(valence) if valence else 0.5
-    acousticness = float(acousticness) if acousticness else 0.5
-    tempo = float(tempo) if tempo else 120.0
-    
-    # Categorize Energy Level
-    if energy >= 0.8:
-        energy_level = 'Very High'
-    elif energy >= 0.6:
-        energy_level = 'High'
-    elif energy >= 0.4:
-        energy_level = 'Medium'
-    elif energy >= 0.2:
-        energy_level = 'Low'
-    else:
-        energy_level = 'Very Low'
-    
-    # Categorize Danceability Level
-    if danceability >= 0.8:
-        danceability_level = 'Very High'
-    elif danceability >= 0.6:
-        danceability_level = 'High'
-    elif danceability >= 0.4:
-        danceability_level = 'Medium'
-    elif danceability >= 0.2:
-        danceability_level = 'Low'
-    else:
-        danceability_level = 'Very Low'
-    
-    # Categorize Valence (Mood) Level
-    if valence >= 0.8:
-        valence_level = 'Very Positive'
-    elif valence >= 0.6:
-        valence_level = 'Positive'
-    elif valence >= 0.4:
-        valence_level = 'Neutral'
-    elif valence >= 0.2:
-        valence_level = 'Negative'
-    else:
-        valence_level = 'Very Negative'
-    
-    # Categorize Tempo
-    if tempo >= 140:
-        tempo_category = 'Very Fast'
-    elif tempo >= 120:
-        tempo_category = 'Fast'
-    elif tempo >= 90:
-        tempo_category = 'Moderate'
-    elif tempo >= 60:
-        tempo_category = 'Slow'
-    else:
-        tempo_category = 'Very Slow'
-    
-    # Categorize Acousticness Level
-    if acousticness >= 0.8:
-        acousticness_level = 'Very High'
-    elif acousticness >= 0.6:
-        acousticness_level = 'High'
-    elif acousticness >= 0.4:
-        acousticness_level = 'Medium'
-    elif acousticness >= 0.2:
-        acousticness_level = 'Low'
-    else:
-        acousticness_level = 'Very Low'
+    Phân loại đặc điểm audio thành các level categories (cả cột)
+    Returns: tuple mảng (energy_level, danceability_level, valence_level, tempo_category, acousticness_level)
+    """
+    # Giá trị 0 được coi là thiếu (default) như `float(x) if x else default`
+    def value(column, default):
+        column = np.asarray(column, dtype=np.float64)
+        return np.where(column == 0, default, column)
     
-    return (energy_level, danceability_level, valence_level, tempo_category, acousticness_level)
+    levels = ['Very Low', 'Low', 'Medium', 'High', 'Very High']
+    thresholds = [0.2, 0.4, 0.6, 0.8]
+    return (
+        _levels(value(energy, 0.5), thresholds, levels),
+        _levels(value(danceability, 0.5), thresholds, levels),
+        _levels(value(valence, 0.5), thresholds,
+                ['Very Negative', 'Negative', 'Neutral', 'Positive', 'Very Positive']),
+        _levels(value(tempo, 120.0), [60, 90, 120, 140], ['Very Slow', 'Slow', 'Moderate', 'Fast', 'Very Fast']),
+        _levels(value(acousticness, 0.5), thresholds, levels),
+    )
+
+# Thứ tự phần tử của audio_features_tuple = các cột (UNIQUE) của dim_audio_features
+AUDIO_FEATURES_COLUMNS = [
+    'energy_level', 'danceability_level', 'valence_level', 'tempo_category', 'acousticness_level',
+    'mood_category', 'energy_band', 'danceability_band', 'valence_band', 'acousticness_band',
+    'tempo_band', 'genre_code', 'mood_trending', 'mood_regional', 'mood_profile', 'mood_quadrant',
+]
+
+def audio_band_codes(energy, danceability, valence, acousticness, tempo):
+    """
+    Mã số nguyên (SMALLINT) của các cách chia nhóm mà dashboard dùng, lưu trong dim_audio_features
+    để query GROUP BY theo key số thay vì đánh giá CASE trên từng dòng fact.
+    Thứ tự mã khớp với mảng nhãn *_LABELS trong streamlit/sql_queries.py.
+    Giá trị được làm tròn về REAL (float4) như khi lưu vào fact_audio_analysis nên ngưỡng
+    so sánh cho kết quả giống hệt CASE trên cột REAL.
+    Tính trên cả cột (np.digitize / np.select), giống CASE của elt_warehouse.clean_sql
+    Returns: tuple mảng (energy_band, danceability_band, valence_band, acousticness_band, tempo_band,
+                         genre_code, mood_trending, mood_regional, mood_profile, mood_quadrant)
+    """
+    def stored(column, default):
+        column = np.asarray(column, dtype=np.float64)
+        return np.where(np.isnan(column), default, column).astype(np.float32).astype(np.float64)
+
+    energy = stored(energy, 0.5)
+    danceability = stored(danceability, 0.5)
+    valence = stored(valence, 0.5)
+    acousticness = stored(acousticness, 0.5)
+    tempo = stored(tempo, 120.0)
+
+    # Low / Medium / High (ngưỡng 0.3, 0.7)
+    def band(column):
+        return np.digitize(column, [0.3, 0.7])
+
+    tempo_band = np.digitize(tempo, [90, 120, 150])
+
+    # GENRE_LABELS
+    genre_code = np.select(
+        [(energy > 0.7) & (danceability > 0.7), energy > 0.7, danceability > 0.7,
+         acousticness > 0.5, valence > 0.6, valence < 0.4],
+        [0, 1, 2, 3, 4, 5],
+        default=6
+    )
+
+    positive, negative = valence > 0.6, valence < 0.4
+    energetic, calm = energy > 0.6, energy < 0.4
+
+    # MOOD_TRENDING_LABELS: Energetic / Happy / Sad / Neutral
+    mood_trending = np.select([positive & energetic, positive, negative & calm], [0, 1, 2], default=3)
+    # MOOD_REGIONAL_LABELS: Happy & Energetic / Happy / Energetic / Melancholic / Neutral
+    mood_regional = np.select([positive & energetic, positive, energetic, negative], [0, 1, 2, 3], default=4)
+    # MOOD_PROFILE_LABELS: Happy / Calm / Energetic / Sad / Neutral
+    mood_profile = np.select([positive & energetic, positive, negative & energetic, negative],
+                             [0, 1, 2, 3], default=4)
+    # MOOD_QUADRANT_LABELS: Happy / Calm / Energetic / Sad / Neutral (chỉ 4 góc valence × energy)
+    mood_quadrant = np.select([positive & energetic, positive & calm, negative & energetic, negative & calm],
+                              [0, 1, 2, 3], default=4)
+
+    return (band(energy), band(danceability), band(valence), band(acousticness), tempo_band,
+            genre_code, mood_trending, mood_regional, mood_profile, mood_quadrant)
+
+# Kiểu gọn của các cột số sau transform (--compact-types); nullable vì cột có thể còn NULL
+COMPACT_DTYPES = {
+    'daily_rank': 'Int16', 'daily_movement': 'Int16', 'weekly_movement': 'Int16',
+    'popularity': 'Int8', 'duration_ms': 'Int32',
+    'key': 'Int8', 'mode': 'Int8', 'time_signature': 'Int8',
+    'danceability': 'float32', 'energy': 'float32', 'speechiness': 'float32', 'acousticness': 'float32',
+    'instrumentalness': 'float32', 'liveness': 'float32', 'valence': 'float32', 'tempo': 'float32',
+    'loudness': 'float32',
+}
+
+def compact_dtypes(df):
+    """
+    Ép các cột số về kiểu gọn (COMPACT_DTYPES). Cột số nguyên chỉ bị ép khi mọi giá trị là số nguyên
+    nằm trong khoảng của kiểu, ngược lại giữ nguyên. Gọi sau khi đã phân loại audio features
+    (ngưỡng so sánh trên float64 như chế độ thường)
+    """
+    for column, dtype in COMPACT_DTYPES.items():
+        if column not in df.columns:
+            continue
+        values = pd.to_numeric(df[column], errors='coerce')
+        if dtype.startswith('Int'):
+            present = values.dropna()
+            info = np.iinfo(dtype.lower())
+            if len(present) and ((present % 1 != 0).any() or present.min() < info.min or present.max() > info.max):
+                continue
+        df[column] = values.astype(dtype)
+    return df
 
 # ========================================
 # PHẦN 2: SCHEMA CREATION
 # ========================================
 
-def create_tables(cur):
+# Kiểu cột của schema gọn (--compact-types), thay cho kiểu trong create_tables:
+# SMALLINT cho rank/movement/popularity/mã nhỏ, REAL cho chỉ số dẫn xuất chỉ dùng để hiển thị,
+# DATE cho created_at (ETL ghi snapshot_date vào cột này). Giữ NUMERIC cho artist_score và
+# rank_points_sum vì dashboard tính AVG/SUM trên chúng và cần đúng 2 chữ số thập phân.
+COMPACT_COLUMN_TYPES = {
+    'fact_song_daily': {
+        'daily_rank': 'SMALLINT', 'popularity_score': 'SMALLINT', 'rank_points': 'SMALLINT',
+        'performance_index': 'REAL', 'created_at': 'DATE',
+    },
+    'fact_artist_stats': {
+        'song_rank': 'SMALLINT', 'song_popularity': 'SMALLINT', 'artist_position': 'SMALLINT',
+        'contribution_weight': 'REAL', 'created_at': 'DATE',
+    },
+    'fact_chart_position': {
+        'current_rank': 'SMALLINT', 'previous_rank': 'SMALLINT', 'daily_movement': 'SMALLINT',
+        'weekly_movement': 'SMALLINT', 'movement_magnitude': 'SMALLINT', 'trend_strength': 'REAL',
+        'chart_streak': 'SMALLINT', 'created_at': 'DATE',
+    },
+    'fact_audio_analysis': {
+        'key_signature': 'SMALLINT', 'mode': 'SMALLINT', 'time_signature': 'SMALLINT', 'created_at': 'DATE',
+    },
+    'fact_streaming_metrics': {
+        'avg_completion_rate': 'REAL', 'engagement_score': 'REAL', 'viral_coefficient': 'REAL',
+        'created_at': 'DATE',
+    },
+    'wide_song_daily': {
+        'release_year': 'SMALLINT', 'daily_rank': 'SMALLINT', 'popularity_score': 'SMALLINT',
+        'rank_points': 'SMALLINT', 'performance_index': 'REAL',
+    },
+}
+
+# Kiểu cột có thể được thay trong DDL
+_DDL_TYPE = r"(?:INTEGER|BIGINT|REAL|DOUBLE PRECISION|TIMESTAMP|NUMERIC\(\d+,\s*\d+\))"
+
+def compact_ddl(command):
+    """Đổi kiểu các cột trong COMPACT_COLUMN_TYPES của các câu CREATE TABLE trong command"""
+    for table, columns in COMPACT_COLUMN_TYPES.items():
+        match = re.search(rf"CREATE TABLE {table} \((.*?)\n\s*\);", command, re.S)
+        if not match:
+            continue
+        body = match.group(1)
+        for column, pg_type in columns.items():
+            body, count = re.subn(rf"(\n\s+{column}\s+){_DDL_TYPE}", rf"\g<1>{pg_type}", body)
+            if count != 1:
+                raise ValueError(f"Không tìm thấy cột {table}.{column} trong DDL")
+        command = command[:match.start(1)] + body + command[match.end(1):]
+    return command
+
+# Surrogate key dạng hash (--key-strategy hash): key của dimension là hash 63-bit (BLAKE2b) của natural key,
+# date_id là số yyyymmdd. Mọi process tính ra cùng 1 key cho cùng 1 natural key nên các dòng fact được
+# dựng mà không cần đọc lại dimension từ database. Xác suất 2 natural key trùng hash ~ n² / 2^64.
+HASH_KEY_COLUMNS = ('song_id', 'artist_id', 'album_id', 'country_id', 'features_id', 'primary_artist_id')
+
+def hash_key(*parts):
+    """Key 63-bit (luôn dương) ổn định giữa các process/lần chạy; NULL/NaN được hash như chuỗi rỗng"""
+    text = '\x1f'.join('' if part is None or pd.isna(part) else str(part) for part in parts)
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big') >> 1
+
+def date_key(day):
+    """date_id dạng yyyymmdd, ví dụ 2024-01-31 => 20240131"""
+    return day.year * 10000 + day.month * 100 + day.day
+
+def hash_key_ddl(command):
+    """Đổi key của dimension sang BIGINT (date_id: INTEGER yyyymmdd), không dùng SERIAL"""
+    command = re.sub(r"\bdate_id SERIAL PRIMARY KEY", "date_id INTEGER PRIMARY KEY", command)
+    columns = '|'.join(HASH_KEY_COLUMNS)
+    command = re.sub(rf"\b({columns}) SERIAL PRIMARY KEY", r"\1 BIGINT PRIMARY KEY", command)
+    return re.sub(rf"\b({columns}) INTEGER\b", r"\1 BIGINT", command)
+
+def schema_key_strategy(cur):
+    """Cách sinh key của kho dữ liệu đang có ('hash' nếu dim_song.song_id là BIGINT), None nếu chưa có schema"""
+    cur.execute("""SELECT data_type FROM information_schema.columns
+                   WHERE table_schema = current_schema() AND table_name = 'dim_song'
+                     AND column_name = 'song_id'""")
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return 'hash' if row[0] == 'bigint' else 'serial'
+
+def table_sizes(cur):
+    """
+    Kích thước các bảng được build lại mỗi lần chạy (dimension, fact, bảng phân tích, trạng thái BXH / xu hướng):
+    {bảng: (số dòng ước lượng, heap bytes, index bytes)}
+    """
+    cur.execute("""
+        SELECT c.relname, c.reltuples::bigint, pg_table_size(c.oid), pg_indexes_size(c.oid)
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relkind = 'r'
+          AND (c.relname LIKE 'fact\\_%' OR c.relname LIKE 'dim\\_%'
+               OR c.relname IN ('wide_song_daily', 'sketch_daily_country', 'trend_song_daily', 'trend_artist_daily',
+                                'etl_chart_history', 'etl_trend_state'))
+        ORDER BY c.relname
+    """)
+    return {name: (rows, heap, index) for name, rows, heap, index in cur.fetchall()}
+
+def print_size_report(before, after):
+    """So sánh kích thước bảng (heap và index) trước (lần build trước) và sau lần build này"""
+    def change(old, new):
+        return f"{new / old - 1:+.1%}" if old else "mới"
+    
+    print("\n💾 KÍCH THƯỚC BẢNG (lần build trước → lần này, MB):")
+    print("-" * 92)
+    print(f"  {'bảng':<24}{'heap':>24}{'':>8}{'index':>22}{'':>8}{'heap/dòng':>12}")
+    print("-" * 92)
+    totals = [0, 0, 0, 0]
+    for table in sorted(set(before) | set(after)):
+        _, old_heap, old_index = before.get(table, (0, 0, 0))
+        rows, new_heap, new_index = after.get(table, (0, 0, 0))
+        for k, value in enumerate((old_heap, new_heap, old_index, new_index)):
+            totals[k] += value
+        per_row = f"{new_heap / rows:,.0f} B" if rows > 0 else ""
+        print(f"  {table:<24}{old_heap / 1024 / 1024:>11.2f} → {new_heap / 1024 / 1024:>8.2f}{change(old_heap, new_heap):>8}"
+              f"{old_index / 1024 / 1024:>10.2f} → {new_index / 1024 / 1024:>8.2f}{change(old_index, new_index):>8}"
+              f"{per_row:>12}")
+    print("-" * 92)
+    old_heap, new_heap, old_index, new_index = totals
+    print(f"  {'TỔNG':<24}{old_heap / 1024 / 1024:>11.2f} → {new_heap / 1024 / 1024:>8.2f}{change(old_heap, new_heap):>8}"
+          f"{old_index / 1024 / 1024:>10.2f} → {new_index / 1024 / 1024:>8.2f}{change(old_index, new_index):>8}")
+
+def create_tables(cur, compact=None, key_strategy=None):
     """
     Tạo schema với 11 bảng: 6 Dimensions + 5 Facts
     
@@ -187,10 +346,29 @@ def create_tables(cur):
     3. fact_chart_position - Vị trí và di chuyển BXH
     4. fact_audio_analysis - Phân tích đặc điểm âm nhạc
     5. fact_streaming_metrics - Metrics streaming và engagement
+    
+    ANALYTICS TABLES:
+    - wide_song_daily - Bảng phi chuẩn hóa cho dashboard
+    - sketch_daily_country - Sketch HyperLogLog theo ngày × quốc gia cho COUNT(DISTINCT)
+    - trend_song_daily, trend_artist_daily - Rolling 7/30/60 ngày của bài hát/nghệ sĩ
+    
+    compact: dùng kiểu gọn của COMPACT_COLUMN_TYPES (mặc định theo COMPACT_TYPES)
+    key_strategy: 'serial' hoặc 'hash' (mặc định theo KEY_STRATEGY)
     """
+    if compact is None:
+        compact = COMPACT_TYPES
+    key_strategy = key_strategy or KEY_STRATEGY
     
     commands = (
         # Drop all tables
+        "DROP TABLE IF EXISTS etl_chart_history CASCADE;",
+        "DROP TABLE IF EXISTS etl_trend_state CASCADE;",
+        "DROP TABLE IF EXISTS etl_quarantine CASCADE;",
+        "DROP TABLE IF EXISTS etl_loaded_files CASCADE;",
+        "DROP TABLE IF EXISTS trend_artist_daily CASCADE;",
+        "DROP TABLE IF EXISTS trend_song_daily CASCADE;",
+        "DROP TABLE IF EXISTS sketch_daily_country CASCADE;",
+        "DROP TABLE IF EXISTS wide_song_daily CASCADE;",
         "DROP TABLE IF EXISTS fact_streaming_metrics CASCADE;",
         "DROP TABLE IF EXISTS fact_audio_analysis CASCADE;",
         "DROP TABLE IF EXISTS fact_chart_position CASCADE;",
@@ -237,7 +415,8 @@ def create_tables(cur):
             release_year INTEGER,
             release_month INTEGER,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(album_name, release_date)
+            -- Album không có ngày phát hành cũng chỉ 1 dòng (ON CONFLICT bắt được NULL, PostgreSQL 15+)
+            UNIQUE NULLS NOT DISTINCT (album_name, release_date)
         );
         COMMENT ON TABLE dim_album IS 'Dimension: Thông tin album';
         """,
@@ -280,8 +459,23 @@ def create_tables(cur):
             valence_level VARCHAR(20) NOT NULL,
             tempo_category VARCHAR(20) NOT NULL,
             acousticness_level VARCHAR(20) NOT NULL,
+            mood_category VARCHAR(20) NOT NULL,
+            
+            -- Mã nhóm cho dashboard (audio_band_codes): query GROUP BY theo key số
+            energy_band SMALLINT NOT NULL,
+            danceability_band SMALLINT NOT NULL,
+            valence_band SMALLINT NOT NULL,
+            acousticness_band SMALLINT NOT NULL,
+            tempo_band SMALLINT NOT NULL,
+            genre_code SMALLINT NOT NULL,
+            mood_trending SMALLINT NOT NULL,
+            mood_regional SMALLINT NOT NULL,
+            mood_profile SMALLINT NOT NULL,
+            mood_quadrant SMALLINT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(energy_level, danceability_level, valence_level, tempo_category, acousticness_level)
+            UNIQUE(energy_level, danceability_level, valence_level, tempo_category, acousticness_level,
+                   mood_category, energy_band, danceability_band, valence_band, acousticness_band,
+                   tempo_band, genre_code, mood_trending, mood_regional, mood_profile, mood_quadrant)
         );
         COMMENT ON TABLE dim_audio_features IS 'Dimension: Phân loại đặc điểm âm nhạc dựa trên audio features';
         """,
@@ -360,6 +554,7 @@ def create_tables(cur):
             is_falling BOOLEAN,
             movement_magnitude INTEGER,
             trend_strength NUMERIC(8,2),
+            chart_streak INTEGER,  -- Số ngày liên tiếp trong BXH (etl_chart_history)
             
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(song_id, date_id, country_id)
@@ -426,15 +621,212 @@ def create_tables(cur):
         CREATE INDEX idx_fact_streaming_song ON fact_streaming_metrics(song_id);
         CREATE INDEX idx_fact_streaming_date ON fact_streaming_metrics(date_id);
         """,
+        
+        # ==================== ANALYTICS TABLE ====================
+        
+        # Bảng phi chuẩn hóa (denormalized) cho dashboard: 1 dòng = song × date × country,
+        # mang sẵn thuộc tính dimension, audio features, nhãn audio level và nghệ sĩ chính
+        # => các panel chỉ cần scan 1 bảng thay vì join 4-6 bảng.
+        # Chỉ append (ON CONFLICT DO NOTHING giống fact_song_daily), mỗi chunk được ghi
+        # theo thứ tự (full_date, country_code) để các dòng cùng ngày/quốc gia nằm gần nhau,
+        # nhờ đó BRIN index trên full_date chỉ cần đọc các block của khoảng ngày được lọc.
+        """
+        CREATE TABLE wide_song_daily (
+            date_id INTEGER NOT NULL,
+            country_id INTEGER NOT NULL,
+            song_id INTEGER NOT NULL,
+            
+            -- Date & Country
+            full_date DATE NOT NULL,
+            year INTEGER,
+            month INTEGER,
+            day_of_week INTEGER,
+            day_name VARCHAR(20),
+            country_code VARCHAR(10),
+            country_name VARCHAR(255),
+            
+            -- Song, Album & Primary Artist
+            song_name TEXT,
+            is_explicit BOOLEAN,
+            duration_ms INTEGER,
+            album_id INTEGER,
+            album_name TEXT,
+            release_year INTEGER,
+            primary_artist_id INTEGER,
+            primary_artist_name TEXT,
+            
+            -- Performance Metrics
+            daily_rank INTEGER,
+            popularity_score INTEGER,
+            rank_points NUMERIC(10,2),
+            performance_index NUMERIC(10,2),
+            
+            -- Audio Features & Levels
+            features_id INTEGER,
+            danceability REAL,
+            energy REAL,
+            valence REAL,
+            acousticness REAL,
+            speechiness REAL,
+            instrumentalness REAL,
+            liveness REAL,
+            loudness REAL,
+            tempo REAL,
+            energy_level VARCHAR(20),
+            danceability_level VARCHAR(20),
+            valence_level VARCHAR(20),
+            tempo_category VARCHAR(20),
+            acousticness_level VARCHAR(20),
+            
+            PRIMARY KEY (date_id, country_id, song_id)
+        );
+        COMMENT ON TABLE wide_song_daily IS 'Analytics: Bảng phi chuẩn hóa song × date × country cho dashboard (append-only)';
+        CREATE INDEX idx_wide_song_daily_song ON wide_song_daily(song_id);
+        CREATE INDEX idx_wide_song_daily_full_date ON wide_song_daily USING BRIN (full_date);
+        """,
+        
+        # Sketch HyperLogLog (hll_sketch.py) cho mỗi ngày × quốc gia: tập bài hát, nghệ sĩ
+        # và album có trong BXH, cùng các tổng để tính AVG/SUM. Dashboard gộp sketch của khoảng
+        # ngày/quốc gia cần xem thay vì COUNT(DISTINCT) trên join fact lớn.
+        # Các tổng có trọng số = số dòng khớp khi LEFT JOIN fact_artist_stats theo (song, date)
+        # giống các query gốc, để AVG/SUM của 2 chế độ sketch và exact khớp nhau.
+        """
+        CREATE TABLE sketch_daily_country (
+            date_id INTEGER NOT NULL REFERENCES dim_date(date_id),
+            country_id INTEGER NOT NULL REFERENCES dim_country(country_id),
+            
+            -- Distinct Sketches (HyperLogLog)
+            song_sketch BYTEA NOT NULL,
+            artist_sketch BYTEA NOT NULL,
+            album_sketch BYTEA NOT NULL,
+            
+            -- Additive Metrics
+            row_weight BIGINT NOT NULL,
+            popularity_sum BIGINT NOT NULL,
+            max_popularity INTEGER,
+            rank_points_sum NUMERIC(14,2),
+            
+            PRIMARY KEY (date_id, country_id)
+        );
+        COMMENT ON TABLE sketch_daily_country IS 'Analytics: Sketch HyperLogLog bài hát/nghệ sĩ/album theo ngày × quốc gia';
+        """,
+        
+        # Snapshot xu hướng theo ngày (build_trend_tables): mỗi ngày có dữ liệu, mỗi bài hát/nghệ sĩ
+        # có mặt trong BXH ngày đó 1 dòng với trung bình rolling 7/30/60 ngày và độ thay đổi hạng.
+        # Panel trending chỉ đọc snapshot của 1 ngày (ngày mới nhất hoặc cuối khoảng được lọc).
+        """
+        CREATE TABLE trend_song_daily (
+            full_date DATE NOT NULL,
+            song_id INTEGER NOT NULL REFERENCES dim_song(song_id),
+            song_name TEXT,
+            artist_name TEXT,
+            
+            -- Ngày hiện tại (trung bình trên các quốc gia)
+            num_countries INTEGER,
+            avg_rank DOUBLE PRECISION,
+            avg_popularity DOUBLE PRECISION,
+            
+            -- Thay đổi hạng (NULL nếu ngày so sánh không có trong BXH)
+            prev_rank DOUBLE PRECISION,
+            rank_change DOUBLE PRECISION,
+            rank_delta_7d DOUBLE PRECISION,
+            
+            -- Rolling Averages (trên các ngày có trong BXH của cửa sổ)
+            rank_7d DOUBLE PRECISION,
+            rank_30d DOUBLE PRECISION,
+            rank_60d DOUBLE PRECISION,
+            popularity_7d DOUBLE PRECISION,
+            popularity_30d DOUBLE PRECISION,
+            popularity_60d DOUBLE PRECISION,
+            days_in_chart_60d INTEGER,
+            
+            PRIMARY KEY (full_date, song_id)
+        );
+        COMMENT ON TABLE trend_song_daily IS 'Analytics: Snapshot xu hướng bài hát theo ngày (rolling 7/30/60 ngày)';
+        
+        CREATE TABLE trend_artist_daily (
+            full_date DATE NOT NULL,
+            artist_id INTEGER NOT NULL REFERENCES dim_artist(artist_id),
+            artist_name TEXT,
+            
+            -- Ngày hiện tại
+            num_songs INTEGER,
+            avg_popularity DOUBLE PRECISION,
+            
+            -- Rolling Averages
+            popularity_7d DOUBLE PRECISION,
+            popularity_30d DOUBLE PRECISION,
+            popularity_60d DOUBLE PRECISION,
+            songs_7d DOUBLE PRECISION,
+            songs_30d DOUBLE PRECISION,
+            songs_60d DOUBLE PRECISION,
+            
+            PRIMARY KEY (full_date, artist_id)
+        );
+        COMMENT ON TABLE trend_artist_daily IS 'Analytics: Snapshot xu hướng nghệ sĩ theo ngày (rolling 7/30/60 ngày)';
+        """,
+        
+        # ==================== METADATA ====================
+        
+        # Các file CSV đã load (ingest_files.py bỏ qua file có fingerprint đã có);
+        # DROP cùng dữ liệu vì chỉ có ý nghĩa với kho dữ liệu hiện tại
+        """
+        CREATE TABLE etl_loaded_files (
+            fingerprint CHAR(64) PRIMARY KEY,
+            file_name TEXT NOT NULL,
+            file_size BIGINT NOT NULL,
+            row_count INTEGER,
+            loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        COMMENT ON TABLE etl_loaded_files IS 'Metadata: File CSV đã load (SHA-256 nội dung), dùng để ingest tăng dần';
+        """,
+        
+        QUARANTINE_DDL,
+        
+        # Rank N ngày gần nhất của mỗi (bài hát, quốc gia), giữ qua các chunk / lần chạy (chart_history.py)
+        chart_history.HISTORY_DDL,
+        trend_state.TREND_STATE_DDL,
+        
+        # Không DROP bảng này: data_version phải tăng liên tục qua các lần chạy ETL,
+        # nếu reset về 0 thì dashboard sẽ đọc nhầm result cache của kho dữ liệu cũ
+        """
+        CREATE TABLE IF NOT EXISTS etl_metadata (
+            meta_key VARCHAR(50) PRIMARY KEY,
+            meta_value BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        COMMENT ON TABLE etl_metadata IS 'Metadata: Phiên bản dữ liệu của kho (dùng để invalidate cache dashboard)';
+        INSERT INTO etl_metadata (meta_key, meta_value) VALUES ('data_version', 0)
+        ON CONFLICT (meta_key) DO NOTHING;
+        """,
     )
     
     for command in commands:
-        cur.execute(command)
+        if key_strategy == 'hash':
+            command = hash_key_ddl(command)
+        cur.execute(compact_ddl(command) if compact else command)
     
     print("✅ Schema created successfully!")
     print("   📊 6 Dimension Tables")
     print("   📈 5 Fact Tables")
     print("   📝 Total: 11 Tables")
+    print("   🧮 + 4 Analytics Tables (wide_song_daily, sketch_daily_country, trend_song_daily, trend_artist_daily)")
+    if compact:
+        print("   🗜️  Kiểu số gọn (SMALLINT/REAL/DATE)")
+    if key_strategy == 'hash':
+        print("   🔑 Surrogate key: hash 64-bit của natural key (date_id = yyyymmdd)")
+
+def bump_data_version(cur):
+    """
+    Tăng data_version trong etl_metadata (gọi ngay trước conn.commit())
+    Dashboard dùng data_version làm một phần của cache key, nên mọi result
+    cache cũ tự động hết hiệu lực khi có dữ liệu mới được commit.
+    """
+    cur.execute("""UPDATE etl_metadata
+                   SET meta_value = meta_value + 1, updated_at = CURRENT_TIMESTAMP
+                   WHERE meta_key = 'data_version'
+                   RETURNING meta_value""")
+    return cur.fetchone()[0]
 
 # ========================================
 # PHẦN 3: ETL PROCESS
@@ -445,72 +837,314 @@ def extract_data(csv_file, chunk_size=10000):
     print(f"\n📥 EXTRACT: Đọc dữ liệu từ {csv_file}")
     return pd.read_csv(csv_file, chunksize=chunk_size, iterator=True)
 
-def transform_data(chunk):
-    """TRANSFORM: Làm sạch và biến đổi dữ liệu"""
+def build_calendar(start_date, end_date):
+    """Tạo các dòng dim_date cho mọi ngày trong [start_date, end_date] (vectorized)"""
+    days = pd.date_range(start_date, end_date, freq='D')
+    month = days.month
+    season = np.select(
+        [month.isin([12, 1, 2]), month.isin([3, 4, 5]), month.isin([6, 7, 8])],
+        ['Winter', 'Spring', 'Summer'],
+        'Fall'
+    )
+    return pd.DataFrame({
+        'full_date': days.date,
+        'year': days.year,
+        'quarter': days.quarter,
+        'month': month,
+        'month_name': days.month_name(),
+        'day': days.day,
+        'day_of_week': days.weekday,
+        'day_name': days.day_name(),
+        'week_of_year': days.isocalendar()['week'].to_numpy(dtype='int64'),
+        'is_weekend': days.weekday >= 5,
+        'season': season,
+    })
+
+def load_calendar(csv_file, cur):
+    """
+    LOAD: Nạp dim_date 1 lần cho toàn bộ khoảng ngày của file CSV trước khi xử lý các chunk
+    Chỉ đọc cột snapshot_date; các chunk sau đó chỉ tra date_id, không INSERT lại ngày đã có
+    """
+    dates = pd.read_csv(csv_file, usecols=['snapshot_date'])['snapshot_date'].drop_duplicates()
+    return extend_calendar(dates.map(clean_date).dropna(), cur)
+
+def extend_calendar(dates, cur):
+    """
+    Nạp các ngày còn thiếu của dim_date để calendar liên tục từ ngày nhỏ nhất đến lớn nhất
+    (gồm cả các ngày đã có trong bảng), chỉ COPY các ngày chưa có
+    """
+    if dates.empty:
+        print("   ⚠️  Không có ngày hợp lệ")
+        return 0
+    cur.execute("SELECT MIN(full_date), MAX(full_date) FROM dim_date")
+    first, last = cur.fetchone()
+    start, end = min(dates.min(), first or dates.min()), max(dates.max(), last or dates.max())
+    calendar = build_calendar(start, end)
+    if first is not None:
+        calendar = calendar[(calendar['full_date'] < first) | (calendar['full_date'] > last)]
+    if KEY_STRATEGY == 'hash':
+        calendar.insert(0, 'date_id', calendar['year'] * 10000 + calendar['month'] * 100 + calendar['day'])
+    if not calendar.empty:
+        copy_dataframe(cur, 'dim_date', calendar)
+    print(f"   ✓ dim_date: +{len(calendar)} ngày ({start} → {end})")
+    return len(calendar)
+
+def file_fingerprint(path, block_size=1 << 20):
+    """SHA-256 nội dung file (file đổi tên/copy sang chỗ khác vẫn được nhận ra là đã load)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def record_loaded_file(cur, path, fingerprint=None, row_count=None):
+    """Ghi file đã load vào etl_loaded_files (gọi trong cùng transaction với dữ liệu của file)"""
+    cur.execute(
+        """INSERT INTO etl_loaded_files (fingerprint, file_name, file_size, row_count) VALUES (%s, %s, %s, %s)
+           ON CONFLICT (fingerprint) DO UPDATE SET file_name = EXCLUDED.file_name, row_count = EXCLUDED.row_count,
+               loaded_at = CURRENT_TIMESTAMP""",
+        (fingerprint or file_fingerprint(path), os.path.basename(path), os.path.getsize(path), row_count)
+    )
+
+# ========================================
+# KIỂM TRA DỮ LIỆU (VALIDATION)
+# ========================================
+
+# Luật kiểm tra: tên => (bit trong rule_mask, hành động)
+# - 'reject': dòng bị loại khỏi kho dữ liệu và được ghi nguyên dạng vào etl_quarantine
+# - 'coerce': giá trị được thay bằng mặc định (CLEAN_NUMERIC), chỉ đếm
+VALIDATION_RULES = {
+    'missing_spotify_id': (1 << 0, 'reject'),
+    'missing_name': (1 << 1, 'reject'),
+    'invalid_snapshot_date': (1 << 2, 'reject'),
+    'duplicate_row': (1 << 3, 'reject'),
+    'invalid_daily_rank': (1 << 4, 'coerce'),
+    'popularity_out_of_range': (1 << 5, 'coerce'),
+    'invalid_duration': (1 << 6, 'coerce'),
+    'audio_feature_out_of_range': (1 << 7, 'coerce'),
+    'tempo_out_of_range': (1 << 8, 'coerce'),
+    'loudness_out_of_range': (1 << 9, 'coerce'),
+    'key_out_of_range': (1 << 10, 'coerce'),
+    'time_signature_out_of_range': (1 << 11, 'coerce'),
+    'missing_mode': (1 << 12, 'coerce'),
+    'invalid_album_release_date': (1 << 13, 'coerce'),
+}
+RULE_ACTIONS = {rule: action for rule, (_, action) in VALIDATION_RULES.items()}
+
+# Luật 'coerce' cho cột số: tên => (các cột, min, max), cùng ngưỡng với transform_data;
+# giá trị thiếu, không phải số hoặc ngoài [min, max] đều bị thay bằng mặc định
+NUMERIC_RULES = {
+    'invalid_daily_rank': (['daily_rank'], 1, None),
+    'popularity_out_of_range': (['popularity'], 0, 100),
+    'invalid_duration': (['duration_ms'], 0, None),
+    'audio_feature_out_of_range': (['danceability', 'energy', 'speechiness', 'acousticness',
+                                    'instrumentalness', 'liveness', 'valence'], 0, 1),
+    'tempo_out_of_range': (['tempo'], 30, 250),
+    'loudness_out_of_range': (['loudness'], -60, 0),
+    'key_out_of_range': (['key'], 0, 11),
+    'time_signature_out_of_range': (['time_signature'], 3, 7),
+    'missing_mode': (['mode'], None, None),
+}
+
+# Làm sạch cột số: cột => (min, max, mặc định); giá trị thiếu / không phải số / ngoài khoảng
+# (cùng mask với NUMERIC_RULES) được thay bằng mặc định. mode thiếu => 1
+CLEAN_NUMERIC = {
+    'duration_ms': (0, None, 180000),
+    'daily_rank': (1, None, None),
+    'popularity': (0, 100, 50),
+    'danceability': (0, 1, 0.5),
+    'energy': (0, 1, 0.5),
+    'speechiness': (0, 1, 0.05),
+    'acousticness': (0, 1, 0.5),
+    'instrumentalness': (0, 1, 0),
+    'liveness': (0, 1, 0.1),
+    'valence': (0, 1, 0.5),
+    'tempo': (30, 250, 120),
+    'loudness': (-60, 0, -7),
+    'key': (0, 11, 0),
+    'time_signature': (3, 7, 4),
+}
+
+QUARANTINE_COLUMNS = ['run_id', 'source_row', 'rule_mask', 'raw_row']
+
+# Dòng bị loại khi transform (nguyên dạng CSV); IF NOT EXISTS để ingest_files.py tạo thêm cho kho dữ liệu cũ
+QUARANTINE_DDL = """
+    CREATE TABLE IF NOT EXISTS etl_quarantine (
+        quarantine_id BIGSERIAL PRIMARY KEY,
+        run_id VARCHAR(32) NOT NULL,
+        source_file TEXT,
+        source_row INTEGER,
+        rule_mask INTEGER NOT NULL,
+        raw_row JSONB NOT NULL,
+        rejected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_etl_quarantine_run ON etl_quarantine (run_id);
+    COMMENT ON TABLE etl_quarantine IS 'Metadata: Dòng CSV bị loại khi transform, rule_mask = OR các bit của VALIDATION_RULES';
+"""
+
+def out_of_range(values, min_val=None, max_val=None):
+    """Mask các giá trị thiếu / không phải số / ngoài [min_val, max_val] (vectorized)"""
+    numbers = pd.to_numeric(values, errors='coerce')
+    mask = numbers.isna()
+    if min_val is not None:
+        mask |= numbers < min_val
+    if max_val is not None:
+        mask |= numbers > max_val
+    return mask.to_numpy(dtype=bool)
+
+def numeric_masks(raw):
+    """Mask out_of_range của từng cột trong NUMERIC_RULES trên chunk gốc: {cột: mask}"""
+    return {column: out_of_range(raw[column], min_val, max_val)
+            for columns, min_val, max_val in NUMERIC_RULES.values() for column in columns}
+
+def validation_masks(raw, cleaned, numeric=None):
+    """
+    Đánh giá mọi luật trên cả chunk bằng mask boolean
+    raw: chunk gốc từ CSV, cleaned: chunk sau các bước làm sạch (cùng index, chưa lọc)
+    numeric: kết quả numeric_masks(raw) đã tính khi làm sạch (None => tính lại)
+    Trả về {tên luật: mask}; duplicate_row chỉ xét các dòng không bị loại bởi luật khác (giữ dòng đầu)
+    """
+    masks = {
+        'missing_spotify_id': cleaned['spotify_id'].isna().to_numpy(),
+        'missing_name': cleaned['name'].isna().to_numpy(),
+        'invalid_snapshot_date': cleaned['snapshot_date'].isna().to_numpy(),
+        'invalid_album_release_date': (raw['album_release_date'].notna()
+                                       & cleaned['album_release_date'].isna()).to_numpy(),
+    }
+    numeric = numeric if numeric is not None else numeric_masks(raw)
+    for rule, (columns, _, _) in NUMERIC_RULES.items():
+        masks[rule] = np.logical_or.reduce([numeric[column] for column in columns])
+    kept = ~(masks['missing_spotify_id'] | masks['missing_name'] | masks['invalid_snapshot_date'])
+    duplicate = np.zeros(len(cleaned), dtype=bool)
+    duplicate[kept] = cleaned[kept].duplicated(subset=['spotify_id', 'artists', 'snapshot_date', 'country']).to_numpy()
+    masks['duplicate_row'] = duplicate
+    return {rule: masks[rule] for rule in VALIDATION_RULES}
+
+def validate_chunk(raw, cleaned, numeric=None):
+    """
+    Gộp các mask thành rule_mask (OR các bit của luật vi phạm) cho từng dòng
+    Trả về (mask các dòng bị loại, DataFrame quarantine của các dòng đó, {tên luật: số dòng vi phạm})
+    """
+    masks = validation_masks(raw, cleaned, numeric)
+    rule_mask = np.zeros(len(cleaned), dtype=np.int32)
+    rejected = np.zeros(len(cleaned), dtype=bool)
+    for rule, mask in masks.items():
+        bit, action = VALIDATION_RULES[rule]
+        rule_mask |= np.where(mask, bit, 0).astype(np.int32)
+        if action == 'reject':
+            rejected |= mask
+    counts = {rule: int(mask.sum()) for rule, mask in masks.items()}
+    
+    rows = raw[rejected]
+    quarantine = pd.DataFrame({
+        'run_id': etl_metrics.RUN_ID,
+        # Số dòng trong file CSV (dòng 1 là header; index của read_csv liên tục giữa các chunk)
+        'source_row': rows.index.to_numpy() + 2,
+        'rule_mask': rule_mask[rejected],
+        'raw_row': rows.to_json(orient='records', lines=True, date_format='iso', force_ascii=False).splitlines() if len(rows) else [],
+    }, columns=QUARANTINE_COLUMNS)
+    return rejected, quarantine, counts
+
+def write_quarantine(cur, quarantine, source_file=None):
+    """LOAD: Ghi các dòng bị loại của 1 chunk/file vào etl_quarantine bằng 1 lệnh COPY"""
+    if quarantine is None or quarantine.empty:
+        return 0
+    rows = quarantine.assign(source_file=os.path.basename(source_file) if source_file else None)
+    copy_dataframe(cur, 'etl_quarantine', rows)
+    return len(rows)
+
+def describe_rule_mask(rule_mask):
+    """Tên các luật có bit trong rule_mask, ví dụ 5 => ['missing_spotify_id', 'invalid_snapshot_date']"""
+    return [rule for rule, (bit, _) in VALIDATION_RULES.items() if rule_mask & bit]
+
+def transform_data(chunk, quarantine=None):
+    """
+    TRANSFORM: Làm sạch và biến đổi dữ liệu
+    quarantine: list nhận DataFrame các dòng bị loại (xem validate_chunk), None => chỉ đếm
+    """
     print(f"\n🔄 TRANSFORM: Đang xử lý {len(chunk)} dòng dữ liệu")
     
     df = chunk.copy()
     
     # Làm sạch text
-    df['name'] = df['name'].apply(clean_text)
-    df['artists'] = df['artists'].apply(clean_text)
-    df['album_name'] = df['album_name'].apply(clean_text)
-    df['country'] = df['country'].apply(lambda x: clean_text(x) if x and x != '' else 'GLOBAL')
+    with etl_metrics.stage('transform.clean_text', rows_in=len(df)):
+        df['name'] = df['name'].apply(clean_text)
+        df['artists'] = df['artists'].apply(clean_text)
+        df['album_name'] = df['album_name'].apply(clean_text)
+        df['country'] = df['country'].apply(lambda x: clean_text(x) if x and x != '' else 'GLOBAL')
     
     # Làm sạch boolean
-    df['is_explicit'] = df['is_explicit'].apply(clean_boolean)
+    with etl_metrics.stage('transform.clean_boolean', rows_in=len(df)):
+        df['is_explicit'] = df['is_explicit'].apply(clean_boolean)
     
     # Làm sạch numeric
-    df['duration_ms'] = df['duration_ms'].apply(lambda x: clean_numeric(x, min_val=0, default=180000))
-    df['daily_rank'] = df['daily_rank'].apply(lambda x: clean_numeric(x, min_val=1, default=None))
-    df['popularity'] = df['popularity'].apply(lambda x: clean_numeric(x, min_val=0, max_val=100, default=50))
-    
-    # Làm sạch audio features
-    df['danceability'] = df['danceability'].apply(lambda x: clean_numeric(x, min_val=0, max_val=1, default=0.5))
-    df['energy'] = df['energy'].apply(lambda x: clean_numeric(x, min_val=0, max_val=1, default=0.5))
-    df['speechiness'] = df['speechiness'].apply(lambda x: clean_numeric(x, min_val=0, max_val=1, default=0.05))
-    df['acousticness'] = df['acousticness'].apply(lambda x: clean_numeric(x, min_val=0, max_val=1, default=0.5))
-    df['instrumentalness'] = df['instrumentalness'].apply(lambda x: clean_numeric(x, min_val=0, max_val=1, default=0))
-    df['liveness'] = df['liveness'].apply(lambda x: clean_numeric(x, min_val=0, max_val=1, default=0.1))
-    df['valence'] = df['valence'].apply(lambda x: clean_numeric(x, min_val=0, max_val=1, default=0.5))
-    df['tempo'] = df['tempo'].apply(lambda x: clean_numeric(x, min_val=30, max_val=250, default=120))
-    df['loudness'] = df['loudness'].apply(lambda x: clean_numeric(x, min_val=-60, max_val=0, default=-7))
-    df['key'] = df['key'].apply(lambda x: clean_numeric(x, min_val=0, max_val=11, default=0))
-    df['mode'] = df['mode'].apply(lambda x: 1 if clean_numeric(x, default=1) >= 0.5 else 0)
-    df['time_signature'] = df['time_signature'].apply(lambda x: clean_numeric(x, min_val=3, max_val=7, default=4))
+    with etl_metrics.stage('transform.clean_numeric', rows_in=len(df)):
+        # Giá trị thiếu / không phải số / ngoài khoảng => mặc định, dùng lại mask của luật kiểm tra
+        numeric = numeric_masks(chunk)
+        for column, (_, _, default) in CLEAN_NUMERIC.items():
+            numbers = pd.to_numeric(df[column], errors='coerce').astype(np.float64)
+            df[column] = numbers.where(~numeric[column], default)
+        mode = pd.to_numeric(df['mode'], errors='coerce').astype(np.float64).where(~numeric['mode'], 1)
+        df['mode'] = (mode >= 0.5).astype(np.int64)
     
     # Làm sạch dates
-    df['snapshot_date'] = df['snapshot_date'].apply(clean_date)
-    df['album_release_date'] = df['album_release_date'].apply(clean_date)
+    with etl_metrics.stage('transform.clean_dates', rows_in=len(df)):
+        df['snapshot_date'] = df['snapshot_date'].apply(clean_date)
+        df['album_release_date'] = df['album_release_date'].apply(clean_date)
     
     # Tính toán mood category
-    df['mood_category'] = df.apply(lambda row: categorize_mood(row['valence'], row['energy']), axis=1)
-    
-    # Tính toán audio features categorization (tuple of 5 levels)
-    df['audio_features_tuple'] = df.apply(
-        lambda row: categorize_audio_features(
-            row['energy'], 
-            row['danceability'], 
-            row['valence'],
-            row['acousticness'],
-            row['tempo']
-        ), 
-        axis=1
-    )
+    with etl_metrics.stage('transform.categorize', rows_in=len(df)):
+        df['mood_category'] = categorize_mood(df['valence'], df['energy'])
+    
+        # Tính toán audio features categorization (5 levels + mood + mã nhóm của dashboard), theo cả cột
+        features = (df['energy'], df['danceability'], df['valence'], df['acousticness'], df['tempo'])
+        columns = categorize_audio_features(*features) + (df['mood_category'].to_numpy(),) + audio_band_codes(*features)
+        df['audio_features_tuple'] = list(zip(*(column.tolist() for column in columns)))
     
-    # Loại bỏ dòng có giá trị critical bị thiếu
-    df = df.dropna(subset=['spotify_id', 'name', 'snapshot_date'])
+    # Loại bỏ dòng thiếu giá trị critical / duplicate, đếm số dòng vi phạm từng luật
+    with etl_metrics.stage('transform.validate', rows_in=len(df)) as metric:
+        rejected, rejected_rows, counts = validate_chunk(chunk, df, numeric)
+        df = df[~rejected]
+        metric['rows_out'] = len(df)
+    etl_metrics.count_rules(counts, RULE_ACTIONS)
+    if quarantine is not None:
+        quarantine.append(rejected_rows)
     
-    # Loại bỏ duplicate
-    df = df.drop_duplicates(subset=['spotify_id', 'artists', 'snapshot_date', 'country'])
+    # Kiểu số gọn cho các bước load phía sau (--compact-types)
+    if COMPACT_TYPES:
+        with etl_metrics.stage('transform.compact_types', rows_in=len(df)):
+            memory_before = df.memory_usage(deep=True).sum()
+            df = compact_dtypes(df)
+        print(f"   - Compact types: {memory_before / 1024 / 1024:.1f} MB → "
+              f"{df.memory_usage(deep=True).sum() / 1024 / 1024:.1f} MB")
     
     print(f"✅ TRANSFORM: Hoàn thành. Còn lại {len(df)} dòng hợp lệ")
+    violations = ', '.join(f"{rule}={count}" for rule, count in counts.items() if count)
+    if violations:
+        print(f"   - Loại {int(rejected.sum())} dòng, vi phạm: {violations}")
     print(f"   - Categorized audio features for {len(df)} songs")
     return df
 
+def insert_dimension(cur, table, columns, values, conflict, key=None):
+    """
+    INSERT các dòng dimension, bỏ qua dòng đã có (ON CONFLICT DO NOTHING)
+    key: (cột key, hàm tính key từ 1 dòng) khi dùng hash key => ghi luôn key và conflict theo key
+    """
+    if key is not None:
+        key_column, key_of = key
+        columns = [key_column] + columns
+        values = [(key_of(*value),) + tuple(value) for value in values]
+        conflict = key_column
+    extras.execute_values(
+        cur,
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s ON CONFLICT ({conflict}) DO NOTHING",
+        values
+    )
+
 def load_dimensions(df, cur):
     """LOAD: Nạp dữ liệu vào các bảng dimension"""
     print("\n📤 LOAD DIMENSIONS:")
+    hashed = KEY_STRATEGY == 'hash'
     
     # 1. Load dim_artist
     all_artists = set()
@@ -522,93 +1156,67 @@ def load_dimensions(df, cur):
         # Lấy first created_at từ snapshot_date
         first_date = df['snapshot_date'].min()
         artist_values = [(artist, first_date) for artist in all_artists if artist]
-        extras.execute_values(
-            cur,
-            "INSERT INTO dim_artist (artist_name, created_at) VALUES %s ON CONFLICT (artist_name) DO NOTHING",
-            artist_values
-        )
+        with etl_metrics.stage('load_dimensions.dim_artist', rows_in=len(artist_values), conflict=True):
+            insert_dimension(cur, 'dim_artist', ['artist_name', 'created_at'], artist_values, 'artist_name',
+                             key=('artist_id', lambda name, _: hash_key(name)) if hashed else None)
         print(f"   ✓ dim_artist: {len(artist_values)} records")
     
     # 2. Load dim_album
     first_date = df['snapshot_date'].min()
     albums = df[['album_name', 'album_release_date']].dropna(subset=['album_name']).drop_duplicates()
     if not albums.empty:
-        album_values = []
-        for _, row in albums.iterrows():
-            release_date = row['album_release_date']
-            year = release_date.year if release_date else None
-            month = release_date.month if release_date else None
-            album_values.append((row['album_name'], release_date, year, month, first_date))
-        
-        extras.execute_values(
-            cur,
-            "INSERT INTO dim_album (album_name, release_date, release_year, release_month, created_at) VALUES %s ON CONFLICT (album_name, release_date) DO NOTHING",
-            album_values
-        )
+        release = pd.to_datetime(albums['album_release_date'])
+        years = release.dt.year.astype('Int64')
+        months = release.dt.month.astype('Int64')
+        album_values = list(zip(
+            albums['album_name'].tolist(),
+            albums['album_release_date'].tolist(),
+            years.astype(object).where(years.notna(), None).tolist(),
+            months.astype(object).where(months.notna(), None).tolist(),
+            [first_date] * len(albums)
+        ))
+        
+        with etl_metrics.stage('load_dimensions.dim_album', rows_in=len(album_values), conflict=True):
+            insert_dimension(cur, 'dim_album',
+                             ['album_name', 'release_date', 'release_year', 'release_month', 'created_at'],
+                             album_values, 'album_name, release_date',
+                             key=('album_id', lambda name, release_date, *_: hash_key(name, release_date)) if hashed else None)
         print(f"   ✓ dim_album: {len(album_values)} records")
     
-    # 3. Load dim_date
-    dates = df['snapshot_date'].dropna().drop_duplicates()
-    if not dates.empty:
-        date_values = []
-        month_names = ['', 'January', 'February', 'March', 'April', 'May', 'June', 
-                      'July', 'August', 'September', 'October', 'November', 'December']
-        day_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        
-        for date in dates:
-            month = date.month
-            season = 'Winter' if month in [12, 1, 2] else 'Spring' if month in [3, 4, 5] else 'Summer' if month in [6, 7, 8] else 'Fall'
-            
-            date_values.append((
-                date,
-                date.year,
-                (month - 1) // 3 + 1,
-                month,
-                month_names[month],
-                date.day,
-                date.weekday(),
-                day_names[date.weekday()],
-                date.isocalendar()[1],
-                date.weekday() >= 5,
-                season
-            ))
-        
-        extras.execute_values(
-            cur,
-            "INSERT INTO dim_date (full_date, year, quarter, month, month_name, day, day_of_week, day_name, week_of_year, is_weekend, season) VALUES %s ON CONFLICT (full_date) DO NOTHING",
-            date_values
-        )
-        print(f"   ✓ dim_date: {len(date_values)} records")
+    # 3. dim_date đã được nạp trước cho toàn bộ khoảng ngày (load_calendar), chỉ cần tra key
     
     # 4. Load dim_country
+    country_key = ('country_id', lambda code, _: hash_key(code)) if hashed else None
     countries = df['country'].dropna().drop_duplicates()
     if not countries.empty:
         country_values = [(country, country) for country in countries if country and country != '']
         if country_values:
-            extras.execute_values(
-                cur,
-                "INSERT INTO dim_country (country_code, country_name) VALUES %s ON CONFLICT (country_code) DO NOTHING",
-                country_values
-            )
+            with etl_metrics.stage('load_dimensions.dim_country', rows_in=len(country_values), conflict=True):
+                insert_dimension(cur, 'dim_country', ['country_code', 'country_name'], country_values,
+                                 'country_code', key=country_key)
             print(f"   ✓ dim_country: {len(country_values)} records")
     
     # Thêm 1 country mặc định cho GLOBAL (xử lý NULL)
-    cur.execute("INSERT INTO dim_country (country_code, country_name) VALUES (%s, %s) ON CONFLICT (country_code) DO NOTHING", ('GLOBAL', 'Global'))
+    with etl_metrics.stage('load_dimensions.dim_country_global', rows_in=1, conflict=True):
+        insert_dimension(cur, 'dim_country', ['country_code', 'country_name'], [('GLOBAL', 'Global')],
+                         'country_code', key=country_key)
     print(f"   ✓ dim_country: Added default 'GLOBAL' country")
     
     # 1. Load dim_song
     first_date = df['snapshot_date'].min()
     songs = df[['spotify_id', 'name', 'is_explicit', 'duration_ms']].drop_duplicates(subset=['spotify_id'])
     if not songs.empty:
-        song_values = [
-            (row['spotify_id'], row['name'], row['is_explicit'], int(row['duration_ms']), first_date)
-            for _, row in songs.iterrows()
-        ]
-        extras.execute_values(
-            cur,
-            "INSERT INTO dim_song (spotify_id, song_name, is_explicit, duration_ms, created_at) VALUES %s ON CONFLICT (spotify_id) DO NOTHING",
-            song_values
-        )
+        song_values = list(zip(
+            songs['spotify_id'].tolist(),
+            songs['name'].tolist(),
+            songs['is_explicit'].tolist(),
+            songs['duration_ms'].astype('int64').tolist(),
+            [first_date] * len(songs)
+        ))
+        with etl_metrics.stage('load_dimensions.dim_song', rows_in=len(song_values), conflict=True):
+            insert_dimension(cur, 'dim_song', ['spotify_id', 'song_name', 'is_explicit', 'duration_ms', 'created_at'],
+                             song_values, 'spotify_id',
+                             key=('song_id', lambda spotify_id, *_: hash_key(spotify_id)) if hashed else None)
         print(f"   ✓ dim_song: {len(song_values)} records")
     
     # 6. Load dim_audio_features - Audio Feature Combinations
@@ -617,24 +1225,34 @@ def load_dimensions(df, cur):
     
     if audio_features_set:
         first_date = df['snapshot_date'].min()
-        features_values = [
-            (energy_lvl, dance_lvl, val_lvl, tempo_cat, acoustic_lvl, first_date)
-            for energy_lvl, dance_lvl, val_lvl, tempo_cat, acoustic_lvl in audio_features_set
-        ]
-        extras.execute_values(
-            cur,
-            """INSERT INTO dim_audio_features 
-               (energy_level, danceability_level, valence_level, tempo_category, acousticness_level, created_at) 
-               VALUES %s 
-               ON CONFLICT (energy_level, danceability_level, valence_level, tempo_category, acousticness_level) 
-               DO NOTHING""",
-            features_values
-        )
+        features_values = [features + (first_date,) for features in audio_features_set]
+        with etl_metrics.stage('load_dimensions.dim_audio_features', rows_in=len(features_values), conflict=True):
+            insert_dimension(cur, 'dim_audio_features', AUDIO_FEATURES_COLUMNS + ['created_at'], features_values,
+                             ', '.join(AUDIO_FEATURES_COLUMNS),
+                             key=('features_id', lambda *features: hash_key(*features[:-1])) if hashed else None)
         print(f"   ✓ dim_audio_features: {len(features_values)} feature combinations")
 
-def load_facts(df, cur):
-    """LOAD: Nạp dữ liệu vào các bảng fact"""
-    print("\n📤 LOAD FACTS:")
+def dimension_key_maps(df, cur=None):
+    """
+    Map natural key => surrogate key của các dimension mà các dòng fact của df cần
+    - 'serial': đọc từ các bảng dimension (cần cur, sau khi load_dimensions)
+    - 'hash': tính trong process từ chính df, không cần database
+    Trả về (song_map, artist_map, album_map, date_map, country_map, features_map)
+    """
+    if KEY_STRATEGY == 'hash':
+        artists = {artist for artists_str in df['artists'].dropna() for artist in extract_and_clean_artists(artists_str)}
+        # Cùng tập album với load_dimensions (album không có tên => album_id NULL như chế độ SERIAL)
+        albums = df[['album_name', 'album_release_date']].dropna(subset=['album_name']).drop_duplicates()
+        albums = albums.itertuples(index=False, name=None)
+        countries = set(df['country'].dropna()) | {'GLOBAL'}
+        return (
+            {spotify_id: hash_key(spotify_id) for spotify_id in df['spotify_id'].unique()},
+            {artist: hash_key(artist) for artist in artists},
+            {album: hash_key(*album) for album in albums},
+            {day: date_key(day) for day in df['snapshot_date'].dropna().unique()},
+            {country: hash_key(country) for country in countries},
+            {features: hash_key(*features) for features in df['audio_features_tuple'].unique()},
+        )
     
     # Lấy dimension keys
     cur.execute("SELECT spotify_id, song_id FROM dim_song")
@@ -653,189 +1271,600 @@ def load_facts(df, cur):
     country_map = dict(cur.fetchall())
     
     # QUAN TRỌNG: Lấy features_id từ dim_audio_features
-    cur.execute("""SELECT energy_level, danceability_level, valence_level, 
-                   tempo_category, acousticness_level, features_id 
-                   FROM dim_audio_features""")
-    features_map = {(e, d, v, t, a): fid for e, d, v, t, a, fid in cur.fetchall()}
+    cur.execute(f"SELECT {', '.join(AUDIO_FEATURES_COLUMNS)}, features_id FROM dim_audio_features")
+    features_map = {tuple(row[:-1]): row[-1] for row in cur.fetchall()}
+    return song_map, artist_map, album_map, date_map, country_map, features_map
+
+def build_fact_rows(df, cur=None):
+    """
+    Dựng các dòng của 5 bảng fact từ df đã transform
+    Với hash key không cần cur (chạy được ở worker/thread transform, không round-trip database)
+    Trả về dict {bảng fact: [tuple]}
+    """
+    with etl_metrics.stage('load_facts.prepare', rows_in=len(df)) as metric:
+        song_map, artist_map, album_map, date_map, country_map, features_map = dimension_key_maps(df, cur)
     
-    # Chuẩn bị dữ liệu cho các fact tables
-    fact_song_daily = []
-    fact_artist_stats = []
-    fact_chart_position = []
-    fact_audio_analysis = []
-    fact_streaming_metrics = []
+        # Chuẩn bị dữ liệu cho các fact tables
+        fact_song_daily = []
+        fact_artist_stats = []
+        fact_chart_position = []
+        fact_audio_analysis = []
+        fact_streaming_metrics = []
     
-    processed_audio = set()
+        processed_audio = set()
     
-    for _, row in df.iterrows():
-        song_id = song_map.get(row['spotify_id'])
-        date_id = date_map.get(row['snapshot_date'])
+        for _, row in df.iterrows():
+            song_id = song_map.get(row['spotify_id'])
+            date_id = date_map.get(row['snapshot_date'])
         
-        # XỬ LÝ NULL COUNTRY: Nếu country null/empty thì dùng 'GLOBAL'
-        country_val = row['country'] if pd.notna(row['country']) and row['country'] != '' else 'GLOBAL'
-        country_id = country_map.get(country_val)
-        if not country_id:  # Fallback nếu vẫn không tìm thấy
-            country_id = country_map.get('GLOBAL')
+            # XỬ LÝ NULL COUNTRY: Nếu country null/empty thì dùng 'GLOBAL'
+            country_val = row['country'] if pd.notna(row['country']) and row['country'] != '' else 'GLOBAL'
+            country_id = country_map.get(country_val)
+            if not country_id:  # Fallback nếu vẫn không tìm thấy
+                country_id = country_map.get('GLOBAL')
         
-        album_id = album_map.get((row['album_name'], row['album_release_date']))
+            album_id = album_map.get((row['album_name'], row['album_release_date']))
         
-        if not song_id or not date_id:
-            continue
+            if not song_id or not date_id:
+                continue
         
-        # Tính toán các metrics - XỬ LÝ NULL VALUES
-        rank = int(row['daily_rank']) if pd.notna(row['daily_rank']) else 100
-        popularity = int(row['popularity']) if pd.notna(row['popularity']) else 50
-        rank_points = (101 - rank)
-        performance_index = (rank_points + popularity) / 2
+            # Tính toán các metrics - XỬ LÝ NULL VALUES
+            rank = int(row['daily_rank']) if pd.notna(row['daily_rank']) else 100
+            popularity = int(row['popularity']) if pd.notna(row['popularity']) else 50
+            rank_points = (101 - rank)
+            performance_index = (rank_points + popularity) / 2
         
-        # FACT 1: Song Daily Performance
-        fact_song_daily.append((
-            song_id, date_id, country_id, album_id,
-            rank, popularity, rank_points, performance_index, row['snapshot_date']
-        ))
+            # FACT 1: Song Daily Performance
+            fact_song_daily.append((
+                song_id, date_id, country_id, album_id,
+                rank, popularity, rank_points, performance_index, row['snapshot_date']
+            ))
         
-        # FACT 3: Chart Position - XỬ LÝ NULL MOVEMENTS
-        daily_mov = int(row['daily_movement']) if pd.notna(row['daily_movement']) else 0
-        weekly_mov = int(row['weekly_movement']) if pd.notna(row['weekly_movement']) else 0
-        is_rising = daily_mov > 0 or weekly_mov > 0
-        is_falling = daily_mov < 0 or weekly_mov < 0
-        movement_mag = abs(daily_mov) + abs(weekly_mov)
-        trend_strength = min(10.0, movement_mag / 10.0)  # Cap at 10.0
-        
-        # Calculate previous_rank từ current rank và daily_movement
-        previous_rank = rank - daily_mov if rank and daily_mov else rank
-        if not previous_rank or previous_rank < 1:
-            previous_rank = 100  # Default to 100 if invalid
-        
-        fact_chart_position.append((
-            song_id, date_id, country_id,
-            rank, int(previous_rank), daily_mov, weekly_mov,
-            is_rising, is_falling, movement_mag, trend_strength, row['snapshot_date']
-        ))
+            # FACT 3: Chart Position - XỬ LÝ NULL MOVEMENTS
+            daily_mov = int(row['daily_movement']) if pd.notna(row['daily_movement']) else 0
+            weekly_mov = int(row['weekly_movement']) if pd.notna(row['weekly_movement']) else 0
+            is_rising = daily_mov > 0 or weekly_mov > 0
+            is_falling = daily_mov < 0 or weekly_mov < 0
+            movement_mag = abs(daily_mov) + abs(weekly_mov)
+            trend_strength = min(10.0, movement_mag / 10.0)  # Cap at 10.0
+        
+            # Calculate previous_rank từ current rank và daily_movement
+            previous_rank = rank - daily_mov if rank and daily_mov else rank
+            if not previous_rank or previous_rank < 1:
+                previous_rank = 100  # Default to 100 if invalid
         
-        # FACT 4: Audio Analysis (chỉ 1 lần mỗi bài) - XỬ LÝ NULL AUDIO FEATURES
-        if song_id not in processed_audio:
-            energy = float(row['energy']) if pd.notna(row['energy']) else 0.5
-            danceability = float(row['danceability']) if pd.notna(row['danceability']) else 0.5
-            valence = float(row['valence']) if pd.notna(row['valence']) else 0.5
-            
-            energy_dance = (energy + danceability) / 2
-            mood_score = (valence * 0.6 + energy * 0.4)
-            
-            # LẤY FEATURES_ID TỰ ĐỘNG TỪ DIM_AUDIO_FEATURES
-            audio_features_tuple = row.get('audio_features_tuple', None)
-            features_id = features_map.get(audio_features_tuple) if audio_features_tuple else None
-            
-            fact_audio_analysis.append((
-                song_id, features_id,
-                danceability, energy,
-                int(row['key']) if pd.notna(row['key']) else 0,
-                float(row['loudness']) if pd.notna(row['loudness']) else -7.0,
-                int(row['mode']) if pd.notna(row['mode']) else 1,
-                float(row['speechiness']) if pd.notna(row['speechiness']) else 0.05,
-                float(row['acousticness']) if pd.notna(row['acousticness']) else 0.5,
-                float(row['instrumentalness']) if pd.notna(row['instrumentalness']) else 0.0,
-                float(row['liveness']) if pd.notna(row['liveness']) else 0.1,
-                valence,
-                float(row['tempo']) if pd.notna(row['tempo']) else 120.0,
-                int(row['time_signature']) if pd.notna(row['time_signature']) else 4,
-                energy_dance, mood_score, row['snapshot_date']
+            fact_chart_position.append((
+                song_id, date_id, country_id,
+                rank, int(previous_rank), daily_mov, weekly_mov,
+                is_rising, is_falling, movement_mag, trend_strength, None, row['snapshot_date']
             ))
-            processed_audio.add(song_id)
-        
-        # FACT 5: Streaming Metrics (ước tính) - XỬ LÝ NULL STREAMS
-        estimated_streams = int((101 - rank) * 10000)
-        estimated_listeners = max(0, int(estimated_streams * 0.6))
-        engagement = min(100.0, popularity * 1.2)  # Cap at 100
-        viral_coef = min(1.0, movement_mag / 100.0)  # Cap at 1.0
-        
-        fact_streaming_metrics.append((
-            song_id, date_id, country_id,
-            estimated_streams, estimated_listeners,
-            85.0, engagement, viral_coef, row['snapshot_date']
-        ))
         
-        # FACT 2: Artist Stats - XỬ LÝ ARTISTS KHÔNG CÓ
-        artists = extract_and_clean_artists(row['artists'])
-        if not artists:  # Nếu không có artist thì skip
-            continue
+            # FACT 4: Audio Analysis (chỉ 1 lần mỗi bài) - XỬ LÝ NULL AUDIO FEATURES
+            if song_id not in processed_audio:
+                energy = float(row['energy']) if pd.notna(row['energy']) else 0.5
+                danceability = float(row['danceability']) if pd.notna(row['danceability']) else 0.5
+                valence = float(row['valence']) if pd.notna(row['valence']) else 0.5
             
-        for idx, artist_name in enumerate(artists):
-            artist_id = artist_map.get(artist_name)
-            if artist_id:
-                artist_score = performance_index * (1.0 if idx == 0 else 0.7)
-                contribution = 1.0 if idx == 0 else 0.5
-                
-                fact_artist_stats.append((
-                    artist_id, song_id, date_id, country_id,
-                    rank, popularity, idx + 1,
-                    artist_score, contribution, row['snapshot_date']
+                energy_dance = (energy + danceability) / 2
+                mood_score = (valence * 0.6 + energy * 0.4)
+            
+                # LẤY FEATURES_ID TỰ ĐỘNG TỪ DIM_AUDIO_FEATURES
+                audio_features_tuple = row.get('audio_features_tuple', None)
+                features_id = features_map.get(audio_features_tuple) if audio_features_tuple else None
+            
+                fact_audio_analysis.append((
+                    song_id, features_id,
+                    danceability, energy,
+                    int(row['key']) if pd.notna(row['key']) else 0,
+                    float(row['loudness']) if pd.notna(row['loudness']) else -7.0,
+                    int(row['mode']) if pd.notna(row['mode']) else 1,
+                    float(row['speechiness']) if pd.notna(row['speechiness']) else 0.05,
+                    float(row['acousticness']) if pd.notna(row['acousticness']) else 0.5,
+                    float(row['instrumentalness']) if pd.notna(row['instrumentalness']) else 0.0,
+                    float(row['liveness']) if pd.notna(row['liveness']) else 0.1,
+                    valence,
+                    float(row['tempo']) if pd.notna(row['tempo']) else 120.0,
+                    int(row['time_signature']) if pd.notna(row['time_signature']) else 4,
+                    energy_dance, mood_score, row['snapshot_date']
                 ))
+                processed_audio.add(song_id)
+        
+            # FACT 5: Streaming Metrics (ước tính) - XỬ LÝ NULL STREAMS
+            estimated_streams = int((101 - rank) * 10000)
+            estimated_listeners = max(0, int(estimated_streams * 0.6))
+            engagement = min(100.0, popularity * 1.2)  # Cap at 100
+            viral_coef = min(1.0, movement_mag / 100.0)  # Cap at 1.0
+        
+            fact_streaming_metrics.append((
+                song_id, date_id, country_id,
+                estimated_streams, estimated_listeners,
+                85.0, engagement, viral_coef, row['snapshot_date']
+            ))
+        
+            # FACT 2: Artist Stats - XỬ LÝ ARTISTS KHÔNG CÓ
+            artists = extract_and_clean_artists(row['artists'])
+            if not artists:  # Nếu không có artist thì skip
+                continue
+            
+            for idx, artist_name in enumerate(artists):
+                artist_id = artist_map.get(artist_name)
+                if artist_id:
+                    artist_score = performance_index * (1.0 if idx == 0 else 0.7)
+                    contribution = 1.0 if idx == 0 else 0.5
+                
+                    fact_artist_stats.append((
+                        artist_id, song_id, date_id, country_id,
+                        rank, popularity, idx + 1,
+                        artist_score, contribution, row['snapshot_date']
+                    ))
+        metric['rows_out'] = len(fact_song_daily)
+    return {
+        'fact_song_daily': fact_song_daily,
+        'fact_artist_stats': fact_artist_stats,
+        'fact_chart_position': fact_chart_position,
+        'fact_audio_analysis': fact_audio_analysis,
+        'fact_streaming_metrics': fact_streaming_metrics,
+    }
+
+def load_facts(df, cur, facts=None, history=None):
+    """
+    LOAD: Nạp dữ liệu vào các bảng fact
+    facts: các dòng fact đã dựng sẵn (build_fact_rows), None => dựng từ df
+    history: chart_history.ChartHistory => previous_rank / movement / chart_streak tính từ lịch sử BXH
+             (thay vì suy ra từ CSV), trạng thái được lưu trong cùng transaction
+    """
+    print("\n📤 LOAD FACTS:")
+    
+    # Tra dimension keys + dựng các dòng fact
+    if facts is None:
+        facts = build_fact_rows(df, cur)
+    if history is not None:
+        with etl_metrics.stage('load_facts.chart_history', rows_in=len(facts['fact_chart_position'])) as metric:
+            facts = history.apply_to_facts(facts)
+            metric['rows_out'] = len(history)
+    fact_song_daily = facts['fact_song_daily']
+    fact_artist_stats = facts['fact_artist_stats']
+    fact_chart_position = facts['fact_chart_position']
+    fact_audio_analysis = facts['fact_audio_analysis']
+    fact_streaming_metrics = facts['fact_streaming_metrics']
     
     # Insert vào database
     if fact_song_daily:
-        extras.execute_values(
-            cur,
-            """INSERT INTO fact_song_daily 
-               (song_id, date_id, country_id, album_id, daily_rank, popularity_score, 
-                rank_points, performance_index, created_at) 
-               VALUES %s ON CONFLICT (song_id, date_id, country_id) DO NOTHING""",
-            fact_song_daily
-        )
+        with etl_metrics.stage('load_facts.fact_song_daily', rows_in=len(fact_song_daily), conflict=True):
+            extras.execute_values(
+                cur,
+                """INSERT INTO fact_song_daily 
+                   (song_id, date_id, country_id, album_id, daily_rank, popularity_score, 
+                    rank_points, performance_index, created_at) 
+                   VALUES %s ON CONFLICT (song_id, date_id, country_id) DO NOTHING""",
+                fact_song_daily
+            )
         print(f"   ✓ fact_song_daily: {len(fact_song_daily)} records")
     
     if fact_artist_stats:
-        extras.execute_values(
-            cur,
-            """INSERT INTO fact_artist_stats 
-               (artist_id, song_id, date_id, country_id, song_rank, song_popularity, 
-                artist_position, artist_score, contribution_weight, created_at) 
-               VALUES %s ON CONFLICT (artist_id, song_id, date_id, country_id) DO NOTHING""",
-            fact_artist_stats
-        )
+        with etl_metrics.stage('load_facts.fact_artist_stats', rows_in=len(fact_artist_stats), conflict=True):
+            extras.execute_values(
+                cur,
+                """INSERT INTO fact_artist_stats 
+                   (artist_id, song_id, date_id, country_id, song_rank, song_popularity, 
+                    artist_position, artist_score, contribution_weight, created_at) 
+                   VALUES %s ON CONFLICT (artist_id, song_id, date_id, country_id) DO NOTHING""",
+                fact_artist_stats
+            )
         print(f"   ✓ fact_artist_stats: {len(fact_artist_stats)} records")
     
     if fact_chart_position:
-        extras.execute_values(
-            cur,
-            """INSERT INTO fact_chart_position 
-               (song_id, date_id, country_id, current_rank, previous_rank, 
-                daily_movement, weekly_movement, is_rising, is_falling, 
-                movement_magnitude, trend_strength, created_at) 
-               VALUES %s ON CONFLICT (song_id, date_id, country_id) DO NOTHING""",
-            fact_chart_position
-        )
+        with etl_metrics.stage('load_facts.fact_chart_position', rows_in=len(fact_chart_position), conflict=True):
+            extras.execute_values(
+                cur,
+                """INSERT INTO fact_chart_position 
+                   (song_id, date_id, country_id, current_rank, previous_rank, 
+                    daily_movement, weekly_movement, is_rising, is_falling, 
+                    movement_magnitude, trend_strength, chart_streak, created_at) 
+                   VALUES %s ON CONFLICT (song_id, date_id, country_id) DO NOTHING""",
+                fact_chart_position
+            )
         print(f"   ✓ fact_chart_position: {len(fact_chart_position)} records")
     
     if fact_audio_analysis:
-        extras.execute_values(
-            cur,
-            """INSERT INTO fact_audio_analysis 
-               (song_id, features_id, danceability, energy, key_signature, loudness, mode,
-                speechiness, acousticness, instrumentalness, liveness, valence, tempo,
-                time_signature, energy_dance_score, mood_score, created_at) 
-               VALUES %s ON CONFLICT (song_id) DO NOTHING""",
-            fact_audio_analysis
-        )
+        with etl_metrics.stage('load_facts.fact_audio_analysis', rows_in=len(fact_audio_analysis), conflict=True):
+            extras.execute_values(
+                cur,
+                """INSERT INTO fact_audio_analysis 
+                   (song_id, features_id, danceability, energy, key_signature, loudness, mode,
+                    speechiness, acousticness, instrumentalness, liveness, valence, tempo,
+                    time_signature, energy_dance_score, mood_score, created_at) 
+                   VALUES %s ON CONFLICT (song_id) DO NOTHING""",
+                fact_audio_analysis
+            )
         print(f"   ✓ fact_audio_analysis: {len(fact_audio_analysis)} records")
     
     if fact_streaming_metrics:
-        extras.execute_values(
-            cur,
-            """INSERT INTO fact_streaming_metrics 
-               (song_id, date_id, country_id, estimated_streams, estimated_listeners,
-                avg_completion_rate, engagement_score, viral_coefficient, created_at) 
-               VALUES %s ON CONFLICT (song_id, date_id, country_id) DO NOTHING""",
-            fact_streaming_metrics
-        )
+        with etl_metrics.stage('load_facts.fact_streaming_metrics', rows_in=len(fact_streaming_metrics), conflict=True):
+            extras.execute_values(
+                cur,
+                """INSERT INTO fact_streaming_metrics 
+                   (song_id, date_id, country_id, estimated_streams, estimated_listeners,
+                    avg_completion_rate, engagement_score, viral_coefficient, created_at) 
+                   VALUES %s ON CONFLICT (song_id, date_id, country_id) DO NOTHING""",
+                fact_streaming_metrics
+            )
         print(f"   ✓ fact_streaming_metrics: {len(fact_streaming_metrics)} records")
+    
+    if history is not None:
+        history.save(cur)
+
+def load_wide_table(df, cur):
+    """
+    LOAD: Append các dòng mới của chunk vào bảng phi chuẩn hóa wide_song_daily
+    Dữ liệu lấy từ các bảng fact/dimension vừa load (cùng transaction) nên luôn khớp với fact_song_daily
+    """
+    dates = [d for d in df['snapshot_date'].dropna().unique()]
+    if not dates:
+        return 0
+    cur.execute("SELECT date_id FROM dim_date WHERE full_date = ANY(%s)", (dates,))
+    date_ids = [row[0] for row in cur.fetchall()]
+    
+    cur.execute("""
+        INSERT INTO wide_song_daily (
+            date_id, country_id, song_id,
+            full_date, year, month, day_of_week, day_name, country_code, country_name,
+            song_name, is_explicit, duration_ms, album_id, album_name, release_year,
+            primary_artist_id, primary_artist_name,
+            daily_rank, popularity_score, rank_points, performance_index,
+            features_id, danceability, energy, valence, acousticness, speechiness,
+            instrumentalness, liveness, loudness, tempo,
+            energy_level, danceability_level, valence_level, tempo_category, acousticness_level
+        )
+        SELECT
+            fsd.date_id, fsd.country_id, fsd.song_id,
+            d.full_date, d.year, d.month, d.day_of_week, d.day_name, c.country_code, c.country_name,
+            s.song_name, s.is_explicit, s.duration_ms, fsd.album_id, al.album_name, al.release_year,
+            pa.artist_id, a.artist_name,
+            fsd.daily_rank, fsd.popularity_score, fsd.rank_points, fsd.performance_index,
+            faa.features_id, faa.danceability, faa.energy, faa.valence, faa.acousticness, faa.speechiness,
+            faa.instrumentalness, faa.liveness, faa.loudness, faa.tempo,
+            daf.energy_level, daf.danceability_level, daf.valence_level, daf.tempo_category, daf.acousticness_level
+        FROM fact_song_daily fsd
+        JOIN dim_date d ON fsd.date_id = d.date_id
+        JOIN dim_country c ON fsd.country_id = c.country_id
+        JOIN dim_song s ON fsd.song_id = s.song_id
+        LEFT JOIN dim_album al ON fsd.album_id = al.album_id
+        LEFT JOIN fact_audio_analysis faa ON fsd.song_id = faa.song_id
+        LEFT JOIN dim_audio_features daf ON faa.features_id = daf.features_id
+        LEFT JOIN (
+            SELECT song_id, date_id, country_id, MIN(artist_id) as artist_id
+            FROM fact_artist_stats
+            WHERE artist_position = 1 AND date_id = ANY(%(date_ids)s)
+            GROUP BY song_id, date_id, country_id
+        ) pa ON fsd.song_id = pa.song_id AND fsd.date_id = pa.date_id AND fsd.country_id = pa.country_id
+        LEFT JOIN dim_artist a ON pa.artist_id = a.artist_id
+        WHERE fsd.date_id = ANY(%(date_ids)s)
+        ORDER BY d.full_date, c.country_code, fsd.song_id
+        ON CONFLICT (date_id, country_id, song_id) DO NOTHING
+    """, {'date_ids': date_ids})
+    print(f"   ✓ wide_song_daily: {cur.rowcount} records")
+    return cur.rowcount
+
+def load_sketches(df, cur):
+    """
+    LOAD: Tạo lại sketch distinct của mọi (ngày × quốc gia) thuộc các ngày trong chunk
+    Đọc lại fact của cả ngày (cùng transaction) nên ngày bị chia qua nhiều chunk vẫn đúng;
+    hash và gộp register bằng NumPy (hll_sketch.build_sketches), upsert 1 lần
+    """
+    
+    dates = [d for d in df['snapshot_date'].dropna().unique()]
+    if not dates:
+        return 0
+    cur.execute("SELECT date_id FROM dim_date WHERE full_date = ANY(%s)", (dates,))
+    date_ids = [row[0] for row in cur.fetchall()]
+    
+    # Mỗi dòng fact_song_daily với trọng số = số dòng fact_artist_stats cùng (song, date)
+    cur.execute("""
+        SELECT fsd.date_id, fsd.country_id, fsd.song_id, fsd.album_id,
+               fsd.popularity_score, fsd.rank_points, COALESCE(fan.n, 1)
+        FROM fact_song_daily fsd
+        LEFT JOIN (
+            SELECT song_id, date_id, COUNT(*) as n
+            FROM fact_artist_stats
+            WHERE date_id = ANY(%(date_ids)s)
+            GROUP BY song_id, date_id
+        ) fan ON fsd.song_id = fan.song_id AND fsd.date_id = fan.date_id
+        WHERE fsd.date_id = ANY(%(date_ids)s)
+    """, {'date_ids': date_ids})
+    rows = cur.fetchall()
+    songs = pd.DataFrame(rows, columns=[
+        'date_id', 'country_id', 'song_id', 'album_id', 'popularity', 'rank_points', 'weight'
+    ])
+    if songs.empty:
+        return 0
+    # album_id có NULL: giữ kiểu Int64 (float64 làm mất chính xác của hash key 64-bit)
+    songs['album_id'] = pd.array([row[3] for row in rows], dtype='Int64')
+    
+    cur.execute("""
+        SELECT DISTINCT fsd.date_id, fsd.country_id, fas.artist_id
+        FROM fact_song_daily fsd
+        JOIN fact_artist_stats fas ON fsd.song_id = fas.song_id AND fsd.date_id = fas.date_id
+        WHERE fsd.date_id = ANY(%(date_ids)s) AND fas.date_id = ANY(%(date_ids)s)
+    """, {'date_ids': date_ids})
+    artists = pd.DataFrame(cur.fetchall(), columns=['date_id', 'country_id', 'artist_id'])
+    
+    # Mã nhóm (ngày × quốc gia) dùng chung cho 2 DataFrame
+    groups = songs[['date_id', 'country_id']].drop_duplicates().reset_index(drop=True)
+    group_codes = pd.MultiIndex.from_frame(groups)
+    song_groups = group_codes.get_indexer(pd.MultiIndex.from_frame(songs[['date_id', 'country_id']]))
+    artist_groups = group_codes.get_indexer(pd.MultiIndex.from_frame(artists[['date_id', 'country_id']]))
+    
+    song_sketches = hll_sketch.build_sketches(song_groups, songs['song_id'].to_numpy())
+    has_album = songs['album_id'].notna().to_numpy()
+    album_sketches = hll_sketch.build_sketches(song_groups[has_album], songs['album_id'][has_album].to_numpy(dtype=np.int64))
+    artist_sketches = hll_sketch.build_sketches(artist_groups, artists['artist_id'].to_numpy())
+    
+    weight = songs['weight'].to_numpy(dtype=np.int64)
+    n_groups = len(groups)
+    row_weight = np.bincount(song_groups, weights=weight, minlength=n_groups)
+    popularity_sum = np.bincount(song_groups, weights=weight * songs['popularity'].to_numpy(dtype=np.int64), minlength=n_groups)
+    rank_points_sum = np.bincount(song_groups, weights=weight * songs['rank_points'].astype(float).to_numpy(), minlength=n_groups)
+    max_popularity = np.full(n_groups, -1, dtype=np.int64)
+    np.maximum.at(max_popularity, song_groups, songs['popularity'].to_numpy(dtype=np.int64))
+    
+    empty = hll_sketch.SPARSE  # sketch rỗng (ngày × quốc gia không có nghệ sĩ/album)
+    sketch_values = [
+        (int(date_id), int(country_id),
+         song_sketches.get(i, empty), artist_sketches.get(i, empty), album_sketches.get(i, empty),
+         int(row_weight[i]), int(popularity_sum[i]), int(max_popularity[i]), round(float(rank_points_sum[i]), 2))
+        for i, (date_id, country_id) in enumerate(groups.itertuples(index=False))
+    ]
+    extras.execute_values(
+        cur,
+        """INSERT INTO sketch_daily_country
+           (date_id, country_id, song_sketch, artist_sketch, album_sketch,
+            row_weight, popularity_sum, max_popularity, rank_points_sum)
+           VALUES %s
+           ON CONFLICT (date_id, country_id) DO UPDATE SET
+               song_sketch = EXCLUDED.song_sketch,
+               artist_sketch = EXCLUDED.artist_sketch,
+               album_sketch = EXCLUDED.album_sketch,
+               row_weight = EXCLUDED.row_weight,
+               popularity_sum = EXCLUDED.popularity_sum,
+               max_popularity = EXCLUDED.max_popularity,
+               rank_points_sum = EXCLUDED.rank_points_sum""",
+        sketch_values
+    )
+    print(f"   ✓ sketch_daily_country: {len(sketch_values)} (ngày × quốc gia)")
+    return len(sketch_values)
+
+def copy_dataframe(cur, table, df):
+    """Ghi DataFrame vào bảng bằng 1 lệnh COPY (NaN/None => NULL)"""
+    buffer = io.StringIO()
+    df.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def build_trend_tables(cur, dates=None):
+    """
+    LOAD: Snapshot xu hướng theo ngày (trend_song_daily, trend_artist_daily) từ trạng thái rolling
+    đã lưu (trend_state.py): chỉ tổng hợp fact của các ngày sau ngày cuối của trạng thái và ghi thêm các ngày đó.
+    dates: các ngày vừa load. Có ngày không sau ngày cuối của trạng thái (file đến muộn) thì dựng lại
+    trạng thái từ HORIZON ngày trước ngày sớm nhất và tính lại từ ngày đó; chưa có trạng thái thì tính cả lịch sử.
+    Chạy sau khi load xong các chunk: rolling window cần duyệt các ngày theo thứ tự tăng dần,
+    còn chunk của CSV không chia theo ngày (1 ngày có thể nằm ở nhiều chunk)
+    """
+    print("\n📈 TREND TABLES:")
+    cur.execute("""
+        SELECT MAX(d.full_date) FROM dim_date d
+        WHERE EXISTS (SELECT 1 FROM fact_song_daily f WHERE f.date_id = d.date_id)
+    """)
+    last_date = cur.fetchone()[0]
+    if last_date is None:
+        print("   ⚠️  Không có dữ liệu")
+        return
+    end_day = int(trend_state.to_days([last_date])[0])
+    
+    songs_state = trend_state.TrendWindow.load(cur, 'song', 2)
+    artists_state = trend_state.TrendWindow.load(cur, 'artist', 2)
+    first_loaded = int(trend_state.to_days([min(dates)])[0]) if dates is not None and len(dates) else None
+    has_state = songs_state is not None and artists_state is not None \
+        and songs_state.end_day == artists_state.end_day
+    if has_state and (first_loaded is None or first_loaded > songs_state.end_day):
+        # Chỉ các ngày mới
+        start = read_from = songs_state.end_day + 1
+    else:
+        songs_state, artists_state = trend_state.TrendWindow(2), trend_state.TrendWindow(2)
+        if has_state:
+            # Ngày đến muộn: HORIZON - 1 ngày trước đó chỉ để dựng lại trạng thái
+            start, read_from = first_loaded, first_loaded - (trend_state.HORIZON - 1)
+        else:
+            start = read_from = None
+    if start is not None and start > end_day:
+        print("   ✓ Không có ngày mới")
+        return
+    if start is None:
+        cur.execute("TRUNCATE trend_song_daily, trend_artist_daily")
+    else:
+        cur.execute("DELETE FROM trend_song_daily WHERE full_date >= %s", (trend_state.to_date(start),))
+        cur.execute("DELETE FROM trend_artist_daily WHERE full_date >= %s", (trend_state.to_date(start),))
+    params = {'read_from': None if read_from is None else trend_state.to_date(read_from)}
+    
+    # Giá trị từng ngày của bài hát (trung bình trên các quốc gia)
+    cur.execute("""
+        SELECT d.full_date, fsd.song_id,
+               AVG(fsd.daily_rank)::float, AVG(fsd.popularity_score)::float, COUNT(*)
+        FROM fact_song_daily fsd
+        JOIN dim_date d ON fsd.date_id = d.date_id
+        WHERE %(read_from)s::DATE IS NULL OR d.full_date >= %(read_from)s::DATE
+        GROUP BY d.full_date, fsd.song_id
+        ORDER BY d.full_date, fsd.song_id
+    """, params)
+    songs = pd.DataFrame(cur.fetchall(), columns=['full_date', 'song_id', 'avg_rank', 'avg_popularity', 'num_countries'])
+    songs['day'] = trend_state.to_days(songs['full_date']) if len(songs) else np.zeros(0, dtype=np.int64)
+    
+    rolling, days, lagged = songs_state.advance(
+        songs['day'].to_numpy(), songs['song_id'].to_numpy(dtype=np.int64),
+        songs[['avg_rank', 'avg_popularity']].to_numpy(dtype=np.float64), end_day
+    )
+    songs['prev_rank'] = lagged[1][:, 0]
+    songs['rank_change'] = songs['avg_rank'] - songs['prev_rank']
+    songs['rank_delta_7d'] = songs['avg_rank'] - lagged[7][:, 0]
+    for w in trend_state.TREND_WINDOWS:
+        songs[f'rank_{w}d'] = rolling[w][:, 0]
+        songs[f'popularity_{w}d'] = rolling[w][:, 1]
+    songs['days_in_chart_60d'] = days[60]
+    if start is not None:
+        songs = songs[songs['day'] >= start]
+    
+    # Tên bài hát / nghệ sĩ chỉ của các bài hát có dòng mới
+    song_ids = [int(song_id) for song_id in songs['song_id'].unique()]
+    cur.execute("SELECT song_id, song_name FROM dim_song WHERE song_id = ANY(%s)", (song_ids,))
+    song_names = dict(cur.fetchall())
+    cur.execute("""
+        SELECT fas.song_id, STRING_AGG(DISTINCT a.artist_name, ', ')
+        FROM fact_artist_stats fas
+        JOIN dim_artist a ON fas.artist_id = a.artist_id
+        WHERE fas.song_id = ANY(%s)
+        GROUP BY fas.song_id
+    """, (song_ids,))
+    song_artists = dict(cur.fetchall())
+    songs['song_name'] = songs['song_id'].map(song_names)
+    songs['artist_name'] = songs['song_id'].map(song_artists)
+    
+    copy_dataframe(cur, 'trend_song_daily', songs[[
+        'full_date', 'song_id', 'song_name', 'artist_name',
+        'num_countries', 'avg_rank', 'avg_popularity',
+        'prev_rank', 'rank_change', 'rank_delta_7d',
+        'rank_7d', 'rank_30d', 'rank_60d',
+        'popularity_7d', 'popularity_30d', 'popularity_60d', 'days_in_chart_60d'
+    ]])
+    print(f"   ✓ trend_song_daily: {len(songs)} records ({songs['full_date'].nunique()} ngày"
+          f"{', tính lại toàn bộ' if start is None else ''})")
+    
+    # Giá trị từng ngày của nghệ sĩ
+    cur.execute("""
+        SELECT d.full_date, fas.artist_id,
+               AVG(fas.song_popularity)::float, COUNT(DISTINCT fas.song_id)
+        FROM fact_artist_stats fas
+        JOIN dim_date d ON fas.date_id = d.date_id
+        WHERE %(read_from)s::DATE IS NULL OR d.full_date >= %(read_from)s::DATE
+        GROUP BY d.full_date, fas.artist_id
+        ORDER BY d.full_date, fas.artist_id
+    """, params)
+    artists = pd.DataFrame(cur.fetchall(), columns=['full_date', 'artist_id', 'avg_popularity', 'num_songs'])
+    artists['day'] = trend_state.to_days(artists['full_date']) if len(artists) else np.zeros(0, dtype=np.int64)
+    
+    rolling, _, _ = artists_state.advance(
+        artists['day'].to_numpy(), artists['artist_id'].to_numpy(dtype=np.int64),
+        artists[['avg_popularity', 'num_songs']].to_numpy(dtype=np.float64), end_day, lags=()
+    )
+    for w in trend_state.TREND_WINDOWS:
+        artists[f'popularity_{w}d'] = rolling[w][:, 0]
+        artists[f'songs_{w}d'] = rolling[w][:, 1]
+    if start is not None:
+        artists = artists[artists['day'] >= start]
+    
+    cur.execute("SELECT artist_id, artist_name FROM dim_artist WHERE artist_id = ANY(%s)",
+                ([int(artist_id) for artist_id in artists['artist_id'].unique()],))
+    artists['artist_name'] = artists['artist_id'].map(dict(cur.fetchall()))
+    
+    copy_dataframe(cur, 'trend_artist_daily', artists[[
+        'full_date', 'artist_id', 'artist_name', 'num_songs', 'avg_popularity',
+        'popularity_7d', 'popularity_30d', 'popularity_60d',
+        'songs_7d', 'songs_30d', 'songs_60d'
+    ]])
+    print(f"   ✓ trend_artist_daily: {len(artists)} records")
+    
+    songs_state.save(cur, 'song')
+    artists_state.save(cur, 'artist')
 
 # ========================================
 # PHẦN 4: MAIN PIPELINE
 # ========================================
 
-def main():
+def add_dashboard_path():
+    """Cho phép import các module của dashboard (thư mục streamlit/)"""
+    dashboard_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'streamlit')
+    if dashboard_dir not in sys.path:
+        sys.path.insert(0, dashboard_dir)
+
+def run_cache_warmer(max_workers=4):
+    """Chạy trước các query của dashboard để lần mở đầu tiên không bị chậm"""
+    add_dashboard_path()
+    from warm_cache import warm_cache
+    return warm_cache(max_workers=max_workers)
+
+def run_parquet_export():
+    """Export kho dữ liệu ra Parquet cho backend DuckDB của dashboard"""
+    add_dashboard_path()
+    from columnar_backend import export_parquet
+    return export_parquet()
+
+def run_elt(conn, cur, csv_file, chunk_size=10000):
+    """Chế độ ELT: COPY CSV vào etl_landing, làm sạch và nạp dimension/fact bằng SQL (elt_warehouse.py)"""
+    import elt_warehouse
+    return elt_warehouse.run_elt(conn, cur, csv_file, chunk_size)
+
+def run_optimize(conn, cluster_key=None):
+    """CLUSTER các bảng fact, tạo extended statistics và VACUUM ANALYZE (optimize_warehouse.py)"""
+    from optimize_warehouse import optimize
+    return optimize(conn, cluster_key)
+
+def transform_chunk(chunk, quarantine=None):
+    """TRANSFORM 1 chunk (có metric), dùng chung cho chế độ tuần tự và asyncio"""
+    with etl_metrics.stage('transform', rows_in=len(chunk)) as metric:
+        cleaned_chunk = transform_data(chunk, quarantine)
+        metric['rows_out'] = len(cleaned_chunk)
+    return cleaned_chunk
+
+def prepare_chunk(chunk):
+    """
+    TRANSFORM 1 chunk, với hash key thì dựng luôn các dòng fact (không cần database)
+    Trả về (cleaned_chunk, facts, quarantine); facts = None với key SERIAL (dựng lúc load, sau load_dimensions)
+    """
+    quarantine = []
+    cleaned_chunk = transform_chunk(chunk, quarantine)
+    facts = None
+    if KEY_STRATEGY == 'hash' and len(cleaned_chunk):
+        facts = build_fact_rows(cleaned_chunk)
+    return cleaned_chunk, facts, quarantine[0]
+
+def load_chunk(cleaned_chunk, chunk_index, cur, conn, facts=None, quarantine=None, source_file=None, history=None):
+    """
+    LOAD 1 chunk đã transform vào các bảng rồi commit (dùng chung cho chế độ tuần tự và asyncio)
+    history: lịch sử BXH, áp dụng ở đây (writer) để các chunk luôn đi qua theo đúng thứ tự
+    """
+    if quarantine is not None and len(quarantine):
+        with etl_metrics.stage('load_quarantine', rows_in=len(quarantine)):
+            write_quarantine(cur, quarantine, source_file)
+    if len(cleaned_chunk) == 0:
+        print(f"⚠️  Chunk {chunk_index}: không có dữ liệu hợp lệ, bỏ qua chunk này")
+        conn.commit()
+        return
+    
+    with etl_metrics.stage('load_dimensions', rows_in=len(cleaned_chunk)):
+        load_dimensions(cleaned_chunk, cur)
+    with etl_metrics.stage('load_facts', rows_in=len(cleaned_chunk)):
+        load_facts(cleaned_chunk, cur, facts, history)
+    with etl_metrics.stage('load_wide_table', rows_in=len(cleaned_chunk)) as metric:
+        metric['rows_out'] = load_wide_table(cleaned_chunk, cur)
+    with etl_metrics.stage('load_sketches', rows_in=len(cleaned_chunk)):
+        load_sketches(cleaned_chunk, cur)
+    
+    with etl_metrics.stage('commit'):
+        data_version = bump_data_version(cur)
+        conn.commit()
+    etl_metrics.write_prometheus()
+    print(f"\n✅ Chunk {chunk_index} hoàn thành và đã commit (data_version = {data_version})")
+
+def main(warm_cache=False, warm_workers=4, export_parquet=False, async_mode=False,
+         queue_size=None, transform_workers=None, compact_types=None, key_strategy=None,
+         optimize=False, cluster_key=None, elt=False):
     """Main ETL Pipeline"""
+    global COMPACT_TYPES, KEY_STRATEGY
+    if compact_types is not None:
+        COMPACT_TYPES = compact_types
+    if key_strategy is not None:
+        KEY_STRATEGY = key_strategy
+    if elt and (async_mode or KEY_STRATEGY != 'serial'):
+        raise ValueError("--elt không dùng chung với --async hoặc --key-strategy hash")
     print("\n" + "="*80)
     print("  🎵 SPOTIFY DATA WAREHOUSE - STUDENT PROJECT VERSION")
     print("="*80)
@@ -850,13 +1879,18 @@ def main():
             host=DB_HOST, port=DB_PORT, dbname=DB_NAME,
             user=DB_USER, password=DB_PASS
         )
-        cur = conn.cursor()
+        # MetricsCursor đếm round-trip / byte gửi đi cho telemetry (etl_metrics.py)
+        cur = conn.cursor(cursor_factory=etl_metrics.MetricsCursor)
         
         # Tạo schema
         print("📋 BƯỚC 1: TẠO SCHEMA")
         print("-" * 80)
-        create_tables(cur)
-        conn.commit()
+        # Kích thước của kho dữ liệu cũ để so sánh sau khi load (báo cáo cuối)
+        sizes_before = table_sizes(cur)
+        with etl_metrics.stage('create_schema'):
+            create_tables(cur)
+            bump_data_version(cur)
+            conn.commit()
         
         # ETL Process
         csv_file = 'universal_top_spotify_songs.csv'
@@ -865,28 +1899,59 @@ def main():
         print("\n📊 BƯỚC 2: ETL PROCESS")
         print("="*80)
         
-        chunk_iterator = extract_data(csv_file, chunk_size)
+        if elt:
+            # COPY CSV thô vào PostgreSQL, làm sạch + dựng dimension/fact bằng SQL (elt_warehouse.py)
+            with etl_metrics.stage('elt'):
+                run_elt(conn, cur, csv_file, chunk_size)
+        else:
+            # Calendar dimension cho toàn bộ khoảng ngày
+            print("\n📅 DIM_DATE:")
+            with etl_metrics.stage('load_calendar'):
+                load_calendar(csv_file, cur)
+                conn.commit()
+            # Lịch sử BXH của kho dữ liệu (schema mới => rỗng)
+            history = chart_history.ChartHistory.load(cur)
         
-        chunk_count = 0
-        for i, chunk in enumerate(chunk_iterator):
-            chunk_count += 1
-            print(f"\n{'─'*80}")
-            print(f"📦 CHUNK {chunk_count}")
-            print(f"{'─'*80}")
-            
-            # Transform
-            cleaned_chunk = transform_data(chunk)
-            
-            if len(cleaned_chunk) == 0:
-                print("⚠️  Không có dữ liệu hợp lệ, bỏ qua chunk này")
-                continue
-            
-            # Load
-            load_dimensions(cleaned_chunk, cur)
-            load_facts(cleaned_chunk, cur)
-            
+            chunk_iterator = extract_data(csv_file, chunk_size)
+        
+            if async_mode:
+                # Chồng extract / transform / load qua các hàng đợi có giới hạn (async_pipeline.py)
+                print(f"⚡ Chế độ asyncio: queue {queue_size or async_pipeline.QUEUE_SIZE} chunk, "
+                      f"{transform_workers or async_pipeline.TRANSFORM_WORKERS} worker transform")
+                # Với hash key, các dòng fact được dựng luôn trên thread transform, writer chỉ còn ghi
+                async_pipeline.run_pipeline(
+                    chunk_iterator, prepare_chunk,
+                    lambda prepared, chunk_index: load_chunk(prepared[0], chunk_index, cur, conn, prepared[1],
+                                                             prepared[2], csv_file, history),
+                    queue_size, transform_workers
+                )
+            else:
+                chunk_count = 0
+                for chunk in etl_metrics.timed_chunks(chunk_iterator):
+                    chunk_count += 1
+                    print(f"\n{'─'*80}")
+                    print(f"📦 CHUNK {chunk_count}")
+                    print(f"{'─'*80}")
+                
+                    cleaned_chunk, facts, quarantine = prepare_chunk(chunk)
+                    load_chunk(cleaned_chunk, chunk_count, cur, conn, facts, quarantine, csv_file, history)
+        
+        # Ghi nhận file đã load (ingest_files.py sẽ bỏ qua file này)
+        record_loaded_file(cur, csv_file)
+        
+        # Snapshot xu hướng rolling cho các panel trending
+        with etl_metrics.stage('build_trend_tables'):
+            build_trend_tables(cur)
+            bump_data_version(cur)
             conn.commit()
-            print(f"\n✅ Chunk {chunk_count} hoàn thành và đã commit")
+        etl_metrics.set_chunk(None)
+        
+        # Sắp xếp vật lý + thống kê cho planner (dữ liệu không đổi, không tăng data_version)
+        if optimize:
+            with etl_metrics.stage('optimize'):
+                run_optimize(conn, cluster_key)
+        etl_metrics.print_summary()
+        etl_metrics.write_prometheus()
         
         # Thống kê cuối cùng
         print("\n" + "="*80)
@@ -903,6 +1968,10 @@ def main():
             ('FACTS', [
                 'fact_song_daily', 'fact_artist_stats', 'fact_chart_position',
                 'fact_audio_analysis', 'fact_streaming_metrics'
+            ]),
+            ('ANALYTICS', [
+                'wide_song_daily', 'sketch_daily_country',
+                'trend_song_daily', 'trend_artist_daily'
             ])
         ]
         
@@ -915,6 +1984,9 @@ def main():
         
         print("-" * 80)
         
+        cur.execute("ANALYZE")
+        print_size_report(sizes_before, table_sizes(cur))
+        
         # Tổng số bảng
         print(f"\n📋 Tổng số bảng: 11 (6 Dimensions + 5 Facts)")
         print(f"✅ Kho dữ liệu đã sẵn sàng để phân tích!\n")
@@ -922,9 +1994,53 @@ def main():
         cur.close()
         conn.close()
         
+        # Export Parquet cho backend cột (DuckDB) của dashboard
+        if export_parquet:
+            print("\n📊 BƯỚC 3: EXPORT PARQUET")
+            print("="*80)
+            run_parquet_export()
+        
+        # Warm result cache của dashboard với dữ liệu vừa load
+        if warm_cache:
+            print("\n📊 BƯỚC 4: WARM CACHE DASHBOARD")
+            print("="*80)
+            run_cache_warmer(warm_workers)
+        
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"\n❌ LỖI: {error}")
         raise
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Spotify Data Warehouse ETL")
+    parser.add_argument('--warm-cache', action='store_true',
+                        help="Sau khi load xong, chạy trước các query của dashboard và lưu vào result cache")
+    parser.add_argument('--warm-workers', type=int, default=4,
+                        help="Số query chạy song song khi warm cache (mặc định 4)")
+    parser.add_argument('--export-parquet', action='store_true',
+                        help="Sau khi load xong, export kho dữ liệu ra Parquet cho backend DuckDB của dashboard")
+    parser.add_argument('--optimize', action='store_true',
+                        help="Sau khi load xong, CLUSTER các bảng fact, tạo extended statistics và VACUUM ANALYZE")
+    parser.add_argument('--cluster-key',
+                        help="Các cột sắp xếp vật lý khi --optimize (mặc định ETL_CLUSTER_KEY=date_id,country_id)")
+    parser.add_argument('--compact-types', action='store_true', default=None,
+                        help="Dùng kiểu số gọn (SMALLINT/REAL trong schema, int8/int16/float32 trong DataFrame)")
+    parser.add_argument('--key-strategy', choices=['serial', 'hash'],
+                        help="Cách sinh surrogate key của dimension: SERIAL của database hoặc hash 64-bit "
+                             "của natural key tính trong process (mặc định ETL_KEY_STRATEGY=serial)")
+    parser.add_argument('--elt', action='store_true',
+                        help="Chế độ ELT: COPY CSV thô vào bảng landing UNLOGGED rồi làm sạch và nạp "
+                             "dimension/fact bằng SQL trong PostgreSQL")
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help="Chạy chồng extract / transform / load bằng asyncio với hàng đợi có giới hạn")
+    parser.add_argument('--queue-size', type=int,
+                        help="Số chunk tối đa trong mỗi hàng đợi của chế độ --async (mặc định ETL_QUEUE_SIZE=4)")
+    parser.add_argument('--transform-workers', type=int,
+                        help="Số chunk transform song song ở chế độ --async (mặc định ETL_TRANSFORM_WORKERS=2)")
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    main(warm_cache=args.warm_cache, warm_workers=args.warm_workers, export_parquet=args.export_parquet,
+         async_mode=args.async_mode, queue_size=args.queue_size, transform_workers=args.transform_workers,
+         compact_types=args.compact_types, key_strategy=args.key_strategy,
+         optimize=args.optimize, cluster_key=args.cluster_key, elt=args.elt)
@@ -0,0 +1,620 @@
+# -*- coding: utf-8 -*-
+"""
+================================================================================
+CHẾ ĐỘ ELT: COPY CSV THÔ VÀO POSTGRESQL, DỰNG DIMENSION/FACT BẰNG SQL
+================================================================================
+Thay vì làm sạch và tính từng dòng bằng Python rồi gửi từng tuple tới PostgreSQL:
+1. COPY nguyên file CSV (mọi cột dạng TEXT) vào bảng landing UNLOGGED etl_landing
+2. Các câu SQL (FUNCTIONS_SQL, clean_sql, DIMENSION_STEPS, FACT_STEPS; phiên bản ELT_SQL_VERSION)
+   làm sạch, kiểm tra, loại trùng và nạp 6 dimension + 5 fact theo cùng quy tắc với
+   transform_data / load_dimensions / build_fact_rows:
+   - giá trị thiếu/ngoài khoảng => mặc định của CLEAN_NUMERIC, luật kiểm tra của VALIDATION_RULES,
+     dòng bị loại ghi vào etl_quarantine
+   - created_at của dimension = ngày nhỏ nhất của chunk (chunk_size dòng) đầu tiên chứa dòng đó,
+     giống chế độ theo chunk
+3. wide_song_daily, sketch và bảng xu hướng dùng lại các hàm của create_warehouse.py
+
+Tất cả chạy trong 1 transaction; các câu SQL set-based có thể dùng parallel worker của PostgreSQL
+(ELT_PARALLEL_WORKERS => max_parallel_workers_per_gather).
+Khác với chế độ Python:
+- Ngày chỉ nhận dạng ISO (YYYY, YYYY-MM, YYYY-MM-DD, có thể kèm giờ), YYYYMMDD và M/D/YYYY
+  (pd.to_datetime nhận nhiều dạng hơn); ngày không đọc được vẫn được đếm/ghi quarantine như thường
+- Dòng trùng được loại trên cả file (chế độ Python loại trong từng chunk, phần còn lại bị
+  ON CONFLICT bỏ qua nên dữ liệu nạp vào giống nhau)
+- Chỉ hỗ trợ key SERIAL (hash BLAKE2b của --key-strategy hash không có sẵn trong PostgreSQL)
+- previous_rank / movement / chart_streak dùng rank hôm trước / 7 ngày trước trên cả file
+  (chế độ Python: lịch sử BXH theo thứ tự chunk, giống nhau khi CSV sắp theo ngày)
+
+    python create_warehouse.py --elt
+    python benchmark_etl.py --csv bench.csv --elt --compare baseline.json
+================================================================================
+"""
+
+import csv
+import os
+import time
+import pandas as pd
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+import etl_metrics
+import chart_history
+import create_warehouse
+from create_warehouse import (
+    extend_calendar, load_wide_table, load_sketches, VALIDATION_RULES, NUMERIC_RULES, CLEAN_NUMERIC, RULE_ACTIONS
+)
+
+load_dotenv()
+
+# Tăng khi đổi bất kỳ câu SQL nào bên dưới (ghi vào etl_metadata.elt_sql_version sau mỗi lần chạy)
+ELT_SQL_VERSION = 2
+
+# Số parallel worker mỗi Gather cho các câu SQL của ELT (rỗng => theo cấu hình server)
+PARALLEL_WORKERS = os.getenv("ELT_PARALLEL_WORKERS", "")
+
+# Các cột bắt buộc của file CSV
+LANDING_COLUMNS = [
+    'spotify_id', 'name', 'artists', 'daily_rank', 'daily_movement', 'weekly_movement', 'country',
+    'snapshot_date', 'popularity', 'is_explicit', 'duration_ms', 'album_name', 'album_release_date',
+    'danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+    'instrumentalness', 'liveness', 'valence', 'tempo', 'time_signature',
+]
+
+# Giá trị thiếu mặc định của pandas.read_csv (na_values): chuỗi đúng bằng 1 trong các giá trị này là NULL
+CSV_NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+]
+
+# Bảng làm việc của ELT (UNLOGGED: không ghi WAL, mất khi server crash - chỉ chứa dữ liệu tạm)
+WORK_TABLES = ['etl_elt_artists', 'etl_elt_clean', 'etl_landing']
+
+# ========================================
+# HÀM SQL (giống clean_text / CLEAN_NUMERIC / clean_date)
+# ========================================
+
+FUNCTIONS_SQL = r"""
+-- Chuỗi thiếu theo quy tắc của pandas.read_csv => NULL
+CREATE OR REPLACE FUNCTION elt_csv_value(value TEXT) RETURNS TEXT AS $$
+    SELECT CASE WHEN value = ANY(%(na_values)s::TEXT[]) THEN NULL ELSE value END
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- clean_text: gộp khoảng trắng, bỏ khoảng trắng 2 đầu, chuỗi rỗng => NULL
+CREATE OR REPLACE FUNCTION elt_clean_text(value TEXT) RETURNS TEXT AS $$
+    SELECT NULLIF(btrim(regexp_replace(value, '\s+', ' ', 'g')), '')
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Số thực; không phải số => NULL (không lỗi như phép ép kiểu ::float8)
+CREATE OR REPLACE FUNCTION elt_number(value TEXT) RETURNS DOUBLE PRECISION AS $$
+    SELECT CASE WHEN value ~ '^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d{1,2})?\s*$' THEN value::DOUBLE PRECISION END
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- CLEAN_NUMERIC: NULL hoặc ngoài [min_val, max_val] => default_val
+CREATE OR REPLACE FUNCTION elt_clean_number(value DOUBLE PRECISION, min_val DOUBLE PRECISION,
+                                            max_val DOUBLE PRECISION, default_val DOUBLE PRECISION)
+RETURNS DOUBLE PRECISION AS $$
+    SELECT CASE WHEN value >= COALESCE(min_val, '-Infinity') AND value <= COALESCE(max_val, 'Infinity')
+                THEN value ELSE default_val END
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- clean_date: YYYY, YYYY-MM, YYYY-MM-DD (có thể kèm giờ), YYYYMMDD, M/D/YYYY; ngày không tồn tại => NULL
+CREATE OR REPLACE FUNCTION elt_date(value TEXT) RETURNS DATE AS $$
+DECLARE
+    parts TEXT[];
+    y INTEGER;
+    m INTEGER;
+    d INTEGER;
+BEGIN
+    parts := regexp_match(value, '^\s*(\d{4})(?:-(\d{1,2})(?:-(\d{1,2})(?:[ T]\S*)?)?)?\s*$');
+    IF parts IS NOT NULL THEN
+        y := parts[1]; m := COALESCE(parts[2], '1'); d := COALESCE(parts[3], '1');
+    ELSE
+        parts := regexp_match(value, '^\s*(\d{4})(\d{2})(\d{2})\s*$');
+        IF parts IS NOT NULL THEN
+            y := parts[1]; m := parts[2]; d := parts[3];
+        ELSE
+            parts := regexp_match(value, '^\s*(\d{1,2})/(\d{1,2})/(\d{4})\s*$');
+            IF parts IS NULL THEN
+                RETURN NULL;
+            END IF;
+            y := parts[3]; m := parts[1]; d := parts[2];
+        END IF;
+    END IF;
+    IF y < 1 OR m NOT BETWEEN 1 AND 12 OR d < 1
+       OR d > extract(day FROM make_date(y, m, 1) + INTERVAL '1 month - 1 day') THEN
+        RETURN NULL;
+    END IF;
+    RETURN make_date(y, m, d);
+END
+$$ LANGUAGE plpgsql IMMUTABLE STRICT PARALLEL SAFE;
+"""
+
+# ========================================
+# CÁC BƯỚC SQL (ELT_SQL_VERSION)
+# ========================================
+
+def level_sql(value, labels, thresholds=(0.8, 0.6, 0.4, 0.2)):
+    """CASE chia 5 mức như categorize_audio_features (giá trị 0 được coi là 0.5 giống `if value else 0.5`)"""
+    value = f"(CASE WHEN {value} = 0 THEN 0.5 ELSE {value} END)"
+    cases = ' '.join(f"WHEN {value} >= {threshold} THEN '{label}'" for threshold, label in zip(thresholds, labels))
+    return f"CASE {cases} ELSE '{labels[-1]}' END"
+
+def rule_mask_sql():
+    """rule_mask của 1 dòng (OR các bit của VALIDATION_RULES) tính trên cột đã parse / làm sạch"""
+    conditions = {
+        'missing_spotify_id': "spotify_id IS NULL",
+        'missing_name': "name IS NULL",
+        'invalid_snapshot_date': "snapshot_date IS NULL",
+        'duplicate_row': "complete AND copy_no > 1",
+        'invalid_album_release_date': "raw_release_date IS NOT NULL AND album_release_date IS NULL",
+    }
+    for rule, (columns, min_val, max_val) in NUMERIC_RULES.items():
+        bounds = f"{'NULL' if min_val is None else min_val}, {'NULL' if max_val is None else max_val}"
+        conditions[rule] = ' OR '.join(f"elt_clean_number(raw_{column}, {bounds}, NULL) IS NULL" for column in columns)
+    return ' | '.join(f"(CASE WHEN {conditions[rule]} THEN {bit} ELSE 0 END)"
+                      for rule, (bit, _) in VALIDATION_RULES.items())
+
+def clean_sql():
+    """Làm sạch + kiểm tra toàn bộ etl_landing => etl_elt_clean (1 dòng / dòng CSV, kept = được nạp)"""
+    numbers = sorted({column for columns, _, _ in NUMERIC_RULES.values() for column in columns}
+                     | {'daily_movement', 'weekly_movement'})
+    parsed_numbers = ',\n            '.join(f"elt_number({column}) AS raw_{column}" for column in numbers)
+    cleaned_numbers = ',\n            '.join(
+        f"elt_clean_number(raw_{column}, {'NULL' if low is None else low}, "
+        f"{'NULL' if high is None else high}, {'NULL' if default is None else default}) AS {column}"
+        for column, (low, high, default) in CLEAN_NUMERIC.items()
+    )
+    stored = {name: f"{name}::REAL::DOUBLE PRECISION" for name in ['energy', 'danceability', 'valence', 'acousticness', 'tempo']}
+    positive, negative = f"{stored['valence']} > 0.6", f"{stored['valence']} < 0.4"
+    energetic, calm = f"{stored['energy']} > 0.6", f"{stored['energy']} < 0.4"
+    band = lambda value: f"CASE WHEN {value} < 0.3 THEN 0 WHEN {value} < 0.7 THEN 1 ELSE 2 END"
+    levels = ['Very High', 'High', 'Medium', 'Low', 'Very Low']
+    return f"""
+    CREATE UNLOGGED TABLE etl_elt_clean AS
+    WITH parsed AS MATERIALIZED (
+        SELECT
+            line_no,
+            (line_no - 1) / %(chunk_size)s AS chunk_no,
+            elt_csv_value(spotify_id) AS spotify_id,
+            elt_clean_text(elt_csv_value(name)) AS name,
+            elt_clean_text(elt_csv_value(artists)) AS artists,
+            elt_clean_text(elt_csv_value(country)) AS country,
+            elt_date(snapshot_date) AS snapshot_date,
+            elt_clean_text(elt_csv_value(album_name)) AS album_name,
+            elt_csv_value(album_release_date) AS raw_release_date,
+            elt_date(album_release_date) AS album_release_date,
+            COALESCE(lower(is_explicit) IN ('true', '1', 'yes', 't'), FALSE) AS is_explicit,
+            {parsed_numbers}
+        FROM etl_landing
+    ),
+    cleaned AS (
+        SELECT
+            parsed.*,
+            COALESCE(country, 'GLOBAL') AS country_code,
+            spotify_id IS NOT NULL AND name IS NOT NULL AND snapshot_date IS NOT NULL AS complete,
+            {cleaned_numbers},
+            CASE WHEN COALESCE(raw_mode, 1) >= 0.5 THEN 1 ELSE 0 END AS mode,
+            -- Thứ tự của dòng trong các dòng trùng (spotify_id, artists, snapshot_date, country), chỉ xét dòng đủ cột bắt buộc
+            row_number() OVER (
+                PARTITION BY spotify_id IS NULL OR name IS NULL OR snapshot_date IS NULL,
+                             spotify_id, artists, snapshot_date, country
+                ORDER BY line_no
+            ) AS copy_no
+        FROM parsed
+    )
+    SELECT
+        line_no, chunk_no, spotify_id, name, artists, country, country_code, snapshot_date,
+        album_name, album_release_date, is_explicit,
+        {', '.join(CLEAN_NUMERIC)}, mode, raw_daily_movement AS daily_movement, raw_weekly_movement AS weekly_movement,
+        complete, complete AND copy_no = 1 AS kept,
+        {rule_mask_sql()} AS rule_mask,
+
+        -- categorize_audio_features + categorize_mood
+        {level_sql('energy', levels)} AS energy_level,
+        {level_sql('danceability', levels)} AS danceability_level,
+        {level_sql('valence', ['Very Positive', 'Positive', 'Neutral', 'Negative', 'Very Negative'])} AS valence_level,
+        {level_sql('tempo', ['Very Fast', 'Fast', 'Moderate', 'Slow', 'Very Slow'], (140, 120, 90, 60))} AS tempo_category,
+        {level_sql('acousticness', levels)} AS acousticness_level,
+        CASE WHEN valence >= 0.6 AND energy >= 0.6 THEN 'Happy'
+             WHEN valence >= 0.6 THEN 'Calm'
+             WHEN valence < 0.4 AND energy >= 0.6 THEN 'Energetic'
+             WHEN valence < 0.4 THEN 'Sad'
+             ELSE 'Neutral' END AS mood_category,
+
+        -- audio_band_codes (so sánh trên giá trị đã làm tròn về REAL)
+        {band(stored['energy'])} AS energy_band,
+        {band(stored['danceability'])} AS danceability_band,
+        {band(stored['valence'])} AS valence_band,
+        {band(stored['acousticness'])} AS acousticness_band,
+        CASE WHEN {stored['tempo']} < 90 THEN 0 WHEN {stored['tempo']} < 120 THEN 1
+             WHEN {stored['tempo']} < 150 THEN 2 ELSE 3 END AS tempo_band,
+        CASE WHEN {stored['energy']} > 0.7 AND {stored['danceability']} > 0.7 THEN 0
+             WHEN {stored['energy']} > 0.7 THEN 1
+             WHEN {stored['danceability']} > 0.7 THEN 2
+             WHEN {stored['acousticness']} > 0.5 THEN 3
+             WHEN {positive} THEN 4
+             WHEN {negative} THEN 5
+             ELSE 6 END AS genre_code,
+        CASE WHEN {positive} AND {energetic} THEN 0 WHEN {positive} THEN 1
+             WHEN {negative} AND {calm} THEN 2 ELSE 3 END AS mood_trending,
+        CASE WHEN {positive} AND {energetic} THEN 0 WHEN {positive} THEN 1
+             WHEN {energetic} THEN 2 WHEN {negative} THEN 3 ELSE 4 END AS mood_regional,
+        CASE WHEN {positive} AND {energetic} THEN 0 WHEN {positive} THEN 1
+             WHEN {negative} AND {energetic} THEN 2 WHEN {negative} THEN 3 ELSE 4 END AS mood_profile,
+        CASE WHEN {positive} AND {energetic} THEN 0 WHEN {positive} AND {calm} THEN 1
+             WHEN {negative} AND {energetic} THEN 2 WHEN {negative} AND {calm} THEN 3 ELSE 4 END AS mood_quadrant
+    FROM cleaned;
+
+    -- extract_and_clean_artists: 1 dòng / nghệ sĩ của mỗi dòng được nạp, artist_position đếm trên tên hợp lệ
+    CREATE UNLOGGED TABLE etl_elt_artists AS
+    SELECT c.line_no, c.chunk_no,
+           row_number() OVER (PARTITION BY c.line_no ORDER BY p.part_no) AS artist_position,
+           p.artist_name
+    FROM etl_elt_clean c
+    CROSS JOIN LATERAL (
+        SELECT elt_clean_text(part) AS artist_name, part_no
+        FROM regexp_split_to_table(c.artists, ',') WITH ORDINALITY AS parts(part, part_no)
+    ) p
+    WHERE c.kept AND p.artist_name IS NOT NULL;
+
+    ANALYZE etl_elt_clean;
+    ANALYZE etl_elt_artists;
+    """
+
+# created_at của dimension: ngày nhỏ nhất của chunk đầu tiên chứa dòng đó (giống first_date của load_dimensions)
+CHUNK_FIRST_DATE = """
+    chunk_first AS (
+        SELECT chunk_no, MIN(snapshot_date) AS first_date
+        FROM etl_elt_clean WHERE complete GROUP BY chunk_no
+    )
+"""
+
+AUDIO_COLUMNS = ', '.join(create_warehouse.AUDIO_FEATURES_COLUMNS)
+
+QUARANTINE_SQL = """
+    INSERT INTO etl_quarantine (run_id, source_file, source_row, rule_mask, raw_row)
+    SELECT %(run_id)s, %(source_file)s, c.line_no + 1, c.rule_mask, to_jsonb(l) - 'line_no'
+    FROM etl_elt_clean c
+    JOIN etl_landing l ON l.line_no = c.line_no
+    WHERE NOT c.kept
+    ORDER BY c.line_no
+"""
+
+# Key SERIAL được cấp theo thứ tự xuất hiện đầu tiên trong file (giống drop_duplicates của chế độ Python;
+# dim_artist / dim_audio_features ở chế độ Python đi qua set nên thứ tự key ở đó không cố định),
+# created_at = ngày nhỏ nhất của chunk chứa lần xuất hiện đầu tiên
+DIMENSION_STEPS = [
+    ('dim_artist', f"""
+    WITH {CHUNK_FIRST_DATE}
+    INSERT INTO dim_artist (artist_name, created_at)
+    SELECT a.artist_name, f.first_date
+    FROM (
+        SELECT DISTINCT ON (artist_name) artist_name, chunk_no, line_no, artist_position
+        FROM etl_elt_artists ORDER BY artist_name, line_no, artist_position
+    ) a
+    JOIN chunk_first f ON f.chunk_no = a.chunk_no
+    ORDER BY a.line_no, a.artist_position
+    ON CONFLICT (artist_name) DO NOTHING
+    """),
+    ('dim_album', f"""
+    WITH {CHUNK_FIRST_DATE}
+    INSERT INTO dim_album (album_name, release_date, release_year, release_month, created_at)
+    SELECT a.album_name, a.album_release_date,
+           EXTRACT(YEAR FROM a.album_release_date), EXTRACT(MONTH FROM a.album_release_date), f.first_date
+    FROM (
+        SELECT album_name, album_release_date, MIN(chunk_no) AS chunk_no, MIN(line_no) AS line_no
+        FROM etl_elt_clean WHERE kept AND album_name IS NOT NULL
+        GROUP BY album_name, album_release_date
+    ) a
+    JOIN chunk_first f ON f.chunk_no = a.chunk_no
+    ORDER BY a.line_no
+    ON CONFLICT (album_name, release_date) DO NOTHING
+    """),
+    ('dim_country', """
+    INSERT INTO dim_country (country_code, country_name)
+    SELECT country, country FROM (
+        SELECT country, MIN(line_no) AS line_no FROM etl_elt_clean WHERE kept AND country IS NOT NULL GROUP BY country
+    ) c
+    ORDER BY line_no
+    ON CONFLICT (country_code) DO NOTHING;
+
+    INSERT INTO dim_country (country_code, country_name) VALUES ('GLOBAL', 'Global')
+    ON CONFLICT (country_code) DO NOTHING
+    """),
+    ('dim_song', f"""
+    WITH {CHUNK_FIRST_DATE}
+    INSERT INTO dim_song (spotify_id, song_name, is_explicit, duration_ms, created_at)
+    SELECT s.spotify_id, s.name, s.is_explicit, trunc(s.duration_ms), f.first_date
+    FROM (
+        SELECT DISTINCT ON (spotify_id) spotify_id, name, is_explicit, duration_ms, chunk_no, line_no
+        FROM etl_elt_clean WHERE kept
+        ORDER BY spotify_id, line_no
+    ) s
+    JOIN chunk_first f ON f.chunk_no = s.chunk_no
+    ORDER BY s.line_no
+    ON CONFLICT (spotify_id) DO NOTHING
+    """),
+    ('dim_audio_features', f"""
+    WITH {CHUNK_FIRST_DATE}
+    INSERT INTO dim_audio_features ({AUDIO_COLUMNS}, created_at)
+    SELECT {', '.join('a.' + column for column in create_warehouse.AUDIO_FEATURES_COLUMNS)}, f.first_date
+    FROM (
+        SELECT {AUDIO_COLUMNS}, MIN(chunk_no) AS chunk_no, MIN(line_no) AS line_no
+        FROM etl_elt_clean WHERE kept
+        GROUP BY {AUDIO_COLUMNS}
+    ) a
+    JOIN chunk_first f ON f.chunk_no = a.chunk_no
+    ORDER BY a.line_no
+    ON CONFLICT ({AUDIO_COLUMNS}) DO NOTHING
+    """),
+]
+
+# Dòng đầu tiên (theo thứ tự trong file) của mỗi (bài hát, ngày, quốc gia) kèm các key;
+# các dòng sau cùng key bị ON CONFLICT DO NOTHING bỏ qua ở chế độ Python
+FIRST_FACT_ROWS = """
+    fact_rows AS (
+        SELECT DISTINCT ON (c.spotify_id, c.snapshot_date, c.country_code)
+            c.*, s.song_id, d.date_id, co.country_id,
+            trunc(COALESCE(c.daily_rank, 100))::INTEGER AS rank,
+            trunc(c.popularity)::INTEGER AS popularity_score,
+            trunc(COALESCE(c.daily_movement, 0))::INTEGER AS daily_mov,
+            trunc(COALESCE(c.weekly_movement, 0))::INTEGER AS weekly_mov
+        FROM etl_elt_clean c
+        JOIN dim_song s ON s.spotify_id = c.spotify_id
+        JOIN dim_date d ON d.full_date = c.snapshot_date
+        JOIN dim_country co ON co.country_code = c.country_code
+        WHERE c.kept
+        ORDER BY c.spotify_id, c.snapshot_date, c.country_code, c.line_no
+    )
+"""
+
+# Lịch sử BXH như chart_history.py: rank hôm trước / 7 ngày trước của cùng (bài hát, quốc gia) và số ngày
+# liên tiếp trong BXH (island: các ngày liên tiếp có cùng snapshot_date - row_number);
+# không có rank hôm trước / 7 ngày trước => giữ movement của CSV như build_fact_rows
+CHART_ROWS = FIRST_FACT_ROWS + """,
+    islands AS (
+        SELECT r.*, p.rank AS day_rank, w.rank AS week_rank,
+               r.snapshot_date - (row_number() OVER (PARTITION BY r.song_id, r.country_id
+                                                     ORDER BY r.snapshot_date))::INTEGER AS island
+        FROM fact_rows r
+        LEFT JOIN fact_rows p ON p.song_id = r.song_id AND p.country_id = r.country_id
+            AND p.snapshot_date = r.snapshot_date - 1
+        LEFT JOIN fact_rows w ON w.song_id = r.song_id AND w.country_id = r.country_id
+            AND w.snapshot_date = r.snapshot_date - 7
+    ),
+    chart_rows AS (
+        SELECT i.*,
+               COALESCE(day_rank, CASE WHEN daily_mov <> 0 THEN rank - daily_mov ELSE rank END) AS chart_previous,
+               COALESCE(day_rank - rank, daily_mov) AS chart_daily,
+               COALESCE(week_rank - rank, weekly_mov) AS chart_weekly,
+               row_number() OVER (PARTITION BY song_id, country_id, island ORDER BY snapshot_date) AS chart_streak
+        FROM islands i
+    )
+"""
+
+FACT_STEPS = [
+    ('fact_song_daily', f"""
+    WITH {FIRST_FACT_ROWS}
+    INSERT INTO fact_song_daily (song_id, date_id, country_id, album_id, daily_rank, popularity_score,
+                                 rank_points, performance_index, created_at)
+    SELECT r.song_id, r.date_id, r.country_id, al.album_id, r.rank, r.popularity_score,
+           101 - r.rank, (101 - r.rank + r.popularity_score) / 2.0, r.snapshot_date
+    FROM fact_rows r
+    LEFT JOIN dim_album al ON al.album_name = r.album_name
+        AND COALESCE(al.release_date, 'infinity') = COALESCE(r.album_release_date, 'infinity')
+    ORDER BY r.line_no
+    ON CONFLICT (song_id, date_id, country_id) DO NOTHING
+    """),
+    ('fact_artist_stats', """
+    INSERT INTO fact_artist_stats (artist_id, song_id, date_id, country_id, song_rank, song_popularity,
+                                   artist_position, artist_score, contribution_weight, created_at)
+    SELECT DISTINCT ON (a.artist_id, s.song_id, d.date_id, co.country_id)
+        a.artist_id, s.song_id, d.date_id, co.country_id, r.rank, r.popularity_score, p.artist_position,
+        (101 - r.rank + r.popularity_score) / 2.0 * CASE WHEN p.artist_position = 1 THEN 1.0 ELSE 0.7 END,
+        CASE WHEN p.artist_position = 1 THEN 1.0 ELSE 0.5 END,
+        r.snapshot_date
+    FROM etl_elt_artists p
+    JOIN (
+        SELECT line_no, spotify_id, snapshot_date, country_code,
+               trunc(COALESCE(daily_rank, 100))::INTEGER AS rank, trunc(popularity)::INTEGER AS popularity_score
+        FROM etl_elt_clean WHERE kept
+    ) r ON r.line_no = p.line_no
+    JOIN dim_artist a ON a.artist_name = p.artist_name
+    JOIN dim_song s ON s.spotify_id = r.spotify_id
+    JOIN dim_date d ON d.full_date = r.snapshot_date
+    JOIN dim_country co ON co.country_code = r.country_code
+    ORDER BY a.artist_id, s.song_id, d.date_id, co.country_id, p.line_no, p.artist_position
+    ON CONFLICT (artist_id, song_id, date_id, country_id) DO NOTHING
+    """),
+    ('fact_chart_position', f"""
+    WITH {CHART_ROWS}
+    INSERT INTO fact_chart_position (song_id, date_id, country_id, current_rank, previous_rank,
+                                     daily_movement, weekly_movement, is_rising, is_falling,
+                                     movement_magnitude, trend_strength, chart_streak, created_at)
+    SELECT song_id, date_id, country_id, rank,
+           CASE WHEN chart_previous < 1 THEN 100 ELSE chart_previous END,
+           chart_daily, chart_weekly, chart_daily > 0 OR chart_weekly > 0, chart_daily < 0 OR chart_weekly < 0,
+           magnitude, LEAST(10.0, magnitude / 10.0), chart_streak, snapshot_date
+    FROM (
+        SELECT r.*, abs(chart_daily) + abs(chart_weekly) AS magnitude FROM chart_rows r
+    ) r
+    ORDER BY line_no
+    ON CONFLICT (song_id, date_id, country_id) DO NOTHING
+    """),
+    ('fact_audio_analysis', f"""
+    INSERT INTO fact_audio_analysis (song_id, features_id, danceability, energy, key_signature, loudness, mode,
+                                     speechiness, acousticness, instrumentalness, liveness, valence, tempo,
+                                     time_signature, energy_dance_score, mood_score, created_at)
+    SELECT s.song_id, f.features_id, c.danceability, c.energy, trunc(c.key), c.loudness, c.mode,
+           c.speechiness, c.acousticness, c.instrumentalness, c.liveness, c.valence, c.tempo,
+           trunc(c.time_signature), (c.energy + c.danceability) / 2, c.valence * 0.6 + c.energy * 0.4,
+           c.snapshot_date
+    FROM (
+        SELECT DISTINCT ON (spotify_id) * FROM etl_elt_clean WHERE kept ORDER BY spotify_id, line_no
+    ) c
+    JOIN dim_song s ON s.spotify_id = c.spotify_id
+    LEFT JOIN dim_audio_features f ON ({', '.join('f.' + column for column in create_warehouse.AUDIO_FEATURES_COLUMNS)})
+                                    = ({', '.join('c.' + column for column in create_warehouse.AUDIO_FEATURES_COLUMNS)})
+    ORDER BY c.line_no
+    ON CONFLICT (song_id) DO NOTHING
+    """),
+    ('fact_streaming_metrics', f"""
+    WITH {CHART_ROWS}
+    INSERT INTO fact_streaming_metrics (song_id, date_id, country_id, estimated_streams, estimated_listeners,
+                                        avg_completion_rate, engagement_score, viral_coefficient, created_at)
+    SELECT song_id, date_id, country_id, (101 - rank) * 10000,
+           GREATEST(0, trunc((101 - rank) * 10000 * 0.6::DOUBLE PRECISION)),
+           85.0, LEAST(100.0, popularity_score * 1.2::DOUBLE PRECISION),
+           LEAST(1.0, (abs(chart_daily) + abs(chart_weekly)) / 100.0), snapshot_date
+    FROM chart_rows
+    ORDER BY line_no
+    ON CONFLICT (song_id, date_id, country_id) DO NOTHING
+    """),
+]
+
+# ========================================
+# LANDING
+# ========================================
+
+def csv_header(csv_file):
+    """Tên các cột theo đúng thứ tự trong dòng header của file CSV"""
+    with open(csv_file, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f))
+
+def drop_work_tables(cur):
+    """Xóa các bảng tạm của ELT (etl_landing, etl_elt_*)"""
+    for table in WORK_TABLES:
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+
+def create_landing(cur, columns):
+    """Tạo lại etl_landing UNLOGGED: mọi cột của file dạng TEXT + line_no theo thứ tự COPY"""
+    missing = [column for column in LANDING_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError(f"File CSV thiếu cột: {', '.join(missing)}")
+    drop_work_tables(cur)
+    cur.execute(sql.SQL("CREATE UNLOGGED TABLE etl_landing (line_no BIGINT GENERATED ALWAYS AS IDENTITY, {})").format(
+        sql.SQL(', ').join(sql.SQL("{} TEXT").format(sql.Identifier(column)) for column in columns)
+    ))
+
+def copy_landing(cur, csv_file):
+    """EXTRACT + LOAD: COPY nguyên file CSV vào etl_landing (1 lệnh), trả về số dòng"""
+    columns = csv_header(csv_file)
+    create_landing(cur, columns)
+    copy = sql.SQL("COPY etl_landing ({}) FROM STDIN WITH (FORMAT csv, HEADER true)").format(
+        sql.SQL(', ').join(map(sql.Identifier, columns))
+    ).as_string(cur)
+    with open(csv_file, 'rb') as f:
+        cur.copy_expert(copy, f)
+    return cur.rowcount
+
+# ========================================
+# TRANSFORM / LOAD BẰNG SQL
+# ========================================
+
+def rule_counts(cur):
+    """Số dòng vi phạm từng luật (bit trong rule_mask) trên toàn bộ etl_elt_clean"""
+    cur.execute("SELECT {} FROM etl_elt_clean".format(', '.join(
+        f"COUNT(*) FILTER (WHERE rule_mask & {bit} <> 0)" for bit, _ in VALIDATION_RULES.values()
+    )))
+    return dict(zip(VALIDATION_RULES, cur.fetchone()))
+
+def elt_transform(cur, chunk_size=10000, source_file=None):
+    """
+    TRANSFORM: làm sạch + kiểm tra etl_landing bằng SQL, ghi dòng bị loại vào etl_quarantine
+    Trả về (số dòng được nạp, {luật: số dòng vi phạm})
+    """
+    with etl_metrics.stage('elt.transform.functions'):
+        cur.execute(FUNCTIONS_SQL, {'na_values': CSV_NA_VALUES})
+    with etl_metrics.stage('elt.transform.clean') as metric:
+        cur.execute(clean_sql(), {'chunk_size': chunk_size})
+        cur.execute("SELECT COUNT(*), COUNT(*) FILTER (WHERE kept) FROM etl_elt_clean")
+        rows, kept = cur.fetchone()
+        metric['rows_out'] = kept
+    with etl_metrics.stage('elt.transform.quarantine', rows_in=rows - kept):
+        cur.execute(QUARANTINE_SQL, {'run_id': etl_metrics.RUN_ID,
+                                     'source_file': os.path.basename(source_file) if source_file else None})
+    counts = rule_counts(cur)
+    etl_metrics.count_rules(counts, RULE_ACTIONS)
+    return kept, counts
+
+def elt_load_dimensions(cur):
+    """LOAD: dim_date (extend_calendar) + 5 dimension còn lại bằng INSERT ... SELECT"""
+    cur.execute("SELECT DISTINCT snapshot_date FROM etl_elt_clean WHERE snapshot_date IS NOT NULL")
+    with etl_metrics.stage('elt.load_dimensions.dim_date'):
+        extend_calendar(pd.Series([row[0] for row in cur.fetchall()], dtype=object), cur)
+    for table, statement in DIMENSION_STEPS:
+        with etl_metrics.stage(f'elt.load_dimensions.{table}'):
+            cur.execute(statement)
+        print(f"   ✓ {table}: {cur.rowcount:,} records")
+
+def elt_load_facts(cur):
+    """LOAD: 5 bảng fact bằng INSERT ... SELECT (trả về số dòng fact_song_daily)"""
+    written = {}
+    for table, statement in FACT_STEPS:
+        with etl_metrics.stage(f'elt.load_facts.{table}'):
+            cur.execute(statement)
+        written[table] = cur.rowcount
+        print(f"   ✓ {table}: {cur.rowcount:,} records")
+    return written['fact_song_daily']
+
+def elt_finalize(cur):
+    """wide_song_daily + sketch cho mọi ngày đã nạp, xóa các bảng làm việc"""
+    cur.execute("SELECT DISTINCT snapshot_date FROM etl_elt_clean WHERE kept")
+    loaded = pd.DataFrame({'snapshot_date': [row[0] for row in cur.fetchall()]})
+    with etl_metrics.stage('elt.load_wide_table') as metric:
+        metric['rows_out'] = load_wide_table(loaded, cur)
+    with etl_metrics.stage('elt.load_sketches'):
+        load_sketches(loaded, cur)
+    # Trạng thái lịch sử BXH cho các lần chạy / ingest sau, dựng từ fact_chart_position vừa nạp
+    with etl_metrics.stage('elt.chart_history') as metric:
+        history = chart_history.ChartHistory().rebuild(cur)
+        history.save(cur)
+        metric['rows_out'] = len(history)
+    drop_work_tables(cur)
+    cur.execute(
+        """INSERT INTO etl_metadata (meta_key, meta_value) VALUES ('elt_sql_version', %s)
+           ON CONFLICT (meta_key) DO UPDATE SET meta_value = EXCLUDED.meta_value, updated_at = CURRENT_TIMESTAMP""",
+        (ELT_SQL_VERSION,)
+    )
+
+def set_parallel_workers(cur, workers=None):
+    """max_parallel_workers_per_gather cho transaction hiện tại (None/rỗng => giữ cấu hình server)"""
+    workers = workers if workers is not None else PARALLEL_WORKERS
+    if workers != '' and workers is not None:
+        cur.execute("SET LOCAL max_parallel_workers_per_gather = %s", (int(workers),))
+
+def run_elt(conn, cur, csv_file, chunk_size=10000, parallel_workers=None):
+    """
+    Chạy ELT cho csv_file trên schema vừa tạo (create_tables), commit 1 lần ở cuối
+    Trả về số dòng fact_song_daily đã nạp
+    """
+    if create_warehouse.KEY_STRATEGY != 'serial':
+        raise ValueError("Chế độ ELT chỉ hỗ trợ --key-strategy serial")
+    print(f"\n🧪 ELT (SQL v{ELT_SQL_VERSION}): COPY {csv_file} → etl_landing, dựng dimension/fact bằng SQL")
+    started = time.perf_counter()
+    set_parallel_workers(cur, parallel_workers)
+
+    with etl_metrics.stage('elt.copy') as metric:
+        metric['rows_out'] = rows = copy_landing(cur, csv_file)
+    print(f"   ✓ etl_landing: {rows:,} dòng")
+
+    with etl_metrics.stage('elt.transform', rows_in=rows) as metric:
+        kept, counts = elt_transform(cur, chunk_size, csv_file)
+        metric['rows_out'] = kept
+    violations = ', '.join(f"{rule}={count}" for rule, count in counts.items() if count)
+    print(f"   ✓ TRANSFORM: {kept:,} dòng hợp lệ, loại {rows - kept:,} dòng" + (f" ({violations})" if violations else ""))
+
+    print("\n📤 LOAD DIMENSIONS:")
+    with etl_metrics.stage('elt.load_dimensions', rows_in=kept):
+        elt_load_dimensions(cur)
+    print("\n📤 LOAD FACTS:")
+    with etl_metrics.stage('elt.load_facts', rows_in=kept) as metric:
+        metric['rows_out'] = loaded = elt_load_facts(cur)
+    elt_finalize(cur)
+
+    with etl_metrics.stage('commit'):
+        data_version = create_warehouse.bump_data_version(cur)
+        conn.commit()
+    etl_metrics.write_prometheus()
+    print(f"\n✅ ELT hoàn thành trong {time.perf_counter() - started:.1f}s và đã commit (data_version = {data_version})")
+    return loaded
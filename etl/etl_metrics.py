@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Telemetry cho từng bước của ETL (create_warehouse.py)
+- stage(): đo 1 bước (extract, từng bước transform, load từng dimension/fact, commit, ...):
+  thời gian, số dòng vào/ra, số dòng bị ON CONFLICT bỏ qua, số byte gửi tới PostgreSQL
+  và số round-trip
+- MetricsCursor: cursor đếm round-trip, byte SQL/COPY gửi đi và số dòng bị ảnh hưởng,
+  cộng vào mọi stage đang mở (stage cha gồm cả số liệu của stage con)
+- Mỗi stage ghi 1 dòng JSON vào ETL_METRICS_LOG; write_prometheus() ghi snapshot tổng
+  dạng Prometheus textfile (node_exporter textfile collector) vào ETL_METRICS_PROM
+- print_summary(): bảng tổng hợp theo stage ở cuối lần chạy
+- observe_queue()/queue_wait(): độ sâu và thời gian chờ của các hàng đợi giữa các stage
+  (chế độ asyncio, async_pipeline.py)
+- count_rules(): số dòng vi phạm từng luật kiểm tra dữ liệu (transform.validate) trong lần chạy
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from psycopg2 import extensions
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+METRICS_LOG = os.getenv("ETL_METRICS_LOG", os.path.join(_DIR, ".etl_metrics.jsonl"))
+METRICS_PROM = os.getenv("ETL_METRICS_PROM", os.path.join(_DIR, ".etl_metrics.prom"))
+
+FIELDS = ['rows_in', 'rows_out', 'rows_conflict', 'bytes_sent', 'round_trips']
+
+RUN_ID = uuid.uuid4().hex[:12]
+RUN_STARTED = time.time()
+
+# Tổng theo stage của lần chạy hiện tại (giữ thứ tự xuất hiện)
+TOTALS = OrderedDict()
+CHUNKS = 0
+
+# Hàng đợi giữa các stage (chế độ asyncio): số mẫu, độ sâu, thời gian chờ put/get
+QUEUES = OrderedDict()
+
+# Số dòng vi phạm theo luật kiểm tra dữ liệu: {luật: {'action': 'reject'/'coerce', 'rows': n}}
+RULES = OrderedDict()
+
+_lock = threading.Lock()
+_local = threading.local()
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def _total(name):
+    """Tổng của stage; tạo khi stage bắt đầu để stage cha đứng trước stage con trong bảng tổng hợp"""
+    return TOTALS.setdefault(name, dict({'calls': 0, 'seconds': 0.0}, **{field: 0 for field in FIELDS}))
+
+def set_chunk(index):
+    """Đánh dấu chunk đang xử lý (ghi kèm vào mọi metric sau đó)"""
+    global CHUNKS
+    _local.chunk = index
+    CHUNKS = max(CHUNKS, index or 0)
+
+def count_statement(bytes_sent, affected=None):
+    """Cộng 1 round-trip (và số dòng bị ảnh hưởng nếu biết) vào mọi stage đang mở"""
+    for metric in _stack():
+        metric['round_trips'] += 1
+        metric['bytes_sent'] += bytes_sent
+        if affected is not None and affected >= 0:
+            metric['affected'] += affected
+
+class MetricsCursor(extensions.cursor):
+    """Cursor đếm round-trip, byte gửi đi và rowcount cho telemetry"""
+
+    def execute(self, query, vars=None):
+        if vars is not None:
+            text = self.mogrify(query, vars)
+        elif isinstance(query, (str, bytes)):
+            text = query
+        else:
+            text = query.as_string(self)
+        super().execute(query, vars)
+        # rowcount của SELECT là số dòng đọc về, không tính vào số dòng được ghi
+        affected = None if (self.statusmessage or '').startswith('SELECT') else self.rowcount
+        count_statement(len(text.encode('utf-8') if isinstance(text, str) else text), affected)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = file.tell() if hasattr(file, 'tell') else None
+        super().copy_expert(sql, file, size)
+        sent = file.tell() - start if start is not None else 0
+        count_statement(len(sql.encode('utf-8')) + sent, self.rowcount)
+
+@contextlib.contextmanager
+def stage(name, rows_in=None, conflict=False):
+    """
+    Đo 1 bước ETL. Trong khối with có thể gán metric['rows_out'] (mặc định: số dòng bị ảnh hưởng
+    nếu có lệnh SQL, ngược lại bằng rows_in). conflict=True: bước INSERT ... ON CONFLICT DO NOTHING,
+    số dòng bị bỏ qua = rows_in - số dòng thực sự được ghi
+    """
+    metric = {'rows_in': rows_in, 'rows_out': None, 'affected': 0, 'bytes_sent': 0, 'round_trips': 0}
+    with _lock:
+        _total(name)
+    stack = _stack()
+    stack.append(metric)
+    start = time.perf_counter()
+    try:
+        yield metric
+    finally:
+        duration = time.perf_counter() - start
+        stack.pop()
+        if metric['rows_out'] is None:
+            metric['rows_out'] = metric['affected'] if metric['round_trips'] else rows_in
+        rows_conflict = None
+        if conflict and rows_in is not None:
+            rows_conflict = max(0, rows_in - metric['affected'])
+        record(name, duration, rows_in=rows_in, rows_out=metric['rows_out'], rows_conflict=rows_conflict,
+               bytes_sent=metric['bytes_sent'], round_trips=metric['round_trips'])
+
+def _queue(name, maxsize=0):
+    return QUEUES.setdefault(name, {'maxsize': maxsize, 'samples': 0, 'depth_sum': 0, 'depth_max': 0,
+                                    'depth': 0, 'put_wait_seconds': 0.0, 'get_wait_seconds': 0.0})
+
+def observe_queue(name, depth, maxsize=0):
+    """Ghi 1 mẫu độ sâu của hàng đợi"""
+    with _lock:
+        queue = _queue(name, maxsize)
+        queue['samples'] += 1
+        queue['depth_sum'] += depth
+        queue['depth_max'] = max(queue['depth_max'], depth)
+        queue['depth'] = depth
+
+def queue_wait(name, kind, seconds):
+    """Cộng thời gian chờ: kind='put' (hàng đợi đầy, backpressure) hoặc 'get' (hàng đợi rỗng)"""
+    with _lock:
+        _queue(name)[f'{kind}_wait_seconds'] += seconds
+
+def count_rules(counts, actions):
+    """Cộng số dòng vi phạm của 1 chunk; actions: {luật: 'reject' hoặc 'coerce'}"""
+    with _lock:
+        for rule, rows in counts.items():
+            RULES.setdefault(rule, {'action': actions[rule], 'rows': 0})['rows'] += rows
+
+def timed_chunks(chunks, name='extract'):
+    """Bọc iterator các chunk của extract_data: đo thời gian đọc từng chunk và đánh số chunk"""
+    index = 0
+    iterator = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(iterator, None)
+        if chunk is None:
+            return
+        index += 1
+        set_chunk(index)
+        record(name, time.perf_counter() - start, rows_in=len(chunk), rows_out=len(chunk),
+               bytes_sent=0, round_trips=0)
+        yield chunk
+
+def record(name, duration, **fields):
+    """Cộng vào tổng của stage và ghi 1 dòng JSON"""
+    entry = {
+        'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'run_id': RUN_ID,
+        'chunk': getattr(_local, 'chunk', None),
+        'stage': name,
+        'duration_ms': round(duration * 1000, 3),
+    }
+    entry.update({key: int(value) for key, value in fields.items() if value is not None})
+    with _lock:
+        total = _total(name)
+        total['calls'] += 1
+        total['seconds'] += duration
+        for field in FIELDS:
+            total[field] += entry.get(field, 0)
+        try:
+            with open(METRICS_LOG, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        except OSError:
+            pass
+    return entry
+
+def write_prometheus(path=None):
+    """Ghi snapshot tổng (counter theo stage) dạng Prometheus textfile; ghi file tạm rồi rename"""
+    path = path or METRICS_PROM
+    metrics = [
+        ('calls', 'Số lần chạy stage'),
+        ('seconds', 'Tổng thời gian của stage (giây)'),
+        ('rows_in', 'Số dòng đầu vào'),
+        ('rows_out', 'Số dòng đầu ra / được ghi'),
+        ('rows_conflict', 'Số dòng bị ON CONFLICT DO NOTHING bỏ qua'),
+        ('bytes_sent', 'Số byte SQL/COPY gửi tới PostgreSQL'),
+        ('round_trips', 'Số round-trip tới PostgreSQL'),
+    ]
+    lines = []
+    with _lock:
+        totals = {name: dict(total) for name, total in TOTALS.items()}
+    for field, description in metrics:
+        metric = f"spotify_etl_stage_{field}_total"
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} counter")
+        for name, total in totals.items():
+            value = round(total[field], 6) if field == 'seconds' else total[field]
+            lines.append(f'{metric}{{run_id="{RUN_ID}",stage="{name}"}} {value}')
+    with _lock:
+        queues = {name: dict(queue) for name, queue in QUEUES.items()}
+    if queues:
+        for metric, kind, description, value in [
+            ('spotify_etl_queue_depth', 'gauge', 'Độ sâu hiện tại của hàng đợi', lambda q: q['depth']),
+            ('spotify_etl_queue_depth_max', 'gauge', 'Độ sâu lớn nhất của hàng đợi', lambda q: q['depth_max']),
+            ('spotify_etl_queue_capacity', 'gauge', 'Sức chứa của hàng đợi', lambda q: q['maxsize']),
+            ('spotify_etl_queue_put_wait_seconds_total', 'counter', 'Thời gian chờ vì hàng đợi đầy',
+             lambda q: round(q['put_wait_seconds'], 6)),
+            ('spotify_etl_queue_get_wait_seconds_total', 'counter', 'Thời gian chờ vì hàng đợi rỗng',
+             lambda q: round(q['get_wait_seconds'], 6)),
+        ]:
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, queue in queues.items():
+                lines.append(f'{metric}{{run_id="{RUN_ID}",queue="{name}"}} {value(queue)}')
+    with _lock:
+        rules = {name: dict(rule) for name, rule in RULES.items()}
+    if rules:
+        metric = 'spotify_etl_validation_rows_total'
+        lines.append(f"# HELP {metric} Số dòng vi phạm luật kiểm tra dữ liệu (reject: bị loại, coerce: thay bằng mặc định)")
+        lines.append(f"# TYPE {metric} counter")
+        for name, rule in rules.items():
+            lines.append(f'{metric}{{run_id="{RUN_ID}",rule="{name}",action="{rule["action"]}"}} {rule["rows"]}')
+    lines += [
+        "# HELP spotify_etl_chunks_total Số chunk đã xử lý",
+        "# TYPE spotify_etl_chunks_total counter",
+        f'spotify_etl_chunks_total{{run_id="{RUN_ID}"}} {CHUNKS}',
+        "# HELP spotify_etl_run_start_timestamp_seconds Thời điểm bắt đầu lần chạy",
+        "# TYPE spotify_etl_run_start_timestamp_seconds gauge",
+        f'spotify_etl_run_start_timestamp_seconds{{run_id="{RUN_ID}"}} {RUN_STARTED:.0f}',
+        "# HELP spotify_etl_last_update_timestamp_seconds Thời điểm ghi snapshot",
+        "# TYPE spotify_etl_last_update_timestamp_seconds gauge",
+        f'spotify_etl_last_update_timestamp_seconds{{run_id="{RUN_ID}"}} {time.time():.0f}',
+    ]
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def print_summary():
+    """In bảng tổng hợp theo stage (stage con thụt lề theo dấu '.' trong tên)"""
+    with _lock:
+        totals = [(name, dict(total)) for name, total in TOTALS.items()]
+    if not totals:
+        return
+    wall = time.time() - RUN_STARTED
+    print("\n⏱️  TELEMETRY ETL (run " + RUN_ID + f", {CHUNKS} chunk, {wall:.1f}s)")
+    print("-" * 118)
+    print(f"  {'stage':<40}{'lần':>6}{'giây':>10}{'%':>7}{'rows in':>12}{'rows out':>12}"
+          f"{'conflict':>10}{'MB gửi':>9}{'round-trip':>12}")
+    print("-" * 118)
+    for name, total in totals:
+        depth = name.count('.')
+        label = '  ' * depth + (name.rsplit('.', 1)[-1] if depth else name)
+        share = total['seconds'] / wall * 100 if wall else 0
+        print(f"  {label:<40}{total['calls']:>6}{total['seconds']:>10.2f}{share:>6.1f}%"
+              f"{total['rows_in']:>12,}{total['rows_out']:>12,}{total['rows_conflict']:>10,}"
+              f"{total['bytes_sent'] / 1024 / 1024:>9.1f}{total['round_trips']:>12,}")
+    print("-" * 118)
+    with _lock:
+        queues = [(name, dict(queue)) for name, queue in QUEUES.items()]
+    for name, queue in queues:
+        average = queue['depth_sum'] / queue['samples'] if queue['samples'] else 0
+        print(f"  🧺 queue {name:<12} sức chứa {queue['maxsize']:>3} • độ sâu TB {average:>5.2f} / max {queue['depth_max']:>3}"
+              f" • chờ put {queue['put_wait_seconds']:>7.2f}s • chờ get {queue['get_wait_seconds']:>7.2f}s")
+    if queues:
+        print("-" * 118)
+    with _lock:
+        rules = [(name, dict(rule)) for name, rule in RULES.items() if rule['rows']]
+    for name, rule in rules:
+        icon = '🚫' if rule['action'] == 'reject' else '🩹'
+        print(f"  {icon} {rule['action']:<7}{name:<32}{rule['rows']:>10,} dòng")
+    if rules:
+        print("-" * 118)
+    print(f"  📄 {METRICS_LOG}\n  📈 {METRICS_PROM}")
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+================================================================================
+SINH DỮ LIỆU GIẢ LẬP (SYNTHETIC) CHO universal_top_spotify_songs.csv
+================================================================================
+Tạo file CSV cùng schema với dataset Kaggle để đo hiệu năng ETL khi không có dữ liệu thật:
+- 72 bảng xếp hạng mỗi ngày (71 quốc gia + global với country rỗng), top 50 mỗi bảng
+- Bài hát có "độ hot" riêng, sống trong một khoảng ngày rồi rơi khỏi BXH; bài hát
+  nội địa được ưu tiên ở quốc gia của nó => daily/weekly_movement có ý nghĩa
+- Chuỗi nhiều nghệ sĩ ("A, B, C"), album nhiều bài, audio features theo phân phối Beta/Normal
+- Một tỉ lệ nhỏ giá trị bẩn: NULL, ngoài khoảng, khoảng trắng thừa, boolean dạng chuỗi,
+  ngày không hợp lệ, dòng trùng lặp (giống những gì transform_data phải xử lý)
+
+Kết quả chỉ phụ thuộc vào (--rows, --seed, --start-date, --dirty-rate): mỗi ngày dùng
+RNG riêng sinh từ seed nên chạy lại luôn ra cùng một file.
+
+Sử dụng:
+    python generate_synthetic_data.py --rows 1000000 --output universal_top_spotify_songs.csv
+================================================================================
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+
+# Global chart có country rỗng trong dataset gốc (ETL map thành 'GLOBAL')
+COUNTRIES = [
+    '', 'AE', 'AR', 'AT', 'AU', 'BE', 'BG', 'BO', 'BR', 'BY', 'CA', 'CH', 'CL', 'CO', 'CR',
+    'CZ', 'DE', 'DK', 'DO', 'EC', 'EE', 'EG', 'ES', 'FI', 'FR', 'GB', 'GR', 'GT', 'HK', 'HN',
+    'HU', 'ID', 'IE', 'IL', 'IN', 'IS', 'IT', 'JP', 'KR', 'KZ', 'LT', 'LU', 'LV', 'MA', 'MX',
+    'MY', 'NG', 'NI', 'NL', 'NO', 'NZ', 'PA', 'PE', 'PH', 'PK', 'PL', 'PT', 'PY', 'RO', 'SA',
+    'SE', 'SG', 'SK', 'SV', 'TH', 'TR', 'TW', 'UA', 'US', 'UY', 'VE', 'VN',
+]
+CHART_SIZE = 50
+ROWS_PER_DAY = len(COUNTRIES) * CHART_SIZE
+
+COLUMNS = [
+    'spotify_id', 'name', 'artists', 'daily_rank', 'daily_movement', 'weekly_movement',
+    'country', 'snapshot_date', 'popularity', 'is_explicit', 'duration_ms', 'album_name',
+    'album_release_date', 'danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness',
+    'acousticness', 'instrumentalness', 'liveness', 'valence', 'tempo', 'time_signature',
+]
+
+# Số bài hát đang "sống" (có thể vào BXH) tại mỗi thời điểm và số ngày sống trung bình
+ACTIVE_SONGS = 600
+SONG_LIFETIME_DAYS = 90
+
+BASE62 = np.array(list('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'))
+SYLLABLES = np.array(['la', 'mi', 'do', 're', 'sol', 'ka', 'ri', 'no', 'van', 'el', 'to', 'shi',
+                      'ma', 'lu', 'na', 'ze', 'ro', 'bel', 'sun', 'star', 'love', 'night', 'fire', 'blue'])
+
+def spotify_ids(rng, n):
+    """ID 22 ký tự base62 như Spotify"""
+    return np.array([''.join(chars) for chars in BASE62[rng.integers(0, 62, size=(n, 22))]])
+
+def titles(rng, n, words=(1, 4)):
+    """Tên ngẫu nhiên ghép từ các âm tiết, viết hoa chữ đầu mỗi từ"""
+    counts = rng.integers(words[0], words[1] + 1, size=n)
+    parts = SYLLABLES[rng.integers(0, len(SYLLABLES), size=(n, words[1], 2))]
+    return np.array([
+        ' '.join((a + b).capitalize() for a, b in part[:count])
+        for part, count in zip(parts, counts)
+    ])
+
+def build_catalog(n_days, seed):
+    """
+    Danh mục bài hát/nghệ sĩ/album dùng cho toàn bộ file
+    Mỗi bài có ngày phát hành, thời gian sống, độ hot, quốc gia "nhà" và audio features cố định
+    """
+    rng = np.random.default_rng([seed, 0])
+    n_songs = max(ACTIVE_SONGS * 2, int(ACTIVE_SONGS * (n_days + SONG_LIFETIME_DAYS) / SONG_LIFETIME_DAYS))
+    n_artists = max(50, n_songs // 3)
+    n_albums = max(20, n_songs // 3)
+
+    release_day = np.sort(rng.integers(-SONG_LIFETIME_DAYS, n_days, size=n_songs))
+    lifetime = np.maximum(7, rng.gamma(2.0, SONG_LIFETIME_DAYS / 2, size=n_songs)).astype(np.int64)
+
+    # Nghệ sĩ chính theo phân phối Zipf (vài nghệ sĩ có rất nhiều bài), 0-3 nghệ sĩ featuring
+    artist_names = titles(rng, n_artists, words=(1, 3))
+    main_artist = (rng.zipf(1.3, size=n_songs) - 1) % n_artists
+    n_featured = rng.choice([0, 0, 0, 1, 1, 2, 3], size=n_songs)
+    featured = rng.integers(0, n_artists, size=(n_songs, 3))
+    artists = np.array([
+        ', '.join(artist_names[np.r_[main, extra[:count]]])
+        for main, extra, count in zip(main_artist, featured, n_featured)
+    ])
+
+    album_names = titles(rng, n_albums, words=(1, 3))
+    album = np.minimum(np.arange(n_songs) // 3 + rng.integers(0, 2, size=n_songs), n_albums - 1)
+    album_offset = rng.integers(0, 30, size=n_albums)
+
+    catalog = pd.DataFrame({
+        'spotify_id': spotify_ids(rng, n_songs),
+        'name': titles(rng, n_songs),
+        'artists': artists,
+        'album_name': album_names[album],
+        'album_id': album,
+        'release_day': release_day,
+        'lifetime': lifetime,
+        'strength': rng.lognormal(0.0, 1.0, size=n_songs),
+        'home_country': rng.integers(0, len(COUNTRIES), size=n_songs),
+        'is_explicit': rng.random(n_songs) < 0.35,
+        'duration_ms': np.clip(rng.normal(200000, 45000, size=n_songs), 60000, 600000).astype(np.int64),
+        'danceability': rng.beta(5, 3, size=n_songs),
+        'energy': rng.beta(4, 3, size=n_songs),
+        'key': rng.integers(0, 12, size=n_songs),
+        'loudness': np.clip(rng.normal(-7, 3, size=n_songs), -40, 0),
+        'mode': (rng.random(n_songs) < 0.6).astype(np.int64),
+        'speechiness': rng.beta(1.5, 15, size=n_songs),
+        'acousticness': rng.beta(1, 3, size=n_songs),
+        'instrumentalness': np.where(rng.random(n_songs) < 0.9, rng.random(n_songs) * 1e-3, rng.random(n_songs)),
+        'liveness': rng.beta(2, 10, size=n_songs),
+        'valence': rng.beta(3, 3, size=n_songs),
+        'tempo': np.clip(rng.normal(120, 28, size=n_songs), 50, 220),
+        'time_signature': rng.choice([3, 4, 4, 4, 4, 4, 4, 5], size=n_songs),
+    })
+    # Spotify API trả audio features với 3 chữ số thập phân
+    features = ['danceability', 'energy', 'loudness', 'speechiness', 'acousticness',
+                'instrumentalness', 'liveness', 'valence', 'tempo']
+    catalog[features] = catalog[features].round(3)
+    # Album phát hành trước bài đầu tiên của nó vài ngày
+    first_day = catalog.groupby('album_id')['release_day'].transform('min')
+    catalog['album_release_day'] = first_day - album_offset[album]
+    return catalog
+
+def daily_charts(catalog, day, seed):
+    """
+    Top 50 của từng quốc gia trong 1 ngày: chọn không lặp theo trọng số (Gumbel top-k)
+    Trả về (vị trí bài hát trong catalog, chỉ số quốc gia, rank), sắp theo quốc gia rồi rank
+    """
+    rng = np.random.default_rng([seed, 1, day])
+    release = catalog['release_day'].to_numpy()
+    age = day - release
+    alive = np.flatnonzero((age >= 0) & (age < catalog['lifetime'].to_numpy()))
+    if len(alive) < CHART_SIZE:
+        alive = np.argsort(np.abs(age))[:CHART_SIZE * 4]
+        age = np.abs(age)
+
+    # Độ hot tăng nhanh sau khi phát hành rồi giảm dần; bài nội địa được cộng điểm ở quốc gia nhà
+    lifetime = catalog['lifetime'].to_numpy()[alive]
+    curve = np.minimum(1.0, (age[alive] + 1) / 7.0) * np.exp(-age[alive] / lifetime)
+    base = np.log(catalog['strength'].to_numpy()[alive] * curve + 1e-9)
+    home = catalog['home_country'].to_numpy()[alive]
+    is_home = home[None, :] == np.arange(len(COUNTRIES))[:, None]
+    scores = base[None, :] + 1.5 * is_home + rng.gumbel(size=(len(COUNTRIES), len(alive)))
+
+    top = np.argsort(-scores, axis=1)[:, :CHART_SIZE]
+    songs = alive[top].ravel()
+    countries = np.repeat(np.arange(len(COUNTRIES)), CHART_SIZE)
+    ranks = np.tile(np.arange(1, CHART_SIZE + 1), len(COUNTRIES))
+    return songs, countries, ranks
+
+def movement(keys, ranks, history):
+    """Rank hôm trước/tuần trước - rank hôm nay (dương = đi lên); 0 nếu trước đó không có trong BXH"""
+    if history is None:
+        return np.zeros(len(keys), dtype=np.int64)
+    prev_keys, prev_ranks = history
+    pos = np.minimum(np.searchsorted(prev_keys, keys), len(prev_keys) - 1)
+    found = prev_keys[pos] == keys
+    return np.where(found, prev_ranks[pos] - ranks, 0)
+
+def dirty(df, rng, rate):
+    """Chèn giá trị bẩn vào khoảng `rate` số dòng cho mỗi loại lỗi"""
+    if rate <= 0:
+        return df
+    n = len(df)
+    # Cột số nguyên dạng nullable để NULL vẫn ghi ra CSV dạng số nguyên
+    for column in ['popularity', 'duration_ms', 'daily_movement']:
+        df[column] = df[column].astype('Int64')
+
+    def pick():
+        return rng.random(n) < rate
+
+    for column in ['danceability', 'energy', 'valence', 'tempo', 'popularity', 'duration_ms',
+                   'album_name', 'album_release_date', 'artists', 'daily_movement']:
+        df.loc[pick(), column] = np.nan
+    df.loc[pick(), 'energy'] = 1.5
+    df.loc[pick(), 'tempo'] = -1.0
+    df.loc[pick(), 'loudness'] = 12.0
+    df.loc[pick(), 'popularity'] = 180
+    df.loc[pick(), 'name'] = '  ' + df['name'] + '   '
+    df.loc[pick(), 'artists'] = df['artists'].str.replace(', ', ' ,  ', regex=False)
+    df.loc[pick(), 'album_release_date'] = 'not-a-date'
+    df['is_explicit'] = df['is_explicit'].astype(object)
+    explicit = df['is_explicit'].astype(bool)
+    mask = pick()
+    df.loc[mask, 'is_explicit'] = np.where(explicit[mask], 'TRUE', 'false')
+    df.loc[pick(), 'is_explicit'] = np.nan
+    df.loc[rng.random(n) < rate / 10, 'snapshot_date'] = np.nan
+    # Dòng trùng lặp
+    duplicates = df[rng.random(n) < rate / 2]
+    return pd.concat([df, duplicates], ignore_index=True) if len(duplicates) else df
+
+def write_csv(df, sink, header):
+    """Ghi 1 lô ra CSV bằng pyarrow (nhanh hơn DataFrame.to_csv nhiều lần); boolean ghi dạng True/False"""
+    df = df.assign(is_explicit=df['is_explicit'].map({True: 'True', False: 'False'}).fillna(df['is_explicit']))
+    table = pa.Table.from_pandas(df.astype({'is_explicit': 'str'}), preserve_index=False)
+    pa_csv.write_csv(table, sink, pa_csv.WriteOptions(include_header=header, quoting_style='needed'))
+
+def generate(rows, output, seed=42, start_date='2023-10-18', dirty_rate=0.01, batch_days=30):
+    """Sinh `rows` dòng (chưa tính dòng trùng lặp) và ghi ra `output` theo từng lô ngày"""
+    n_days = -(-rows // ROWS_PER_DAY)
+    start = pd.Timestamp(start_date)
+    print(f"🎲 Sinh {rows:,} dòng ({n_days:,} ngày × {len(COUNTRIES)} BXH × top {CHART_SIZE}), seed = {seed}")
+
+    started = time.perf_counter()
+    catalog = build_catalog(n_days, seed)
+    print(f"   ✓ Catalog: {len(catalog):,} bài hát, {catalog['album_id'].nunique():,} album "
+          f"({time.perf_counter() - started:.1f}s)")
+
+    album_release = (start + pd.to_timedelta(catalog['album_release_day'], unit='D')).dt.strftime('%Y-%m-%d')
+    song_columns = catalog[['spotify_id', 'name', 'artists', 'is_explicit', 'duration_ms', 'album_name',
+                            'danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness',
+                            'acousticness', 'instrumentalness', 'liveness', 'valence', 'tempo',
+                            'time_signature']].assign(album_release_date=album_release)
+    strength_rank = catalog['strength'].rank(pct=True).to_numpy()
+    countries = np.array(COUNTRIES, dtype=object)
+    n_songs = len(catalog)
+
+    history = []
+    written = 0
+    header = True
+    sink = open(output, 'wb')
+    for batch_start in range(0, n_days, batch_days):
+        frames = []
+        for day in range(batch_start, min(n_days, batch_start + batch_days)):
+            songs, country, ranks = daily_charts(catalog, day, seed)
+            keys = country.astype(np.int64) * n_songs + songs
+            order = np.argsort(keys)
+            today = (keys[order], ranks[order])
+            daily = movement(keys, ranks, history[-1] if history else None)
+            weekly = movement(keys, ranks, history[-7] if len(history) >= 7 else None)
+            history = (history + [today])[-7:]
+
+            rng = np.random.default_rng([seed, 2, day])
+            popularity = np.clip(np.round(
+                45 + 40 * strength_rank[songs] + (CHART_SIZE - ranks) * 0.3 + rng.normal(0, 5, size=len(songs))
+            ), 0, 100).astype(np.int64)
+            frame = song_columns.iloc[songs].reset_index(drop=True)
+            frame['daily_rank'] = ranks
+            frame['daily_movement'] = daily
+            frame['weekly_movement'] = weekly
+            frame['country'] = countries[country]
+            frame['snapshot_date'] = (start + pd.Timedelta(days=day)).strftime('%Y-%m-%d')
+            frame['popularity'] = popularity
+            frames.append(frame)
+
+        df = pd.concat(frames, ignore_index=True)
+        df = df.head(rows - written)
+        written += len(df)
+        df = dirty(df, np.random.default_rng([seed, 3, batch_start]), dirty_rate)
+        write_csv(df[COLUMNS], sink, header)
+        header = False
+        print(f"   ✓ {written:>12,} / {rows:,} dòng", end='\r')
+        if written >= rows:
+            break
+    sink.close()
+
+    size_mb = os.path.getsize(output) / 1024 / 1024
+    print(f"\n✅ Đã ghi {output} ({size_mb:,.1f} MB) trong {time.perf_counter() - started:.1f}s")
+    return output
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sinh dữ liệu giả lập cùng schema với universal_top_spotify_songs.csv")
+    parser.add_argument('--rows', type=int, default=100000,
+                        help="Số dòng cần sinh (mặc định 100,000; dùng tới 50,000,000)")
+    parser.add_argument('--output', default='universal_top_spotify_songs.csv', help="File CSV đầu ra")
+    parser.add_argument('--seed', type=int, default=42, help="Seed (cùng seed => cùng file)")
+    parser.add_argument('--start-date', default='2023-10-18', help="Ngày đầu tiên của BXH (YYYY-MM-DD)")
+    parser.add_argument('--dirty-rate', type=float, default=0.01,
+                        help="Tỉ lệ dòng bị chèn mỗi loại giá trị bẩn (mặc định 0.01, 0 để tắt)")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    generate(args.rows, args.output, seed=args.seed, start_date=args.start_date, dirty_rate=args.dirty_rate)
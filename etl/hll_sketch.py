@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+HyperLogLog (HLL) cho các metric COUNT(DISTINCT ...): định dạng sketch, tạo và gộp sketch
+- ETL (load_sketches) tạo sketch cho từng (ngày × quốc gia) bằng build_sketches, vectorized bằng NumPy
+- Dashboard (streamlit/distinct_sketch.py) gộp sketch của khoảng ngày/quốc gia và ước lượng số distinct
+Module chỉ phụ thuộc NumPy để cả 2 phía import được mà ETL không phụ thuộc vào thư mục dashboard
+"""
+
+import numpy as np
+
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_STANDARD_ERROR = 1.04 / np.sqrt(HLL_REGISTERS)
+
+# Định dạng bytea: 1 byte đầu là loại, phần sau là payload
+# - SPARSE: mảng uint32 little-endian (register << 8 | rho), chỉ các register khác 0
+# - DENSE: HLL_REGISTERS byte, mỗi byte là giá trị 1 register
+SPARSE = b'S'
+DENSE = b'D'
+
+_U64 = np.uint64
+
+def hash64(values):
+    """Hash 64-bit (splitmix64) cho mảng số nguyên, ổn định giữa các lần chạy"""
+    h = np.asarray(values, dtype=np.int64).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        h = h + _U64(0x9E3779B97F4A7C15)
+        h = (h ^ (h >> _U64(30))) * _U64(0xBF58476D1CE4E5B9)
+        h = (h ^ (h >> _U64(27))) * _U64(0x94D049BB133111EB)
+    return h ^ (h >> _U64(31))
+
+def _bit_length(x):
+    """Số bit có nghĩa của từng phần tử uint64 (0 với x = 0)"""
+    x = x.copy()
+    length = np.zeros(x.shape, dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = (x >> _U64(shift)) != 0
+        x = np.where(high, x >> _U64(shift), x)
+        length += high.astype(np.uint8) * shift
+    return length + (x != 0).astype(np.uint8)
+
+def register_values(values):
+    """(chỉ số register, rho) của từng giá trị: p bit đầu của hash chọn register, rho = số bit 0 đầu tiên + 1"""
+    h = hash64(values)
+    tail_bits = 64 - HLL_PRECISION
+    index = (h >> _U64(tail_bits)).astype(np.int64)
+    tail = h & _U64((1 << tail_bits) - 1)
+    rho = (tail_bits + 1 - _bit_length(tail).astype(np.int64)).astype(np.uint8)
+    return index, rho
+
+def serialize(index, rho):
+    """Mã hóa các register khác 0 (index tăng dần, không trùng) thành bytes"""
+    if len(index) * 4 < HLL_REGISTERS:
+        entries = (index.astype('<u4') << 8) | rho.astype('<u4')
+        return SPARSE + entries.astype('<u4').tobytes()
+    registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    registers[index] = rho
+    return DENSE + registers.tobytes()
+
+def build_sketches(groups, values):
+    """
+    Tạo sketch cho từng nhóm trong 1 lần duyệt vectorized
+    groups: mã nhóm (số nguyên, ví dụ vị trí của (date_id, country_id)), values: id cần đếm distinct
+    Trả về dict {mã nhóm: bytes}; giá trị NaN (mảng float) bị bỏ qua giống COUNT(DISTINCT)
+    Mảng số nguyên được hash trực tiếp (không qua float64, giữ đúng id 64-bit)
+    """
+    groups = np.asarray(groups)
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        valid = ~np.isnan(values)
+        groups, values = groups[valid], values[valid]
+    groups, values = groups.astype(np.int64), values.astype(np.int64)
+    if len(values) == 0:
+        return {}
+
+    index, rho = register_values(values)
+    # Giữ rho lớn nhất của mỗi (nhóm, register): sort theo (nhóm, register, rho), lấy phần tử cuối
+    cell = groups * HLL_REGISTERS + index
+    order = np.lexsort((rho, cell))
+    cell, rho = cell[order], rho[order]
+    last = np.r_[cell[1:] != cell[:-1], True]
+    cell, rho = cell[last], rho[last]
+
+    cell_groups = cell // HLL_REGISTERS
+    cell_index = cell % HLL_REGISTERS
+    keys, starts = np.unique(cell_groups, return_index=True)
+    ends = np.r_[starts[1:], len(cell_groups)]
+    return {
+        int(key): serialize(cell_index[start:end], rho[start:end])
+        for key, start, end in zip(keys, starts, ends)
+    }
+
+def merge_registers(sketches):
+    """Gộp nhiều sketch (bytes/memoryview) thành mảng register dày (max từng register)"""
+    registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    sparse_parts = []
+    for sketch in sketches:
+        if sketch is None:
+            continue
+        sketch = bytes(sketch)
+        if sketch[:1] == DENSE:
+            np.maximum(registers, np.frombuffer(sketch, dtype=np.uint8, offset=1), out=registers)
+        elif len(sketch) > 1:
+            sparse_parts.append(sketch[1:])
+    if sparse_parts:
+        # Ghép payload của mọi sketch thưa rồi gộp 1 lần
+        entries = np.frombuffer(b''.join(sparse_parts), dtype='<u4')
+        np.maximum.at(registers, (entries >> 8).astype(np.int64), (entries & 0xFF).astype(np.uint8))
+    return registers
+
+def estimate(registers):
+    """Ước lượng số phần tử distinct từ mảng register (HLL + linear counting cho tập nhỏ)"""
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if raw <= 2.5 * m and zeros:
+        return m * np.log(m / zeros)
+    return raw
+
+def count_distinct(sketches):
+    """Số phần tử distinct (làm tròn) của hợp các sketch"""
+    return int(round(estimate(merge_registers(sketches))))
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+================================================================================
+INGEST NHIỀU FILE CSV (THƯ MỤC / GLOB)
+================================================================================
+Dành cho feed chia thành nhiều file nhỏ (theo ngày hoặc theo quốc gia) thay vì 1 file lớn:
+- Mỗi file được nhận diện bằng SHA-256 nội dung (etl_loaded_files); file đã load thì bỏ qua,
+  nên có thể chạy lại định kỳ trên cả thư mục để chỉ nạp các file mới
+- Các file được xử lý theo lô, mỗi lô 3 pha:
+  1. TRANSFORM song song: mỗi worker (process) đọc + làm sạch 1 file
+  2. DIMENSION: process chính gộp dimension mới của cả lô và ghi 1 lần (1 writer duy nhất)
+     => không có 2 transaction cùng tạo 1 key (SERIAL / ON CONFLICT) => không race, không deadlock.
+     fact_audio_analysis (1 dòng mỗi bài, không theo ngày) cũng được ghi ở đây: dòng của ngày sớm nhất
+     trong lô, như khi load 1 file (worker ghi song song thì file nào commit trước thắng)
+  3. FACT song song: mỗi worker ghi fact của 1 file bằng connection riêng, commit theo file;
+     sau đó process chính cập nhật previous_rank / movement theo lịch sử BXH (chart_history.py),
+     ghi wide_song_daily, sketch, các dòng bị loại (etl_quarantine) và đánh dấu
+     các file của lô là đã load trong cùng 1 transaction (lỗi giữa chừng => file được load lại lần sau,
+     fact có ON CONFLICT)
+- Không tạo lại schema nếu kho dữ liệu đã có (--rebuild để tạo lại); khi đó dùng cách sinh key
+  (SERIAL / hash) của schema đang có. Với --key-strategy hash, worker dựng fact ở pha 3 không cần
+  đọc lại dimension từ database
+
+    python ingest_files.py --input data/daily/                 # mọi *.csv trong thư mục
+    python ingest_files.py --input 'data/daily/2024-*.csv' --workers 8
+================================================================================
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import psycopg2
+
+import etl_metrics
+import chart_history
+import trend_state
+import create_warehouse
+from create_warehouse import (
+    create_tables, extract_data, transform_chunk, extend_calendar, load_dimensions, build_fact_rows,
+    load_facts, load_wide_table, load_sketches, build_trend_tables, bump_data_version, file_fingerprint,
+    record_loaded_file, schema_key_strategy, write_quarantine, QUARANTINE_DDL, RULE_ACTIONS
+)
+
+# Connection riêng của mỗi worker process (tạo lần đầu dùng)
+_worker_conn = None
+
+def connect():
+    return psycopg2.connect(
+        host=create_warehouse.DB_HOST, port=create_warehouse.DB_PORT, dbname=create_warehouse.DB_NAME,
+        user=create_warehouse.DB_USER, password=create_warehouse.DB_PASS,
+        cursor_factory=etl_metrics.MetricsCursor
+    )
+
+# ========================================
+# TÌM FILE & FINGERPRINT
+# ========================================
+
+def discover_files(source):
+    """Thư mục => mọi *.csv bên trong; ngược lại source là đường dẫn file hoặc glob"""
+    pattern = os.path.join(source, '*.csv') if os.path.isdir(source) else source
+    return sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+
+def pending_files(cur, files):
+    """Trả về [(path, fingerprint)] các file chưa load (file trùng nội dung chỉ lấy 1 lần)"""
+    cur.execute("SELECT fingerprint FROM etl_loaded_files")
+    loaded = {row[0] for row in cur.fetchall()}
+    pending, seen = [], set()
+    for path in files:
+        fingerprint = file_fingerprint(path)
+        if fingerprint in loaded or fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        pending.append((path, fingerprint))
+    return pending
+
+def ensure_schema(cur, rebuild=False, key_strategy=None):
+    """
+    Tạo schema khi chưa có kho dữ liệu (hoặc khi rebuild)
+    Trả về (đã tạo mới?, cách sinh key của schema)
+    """
+    cur.execute("SELECT to_regclass('fact_song_daily') IS NOT NULL AND to_regclass('etl_loaded_files') IS NOT NULL")
+    if cur.fetchone()[0] and not rebuild:
+        # Kho dữ liệu tạo trước khi có etl_quarantine / etl_chart_history / etl_trend_state
+        cur.execute(QUARANTINE_DDL)
+        cur.execute(chart_history.HISTORY_DDL)
+        cur.execute(trend_state.TREND_STATE_DDL)
+        cur.execute("ALTER TABLE fact_chart_position ADD COLUMN IF NOT EXISTS chart_streak INTEGER")
+        return False, schema_key_strategy(cur)
+    key_strategy = key_strategy or create_warehouse.KEY_STRATEGY
+    create_tables(cur, key_strategy=key_strategy)
+    return True, key_strategy
+
+# ========================================
+# WORKER (chạy trong process con)
+# ========================================
+
+def _init_worker(run_id, key_strategy):
+    """Metric của worker ghi chung run_id với process chính; log chi tiết của các bước ETL bị ẩn"""
+    etl_metrics.RUN_ID = run_id
+    create_warehouse.KEY_STRATEGY = key_strategy
+    sys.stdout = open(os.devnull, 'w')
+
+def transform_file(path, chunk_size):
+    """
+    Pha 1: đọc + transform cả file
+    Trả về (số dòng đọc được, DataFrame đã làm sạch, các dòng bị loại, số dòng vi phạm từng luật)
+    """
+    # Số dòng vi phạm của riêng file này (process chính cộng vào tổng của lần chạy)
+    etl_metrics.RULES.clear()
+    rows, frames, quarantine = 0, [], []
+    for chunk in extract_data(path, chunk_size):
+        rows += len(chunk)
+        frames.append(transform_chunk(chunk, quarantine))
+    frames = [df for df in frames if len(df)]
+    counts = {rule: value['rows'] for rule, value in etl_metrics.RULES.items()}
+    return (rows, pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(),
+            pd.concat(quarantine, ignore_index=True) if quarantine else None, counts)
+
+def load_audio_facts(df, cur):
+    """
+    Pha 2: fact_audio_analysis của cả lô, ghi ở process chính
+    Mỗi bài lấy dòng của ngày sớm nhất (cùng ngày: theo thứ tự file / dòng), như build_fact_rows khi load 1 file
+    """
+    first = df.sort_values('snapshot_date', kind='stable').drop_duplicates('spotify_id')
+    facts = build_fact_rows(first, cur)
+    load_facts(first, cur, {table: rows if table == 'fact_audio_analysis' else [] for table, rows in facts.items()})
+
+def load_file_facts(path, df, retries=3):
+    """Pha 3: ghi fact theo ngày của 1 file bằng connection của worker, commit riêng (fact_audio_analysis đã ghi ở pha 2)"""
+    global _worker_conn
+    if _worker_conn is None or _worker_conn.closed:
+        _worker_conn = connect()
+    conn = _worker_conn
+    for attempt in range(retries):
+        try:
+            with conn.cursor() as cur, etl_metrics.stage('load_facts', rows_in=len(df)):
+                facts = build_fact_rows(df, cur)
+                facts['fact_audio_analysis'] = []
+                load_facts(df, cur, facts)
+            conn.commit()
+            return len(df)
+        except psycopg2.errors.DeadlockDetected:
+            # 2 file có trùng key fact (song, ngày, quốc gia) được ghi cùng lúc => thử lại
+            conn.rollback()
+            if attempt == retries - 1:
+                raise
+        except Exception:
+            conn.rollback()
+            raise
+
+# ========================================
+# INGEST
+# ========================================
+
+def ingest(source, workers=None, chunk_size=10000, batch_files=None, rebuild=False, key_strategy=None):
+    """
+    Ingest các file CSV mới của source; trả về số file đã load
+    key_strategy chỉ dùng khi tạo schema mới, kho dữ liệu đã có giữ cách sinh key của nó
+    """
+    workers = workers or os.cpu_count() or 1
+    batch_files = batch_files or workers * 4
+    files = discover_files(source)
+    print(f"📂 {source}: {len(files)} file CSV")
+
+    conn = connect()
+    cur = conn.cursor()
+    with etl_metrics.stage('create_schema'):
+        created, schema_keys = ensure_schema(cur, rebuild, key_strategy)
+        if created:
+            bump_data_version(cur)
+        conn.commit()
+    if key_strategy and schema_keys != key_strategy:
+        print(f"⚠️  Kho dữ liệu đang dùng key '{schema_keys}', bỏ qua --key-strategy {key_strategy} (--rebuild để đổi)")
+    create_warehouse.KEY_STRATEGY = schema_keys
+    print(f"🔑 Surrogate key: {schema_keys}")
+    with etl_metrics.stage('fingerprint', rows_in=len(files)) as metric:
+        pending = pending_files(cur, files)
+        metric['rows_out'] = len(pending)
+    print(f"🆕 {len(pending)} file mới, bỏ qua {len(files) - len(pending)} file đã load")
+    if not pending:
+        cur.close()
+        conn.close()
+        return 0
+    # Lịch sử BXH (chưa lưu => dựng lại từ fact_chart_position)
+    with etl_metrics.stage('load_chart_history') as metric:
+        history = chart_history.ChartHistory.load(cur)
+        metric['rows_out'] = len(history)
+
+    # spawn: process con không kế thừa connection/lock của process chính
+    context = multiprocessing.get_context('spawn')
+    loaded = 0
+    loaded_dates = set()
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                             initargs=(etl_metrics.RUN_ID, schema_keys)) as pool:
+        for start in range(0, len(pending), batch_files):
+            batch = pending[start:start + batch_files]
+            etl_metrics.set_chunk(start // batch_files + 1)
+            print(f"\n{'─'*80}\n📦 LÔ {start // batch_files + 1}: {len(batch)} file ({workers} worker)\n{'─'*80}")
+
+            # Pha 1: transform song song
+            with etl_metrics.stage('transform_files', rows_in=len(batch)) as metric:
+                results = list(pool.map(transform_file, [path for path, _ in batch], [chunk_size] * len(batch)))
+                metric['rows_out'] = sum(len(df) for _, df, _, _ in results)
+            for (path, _), (rows, df, quarantine, counts) in zip(batch, results):
+                etl_metrics.count_rules(counts, RULE_ACTIONS)
+                print(f"   ✓ {os.path.basename(path)}: {rows:,} dòng → {len(df):,} dòng hợp lệ"
+                      + (f", {len(quarantine):,} dòng bị loại" if quarantine is not None and len(quarantine) else ""))
+            frames = [df for _, df, _, _ in results if len(df)]
+            merged = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+            if len(merged):
+                # Pha 2: dimension của cả lô, 1 writer
+                with etl_metrics.stage('load_dimensions', rows_in=len(merged)), \
+                        contextlib.redirect_stdout(io.StringIO()):
+                    extend_calendar(merged['snapshot_date'].dropna().drop_duplicates(), cur)
+                    load_dimensions(merged, cur)
+                    load_audio_facts(merged, cur)
+                    conn.commit()
+
+                # Pha 3: fact song song theo file
+                with etl_metrics.stage('load_facts_files', rows_in=len(merged)):
+                    list(pool.map(load_file_facts, [path for (path, _), (_, df, _, _) in zip(batch, results) if len(df)],
+                                  frames))
+
+            # previous_rank / movement từ lịch sử BXH, wide table + sketch của các ngày trong lô,
+            # đánh dấu file đã load, commit 1 lần
+            with etl_metrics.stage('finalize', rows_in=len(merged)), contextlib.redirect_stdout(io.StringIO()):
+                if len(merged):
+                    history.refresh_facts(cur, merged['snapshot_date'].dropna())
+                    loaded_dates.update(merged['snapshot_date'].dropna().unique())
+                    history.save(cur)
+                    load_wide_table(merged, cur)
+                    load_sketches(merged, cur)
+                for (path, fingerprint), (rows, _, quarantine, _) in zip(batch, results):
+                    write_quarantine(cur, quarantine, path)
+                    record_loaded_file(cur, path, fingerprint, rows)
+                data_version = bump_data_version(cur)
+                conn.commit()
+            loaded += len(batch)
+            etl_metrics.write_prometheus()
+            print(f"✅ Lô {start // batch_files + 1}: {len(merged):,} dòng, đã commit (data_version = {data_version})")
+
+    etl_metrics.set_chunk(None)
+    # Xu hướng chỉ của các ngày vừa load (hoặc từ ngày đến muộn sớm nhất)
+    with etl_metrics.stage('build_trend_tables'):
+        build_trend_tables(cur, sorted(loaded_dates))
+        bump_data_version(cur)
+        conn.commit()
+    cur.close()
+    conn.close()
+    return loaded
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ingest nhiều file CSV (thư mục hoặc glob), bỏ qua file đã load")
+    parser.add_argument('--input', required=True, help="Thư mục chứa *.csv hoặc glob, ví dụ 'data/*.csv'")
+    parser.add_argument('--workers', type=int, help="Số process xử lý song song (mặc định: số CPU)")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="Số dòng mỗi chunk khi đọc 1 file")
+    parser.add_argument('--batch-files', type=int, help="Số file mỗi lô (mặc định 4 × workers)")
+    parser.add_argument('--rebuild', action='store_true', help="Tạo lại schema (xóa dữ liệu cũ) trước khi ingest")
+    parser.add_argument('--key-strategy', choices=['serial', 'hash'],
+                        help="Cách sinh surrogate key khi tạo schema mới (mặc định ETL_KEY_STRATEGY=serial)")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    started = time.perf_counter()
+    count = ingest(args.input, args.workers, args.chunk_size, args.batch_files, args.rebuild, args.key_strategy)
+    etl_metrics.print_summary()
+    etl_metrics.write_prometheus()
+    print(f"\n✅ Đã load {count} file trong {time.perf_counter() - started:.1f}s")
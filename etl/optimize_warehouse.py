@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+================================================================================
+TỐI ƯU VẬT LÝ SAU KHI LOAD (CLUSTER / EXTENDED STATISTICS / VACUUM ANALYZE)
+================================================================================
+Sau khi load, các bảng fact nằm theo thứ tự chunk đến và planner chỉ có thống kê từng cột:
+- CLUSTER: sắp xếp lại heap của các bảng fact theo key (mặc định ETL_CLUSTER_KEY=date_id,country_id,
+  đúng các cột dashboard lọc theo khoảng ngày/quốc gia) => các dòng cùng ngày/quốc gia nằm trong ít block.
+  Dùng index có các cột đầu trùng key nếu đã có, ngược lại tạo idx_<bảng>_<các cột> rồi DROP sau khi CLUSTER
+  (CLUSTER ... USING không cần giữ index, giữ lại thì mỗi lần ingest phải cập nhật thêm 1 index; --keep-index để giữ)
+- CREATE STATISTICS (ndistinct, dependencies, mcv) trên các nhóm cột tương quan (song_id, date_id),
+  (country_id, date_id), ... => ước lượng số dòng của GROUP BY / điều kiện nhiều cột sát thực tế hơn
+- VACUUM ANALYZE: cập nhật visibility map (index-only scan) và thống kê (gồm extended statistics)
+
+CLUSTER giữ ACCESS EXCLUSIVE lock trên từng bảng (mỗi bảng 1 transaction): dashboard đọc bảng đó
+sẽ chờ đến khi CLUSTER xong. Dữ liệu không đổi nên không tăng data_version.
+
+    python optimize_warehouse.py                          # chạy sau create_warehouse.py / ingest_files.py
+    python optimize_warehouse.py --measure --runs 5       # đo ALL_QUERIES trước/sau
+    python optimize_warehouse.py --cluster-key song_id,date_id --keep-index
+    python create_warehouse.py --optimize                 # chạy luôn ở cuối ETL
+================================================================================
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+import psycopg2
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+import etl_metrics
+import create_warehouse
+
+load_dotenv()
+
+# Key sắp xếp vật lý của các bảng fact
+CLUSTER_KEY = os.getenv("ETL_CLUSTER_KEY", "date_id,country_id")
+
+# Các bảng được CLUSTER (bảng thiếu cột của key bị bỏ qua)
+CLUSTER_TABLES = (
+    'fact_song_daily', 'fact_artist_stats', 'fact_chart_position', 'fact_streaming_metrics', 'wide_song_daily',
+)
+
+# Nhóm cột tương quan: các query join/group theo (song_id, date_id), lọc theo (country_id, date_id)
+EXTENDED_STATISTICS = {
+    'fact_song_daily': [('song_id', 'date_id'), ('country_id', 'date_id')],
+    'fact_artist_stats': [('song_id', 'date_id'), ('country_id', 'date_id'), ('artist_id', 'song_id')],
+    'fact_chart_position': [('song_id', 'date_id'), ('country_id', 'date_id')],
+    'fact_streaming_metrics': [('song_id', 'date_id'), ('country_id', 'date_id')],
+    'wide_song_daily': [('song_id', 'date_id'), ('country_id', 'date_id')],
+}
+
+def connect():
+    return psycopg2.connect(
+        host=create_warehouse.DB_HOST, port=create_warehouse.DB_PORT, dbname=create_warehouse.DB_NAME,
+        user=create_warehouse.DB_USER, password=create_warehouse.DB_PASS,
+        cursor_factory=etl_metrics.MetricsCursor
+    )
+
+def parse_key(key):
+    """'date_id, country_id' => ('date_id', 'country_id')"""
+    columns = tuple(column.strip() for column in (key or CLUSTER_KEY).split(',') if column.strip())
+    if not columns:
+        raise ValueError("Cluster key rỗng")
+    return columns
+
+# ========================================
+# CLUSTER
+# ========================================
+
+def table_columns(cur, table):
+    cur.execute("SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped",
+                (table,))
+    return {row[0] for row in cur.fetchall()}
+
+def key_columns_present(cur, table, key):
+    return set(key) <= table_columns(cur, table)
+
+def validate_key(cur, key, tables=CLUSTER_TABLES):
+    """Mọi cột của key phải là cột của ít nhất 1 bảng được CLUSTER (key đến từ CLI/biến môi trường)"""
+    known = set().union(*(table_columns(cur, table) for table in tables))
+    unknown = [column for column in key if column not in known]
+    if unknown:
+        raise ValueError(f"Cluster key có cột không tồn tại: {', '.join(unknown)}")
+
+def column_list(columns):
+    return sql.SQL(', ').join(map(sql.Identifier, columns))
+
+def cluster_index(cur, table, columns):
+    """
+    Index btree có các cột đầu đúng bằng columns (tạo mới nếu chưa có)
+    Trả về (tên index, có phải index vừa tạo)
+    """
+    cur.execute("""
+        SELECT i.relname, ARRAY(
+            SELECT a.attname FROM unnest(x.indkey) WITH ORDINALITY k(attnum, n)
+            JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum
+            ORDER BY k.n
+        )
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_am am ON am.oid = i.relam
+        WHERE x.indrelid = %s::regclass AND am.amname = 'btree' AND x.indpred IS NULL
+        ORDER BY array_length(x.indkey, 1)
+    """, (table,))
+    for name, index_columns in cur.fetchall():
+        if tuple(index_columns[:len(columns)]) == columns:
+            return name, False
+    name = f"idx_{table}_{'_'.join(columns)}"
+    cur.execute(sql.SQL("CREATE INDEX {} ON {} ({})").format(
+        sql.Identifier(name), sql.Identifier(table), column_list(columns)))
+    print(f"   + {name}")
+    return name, True
+
+def key_locality(cur, table, key):
+    """Số block heap trung bình chứa các dòng của 1 giá trị key (càng nhỏ thì đọc 1 ngày/quốc gia càng ít block)"""
+    cur.execute(sql.SQL("""
+        SELECT AVG(blocks)::float FROM (
+            SELECT COUNT(DISTINCT (ctid::text::point)[0]) AS blocks FROM {} GROUP BY {}
+        ) g
+    """).format(sql.Identifier(table), column_list(key)))
+    return cur.fetchone()[0]
+
+def cluster_tables(conn, cur, key, tables=CLUSTER_TABLES, keep_index=False):
+    """
+    CLUSTER từng bảng theo key, mỗi bảng 1 transaction; trả về {bảng: index}
+    Index vừa tạo cho CLUSTER bị DROP ngay sau đó (trừ khi keep_index): thứ tự vật lý vẫn giữ,
+    còn index chỉ thêm chi phí ghi cho mỗi lần ingest. Index đã có từ trước luôn được giữ
+    """
+    clustered = {}
+    for table in tables:
+        if not key_columns_present(cur, table, key):
+            print(f"   - {table}: không có cột {', '.join(key)}, bỏ qua")
+            continue
+        with etl_metrics.stage('optimize.cluster'):
+            index, created = cluster_index(cur, table, key)
+            cur.execute(sql.SQL("CLUSTER {} USING {}").format(sql.Identifier(table), sql.Identifier(index)))
+            if created and not keep_index:
+                cur.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(index)))
+            conn.commit()
+        clustered[table] = index
+        print(f"   ✓ CLUSTER {table} USING {index}" + (" (đã DROP index)" if created and not keep_index else ""))
+    return clustered
+
+# ========================================
+# STATISTICS & VACUUM
+# ========================================
+
+def create_extended_statistics(cur, definitions=EXTENDED_STATISTICS):
+    """CREATE STATISTICS IF NOT EXISTS cho các nhóm cột; trả về số statistics"""
+    count = 0
+    for table, groups in definitions.items():
+        for columns in groups:
+            name = f"stx_{table}_{'_'.join(columns)}"
+            cur.execute(sql.SQL("CREATE STATISTICS IF NOT EXISTS {} (ndistinct, dependencies, mcv) ON {} FROM {}").format(
+                sql.Identifier(name), column_list(columns), sql.Identifier(table)))
+            count += 1
+    print(f"   ✓ {count} extended statistics (ndistinct, dependencies, mcv)")
+    return count
+
+def vacuum_analyze(conn, tables):
+    """VACUUM (ANALYZE) từng bảng (VACUUM không chạy được trong transaction => autocommit)"""
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for table in tables:
+                with etl_metrics.stage('optimize.vacuum'):
+                    cur.execute(sql.SQL("VACUUM (ANALYZE) {}").format(sql.Identifier(table)))
+    finally:
+        conn.autocommit = autocommit
+    print(f"   ✓ VACUUM ANALYZE {len(tables)} bảng")
+
+# ========================================
+# ĐO QUERY CỦA DASHBOARD
+# ========================================
+
+def max_q_error(plan, limited=False):
+    """
+    Sai số ước lượng lớn nhất trong plan: q = max(ước lượng, thực tế) / min(...) của từng node
+    (số dòng mỗi lần lặp, tối thiểu 1). Bỏ qua node không chạy, node dưới LIMIT (dừng sớm là đúng)
+    và Materialize (số dòng thực tế gồm cả các lần đọc lại của merge join)
+    """
+    worst = 1.0
+    if plan.get('Actual Loops') and not limited and plan.get('Node Type') != 'Materialize':
+        estimate = max(plan.get('Plan Rows', 0), 1)
+        actual = max(plan.get('Actual Rows', 0), 1)
+        worst = max(estimate, actual) / min(estimate, actual)
+    limited = limited or plan.get('Node Type') == 'Limit'
+    for child in plan.get('Plans', []):
+        worst = max(worst, max_q_error(child, limited))
+    return worst
+
+def measure_queries(queries, runs=3):
+    """p50 warm (ms), số block đọc và q-error lớn nhất của từng query"""
+    from query_metrics import explain_analyze
+    conn = connect()
+    results = {}
+    try:
+        for name, query in queries.items():
+            with conn.cursor() as cur:
+                cur.execute(query)
+                cur.fetchall()
+                samples = []
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    cur.execute(query)
+                    cur.fetchall()
+                    samples.append((time.perf_counter() - start) * 1000)
+            explain = explain_analyze(conn, query)
+            plan = explain.get('explain_plan', {}).get('Plan', {})
+            results[name] = {
+                'p50_ms': float(np.percentile(samples, 50)),
+                'blocks': (explain.get('explain_shared_hit') or 0) + (explain.get('explain_shared_read') or 0),
+                'q_error': max_q_error(plan),
+            }
+    finally:
+        conn.close()
+    return results
+
+def print_query_report(before, after):
+    print("\n📊 QUERY DASHBOARD (trước → sau tối ưu):")
+    print("-" * 100)
+    print(f"  {'query':<28}{'p50 (ms)':>26}{'':>8}{'block':>20}{'q-error lớn nhất':>18}")
+    print("-" * 100)
+    for name in before:
+        b, a = before[name], after[name]
+        change = a['p50_ms'] / b['p50_ms'] - 1 if b['p50_ms'] else 0
+        print(f"  {name:<28}{b['p50_ms']:>12.1f} → {a['p50_ms']:>9.1f}{change:>+8.0%}"
+              f"{b['blocks']:>9,} → {a['blocks']:>8,}{b['q_error']:>9.1f} → {a['q_error']:>6.1f}")
+    print("-" * 100)
+    total_before = sum(item['p50_ms'] for item in before.values())
+    total_after = sum(item['p50_ms'] for item in after.values())
+    print(f"  {'TỔNG':<28}{total_before:>12.1f} → {total_after:>9.1f}{total_after / total_before - 1:>+8.0%}")
+
+# ========================================
+# STAGE TỐI ƯU
+# ========================================
+
+def optimize(conn, cluster_key=None, cluster=True, measure=False, runs=3, keep_index=False):
+    """
+    Chạy stage tối ưu vật lý trên kho dữ liệu đã load (conn ở trạng thái không có transaction dở)
+    measure: đo ALL_QUERIES của dashboard và số block / giá trị key (key_locality, scan cả bảng) trước và sau
+    (chạy mỗi query runs + 2 lần mỗi bên)
+    keep_index: giữ index idx_<bảng>_<các cột> tạo cho CLUSTER
+    Trả về (kết quả đo trước, sau) hoặc None
+    """
+    key = parse_key(cluster_key)
+    cur = conn.cursor(cursor_factory=etl_metrics.MetricsCursor)
+    validate_key(cur, key)
+    conn.rollback()
+    print(f"\n🧹 TỐI ƯU VẬT LÝ (cluster key: {', '.join(key)}):")
+    queries = None
+    if measure:
+        create_warehouse.add_dashboard_path()
+        from sql_queries import ALL_QUERIES
+        queries = ALL_QUERIES
+        with etl_metrics.stage('optimize.measure_before', rows_in=len(queries)):
+            before = measure_queries(queries, runs)
+
+    tables = [table for table in CLUSTER_TABLES if key_columns_present(cur, table, key)]
+    locality_before = {table: key_locality(cur, table, key) for table in tables} if cluster and measure else {}
+    with etl_metrics.stage('optimize.statistics'):
+        create_extended_statistics(cur)
+        conn.commit()
+    if cluster:
+        cluster_tables(conn, cur, key, tables, keep_index)
+    vacuum_analyze(conn, list(dict.fromkeys(tables + list(EXTENDED_STATISTICS))))
+
+    for table, before_blocks in locality_before.items():
+        print(f"   • {table:<24} block / ({', '.join(key)}): {before_blocks or 0:.1f} → "
+              f"{key_locality(cur, table, key) or 0:.1f}")
+    cur.close()
+
+    if measure:
+        with etl_metrics.stage('optimize.measure_after', rows_in=len(queries)):
+            after = measure_queries(queries, runs)
+        print_query_report(before, after)
+        return before, after
+    return None
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tối ưu vật lý kho dữ liệu sau khi load (CLUSTER, extended statistics, VACUUM ANALYZE)")
+    parser.add_argument('--cluster-key', help=f"Các cột sắp xếp vật lý, cách nhau bởi dấu phẩy (mặc định ETL_CLUSTER_KEY={CLUSTER_KEY})")
+    parser.add_argument('--no-cluster', action='store_true', help="Chỉ tạo statistics và VACUUM ANALYZE, không CLUSTER")
+    parser.add_argument('--keep-index', action='store_true',
+                        help="Giữ index idx_<bảng>_<các cột> tạo cho CLUSTER (mặc định DROP sau khi CLUSTER)")
+    parser.add_argument('--measure', action='store_true',
+                        help="Đo ALL_QUERIES của dashboard và số block / giá trị key trước và sau khi tối ưu")
+    parser.add_argument('--runs', type=int, default=3, help="Số lần chạy warm mỗi query khi đo")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    started = time.perf_counter()
+    conn = connect()
+    try:
+        optimize(conn, args.cluster_key, cluster=not args.no_cluster, measure=args.measure, runs=args.runs,
+                 keep_index=args.keep_index)
+    finally:
+        conn.close()
+    etl_metrics.print_summary()
+    etl_metrics.write_prometheus()
+    print(f"\n✅ Tối ưu xong trong {time.perf_counter() - started:.1f}s")
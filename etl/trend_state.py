@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Trạng thái rolling window của bảng xu hướng (trend_song_daily / trend_artist_daily), giữ qua các lần chạy ETL
+
+- Mỗi loại entity (bài hát, nghệ sĩ) có ring buffer giá trị từng ngày của HORIZON = max(TREND_WINDOWS)
+  ngày gần nhất (ô của ngày d là d % HORIZON), kèm tổng và số ngày có dữ liệu của từng cửa sổ tại end_day
+- advance(): đi tiếp từng ngày sau end_day (NumPy theo cả ngày, không lặp theo dòng):
+  trạng thái ngày t = trạng thái ngày t-1 + giá trị ngày t - giá trị ngày vừa rời khỏi cửa sổ
+- Lưu trong etl_trend_state (1 dòng BYTEA mỗi loại entity, chỉ các ô có dữ liệu) cùng transaction với
+  các dòng trend => lần chạy sau chỉ tổng hợp fact của các ngày mới thay vì cả lịch sử
+
+Ngày cũ hơn end_day (file đến muộn) không ghi tiếp được vào trạng thái: build_trend_tables dựng lại
+trạng thái từ HORIZON ngày trước ngày đó rồi tính lại từ ngày đó trở đi.
+"""
+
+import io
+import numpy as np
+import pandas as pd
+import psycopg2
+
+# Cửa sổ rolling (ngày lịch) của bảng xu hướng
+TREND_WINDOWS = (7, 30, 60)
+HORIZON = max(TREND_WINDOWS)
+
+TREND_STATE_DDL = """
+    CREATE TABLE IF NOT EXISTS etl_trend_state (
+        entity VARCHAR(10) PRIMARY KEY,
+        end_day DATE NOT NULL,
+        n_entities INTEGER NOT NULL,
+        state BYTEA NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    COMMENT ON TABLE etl_trend_state IS 'Metadata: Giá trị từng ngày trong cửa sổ rolling của bài hát/nghệ sĩ, dùng cho trend_song_daily / trend_artist_daily';
+"""
+
+def to_days(dates):
+    """Ngày => số ngày tính từ 1970-01-01 (int64)"""
+    return pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+def to_date(day):
+    """Số ngày tính từ 1970-01-01 => datetime.date"""
+    return np.datetime64(int(day), 'D').astype(object)
+
+class TrendWindow:
+    """Giá trị HORIZON ngày gần nhất của mỗi entity (song_id hoặc artist_id) và tổng của từng cửa sổ"""
+
+    def __init__(self, n_metrics):
+        self.n_metrics = n_metrics
+        self.end_day = None
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.buffer = np.zeros((HORIZON, 0, n_metrics))
+        self.present = np.zeros((HORIZON, 0), dtype=bool)
+        self._index = pd.Index(self.ids)
+        self._window_sums()
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ---------- trạng thái ----------
+
+    def _window_sums(self):
+        """Tổng và số ngày có dữ liệu của từng cửa sổ tại end_day, tính lại từ ring buffer"""
+        self.sums, self.counts = {}, {}
+        for w in TREND_WINDOWS:
+            slots = [] if self.end_day is None else [(self.end_day - i) % HORIZON for i in range(w)]
+            self.sums[w] = self.buffer[slots].sum(axis=0)
+            self.counts[w] = self.present[slots].sum(axis=0).astype(np.int64)
+
+    def _slots(self, ids):
+        """Vị trí của từng id trong trạng thái, thêm id mới vào cuối"""
+        slots = self._index.get_indexer(ids)
+        new = slots < 0
+        if new.any():
+            added = pd.unique(ids[new])
+            n = len(added)
+            self.ids = np.concatenate([self.ids, added])
+            self.buffer = np.concatenate([self.buffer, np.zeros((HORIZON, n, self.n_metrics))], axis=1)
+            self.present = np.concatenate([self.present, np.zeros((HORIZON, n), dtype=bool)], axis=1)
+            for w in TREND_WINDOWS:
+                self.sums[w] = np.concatenate([self.sums[w], np.zeros((n, self.n_metrics))])
+                self.counts[w] = np.concatenate([self.counts[w], np.zeros(n, dtype=np.int64)])
+            self._index = pd.Index(self.ids)
+            slots = self._index.get_indexer(ids)
+        return slots
+
+    def _clear(self):
+        self.buffer[:] = 0
+        self.present[:] = False
+        for w in TREND_WINDOWS:
+            self.sums[w][:] = 0
+            self.counts[w][:] = 0
+
+    # ---------- tính toán ----------
+
+    def advance(self, days, ids, metrics, end_day, lags=(1, 7)):
+        """
+        Tính các ngày sau self.end_day đến end_day (ngày không có dòng nào vẫn trượt cửa sổ)
+        - days: số ngày (to_days) của từng dòng, sort tăng dần, mọi ngày > self.end_day
+        - ids: song_id/artist_id của từng dòng (mỗi ngày mỗi id tối đa 1 dòng), metrics: (số dòng, n_metrics)
+        Trả về (rolling, counts, lagged) căn theo từng dòng:
+        rolling[w] = trung bình các ngày có dữ liệu trong w ngày gần nhất, counts[w] = số ngày đó,
+        lagged[k] = giá trị của k ngày trước (NaN nếu ngày đó không có trong BXH)
+        """
+        days = np.asarray(days, dtype=np.int64)
+        if self.end_day is not None and len(days) and days[0] <= self.end_day:
+            raise ValueError(f"Ngày {to_date(days[0])} không sau ngày cuối của trạng thái {to_date(self.end_day)}")
+        slots = self._slots(np.asarray(ids, dtype=np.int64))
+        rolling = {w: np.full(metrics.shape, np.nan) for w in TREND_WINDOWS}
+        counts = {w: np.zeros(len(days), dtype=np.int64) for w in TREND_WINDOWS}
+        lagged = {k: np.full(metrics.shape, np.nan) for k in lags}
+
+        first = int(days[0]) if len(days) else end_day
+        if self.end_day is None or first - self.end_day > HORIZON:
+            # Mọi ngày trong trạng thái đã rời khỏi cửa sổ trước ngày đầu tiên có dữ liệu
+            self._clear()
+            start = first
+        else:
+            start = self.end_day + 1
+        bounds = np.searchsorted(days, np.arange(start, end_day + 2))
+        for t in range(start, end_day + 1):
+            rows = slice(bounds[t - start], bounds[t - start + 1])
+            ids_t, values = slots[rows], metrics[rows]
+            slot = t % HORIZON
+
+            # Bỏ ngày t - w ra khỏi cửa sổ w (với w = HORIZON chính là ô sắp bị ghi đè)
+            for w in TREND_WINDOWS:
+                old = (t - w) % HORIZON
+                self.sums[w] -= self.buffer[old]
+                self.counts[w] -= self.present[old]
+            self.buffer[slot] = 0
+            self.present[slot] = False
+            self.buffer[slot, ids_t] = values
+            self.present[slot, ids_t] = True
+
+            for w in TREND_WINDOWS:
+                self.sums[w][ids_t] += values
+                self.counts[w][ids_t] += 1
+                rolling[w][rows] = self.sums[w][ids_t] / self.counts[w][ids_t, None]
+                counts[w][rows] = self.counts[w][ids_t]
+            for k in lags:
+                prev = (t - k) % HORIZON
+                lagged[k][rows] = np.where(self.present[prev, ids_t][:, None], self.buffer[prev, ids_t], np.nan)
+        self.end_day = end_day
+        return rolling, counts, lagged
+
+    # ---------- lưu / đọc ----------
+
+    def save(self, cur, entity):
+        """Ghi các ô có dữ liệu của trạng thái vào etl_trend_state (gọi trong transaction ghi bảng trend)"""
+        if self.end_day is None:
+            return
+        slot, position = np.nonzero(self.present)
+        days = self.end_day - (self.end_day - slot) % HORIZON
+        buffer = io.BytesIO()
+        np.savez(buffer, days=days.astype(np.int64), ids=self.ids[position],
+                 values=self.buffer[slot, position])
+        cur.execute("""
+            INSERT INTO etl_trend_state (entity, end_day, n_entities, state)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (entity) DO UPDATE SET
+                end_day = EXCLUDED.end_day, n_entities = EXCLUDED.n_entities,
+                state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP
+        """, (entity, to_date(self.end_day), len(np.unique(position)), psycopg2.Binary(buffer.getvalue())))
+
+    @classmethod
+    def load(cls, cur, entity, n_metrics):
+        """Đọc trạng thái đã lưu, None nếu chưa có (id không còn dữ liệu trong cửa sổ bị bỏ)"""
+        cur.execute("SELECT end_day, state FROM etl_trend_state WHERE entity = %s", (entity,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        window = cls(n_metrics)
+        with np.load(io.BytesIO(bytes(row[1]))) as arrays:
+            days, ids, values = arrays['days'], arrays['ids'], arrays['values']
+        window.end_day = int(to_days([row[0]])[0])
+        slots = window._slots(ids)
+        window.buffer[days % HORIZON, slots] = values
+        window.present[days % HORIZON, slots] = True
+        window._window_sums()
+        return window
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark độ trễ của các query trong ALL_QUERIES ở nhiều quy mô kho dữ liệu
+
+Với mỗi quy mô (--scales, số dòng CSV):
+- sinh dữ liệu giả lập (etl/generate_synthetic_data.py) và chạy ETL đầy đủ vào PostgreSQL
+  local (tạo lại schema!); hoặc --current để chỉ đo kho dữ liệu đang có
+- chạy từng query ở 2 chế độ:
+  cold: mỗi mẫu mở connection mới (chưa có catalog/plan cache), chạy --cold-command
+        trước đó nếu có (vd. restart PostgreSQL + drop OS page cache) để cả shared buffers lạnh
+  warm: chạy lặp lại trên cùng connection sau 1 lần làm nóng
+- ghi p50/p95 (ms), số dòng/dung lượng kết quả và shared buffers hit/read
+  (EXPLAIN (ANALYZE, BUFFERS) riêng cho mỗi chế độ)
+
+Đường cong scaling: hệ số mũ b của p50 warm ~ (số dòng fact_song_daily)^b (hồi quy log-log);
+query có b > --superlinear (mặc định 1.15) bị đánh dấu tăng nhanh hơn tuyến tính, tức nên
+chuyển sang bảng tính sẵn trước khi dữ liệu tăng thêm.
+
+    python benchmark_queries.py --scales 100000 300000 1000000 --output scaling.json --plot scaling.html
+    python benchmark_queries.py --current --runs 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+from sql_queries import ALL_QUERIES
+from query_metrics import dataframe_bytes, explain_analyze
+
+load_dotenv()
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ETL_DIR = os.path.join(ROOT_DIR, 'etl')
+
+# Query quá nhanh thì thời gian bị overhead chi phối, không đánh giá scaling
+MIN_SCALING_MS = 5.0
+
+def connect():
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST"), port=os.getenv("DB_PORT"), dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"), password=os.getenv("DB_PASS")
+    )
+
+# ========================================
+# CHUẨN BỊ KHO DỮ LIỆU
+# ========================================
+
+def load_warehouse(rows, work_dir, seed=42):
+    """Sinh CSV (dùng lại nếu đã có) và chạy ETL đầy đủ trong thư mục riêng của quy mô này"""
+    scale_dir = os.path.join(work_dir, f"scale_{rows}")
+    os.makedirs(scale_dir, exist_ok=True)
+    csv_file = os.path.join(scale_dir, 'universal_top_spotify_songs.csv')
+    if not os.path.exists(csv_file):
+        subprocess.run([sys.executable, os.path.join(ETL_DIR, 'generate_synthetic_data.py'),
+                        '--rows', str(rows), '--seed', str(seed), '--output', csv_file], check=True)
+
+    print(f"   ⏳ ETL {rows:,} dòng (log: {scale_dir}/etl.log)")
+    start = time.perf_counter()
+    with open(os.path.join(scale_dir, 'etl.log'), 'w', encoding='utf-8') as log:
+        subprocess.run([sys.executable, os.path.join(ETL_DIR, 'create_warehouse.py')],
+                       cwd=scale_dir, stdout=log, stderr=subprocess.STDOUT, check=True)
+    return time.perf_counter() - start
+
+def warehouse_size(conn):
+    """Số dòng fact_song_daily và dung lượng database (MB)"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM fact_song_daily")
+        fact_rows = cur.fetchone()[0]
+        cur.execute("SELECT pg_database_size(current_database())")
+        db_mb = cur.fetchone()[0] / 1024 / 1024
+    return fact_rows, db_mb
+
+# ========================================
+# ĐO QUERY
+# ========================================
+
+def timed_fetch(conn, query):
+    """Chạy query và fetch toàn bộ kết quả; trả về (ms, DataFrame)"""
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute(query)
+        rows = cur.fetchall()
+        columns = [desc[0] for desc in cur.description]
+    elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, pd.DataFrame(rows, columns=columns)
+
+def percentiles(samples):
+    return {
+        'p50_ms': round(float(np.percentile(samples, 50)), 2),
+        'p95_ms': round(float(np.percentile(samples, 95)), 2),
+        'samples': len(samples),
+    }
+
+def buffers(explain):
+    return {
+        'shared_hit': explain.get('explain_shared_hit'),
+        'shared_read': explain.get('explain_shared_read'),
+        'temp_written': explain.get('explain_temp_written'),
+    }
+
+def cold_connection(cold_command):
+    """Connection mới, sau khi chạy lệnh làm lạnh cache (nếu có)"""
+    if cold_command:
+        subprocess.run(cold_command, shell=True, check=True)
+    return connect()
+
+def benchmark_query(name, query, runs=5, cold_runs=3, cold_command=None):
+    """Đo 1 query: cold (connection mới mỗi mẫu) và warm (lặp trên 1 connection)"""
+    cold = []
+    for _ in range(cold_runs):
+        conn = cold_connection(cold_command)
+        try:
+            elapsed, _ = timed_fetch(conn, query)
+            cold.append(elapsed)
+        finally:
+            conn.close()
+    conn = cold_connection(cold_command)
+    try:
+        cold_buffers = buffers(explain_analyze(conn, query))
+    finally:
+        conn.close()
+
+    conn = connect()
+    try:
+        _, df = timed_fetch(conn, query)
+        warm = [timed_fetch(conn, query)[0] for _ in range(runs)]
+        warm_buffers = buffers(explain_analyze(conn, query))
+    finally:
+        conn.close()
+
+    return {
+        'cold': dict(percentiles(cold), **cold_buffers) if cold else cold_buffers,
+        'warm': dict(percentiles(warm), **warm_buffers),
+        'result_rows': len(df),
+        'result_bytes': dataframe_bytes(df),
+    }
+
+def benchmark_scale(queries, runs, cold_runs, cold_command):
+    conn = connect()
+    fact_rows, db_mb = warehouse_size(conn)
+    conn.close()
+    print(f"   📦 fact_song_daily = {fact_rows:,} dòng • database {db_mb:,.1f} MB")
+
+    results = {}
+    for name in queries:
+        try:
+            results[name] = benchmark_query(name, ALL_QUERIES[name], runs, cold_runs, cold_command)
+        except psycopg2.Error as e:
+            print(f"   ✗ {name}: {e}")
+            results[name] = {'error': str(e)}
+            continue
+        item = results[name]
+        print(f"   ✓ {name:<28} cold p50 {item['cold'].get('p50_ms', 0):>9.1f} ms • "
+              f"warm p50 {item['warm']['p50_ms']:>9.1f} p95 {item['warm']['p95_ms']:>9.1f} ms • "
+              f"{item['result_rows']:>6} dòng • read {item['cold'].get('shared_read') or 0:>7} / "
+              f"hit {item['warm'].get('shared_hit') or 0:>7} blocks")
+    return {'fact_rows': fact_rows, 'db_mb': round(db_mb, 1), 'queries': results}
+
+# ========================================
+# SCALING
+# ========================================
+
+def scaling_exponent(sizes, latencies):
+    """Hệ số mũ b của latency ~ size^b (hồi quy tuyến tính trên log-log)"""
+    sizes, latencies = np.asarray(sizes, dtype=float), np.asarray(latencies, dtype=float)
+    valid = (sizes > 0) & (latencies > 0)
+    if valid.sum() < 2 or np.unique(sizes[valid]).size < 2:
+        return None
+    slope, _ = np.polyfit(np.log(sizes[valid]), np.log(latencies[valid]), 1)
+    return float(slope)
+
+def scaling_report(scales, superlinear=1.15):
+    """Hệ số scaling của từng query (theo p50 warm) và cờ tăng nhanh hơn tuyến tính"""
+    report = {}
+    names = sorted({name for scale in scales for name in scale['queries']})
+    for name in names:
+        points = [(scale['fact_rows'], scale['queries'][name]['warm']['p50_ms'])
+                  for scale in scales if 'warm' in scale['queries'].get(name, {})]
+        if not points:
+            continue
+        exponent = scaling_exponent(*zip(*points))
+        largest_ms = max(points)[1]
+        report[name] = {
+            'points': [{'fact_rows': rows, 'p50_ms': ms} for rows, ms in points],
+            'exponent': round(exponent, 3) if exponent is not None else None,
+            'superlinear': bool(exponent is not None and exponent > superlinear and largest_ms >= MIN_SCALING_MS),
+        }
+    return report
+
+def print_scaling(report, scales):
+    sizes = [scale['fact_rows'] for scale in scales]
+    print("\n" + "=" * 100)
+    print("📈 SCALING (p50 warm, ms) theo số dòng fact_song_daily")
+    print("=" * 100)
+    print(f"  {'query':<28}" + ''.join(f"{size:>12,}" for size in sizes) + f"{'mũ b':>8}")
+    print("-" * 100)
+    for name, item in sorted(report.items(), key=lambda kv: -(kv[1]['exponent'] or 0)):
+        values = {point['fact_rows']: point['p50_ms'] for point in item['points']}
+        flag = '⚠️ ' if item['superlinear'] else '  '
+        exponent = f"{item['exponent']:.2f}" if item['exponent'] is not None else '-'
+        print(f"{flag}{name:<28}" + ''.join(f"{values.get(size, float('nan')):>12.1f}" for size in sizes)
+              + f"{exponent:>8}")
+    flagged = [name for name, item in report.items() if item['superlinear']]
+    if flagged:
+        print(f"\n⚠️  Tăng nhanh hơn tuyến tính: {', '.join(flagged)} => nên chuyển sang bảng tính sẵn")
+
+def plot_scaling(report, path):
+    """Vẽ đường cong scaling (log-log) ra file HTML"""
+    import plotly.express as px
+    rows = [dict(point, query=name) for name, item in report.items() for point in item['points']]
+    if not rows:
+        return
+    fig = px.line(pd.DataFrame(rows), x='fact_rows', y='p50_ms', color='query', markers=True,
+                  log_x=True, log_y=True, title='Độ trễ p50 (warm) theo quy mô kho dữ liệu',
+                  labels={'fact_rows': 'Số dòng fact_song_daily', 'p50_ms': 'p50 (ms)'})
+    fig.write_html(path)
+    print(f"📊 Đã vẽ đường cong scaling: {path}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark độ trễ ALL_QUERIES ở nhiều quy mô kho dữ liệu")
+    parser.add_argument('--scales', nargs='*', type=int, default=[100000, 300000, 1000000],
+                        help="Các quy mô (số dòng CSV giả lập) cần load và đo")
+    parser.add_argument('--current', action='store_true',
+                        help="Chỉ đo kho dữ liệu hiện tại, không sinh/load dữ liệu")
+    parser.add_argument('--work-dir', default=os.path.join(ROOT_DIR, '.benchmark'),
+                        help="Thư mục chứa CSV giả lập và log ETL của từng quy mô")
+    parser.add_argument('--seed', type=int, default=42, help="Seed của dữ liệu giả lập")
+    parser.add_argument('--queries', nargs='*', help="Chỉ đo các query này (mặc định: tất cả)")
+    parser.add_argument('--runs', type=int, default=5, help="Số lần chạy warm mỗi query")
+    parser.add_argument('--cold-runs', type=int, default=3, help="Số lần chạy cold mỗi query")
+    parser.add_argument('--cold-command',
+                        help="Lệnh shell chạy trước mỗi mẫu cold (vd. restart PostgreSQL và drop page cache)")
+    parser.add_argument('--superlinear', type=float, default=1.15,
+                        help="Ngưỡng hệ số mũ để đánh dấu tăng nhanh hơn tuyến tính")
+    parser.add_argument('--output', help="Ghi kết quả ra file JSON")
+    parser.add_argument('--plot', help="Vẽ đường cong scaling ra file HTML")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    queries = args.queries or list(ALL_QUERIES)
+    unknown = [name for name in queries if name not in ALL_QUERIES]
+    if unknown:
+        sys.exit(f"❌ Không có trong ALL_QUERIES: {', '.join(unknown)}")
+
+    scales = []
+    plan = [None] if args.current else sorted(args.scales)
+    for rows in plan:
+        print(f"\n{'─' * 100}")
+        load_seconds = None
+        if rows is None:
+            print("🔍 Kho dữ liệu hiện tại")
+        else:
+            print(f"🔍 Quy mô {rows:,} dòng CSV")
+            load_seconds = load_warehouse(rows, args.work_dir, args.seed)
+        scale = benchmark_scale(queries, args.runs, args.cold_runs, args.cold_command)
+        scale.update({'csv_rows': rows, 'load_seconds': round(load_seconds, 1) if load_seconds else None})
+        scales.append(scale)
+
+    report = scaling_report(scales, args.superlinear)
+    if len(scales) > 1:
+        print_scaling(report, scales)
+
+    if args.output:
+        result = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'runs': args.runs,
+                'cold_runs': args.cold_runs,
+                'cold_command': args.cold_command,
+                'superlinear_threshold': args.superlinear,
+            },
+            'scales': scales,
+            'scaling': report,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Đã ghi kết quả: {args.output}")
+    if args.plot and len(scales) > 1:
+        plot_scaling(report, args.plot)
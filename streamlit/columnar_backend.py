@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""
+Backend cột (columnar) cho dashboard: DuckDB chạy in-process trên bản export Parquet
+của 11 bảng trong kho dữ liệu (và các bảng phân tích wide_song_daily, trend_*)
+- export_parquet: COPY từng bảng từ PostgreSQL ra PARQUET_DIR (chạy sau mỗi lần ETL)
+- run_cached_query / run_registered_query: chạy ALL_QUERIES / QUERY_REGISTRY trên DuckDB
+- check_equivalence: so sánh kết quả DuckDB với PostgreSQL cho từng query
+
+Export:      python streamlit/columnar_backend.py --export
+Kiểm tra:    python streamlit/columnar_backend.py --check
+Dashboard:   QUERY_BACKEND=duckdb streamlit run dashboard.py
+"""
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from sql_queries import ALL_QUERIES, QUERY_REGISTRY
+import db_fetch
+import query_registry
+import result_cache
+
+load_dotenv()
+
+# Database configuration
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASS = os.getenv("DB_PASS")
+
+# Thư mục chứa bản export Parquet
+PARQUET_DIR = os.getenv(
+    "PARQUET_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".warehouse_parquet")
+)
+MANIFEST_FILE = 'manifest.json'
+EXPORT_BLOCK_SIZE = 64 * 1024 * 1024
+
+WAREHOUSE_TABLES = [
+    'dim_song', 'dim_artist', 'dim_album',
+    'dim_date', 'dim_country', 'dim_audio_features',
+    'fact_song_daily', 'fact_artist_stats', 'fact_chart_position',
+    'fact_audio_analysis', 'fact_streaming_metrics'
+]
+
+# Bảng phân tích (cũng được export vì một số query đọc trực tiếp)
+ANALYTICS_TABLES = ['wide_song_daily', 'trend_song_daily', 'trend_artist_daily']
+
+PLACEHOLDER_PATTERN = re.compile(r'%\((\w+)\)s')
+ORDER_BY_PATTERN = re.compile(r'\bORDER\s+BY\s+(.+?)(\bLIMIT\b|\bOFFSET\b|;|\Z)', re.IGNORECASE | re.DOTALL)
+SORT_MODIFIER_PATTERN = re.compile(r'\s+(ASC|DESC|NULLS\s+FIRST|NULLS\s+LAST)\b.*$', re.IGNORECASE | re.DOTALL)
+
+_duckdb_conn = None
+_duckdb_lock = threading.Lock()
+
+def connect():
+    """Tạo kết nối mới đến PostgreSQL"""
+    import psycopg2
+    return psycopg2.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASS
+    )
+
+# ========================================
+# EXPORT POSTGRESQL => PARQUET
+# ========================================
+
+def export_table(conn, table, path):
+    """COPY một bảng ra file CSV tạm rồi ghi thành Parquet theo từng batch, trả về số dòng"""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+    rows = 0
+    with conn.cursor() as cur:
+        columns = db_fetch.arrow_columns(cur, f"SELECT * FROM {table}")
+        with tempfile.TemporaryFile() as f:
+            cur.copy_expert(f"COPY {table} TO STDOUT WITH (FORMAT csv, ENCODING 'UTF8')", f)
+            empty = f.tell() == 0
+            f.seek(0)
+            if empty:
+                schema = pa.schema(columns)
+                pq.write_table(schema.empty_table(), path, compression='zstd')
+                return 0
+            # Batch lớn => mỗi row group trong Parquet đủ lớn để DuckDB scan hiệu quả
+            read_options, convert_options = db_fetch.csv_options(columns, block_size=EXPORT_BLOCK_SIZE)
+            reader = pa_csv.open_csv(f, read_options=read_options, convert_options=convert_options)
+            with pq.ParquetWriter(path, reader.schema, compression='zstd') as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+    return rows
+
+def begin_snapshot(conn):
+    """
+    Mở transaction REPEATABLE READ, READ ONLY: mọi câu lệnh sau đó (đến khi commit/rollback)
+    đọc cùng một snapshot, ETL commit giữa chừng không làm lẫn dữ liệu của 2 data_version
+    """
+    conn.rollback()
+    with conn.cursor() as cur:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+
+def export_parquet(conn=None, output_dir=None):
+    """
+    Export 11 bảng của kho dữ liệu + bảng phân tích ra output_dir (mặc định PARQUET_DIR)
+    Tất cả bảng và data_version được đọc trong cùng một snapshot (begin_snapshot).
+    Mỗi file được ghi ra file tạm rồi đổi tên; manifest.json (data_version,
+    số dòng từng bảng) được ghi cuối cùng
+    """
+    from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+    output_dir = output_dir or PARQUET_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    own_conn = conn is None
+    conn = conn or connect()
+    try:
+        # Snapshot được chụp ở câu SELECT đầu tiên, tức là lúc đọc data_version
+        begin_snapshot(conn)
+        data_version = result_cache.get_data_version(conn)
+        if conn.info.transaction_status == TRANSACTION_STATUS_IDLE:
+            # Chưa có etl_metadata: get_data_version đã rollback => mở lại snapshot
+            begin_snapshot(conn)
+        print(f"\n📦 EXPORT PARQUET: {len(WAREHOUSE_TABLES + ANALYTICS_TABLES)} bảng => {output_dir} (data_version = {data_version})")
+        print("-" * 80)
+        manifest = {'data_version': data_version, 'tables': {}}
+        total_start = time.perf_counter()
+        for table in WAREHOUSE_TABLES + ANALYTICS_TABLES:
+            start = time.perf_counter()
+            path = os.path.join(output_dir, f"{table}.parquet")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                rows = export_table(conn, table, tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            manifest['tables'][table] = rows
+            print(f"  {table:.<40} {rows:>12,} rows {size_mb:>9.2f} MB {time.perf_counter() - start:>8.2f}s")
+        manifest['exported_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+        tmp_manifest = os.path.join(output_dir, f"{MANIFEST_FILE}.tmp")
+        with open(tmp_manifest, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_manifest, os.path.join(output_dir, MANIFEST_FILE))
+        print("-" * 80)
+        print(f"✅ EXPORT PARQUET: Hoàn thành trong {time.perf_counter() - total_start:.2f}s")
+        return manifest
+    finally:
+        if own_conn:
+            conn.close()
+        else:
+            conn.rollback()
+
+# ========================================
+# DUCKDB BACKEND
+# ========================================
+
+def load_manifest(parquet_dir=None):
+    """Đọc manifest.json của bản export, None nếu chưa export"""
+    path = os.path.join(parquet_dir or PARQUET_DIR, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def get_data_version():
+    """data_version của bản export (tiền tố 'pq' để cache không trùng với kết quả của PostgreSQL)"""
+    manifest = load_manifest()
+    if manifest is None:
+        raise FileNotFoundError(
+            f"Chưa có bản export Parquet trong {PARQUET_DIR}. "
+            f"Chạy: python streamlit/columnar_backend.py --export"
+        )
+    return f"pq{manifest['data_version']}"
+
+def duckdb_connection():
+    """Kết nối DuckDB in-memory dùng chung, mỗi bảng là một VIEW trên file Parquet"""
+    global _duckdb_conn
+    with _duckdb_lock:
+        if _duckdb_conn is None:
+            import duckdb
+            conn = duckdb.connect()
+            for table in WAREHOUSE_TABLES + ANALYTICS_TABLES:
+                path = os.path.join(PARQUET_DIR, f"{table}.parquet").replace("'", "''")
+                conn.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{path}')")
+            _duckdb_conn = conn
+        return _duckdb_conn
+
+def to_duckdb_sql(query):
+    """Đổi placeholder %(name)s của psycopg2 thành $name của DuckDB"""
+    return PLACEHOLDER_PATTERN.sub(lambda m: f"${m.group(1)}", query).strip().rstrip(';')
+
+def fetch_dataframe(query, params=None):
+    """
+    Chạy query trên DuckDB, trả về (DataFrame, stats) giống db_fetch.fetch_dataframe
+    Kiểu dữ liệu được đưa về giống đường PostgreSQL: DECIMAL => float, DATE => datetime.date
+    """
+    import pyarrow as pa
+    # Mỗi thread dùng cursor riêng (kết nối DuckDB con) để chạy song song an toàn
+    cur = duckdb_connection().cursor()
+    try:
+        start = time.perf_counter()
+        result = cur.execute(to_duckdb_sql(query), params or {})
+        table = result.to_arrow_table() if hasattr(result, 'to_arrow_table') else result.fetch_arrow_table()
+        executed = time.perf_counter()
+    finally:
+        cur.close()
+
+    for i, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+    df = table.to_pandas(date_as_object=True)
+    return df, {
+        'fetch_method': 'duckdb',
+        'execute_ms': (executed - start) * 1000,
+        'fetch_ms': (time.perf_counter() - executed) * 1000,
+    }
+
+def run_cached_query(query, data_version, params=None, refresh=False, name=None):
+    """Chạy query trên DuckDB qua result cache"""
+    return result_cache.run_cached_query(None, query, data_version, params=params, refresh=refresh,
+                                         name=name, fetch=fetch_dataframe)
+
+def run_registered_query(name, data_version, values=None, refresh=False):
+    """
+    Chạy query có tham số trong QUERY_REGISTRY trên DuckDB qua result cache
+    (luôn COUNT(DISTINCT) chính xác: bảng sketch không được export, DuckDB đếm distinct trên cột đủ nhanh)
+    """
+    params = query_registry.bind_params(name, values)
+    sql = query_registry.registry_sql(name, params)
+    return result_cache.run_cached_query(None, QUERY_REGISTRY[name]['sql'], data_version, params=params,
+                                         refresh=refresh, name=query_registry.metric_name(name),
+                                         fetch=lambda query, params: fetch_dataframe(sql, params))
+
+# ========================================
+# KIỂM TRA TƯƠNG ĐƯƠNG VỚI POSTGRESQL
+# ========================================
+
+def _frames_equal(df_pg, df_duck, sort=False):
+    # Cột toàn NULL: psycopg2 trả về object (None), DuckDB trả về float (NaN)
+    for col in df_pg.columns:
+        if pd.api.types.is_numeric_dtype(df_pg[col]) != pd.api.types.is_numeric_dtype(df_duck[col]):
+            try:
+                df_pg = df_pg.assign(**{col: pd.to_numeric(df_pg[col])})
+                df_duck = df_duck.assign(**{col: pd.to_numeric(df_duck[col])})
+            except (ValueError, TypeError):
+                return False
+    if sort and len(df_pg.columns):
+        df_pg = df_pg.sort_values(list(df_pg.columns)).reset_index(drop=True)
+        df_duck = df_duck.sort_values(list(df_duck.columns)).reset_index(drop=True)
+    try:
+        pd.testing.assert_frame_equal(df_pg, df_duck, check_dtype=False, check_exact=False, rtol=1e-6)
+        return True
+    except (AssertionError, TypeError):
+        return False
+
+def _sort_string_lists(df):
+    """STRING_AGG không có ORDER BY cho thứ tự tùy engine: sắp xếp lại các danh sách 'a, b'"""
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object or pd.api.types.is_string_dtype(df[col]):
+            df[col] = df[col].map(lambda v: ', '.join(sorted(v.split(', '))) if isinstance(v, str) else v)
+    return df
+
+def order_by_limit(query, columns):
+    """
+    Các cột trong ORDER BY cuối cùng của query (tên cột kết quả) nếu query có LIMIT,
+    None nếu không có LIMIT hoặc có khóa sắp xếp không map được về cột kết quả (biểu thức)
+    """
+    matches = list(ORDER_BY_PATTERN.finditer(query))
+    if not matches or matches[-1].group(2).upper() != 'LIMIT':
+        return None
+    clause = matches[-1].group(1)
+    if clause.count('(') != clause.count(')'):
+        # ORDER BY bên trong OVER (...) chứ không phải của câu query
+        return None
+    keys = []
+    for item in clause.split(','):
+        expr = SORT_MODIFIER_PATTERN.sub('', item.strip())
+        if expr.isdigit() and 0 < int(expr) <= len(columns):
+            keys.append(columns[int(expr) - 1])
+        elif expr.split('.')[-1] in columns:
+            keys.append(expr.split('.')[-1])
+        else:
+            return None
+    return keys
+
+def _key_mask(df, keys, values):
+    """Dòng nào có giá trị ORDER BY bằng values"""
+    mask = np.ones(len(df), dtype=bool)
+    for key in keys:
+        column = df[key]
+        if pd.api.types.is_numeric_dtype(column) and values[key] is not None and not pd.isna(values[key]):
+            mask &= np.isclose(column.to_numpy(dtype=float), float(values[key]), rtol=1e-6, equal_nan=False)
+        elif values[key] is None or pd.isna(values[key]):
+            mask &= column.isna().to_numpy()
+        else:
+            mask &= (column == values[key]).to_numpy()
+    return mask
+
+def _ties_at_limit(df_pg, df_duck, keys):
+    """
+    Hai kết quả chỉ khác nhau ở các dòng đồng hạng tại ranh giới LIMIT: các dòng có giá trị
+    ORDER BY khác dòng cuối cùng phải giống hệt nhau, còn nhóm dòng cùng giá trị ORDER BY
+    với dòng cuối (ở cả 2 bên) thì được phép là các dòng khác nhau
+    """
+    if not keys or df_pg.empty:
+        return False
+    boundary = df_pg[keys].iloc[-1]
+    in_pg = _key_mask(df_pg, keys, boundary)
+    in_duck = _key_mask(df_duck, keys, boundary)
+    if not in_duck[-1] or in_pg.sum() != in_duck.sum():
+        return False
+    rest_pg = _sort_string_lists(df_pg[~in_pg].reset_index(drop=True))
+    rest_duck = _sort_string_lists(df_duck[~in_duck].reset_index(drop=True))
+    return _frames_equal(rest_pg, rest_duck, sort=True)
+
+def compare_results(df_pg, df_duck, query=None):
+    """
+    So sánh kết quả PostgreSQL và DuckDB:
+    - 'ok': giống hệt
+    - 'ok (thứ tự)': chỉ khác thứ tự các dòng bằng nhau ở ORDER BY / thứ tự trong STRING_AGG
+    - 'ok (đồng hạng)': chỉ khác các dòng có cùng giá trị ORDER BY với dòng cuối ở LIMIT
+      (engine chọn dòng khác nhau khi đồng hạng), cần query để biết cột ORDER BY
+    - ngược lại mô tả khác biệt
+    """
+    if list(df_pg.columns) != list(df_duck.columns):
+        return f"khác cột: {list(df_pg.columns)} != {list(df_duck.columns)}"
+    if len(df_pg) != len(df_duck):
+        return f"khác số dòng: {len(df_pg)} != {len(df_duck)}"
+    if _frames_equal(df_pg, df_duck):
+        return 'ok'
+    if _frames_equal(_sort_string_lists(df_pg), _sort_string_lists(df_duck), sort=True):
+        return 'ok (thứ tự)'
+    if query is not None and _ties_at_limit(df_pg, df_duck, order_by_limit(query, list(df_pg.columns))):
+        return 'ok (đồng hạng)'
+    return 'khác giá trị'
+
+def check_equivalence(conn=None, queries=None, registry=True):
+    """
+    Chạy từng query trên PostgreSQL và DuckDB, so sánh kết quả và thời gian
+    Trả về danh sách: name, status, pg_ms, duckdb_ms, rows
+    """
+    queries = ALL_QUERIES if queries is None else queries
+    own_conn = conn is None
+    conn = conn or connect()
+    tasks = [(name, query, None) for name, query in queries.items()]
+    if registry:
+        tasks += [(query_registry.metric_name(name), entry['sql'], query_registry.bind_params(name))
+                  for name, entry in QUERY_REGISTRY.items()]
+
+    manifest = load_manifest()
+    print(f"\n🔍 KIỂM TRA TƯƠNG ĐƯƠNG: PostgreSQL vs DuckDB ({len(tasks)} queries, "
+          f"Parquet data_version = {manifest['data_version'] if manifest else '-'})")
+    print("-" * 80)
+    results = []
+    try:
+        for name, query, params in tasks:
+            try:
+                df_pg, stats_pg = db_fetch.fetch_dataframe(conn, query, params)
+                df_duck, stats_duck = fetch_dataframe(query, params)
+                status = compare_results(df_pg, df_duck, query)
+                pg_ms = stats_pg['execute_ms'] + stats_pg['fetch_ms']
+                duck_ms = stats_duck['execute_ms'] + stats_duck['fetch_ms']
+            except Exception as e:
+                conn.rollback()
+                status, pg_ms, duck_ms, df_pg = f"lỗi: {e}", 0, 0, pd.DataFrame()
+            results.append({'name': name, 'status': status, 'pg_ms': pg_ms, 'duckdb_ms': duck_ms, 'rows': len(df_pg)})
+            icon = '✓' if status.startswith('ok') else '✗'
+            print(f"  {icon} {name:.<40} pg {pg_ms:>9.1f}ms  duckdb {duck_ms:>9.1f}ms {len(df_pg):>8,} rows  {status}")
+    finally:
+        if own_conn:
+            conn.close()
+
+    failed = [r for r in results if not r['status'].startswith('ok')]
+    print("-" * 80)
+    if failed:
+        print(f"❌ {len(failed)}/{len(results)} query cho kết quả khác PostgreSQL")
+    else:
+        print(f"✅ Tất cả {len(results)} query cho kết quả giống PostgreSQL")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export Parquet và backend DuckDB cho dashboard")
+    parser.add_argument('--export', action='store_true', help="Export 11 bảng từ PostgreSQL ra Parquet")
+    parser.add_argument('--check', action='store_true', help="So sánh kết quả DuckDB với PostgreSQL")
+    parser.add_argument('--output-dir', default=None, help=f"Thư mục Parquet (mặc định {PARQUET_DIR})")
+    args = parser.parse_args()
+    if args.output_dir:
+        PARQUET_DIR = args.output_dir
+    if not (args.export or args.check):
+        parser.error("Cần chọn --export và/hoặc --check")
+    if args.export:
+        export_parquet()
+    if args.check:
+        results = check_equivalence()
+        if any(not r['status'].startswith('ok') for r in results):
+            raise SystemExit(1)
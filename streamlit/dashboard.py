@@ -5,14 +5,17 @@ Dashboard trực quan phân tích xu hướng âm nhạc và độ phổ biến
 """
 
 import streamlit as st
-import psycopg2
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import os
+import time
 from dotenv import load_dotenv
-from sql_queries import ALL_QUERIES
+from sql_queries import ALL_QUERIES, QUERY_REGISTRY
+import result_cache
+import query_registry
+import query_metrics
+import columnar_backend
+import db_fetch
+import query_service
+import figure_cache
 
 # Load environment variables
 load_dotenv()
@@ -24,6 +27,13 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
+# Backend chạy query: 'postgres' (mặc định), 'duckdb' (bản export Parquet, xem columnar_backend.py)
+# hoặc 'service' (query service dùng chung cho nhiều replica, xem query_service.py)
+QUERY_BACKEND = os.getenv("QUERY_BACKEND", "postgres").lower()
+
+# Hiện tab Performance (hoặc mở dashboard với ?admin=1)
+DASHBOARD_ADMIN = os.getenv("DASHBOARD_ADMIN", "0") == "1"
+
 # Page config
 st.set_page_config(
     page_title="Spotify Music Analytics",
@@ -163,6 +173,7 @@ st.markdown("""
 @st.cache_resource
 def get_database_connection():
     """Tạo kết nối đến PostgreSQL database"""
+    import psycopg2
     try:
         conn = psycopg2.connect(
             host=DB_HOST,
@@ -176,15 +187,219 @@ def get_database_connection():
         st.error(f"❌ Không thể kết nối database: {e}")
         return None
 
-@st.cache_data(ttl=600)
-def execute_query(_conn, query):
-    """Thực thi query và trả về DataFrame"""
+@st.cache_data(ttl=10, show_spinner=False)
+def get_data_version(_conn):
+    """Lấy data_version của kho dữ liệu (ETL tăng giá trị này mỗi lần commit)"""
+    if QUERY_BACKEND == 'duckdb':
+        return columnar_backend.get_data_version()
+    if QUERY_BACKEND == 'service':
+        return query_service.get_data_version()
+    return result_cache.get_data_version(_conn)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_query_result(_conn, query, data_version):
+    """Cache trong bộ nhớ theo (query, data_version), phía sau là result cache trên đĩa"""
+    if QUERY_BACKEND == 'duckdb':
+        return columnar_backend.run_cached_query(query, data_version)
+    if QUERY_BACKEND == 'service':
+        return query_service.run_query(query)
+    return result_cache.run_cached_query(_conn, query, data_version)
+
+def run_instrumented(name, load, params=None):
+    """
+    Gọi hàm load và ghi metric hiệu năng. Miss/hit cache trên đĩa được ghi
+    ở tầng dưới; nếu không có metric nào được ghi thì đây là hit cache bộ nhớ.
+    """
+    query_metrics.begin()
+    start = time.perf_counter()
     try:
-        df = pd.read_sql_query(query, _conn)
-        return df
+        df = load()
     except Exception as e:
+        if not query_metrics.was_recorded():
+            query_metrics.record(name, query_metrics.CACHE_ERROR, params=params,
+                                 total_ms=(time.perf_counter() - start) * 1000, error=str(e))
         st.error(f"❌ Lỗi khi thực thi query: {e}")
         return None
+    if not query_metrics.was_recorded():
+        query_metrics.record(
+            name, query_metrics.CACHE_MEMORY, params=params,
+            total_ms=(time.perf_counter() - start) * 1000,
+            rows=len(df), bytes=query_metrics.dataframe_bytes(df)
+        )
+    return df
+
+def execute_query(_conn, query):
+    """Thực thi query và trả về DataFrame"""
+    return run_instrumented(
+        query_metrics.query_name(query),
+        lambda: load_query_result(_conn, query, get_data_version(_conn))
+    )
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def load_registered_result(_conn, name, data_version, values):
+    """Cache trong bộ nhớ theo (query, bộ tham số, data_version)"""
+    if QUERY_BACKEND == 'duckdb':
+        return columnar_backend.run_registered_query(name, data_version, values)
+    if QUERY_BACKEND == 'service':
+        return query_service.run_registered_query(name, values)
+    return query_registry.run_registered_query(_conn, name, data_version, values)
+
+def registered_values(name, filters):
+    """Các tham số trong bộ lọc mà query trong QUERY_REGISTRY khai báo"""
+    declared = {param for param, _, _ in QUERY_REGISTRY[name]['params']}
+    return {key: value for key, value in filters.items() if key in declared}
+
+def execute_registered_query(_conn, name, filters):
+    """Thực thi query có tham số trong QUERY_REGISTRY (chỉ truyền các tham số query khai báo)"""
+    values = registered_values(name, filters)
+    return run_instrumented(
+        query_registry.metric_name(name),
+        lambda: load_registered_result(_conn, name, get_data_version(_conn), values),
+        params=values
+    )
+
+def registered_csv_export(name, filters, **overrides):
+    """
+    Callable cho st.download_button: stream toàn bộ kết quả query trong registry ra file CSV tạm
+    theo batch (server-side cursor), không giữ cả kết quả (DataFrame hay chuỗi CSV) trong bộ nhớ.
+    Chạy trên thread riêng khi bấm nút nên dùng connection riêng, đóng ngay sau khi xong.
+    overrides: ghi đè tham số, ví dụ max_rows=None để bỏ LIMIT
+    """
+    values = registered_values(name, filters)
+    values.update(overrides)
+
+    def export():
+        import psycopg2
+        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS)
+        try:
+            return db_fetch.write_csv(query_registry.stream_registered_query(conn, name, values))
+        finally:
+            conn.close()
+    return export
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def load_grouped_sum(_conn, name, data_version, values, keys, column):
+    """
+    SUM(column) theo keys của query trong registry, gộp dần từng batch: backend postgres stream
+    qua server-side cursor (stream_registered_query) nên chỉ giữ 1 batch và các tổng đã gộp
+    """
+    import pandas as pd
+    if QUERY_BACKEND == 'postgres':
+        batches = query_registry.stream_registered_query(_conn, name, values)
+    else:
+        batches = [load_registered_result(_conn, name, data_version, values)]
+    parts = [batch.groupby(list(keys))[column].sum() for batch in batches]
+    return pd.concat(parts).groupby(level=list(range(len(keys)))).sum().reset_index()
+
+def execute_grouped_sum(_conn, name, filters, keys, column):
+    """load_grouped_sum có metric (mỗi lần stream ghi 1 metric miss, còn lại là hit cache bộ nhớ)"""
+    values = registered_values(name, filters)
+    return run_instrumented(
+        query_registry.metric_name(name),
+        lambda: load_grouped_sum(_conn, name, get_data_version(_conn), values, tuple(keys), column),
+        params=values
+    )
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def load_figure_spec(panel, data_version, params, _build):
+    """Cache trong bộ nhớ theo (panel, data_version, bộ tham số), phía sau là figure cache trên đĩa"""
+    return figure_cache.cached_spec(panel, data_version, _build, params)
+
+def render_chart(panel, data_version, build, params=None):
+    """
+    Vẽ panel từ spec Plotly JSON đã cache; build() (dựng figure từ DataFrame, import plotly.express)
+    chỉ chạy khi data_version hoặc bộ lọc của panel thay đổi.
+    params: bộ lọc mà dữ liệu của panel phụ thuộc (None với query trong ALL_QUERIES)
+    """
+    spec = load_figure_spec(panel, data_version, params, build)
+    st.plotly_chart(figure_cache.to_figure(spec), width='stretch')
+
+def render_performance_panel():
+    """Tab admin: thời gian, số dòng, dung lượng và tỉ lệ cache hit của từng query"""
+    import plotly.express as px
+    st.markdown("## ⚙️ Hiệu năng Query")
+    st.caption(f"Backend: `{QUERY_BACKEND}` • Nguồn: `{query_metrics.METRICS_LOG}` • "
+               f"Tỉ lệ lấy mẫu EXPLAIN ANALYZE: {query_metrics.EXPLAIN_SAMPLE_RATE:.0%}")
+    
+    df_metrics = query_metrics.load_metrics()
+    if df_metrics.empty:
+        st.info("📊 Chưa có metric nào được ghi lại.")
+        return
+    
+    summary = query_metrics.summarize(df_metrics)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        slow = summary.dropna(subset=['p95_miss_ms']).head(15)
+        fig = px.bar(slow,
+                   x='p95_miss_ms',
+                   y='query',
+                   orientation='h',
+                   title='Top 15 Query chậm nhất khi miss cache (p95)',
+                   labels={'p95_miss_ms': 'p95 (ms)', 'query': 'Query'},
+                   color='avg_fetch_ms',
+                   color_continuous_scale='Reds')
+        fig.update_layout(height=500, yaxis={'categoryorder': 'total ascending'})
+        st.plotly_chart(fig, width='stretch')
+    
+    with col2:
+        cache_counts = df_metrics['cache'].value_counts().reset_index()
+        cache_counts.columns = ['cache', 'count']
+        fig = px.pie(cache_counts,
+                   values='count',
+                   names='cache',
+                   title='Tỉ lệ Cache hit/miss',
+                   color_discrete_sequence=px.colors.qualitative.Set2)
+        st.plotly_chart(fig, width='stretch')
+    
+    st.markdown("### 📋 Tổng hợp theo Query")
+    st.dataframe(summary, hide_index=True)
+    
+    if 'explain_execution_ms' in df_metrics:
+        explains = df_metrics.dropna(subset=['explain_execution_ms'])
+        if not explains.empty:
+            st.markdown("### 🔬 EXPLAIN (ANALYZE, BUFFERS) đã lấy mẫu")
+            st.dataframe(
+                explains[['ts', 'query', 'explain_planning_ms', 'explain_execution_ms',
+                          'explain_shared_hit', 'explain_shared_read']].iloc[::-1],
+                hide_index=True
+            )
+            latest = explains.iloc[-1]
+            with st.expander(f"Plan gần nhất: {latest['query']}"):
+                st.json(latest['explain_plan'])
+    
+    st.markdown("### 🕒 Metric gần nhất")
+    st.dataframe(df_metrics.drop(columns=['explain_plan'], errors='ignore').tail(200).iloc[::-1], hide_index=True)
+
+def render_filters(conn):
+    """Bộ lọc ở sidebar: khoảng ngày và quốc gia được bind vào query phía server"""
+    import pandas as pd
+    filters = {}
+    
+    df_bounds = execute_query(conn, ALL_QUERIES['date_bounds'])
+    if df_bounds is not None and not df_bounds.empty and pd.notna(df_bounds['min_date'].iloc[0]):
+        min_date = pd.to_datetime(df_bounds['min_date'].iloc[0]).date()
+        max_date = pd.to_datetime(df_bounds['max_date'].iloc[0]).date()
+        date_range = st.date_input(
+            "📅 Khoảng thời gian",
+            value=(min_date, max_date),
+            min_value=min_date,
+            max_value=max_date
+        )
+        # Khi đang chọn dở (mới chọn 1 ngày) hoặc chọn toàn bộ khoảng thì không lọc,
+        # để bộ tham số mặc định trùng với kết quả đã warm sẵn trong result cache
+        if isinstance(date_range, (list, tuple)) and len(date_range) == 2 \
+                and tuple(date_range) != (min_date, max_date):
+            filters['start_date'], filters['end_date'] = date_range
+    
+    df_countries = execute_query(conn, ALL_QUERIES['country_list'])
+    if df_countries is not None and not df_countries.empty:
+        filters['countries'] = st.multiselect(
+            "🌍 Quốc gia (để trống = tất cả)",
+            df_countries['country_code'].tolist()
+        )
+    
+    return filters
 
 # Main dashboard
 def main():
@@ -192,15 +407,23 @@ def main():
     st.markdown("<h1>🎵 SPOTIFY MUSIC ANALYTICS DASHBOARD</h1>", unsafe_allow_html=True)
     st.markdown("<p style='text-align: center; font-size: 18px; color: #666;'>Phân tích xu hướng âm nhạc và độ phổ biến nghệ sĩ toàn cầu</p>", unsafe_allow_html=True)
     
-    # Get database connection
-    conn = get_database_connection()
-    if conn is None:
+    # Get database connection (backend DuckDB đọc Parquet, backend service dùng connection của service)
+    conn = get_database_connection() if QUERY_BACKEND == 'postgres' else None
+    if conn is None and QUERY_BACKEND == 'postgres':
         st.stop()
+    # Đọc data_version trước mọi query: nếu ETL commit giữa chừng thì figure dựng từ dữ liệu mới
+    # bị lưu dưới version cũ (không bao giờ được đọc lại), không phải ngược lại
+    data_version = get_data_version(conn)
     
     # Sidebar
     with st.sidebar:
         st.image("https://storage.googleapis.com/pr-newsroom-wp/1/2018/11/Spotify_Logo_RGB_Green.png", width=200)
         st.markdown("---")
+        st.markdown("### 🔎 Bộ lọc")
+        filters = render_filters(conn)
+        top_n = st.slider("🏆 Số lượng Top", min_value=10, max_value=50, value=20, step=5)
+        top_filters = {**filters, 'top_n': top_n}
+        st.markdown("---")
         st.markdown("### 📊 Navigation")
         st.markdown("""
         - 🌍 Tổng quan toàn cầu
@@ -216,7 +439,7 @@ def main():
     
     # Summary metrics
     st.markdown("## 📈 Tổng quan Thống kê")
-    df_summary = execute_query(conn, ALL_QUERIES['summary_stats'])
+    df_summary = execute_registered_query(conn, 'summary_stats', filters)
     
     if df_summary is not None and not df_summary.empty:
         # First row - main metrics
@@ -248,51 +471,94 @@ def main():
     st.markdown("---")
     
     # Tabs for different analysis sections
-    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
+    show_admin = DASHBOARD_ADMIN or st.query_params.get("admin") == "1"
+    tab_names = [
         "🌍 Xu hướng Toàn cầu",
         "🎤 Phân tích Nghệ sĩ",
         "🌏 Phân tích Khu vực",
         "📅 Phân tích Thời gian",
         "💿 Album & Thể loại",
         "🎶 Audio Features"
-    ])
+    ]
+    if show_admin:
+        tab_names.append("⚙️ Performance")
+    tabs = st.tabs(tab_names)
+    tab1, tab2, tab3, tab4, tab5, tab6 = tabs[:6]
     
     # TAB 1: Global Trends
     with tab1:
         st.markdown("## 🌍 Xu hướng Âm nhạc Toàn cầu")
         
         # Top songs global
-        st.markdown("### 🏆 Top 20 Bài hát Phổ biến nhất Toàn cầu")
-        df_top_songs = execute_query(conn, ALL_QUERIES['top_songs_global'])
+        st.markdown(f"### 🏆 Top {top_n} Bài hát Phổ biến nhất Toàn cầu")
+        df_top_songs = execute_registered_query(conn, 'top_songs_global', top_filters)
         
         if df_top_songs is not None and not df_top_songs.empty:
             col1, col2 = st.columns([2, 1])
             
             with col1:
                 # Bar chart
-                fig = px.bar(df_top_songs.head(15), 
-                           x='avg_popularity', 
-                           y='song_name',
-                           orientation='h',
-                           title='Top 15 Bài hát theo Độ phổ biến',
-                           labels={'avg_popularity': 'Độ phổ biến trung bình', 'song_name': 'Tên bài hát'},
-                           color='avg_popularity',
-                           color_continuous_scale='Viridis',
-                           text='avg_popularity')
-                fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-                fig.update_layout(height=600, yaxis={'categoryorder':'total ascending'})
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_top_songs.head(15), 
+                               x='avg_popularity', 
+                               y='song_name',
+                               orientation='h',
+                               title='Top 15 Bài hát theo Độ phổ biến',
+                               labels={'avg_popularity': 'Độ phổ biến trung bình', 'song_name': 'Tên bài hát'},
+                               color='avg_popularity',
+                               color_continuous_scale='Viridis',
+                               text='avg_popularity')
+                    fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
+                    fig.update_layout(height=600, yaxis={'categoryorder':'total ascending'})
+                    return fig
+                render_chart('top_songs', data_version, build, top_filters)
             
             with col2:
                 # Data table
                 st.dataframe(
-                    df_top_songs[['song_name', 'artist_name', 'num_countries', 'avg_popularity']].head(20),
+                    df_top_songs[['song_name', 'artist_name', 'num_countries', 'avg_popularity']].head(top_n),
                     height=600,
                     hide_index=True
                 )
         
         st.markdown("---")
         
+        # Trending songs (snapshot rolling window tại ngày cuối của khoảng thời gian)
+        st.markdown("### 📈 Bài hát đang Trending")
+        df_trending_songs = execute_registered_query(conn, 'trending_songs', top_filters)
+        
+        if df_trending_songs is not None and not df_trending_songs.empty:
+            snapshot_date = df_trending_songs['date'].iloc[0]
+            col1, col2 = st.columns([2, 1])
+            
+            with col1:
+                def build():
+                    import plotly.express as px
+                    movers = df_trending_songs.dropna(subset=['rank_delta_7d']).nsmallest(15, 'rank_delta_7d')
+                    fig = px.bar(movers,
+                               x='rank_delta_7d',
+                               y='song_name',
+                               orientation='h',
+                               title=f'Top 15 Bài hát tăng hạng mạnh nhất so với 7 ngày trước ({snapshot_date})',
+                               labels={'rank_delta_7d': 'Thay đổi hạng TB (âm = tăng hạng)', 'song_name': 'Tên bài hát'},
+                               color='window_avg_popularity',
+                               color_continuous_scale='Teal')
+                    fig.update_layout(height=500, yaxis={'categoryorder': 'total descending'})
+                    return fig
+                render_chart('trending_songs', data_version, build, top_filters)
+            
+            with col2:
+                st.dataframe(
+                    df_trending_songs[['song_name', 'artist_name', 'avg_rank', 'rank_change',
+                                       'rank_delta_7d', 'window_avg_rank']],
+                    height=500,
+                    hide_index=True
+                )
+            st.caption("Hạng TB trên các quốc gia trong BXH; rolling 30 ngày được ETL tính sẵn cho từng ngày đã load.")
+        
+        st.markdown("---")
+        
         # Music category trends (based on audio features)
         st.markdown("### 🎸 Xu hướng theo Phân loại Âm nhạc")
         df_genre = execute_query(conn, ALL_QUERIES['genre_trends'])
@@ -302,25 +568,31 @@ def main():
             
             with col1:
                 # Pie chart
-                fig = px.pie(df_genre.head(10), 
-                           values='num_songs', 
-                           names='music_category',
-                           title='Phân bố Phân loại Âm nhạc (Top 10)',
-                           color_discrete_sequence=px.colors.qualitative.Set3)
-                fig.update_traces(textposition='inside', textinfo='percent+label')
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.pie(df_genre.head(10), 
+                               values='num_songs', 
+                               names='music_category',
+                               title='Phân bố Phân loại Âm nhạc (Top 10)',
+                               color_discrete_sequence=px.colors.qualitative.Set3)
+                    fig.update_traces(textposition='inside', textinfo='percent+label')
+                    return fig
+                render_chart('genre_share', data_version, build)
             
             with col2:
                 # Bar chart
-                fig = px.bar(df_genre.head(10), 
-                           x='music_category', 
-                           y='avg_popularity',
-                           title='Độ phổ biến theo Phân loại',
-                           labels={'avg_popularity': 'Độ phổ biến TB', 'music_category': 'Phân loại'},
-                           color='avg_popularity',
-                           color_continuous_scale='Blues')
-                fig.update_layout(xaxis_tickangle=-45)
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_genre.head(10), 
+                               x='music_category', 
+                               y='avg_popularity',
+                               title='Độ phổ biến theo Phân loại',
+                               labels={'avg_popularity': 'Độ phổ biến TB', 'music_category': 'Phân loại'},
+                               color='avg_popularity',
+                               color_continuous_scale='Blues')
+                    fig.update_layout(xaxis_tickangle=-45)
+                    return fig
+                render_chart('genre_popularity', data_version, build)
         
         st.markdown("---")
         
@@ -333,57 +605,66 @@ def main():
             
             with col1:
                 # Mood distribution
-                mood_dist = df_audio_trending.groupby('mood')['song_count'].sum().reset_index()
-                fig = px.bar(mood_dist, 
-                           x='mood', 
-                           y='song_count',
-                           title='Phân bố Mood trong Bài hát Trending',
-                           labels={'song_count': 'Số lượng', 'mood': 'Mood'},
-                           color='mood',
-                           color_discrete_sequence=px.colors.qualitative.Pastel)
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    mood_dist = df_audio_trending.groupby('mood')['song_count'].sum().reset_index()
+                    fig = px.bar(mood_dist, 
+                               x='mood', 
+                               y='song_count',
+                               title='Phân bố Mood trong Bài hát Trending',
+                               labels={'song_count': 'Số lượng', 'mood': 'Mood'},
+                               color='mood',
+                               color_discrete_sequence=px.colors.qualitative.Pastel)
+                    return fig
+                render_chart('trending_moods', data_version, build)
             
             with col2:
                 # Energy vs Danceability
-                energy_dance = df_audio_trending.groupby(['energy_level', 'danceability_level'])['song_count'].sum().reset_index()
-                fig = px.density_heatmap(energy_dance, 
-                                       x='energy_level', 
-                                       y='danceability_level',
-                                       z='song_count',
-                                       title='Energy vs Danceability',
-                                       labels={'song_count': 'Số lượng'},
-                                       color_continuous_scale='YlOrRd')
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    energy_dance = df_audio_trending.groupby(['energy_level', 'danceability_level'])['song_count'].sum().reset_index()
+                    fig = px.density_heatmap(energy_dance, 
+                                           x='energy_level', 
+                                           y='danceability_level',
+                                           z='song_count',
+                                           title='Energy vs Danceability',
+                                           labels={'song_count': 'Số lượng'},
+                                           color_continuous_scale='YlOrRd')
+                    return fig
+                render_chart('trending_energy_danceability', data_version, build)
     
     # TAB 2: Artist Analysis
     with tab2:
         st.markdown("## 🎤 Phân tích Độ phổ biến Nghệ sĩ")
         
         # Top artists
-        st.markdown("### 🌟 Top 20 Nghệ sĩ Phổ biến nhất")
-        df_top_artists = execute_query(conn, ALL_QUERIES['top_artists'])
+        st.markdown(f"### 🌟 Top {top_n} Nghệ sĩ Phổ biến nhất")
+        df_top_artists = execute_registered_query(conn, 'top_artists', top_filters)
         
         if df_top_artists is not None and not df_top_artists.empty:
             col1, col2 = st.columns([2, 1])
             
             with col1:
                 # Bar chart
-                fig = px.bar(df_top_artists.head(15), 
-                           x='avg_artist_score', 
-                           y='artist_name',
-                           orientation='h',
-                           title='Top 15 Nghệ sĩ theo Điểm số',
-                           labels={'avg_artist_score': 'Điểm nghệ sĩ TB', 'artist_name': 'Tên nghệ sĩ'},
-                           color='countries_present',
-                           color_continuous_scale='Reds',
-                           text='avg_artist_score')
-                fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-                fig.update_layout(height=600, yaxis={'categoryorder':'total ascending'})
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_top_artists.head(15), 
+                               x='avg_artist_score', 
+                               y='artist_name',
+                               orientation='h',
+                               title='Top 15 Nghệ sĩ theo Điểm số',
+                               labels={'avg_artist_score': 'Điểm nghệ sĩ TB', 'artist_name': 'Tên nghệ sĩ'},
+                               color='countries_present',
+                               color_continuous_scale='Reds',
+                               text='avg_artist_score')
+                    fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
+                    fig.update_layout(height=600, yaxis={'categoryorder':'total ascending'})
+                    return fig
+                render_chart('top_artists', data_version, build, top_filters)
             
             with col2:
                 st.dataframe(
-                    df_top_artists[['artist_name', 'total_songs', 'countries_present', 'avg_artist_score']].head(20),
+                    df_top_artists[['artist_name', 'total_songs', 'countries_present', 'avg_artist_score']].head(top_n),
                     height=600,
                     hide_index=True
                 )
@@ -392,37 +673,43 @@ def main():
         
         # Global reach artists
         st.markdown("### 🌍 Nghệ sĩ có Độ phủ sóng Quốc tế cao nhất")
-        df_global_reach = execute_query(conn, ALL_QUERIES['artists_global_reach'])
+        df_global_reach = execute_registered_query(conn, 'artists_global_reach', top_filters)
         
         if df_global_reach is not None and not df_global_reach.empty:
             col1, col2 = st.columns(2)
             
             with col1:
                 # Scatter plot
-                fig = px.scatter(df_global_reach.head(20), 
-                               x='num_countries', 
-                               y='avg_popularity',
-                               size='num_songs',
-                               hover_name='artist_name',
-                               title='Độ phủ sóng vs Độ phổ biến',
-                               labels={'num_countries': 'Số quốc gia', 
-                                     'avg_popularity': 'Độ phổ biến TB',
-                                     'num_songs': 'Số bài hát'},
-                               color='num_countries',
-                               color_continuous_scale='Viridis')
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.scatter(df_global_reach.head(20), 
+                                   x='num_countries', 
+                                   y='avg_popularity',
+                                   size='num_songs',
+                                   hover_name='artist_name',
+                                   title='Độ phủ sóng vs Độ phổ biến',
+                                   labels={'num_countries': 'Số quốc gia', 
+                                         'avg_popularity': 'Độ phổ biến TB',
+                                         'num_songs': 'Số bài hát'},
+                                   color='num_countries',
+                                   color_continuous_scale='Viridis')
+                    return fig
+                render_chart('global_reach_scatter', data_version, build, top_filters)
             
             with col2:
                 # Bar chart
-                fig = px.bar(df_global_reach.head(15), 
-                           x='artist_name', 
-                           y='num_countries',
-                           title='Top 15 Nghệ sĩ theo Số quốc gia',
-                           labels={'num_countries': 'Số quốc gia', 'artist_name': 'Nghệ sĩ'},
-                           color='avg_popularity',
-                           color_continuous_scale='Blues')
-                fig.update_layout(xaxis_tickangle=-45)
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_global_reach.head(15), 
+                               x='artist_name', 
+                               y='num_countries',
+                               title='Top 15 Nghệ sĩ theo Số quốc gia',
+                               labels={'num_countries': 'Số quốc gia', 'artist_name': 'Nghệ sĩ'},
+                               color='avg_popularity',
+                               color_continuous_scale='Blues')
+                    fig.update_layout(xaxis_tickangle=-45)
+                    return fig
+                render_chart('global_reach_countries', data_version, build, top_filters)
         
         st.markdown("---")
         
@@ -435,44 +722,54 @@ def main():
             
             with col1:
                 # Artist tier distribution
-                tier_dist = df_followers.groupby('artist_tier').size().reset_index(name='count')
-                fig = px.pie(tier_dist, 
-                           values='count', 
-                           names='artist_tier',
-                           title='Phân bố Nghệ sĩ theo Tier',
-                           color_discrete_sequence=px.colors.qualitative.Set2)
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    tier_dist = df_followers.groupby('artist_tier').size().reset_index(name='count')
+                    fig = px.pie(tier_dist, 
+                               values='count', 
+                               names='artist_tier',
+                               title='Phân bố Nghệ sĩ theo Tier',
+                               color_discrete_sequence=px.colors.qualitative.Set2)
+                    return fig
+                render_chart('artist_tiers', data_version, build)
             
             with col2:
                 # Top artists by number of songs
-                fig = px.bar(df_followers.head(15), 
-                           x='artist_name', 
-                           y='num_songs',
-                           title='Top 15 Nghệ sĩ theo Số Bài hát',
-                           labels={'num_songs': 'Số bài hát', 'artist_name': 'Nghệ sĩ'},
-                           color='avg_song_popularity',
-                           color_continuous_scale='Oranges')
-                fig.update_layout(xaxis_tickangle=-45)
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_followers.head(15), 
+                               x='artist_name', 
+                               y='num_songs',
+                               title='Top 15 Nghệ sĩ theo Số Bài hát',
+                               labels={'num_songs': 'Số bài hát', 'artist_name': 'Nghệ sĩ'},
+                               color='avg_song_popularity',
+                               color_continuous_scale='Oranges')
+                    fig.update_layout(xaxis_tickangle=-45)
+                    return fig
+                render_chart('artist_songs', data_version, build)
         
         # Trending artists
         st.markdown("### 📈 Nghệ sĩ đang Trending (Tăng trưởng nhanh)")
-        df_trending_artists = execute_query(conn, ALL_QUERIES['trending_artists'])
+        df_trending_artists = execute_registered_query(conn, 'trending_artists', top_filters)
         
         if df_trending_artists is not None and not df_trending_artists.empty:
-            fig = px.bar(df_trending_artists.head(15), 
-                       x='artist_name', 
-                       y='popularity_growth',
-                       title='Top 15 Nghệ sĩ có Mức tăng trưởng cao nhất',
-                       labels={'popularity_growth': 'Mức tăng độ phổ biến', 'artist_name': 'Nghệ sĩ'},
-                       color='current_popularity',
-                       color_continuous_scale='Greens',
-                       text='popularity_growth')
-            fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-            fig.update_layout(xaxis_tickangle=-45)
-            st.plotly_chart(fig, width='stretch')
+            def build():
+                import plotly.express as px
+                fig = px.bar(df_trending_artists.head(15), 
+                           x='artist_name', 
+                           y='popularity_growth',
+                           title='Top 15 Nghệ sĩ có Mức tăng trưởng cao nhất',
+                           labels={'popularity_growth': 'Mức tăng độ phổ biến', 'artist_name': 'Nghệ sĩ'},
+                           color='current_popularity',
+                           color_continuous_scale='Greens',
+                           text='popularity_growth')
+                fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
+                fig.update_layout(xaxis_tickangle=-45)
+                return fig
+            render_chart('trending_artists', data_version, build, top_filters)
         else:
-            st.info("📊 Không có dữ liệu nghệ sĩ trending trong khoảng thời gian gần đây. Cần ít nhất 60 ngày dữ liệu với mức tăng trưởng > 5 điểm.")
+            st.info("📊 Không có nghệ sĩ nào có độ phổ biến TB 7 ngày cao hơn TB 60 ngày tại cuối khoảng thời gian đã chọn.")
+        st.caption("Độ phổ biến TB 7 ngày so với TB 60 ngày trên toàn bộ thị trường, tính tại ngày cuối của khoảng thời gian đã chọn.")
     
     # TAB 3: Regional Analysis
     with tab3:
@@ -480,61 +777,70 @@ def main():
         
         # Popularity by continent
         st.markdown("### 🌍 So sánh Độ phổ biến giữa các Quốc gia (Top 15)")
-        df_continent = execute_query(conn, ALL_QUERIES['popularity_by_continent'])
+        df_continent = execute_registered_query(conn, 'popularity_by_continent', filters)
         
         if df_continent is not None and not df_continent.empty:
             col1, col2 = st.columns(2)
             
             with col1:
                 # Bar chart
-                fig = px.bar(df_continent, 
-                           x='region', 
-                           y='avg_popularity',
-                           title='Độ phổ biến Trung bình theo Quốc gia',
-                           labels={'avg_popularity': 'Độ phổ biến TB', 'region': 'Quốc gia'},
-                           color='avg_popularity',
-                           color_continuous_scale='Teal',
-                           text='avg_popularity')
-                fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-                fig.update_layout(xaxis_tickangle=-45)
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_continent, 
+                               x='region', 
+                               y='avg_popularity',
+                               title='Độ phổ biến Trung bình theo Quốc gia',
+                               labels={'avg_popularity': 'Độ phổ biến TB', 'region': 'Quốc gia'},
+                               color='avg_popularity',
+                               color_continuous_scale='Teal',
+                               text='avg_popularity')
+                    fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
+                    fig.update_layout(xaxis_tickangle=-45)
+                    return fig
+                render_chart('continent_popularity', data_version, build, filters)
             
             with col2:
                 # Metrics per region
-                fig = go.Figure()
-                fig.add_trace(go.Bar(name='Bài hát', x=df_continent['region'], y=df_continent['unique_songs']))
-                fig.add_trace(go.Bar(name='Nghệ sĩ', x=df_continent['region'], y=df_continent['unique_artists']))
-                fig.update_layout(
-                    title='Số lượng Bài hát & Nghệ sĩ theo Quốc gia',
-                    xaxis_title='Quốc gia',
-                    yaxis_title='Số lượng',
-                    barmode='group',
-                    xaxis_tickangle=-45
-                )
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.graph_objects as go
+                    fig = go.Figure()
+                    fig.add_trace(go.Bar(name='Bài hát', x=df_continent['region'], y=df_continent['unique_songs']))
+                    fig.add_trace(go.Bar(name='Nghệ sĩ', x=df_continent['region'], y=df_continent['unique_artists']))
+                    fig.update_layout(
+                        title='Số lượng Bài hát & Nghệ sĩ theo Quốc gia',
+                        xaxis_title='Quốc gia',
+                        yaxis_title='Số lượng',
+                        barmode='group',
+                        xaxis_tickangle=-45
+                    )
+                    return fig
+                render_chart('continent_counts', data_version, build, filters)
         
         st.markdown("---")
         
         # Biggest music markets
         st.markdown("### 📊 Thị trường Âm nhạc Lớn nhất")
-        df_markets = execute_query(conn, ALL_QUERIES['biggest_music_markets'])
+        df_markets = execute_registered_query(conn, 'biggest_music_markets', filters)
         
         if df_markets is not None and not df_markets.empty:
             col1, col2 = st.columns([2, 1])
             
             with col1:
                 # Scatter plot
-                fig = px.scatter(df_markets.head(25), 
-                               x='unique_songs_in_chart', 
-                               y='avg_popularity',
-                               size='unique_artists',
-                               hover_name='country_name',
-                               title='Thị trường theo Số bài hát & Độ phổ biến',
-                               labels={'unique_songs_in_chart': 'Số bài hát trong chart', 
-                                     'avg_popularity': 'Độ phổ biến TB'},
-                               color='unique_songs_in_chart',
-                               color_continuous_scale='Blues')
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.scatter(df_markets.head(25), 
+                                   x='unique_songs_in_chart', 
+                                   y='avg_popularity',
+                                   size='unique_artists',
+                                   hover_name='country_name',
+                                   title='Thị trường theo Số bài hát & Độ phổ biến',
+                                   labels={'unique_songs_in_chart': 'Số bài hát trong chart', 
+                                         'avg_popularity': 'Độ phổ biến TB'},
+                                   color='unique_songs_in_chart',
+                                   color_continuous_scale='Blues')
+                    return fig
+                render_chart('biggest_markets', data_version, build, filters)
             
             with col2:
                 st.dataframe(
@@ -547,24 +853,38 @@ def main():
         
         # Regional music preferences
         st.markdown("### 🎵 Sở thích Âm nhạc theo Quốc gia (Top 10)")
-        df_regional_pref = execute_query(conn, ALL_QUERIES['regional_music_preferences'])
-        
-        if df_regional_pref is not None and not df_regional_pref.empty:
-            # Group by region and mood - show top 10 countries
-            mood_region = df_regional_pref.groupby(['region', 'mood'])['song_count'].sum().reset_index()
-            top_regions = mood_region.groupby('region')['song_count'].sum().nlargest(10).index
-            mood_region_top = mood_region[mood_region['region'].isin(top_regions)]
-            
-            fig = px.bar(mood_region_top, 
-                       x='region', 
-                       y='song_count',
-                       color='mood',
-                       title='Phân bố Mood theo Quốc gia (Top 10)',
-                       labels={'song_count': 'Số lượng bài hát', 'region': 'Quốc gia'},
-                       barmode='group',
-                       color_discrete_sequence=px.colors.qualitative.Pastel)
-            fig.update_layout(xaxis_tickangle=-45)
-            st.plotly_chart(fig, width='stretch')
+        # Chỉ cần tổng song_count theo (region, mood): gộp theo batch, không giữ cả kết quả
+        mood_region = execute_grouped_sum(conn, 'regional_music_preferences', filters,
+                                          ['region', 'mood'], 'song_count')
+        
+        if mood_region is not None and not mood_region.empty:
+            def build():
+                import plotly.express as px
+                # Show top 10 countries
+                top_regions = mood_region.groupby('region')['song_count'].sum().nlargest(10).index
+                mood_region_top = mood_region[mood_region['region'].isin(top_regions)]
+                
+                fig = px.bar(mood_region_top, 
+                           x='region', 
+                           y='song_count',
+                           color='mood',
+                           title='Phân bố Mood theo Quốc gia (Top 10)',
+                           labels={'song_count': 'Số lượng bài hát', 'region': 'Quốc gia'},
+                           barmode='group',
+                           color_discrete_sequence=px.colors.qualitative.Pastel)
+                fig.update_layout(xaxis_tickangle=-45)
+                return fig
+            render_chart('regional_moods', data_version, build, filters)
+            
+            # Export toàn bộ kết quả (không giới hạn max_rows), stream theo batch
+            if QUERY_BACKEND == 'postgres':
+                st.download_button(
+                    "⬇️ Tải toàn bộ dữ liệu (CSV)",
+                    data=registered_csv_export('regional_music_preferences', filters, max_rows=None),
+                    file_name='regional_music_preferences.csv',
+                    mime='text/csv',
+                    on_click='ignore'
+                )
     
     # TAB 4: Time Analysis
     with tab4:
@@ -578,103 +898,118 @@ def main():
             col1, col2 = st.columns(2)
             
             with col1:
-                fig = px.line(df_weekday, 
-                            x='day_name', 
-                            y='avg_popularity',
-                            title='Độ phổ biến TB theo Ngày trong Tuần',
-                            labels={'avg_popularity': 'Độ phổ biến TB', 'day_name': 'Ngày'},
-                            markers=True)
-                fig.update_traces(line_color='#1DB954', line_width=3, marker_size=10)
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.line(df_weekday, 
+                                x='day_name', 
+                                y='avg_popularity',
+                                title='Độ phổ biến TB theo Ngày trong Tuần',
+                                labels={'avg_popularity': 'Độ phổ biến TB', 'day_name': 'Ngày'},
+                                markers=True)
+                    fig.update_traces(line_color='#1DB954', line_width=3, marker_size=10)
+                    return fig
+                render_chart('weekday_popularity', data_version, build)
             
             with col2:
-                fig = px.bar(df_weekday, 
-                           x='day_name', 
-                           y='num_songs',
-                           title='Số lượng Bài hát theo Ngày',
-                           labels={'num_songs': 'Số bài hát', 'day_name': 'Ngày'},
-                           color='num_songs',
-                           color_continuous_scale='Blues')
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_weekday, 
+                               x='day_name', 
+                               y='num_songs',
+                               title='Số lượng Bài hát theo Ngày',
+                               labels={'num_songs': 'Số bài hát', 'day_name': 'Ngày'},
+                               color='num_songs',
+                               color_continuous_scale='Blues')
+                    return fig
+                render_chart('weekday_songs', data_version, build)
         
         st.markdown("---")
         
         # Popularity by month
         st.markdown("### 📊 Xu hướng theo Tháng")
-        df_month = execute_query(conn, ALL_QUERIES['popularity_by_month'])
+        df_month = execute_registered_query(conn, 'popularity_by_month', filters)
         
         if df_month is not None and not df_month.empty:
             col1, col2 = st.columns(2)
             
             with col1:
                 # Bar chart by month
-                fig = px.bar(df_month, 
-                           x='month_name', 
-                           y='avg_popularity',
-                           title='Độ phổ biến Trung bình theo Tháng',
-                           labels={'avg_popularity': 'Độ phổ biến TB', 'month_name': 'Tháng'},
-                           color='avg_popularity',
-                           color_continuous_scale='RdYlGn',
-                           text='avg_popularity')
-                fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-                fig.update_layout(xaxis_tickangle=-45, showlegend=False)
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_month, 
+                               x='month_name', 
+                               y='avg_popularity',
+                               title='Độ phổ biến Trung bình theo Tháng',
+                               labels={'avg_popularity': 'Độ phổ biến TB', 'month_name': 'Tháng'},
+                               color='avg_popularity',
+                               color_continuous_scale='RdYlGn',
+                               text='avg_popularity')
+                    fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
+                    fig.update_layout(xaxis_tickangle=-45, showlegend=False)
+                    return fig
+                render_chart('month_popularity', data_version, build, filters)
             
             with col2:
                 # Number of songs and artists by month
-                fig = go.Figure()
-                fig.add_trace(go.Scatter(
-                    x=df_month['month_name'], 
-                    y=df_month['num_songs'],
-                    mode='lines+markers',
-                    name='Số bài hát',
-                    line=dict(color='#1DB954', width=3),
-                    marker=dict(size=8)
-                ))
-                fig.add_trace(go.Scatter(
-                    x=df_month['month_name'], 
-                    y=df_month['num_artists'],
-                    mode='lines+markers',
-                    name='Số nghệ sĩ',
-                    line=dict(color='#FF6B6B', width=3),
-                    marker=dict(size=8)
-                ))
-                fig.update_layout(
-                    title='Số lượng Bài hát & Nghệ sĩ theo Tháng',
-                    xaxis_title='Tháng',
-                    yaxis_title='Số lượng',
-                    hovermode='x unified',
-                    xaxis_tickangle=-45,
-                    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-                )
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.graph_objects as go
+                    fig = go.Figure()
+                    fig.add_trace(go.Scatter(
+                        x=df_month['month_name'], 
+                        y=df_month['num_songs'],
+                        mode='lines+markers',
+                        name='Số bài hát',
+                        line=dict(color='#1DB954', width=3),
+                        marker=dict(size=8)
+                    ))
+                    fig.add_trace(go.Scatter(
+                        x=df_month['month_name'], 
+                        y=df_month['num_artists'],
+                        mode='lines+markers',
+                        name='Số nghệ sĩ',
+                        line=dict(color='#FF6B6B', width=3),
+                        marker=dict(size=8)
+                    ))
+                    fig.update_layout(
+                        title='Số lượng Bài hát & Nghệ sĩ theo Tháng',
+                        xaxis_title='Tháng',
+                        yaxis_title='Số lượng',
+                        hovermode='x unified',
+                        xaxis_tickangle=-45,
+                        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+                    )
+                    return fig
+                render_chart('month_counts', data_version, build, filters)
         
         st.markdown("---")
         
         # Longest #1 songs
         st.markdown("### 🏆 Bài hát giữ vị trí #1 Lâu nhất")
-        df_longest = execute_query(conn, ALL_QUERIES['longest_number_one'])
+        df_longest = execute_registered_query(conn, 'longest_number_one', top_filters)
         
         if df_longest is not None and not df_longest.empty:
             col1, col2 = st.columns([2, 1])
             
             with col1:
-                fig = px.bar(df_longest.head(15), 
-                           x='days_at_number_one', 
-                           y='song_name',
-                           orientation='h',
-                           title='Top 15 Bài hát giữ #1 Lâu nhất',
-                           labels={'days_at_number_one': 'Số ngày ở #1', 'song_name': 'Bài hát'},
-                           color='days_at_number_one',
-                           color_continuous_scale='Reds',
-                           text='days_at_number_one')
-                fig.update_traces(texttemplate='%{text} days', textposition='outside')
-                fig.update_layout(height=600, yaxis={'categoryorder':'total ascending'})
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_longest.head(15), 
+                               x='days_at_number_one', 
+                               y='song_name',
+                               orientation='h',
+                               title='Top 15 Bài hát giữ #1 Lâu nhất',
+                               labels={'days_at_number_one': 'Số ngày ở #1', 'song_name': 'Bài hát'},
+                               color='days_at_number_one',
+                               color_continuous_scale='Reds',
+                               text='days_at_number_one')
+                    fig.update_traces(texttemplate='%{text} days', textposition='outside')
+                    fig.update_layout(height=600, yaxis={'categoryorder':'total ascending'})
+                    return fig
+                render_chart('longest_number_one', data_version, build, top_filters)
             
             with col2:
                 st.dataframe(
-                    df_longest[['song_name', 'artist_name', 'country_name', 'days_at_number_one']].head(20),
+                    df_longest[['song_name', 'artist_name', 'country_name', 'days_at_number_one']].head(top_n),
                     height=600,
                     hide_index=True
                 )
@@ -691,18 +1026,21 @@ def main():
             col1, col2 = st.columns([2, 1])
             
             with col1:
-                fig = px.bar(df_top_albums.head(15), 
-                           x='avg_popularity', 
-                           y='album_name',
-                           orientation='h',
-                           title='Top 15 Album theo Độ phổ biến',
-                           labels={'avg_popularity': 'Độ phổ biến TB', 'album_name': 'Album'},
-                           color='release_year',
-                           color_continuous_scale='Viridis',
-                           text='avg_popularity')
-                fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-                fig.update_layout(height=600, yaxis={'categoryorder':'total ascending'})
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_top_albums.head(15), 
+                               x='avg_popularity', 
+                               y='album_name',
+                               orientation='h',
+                               title='Top 15 Album theo Độ phổ biến',
+                               labels={'avg_popularity': 'Độ phổ biến TB', 'album_name': 'Album'},
+                               color='release_year',
+                               color_continuous_scale='Viridis',
+                               text='avg_popularity')
+                    fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
+                    fig.update_layout(height=600, yaxis={'categoryorder':'total ascending'})
+                    return fig
+                render_chart('top_albums', data_version, build)
             
             with col2:
                 st.dataframe(
@@ -721,24 +1059,30 @@ def main():
             col1, col2 = st.columns(2)
             
             with col1:
-                fig = px.pie(df_album_type, 
-                           values='num_albums', 
-                           names='album_type',
-                           title='Phân bố theo Loại Album',
-                           color_discrete_sequence=px.colors.qualitative.Set3)
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.pie(df_album_type, 
+                               values='num_albums', 
+                               names='album_type',
+                               title='Phân bố theo Loại Album',
+                               color_discrete_sequence=px.colors.qualitative.Set3)
+                    return fig
+                render_chart('album_type_share', data_version, build)
             
             with col2:
-                fig = px.bar(df_album_type, 
-                           x='album_type', 
-                           y='avg_popularity',
-                           title='Độ phổ biến theo Loại Album',
-                           labels={'avg_popularity': 'Độ phổ biến TB', 'album_type': 'Loại album'},
-                           color='avg_popularity',
-                           color_continuous_scale='Blues',
-                           text='avg_popularity')
-                fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_album_type, 
+                               x='album_type', 
+                               y='avg_popularity',
+                               title='Độ phổ biến theo Loại Album',
+                               labels={'avg_popularity': 'Độ phổ biến TB', 'album_type': 'Loại album'},
+                               color='avg_popularity',
+                               color_continuous_scale='Blues',
+                               text='avg_popularity')
+                    fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
+                    return fig
+                render_chart('album_type_popularity', data_version, build)
         
         st.markdown("---")
         
@@ -747,26 +1091,30 @@ def main():
         df_release_trends = execute_query(conn, ALL_QUERIES['album_release_trends'])
         
         if df_release_trends is not None and not df_release_trends.empty:
-            fig = make_subplots(specs=[[{"secondary_y": True}]])
-            
-            fig.add_trace(
-                go.Bar(name='Số Album', x=df_release_trends['release_year'], y=df_release_trends['num_albums']),
-                secondary_y=False,
-            )
-            
-            fig.add_trace(
-                go.Scatter(name='Độ phổ biến TB', x=df_release_trends['release_year'], 
-                         y=df_release_trends['avg_popularity'], mode='lines+markers',
-                         line=dict(color='red', width=3)),
-                secondary_y=True,
-            )
-            
-            fig.update_xaxes(title_text="Năm")
-            fig.update_yaxes(title_text="Số Album", secondary_y=False)
-            fig.update_yaxes(title_text="Độ phổ biến TB", secondary_y=True)
-            fig.update_layout(title_text="Xu hướng Phát hành Album & Độ phổ biến")
-            
-            st.plotly_chart(fig, width='stretch')
+            def build():
+                import plotly.graph_objects as go
+                from plotly.subplots import make_subplots
+                fig = make_subplots(specs=[[{"secondary_y": True}]])
+                
+                fig.add_trace(
+                    go.Bar(name='Số Album', x=df_release_trends['release_year'], y=df_release_trends['num_albums']),
+                    secondary_y=False,
+                )
+                
+                fig.add_trace(
+                    go.Scatter(name='Độ phổ biến TB', x=df_release_trends['release_year'], 
+                             y=df_release_trends['avg_popularity'], mode='lines+markers',
+                             line=dict(color='red', width=3)),
+                    secondary_y=True,
+                )
+                
+                fig.update_xaxes(title_text="Năm")
+                fig.update_yaxes(title_text="Số Album", secondary_y=False)
+                fig.update_yaxes(title_text="Độ phổ biến TB", secondary_y=True)
+                fig.update_layout(title_text="Xu hướng Phát hành Album & Độ phổ biến")
+                
+                return fig
+            render_chart('album_release_trends', data_version, build)
     
     # TAB 6: Audio Features
     with tab6:
@@ -781,39 +1129,45 @@ def main():
             
             with col1:
                 # Energy vs popularity
-                energy_pop = df_audio_pop.groupby('energy_level').agg({
-                    'avg_popularity': 'mean',
-                    'song_count': 'sum'
-                }).reset_index()
-                
-                fig = px.bar(energy_pop, 
-                           x='energy_level', 
-                           y='avg_popularity',
-                           title='Độ phổ biến theo Mức Energy',
-                           labels={'avg_popularity': 'Độ phổ biến TB', 'energy_level': 'Mức Energy'},
-                           color='avg_popularity',
-                           color_continuous_scale='Reds',
-                           text='avg_popularity')
-                fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    energy_pop = df_audio_pop.groupby('energy_level').agg({
+                        'avg_popularity': 'mean',
+                        'song_count': 'sum'
+                    }).reset_index()
+                    
+                    fig = px.bar(energy_pop, 
+                               x='energy_level', 
+                               y='avg_popularity',
+                               title='Độ phổ biến theo Mức Energy',
+                               labels={'avg_popularity': 'Độ phổ biến TB', 'energy_level': 'Mức Energy'},
+                               color='avg_popularity',
+                               color_continuous_scale='Reds',
+                               text='avg_popularity')
+                    fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
+                    return fig
+                render_chart('energy_popularity', data_version, build)
             
             with col2:
                 # Danceability vs popularity
-                dance_pop = df_audio_pop.groupby('danceability_level').agg({
-                    'avg_popularity': 'mean',
-                    'song_count': 'sum'
-                }).reset_index()
-                
-                fig = px.bar(dance_pop, 
-                           x='danceability_level', 
-                           y='avg_popularity',
-                           title='Độ phổ biến theo Mức Danceability',
-                           labels={'avg_popularity': 'Độ phổ biến TB', 'danceability_level': 'Mức Danceability'},
-                           color='avg_popularity',
-                           color_continuous_scale='Blues',
-                           text='avg_popularity')
-                fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    dance_pop = df_audio_pop.groupby('danceability_level').agg({
+                        'avg_popularity': 'mean',
+                        'song_count': 'sum'
+                    }).reset_index()
+                    
+                    fig = px.bar(dance_pop, 
+                               x='danceability_level', 
+                               y='avg_popularity',
+                               title='Độ phổ biến theo Mức Danceability',
+                               labels={'avg_popularity': 'Độ phổ biến TB', 'danceability_level': 'Mức Danceability'},
+                               color='avg_popularity',
+                               color_continuous_scale='Blues',
+                               text='avg_popularity')
+                    fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
+                    return fig
+                render_chart('danceability_popularity', data_version, build)
         
         st.markdown("---")
         
@@ -825,24 +1179,30 @@ def main():
             col1, col2 = st.columns(2)
             
             with col1:
-                fig = px.pie(df_mood, 
-                           values='num_songs', 
-                           names='mood',
-                           title='Phân bố Mood trong Bài hát Phổ biến',
-                           color_discrete_sequence=px.colors.qualitative.Pastel)
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.pie(df_mood, 
+                               values='num_songs', 
+                               names='mood',
+                               title='Phân bố Mood trong Bài hát Phổ biến',
+                               color_discrete_sequence=px.colors.qualitative.Pastel)
+                    return fig
+                render_chart('mood_share', data_version, build)
             
             with col2:
-                fig = px.bar(df_mood, 
-                           x='mood', 
-                           y='avg_popularity',
-                           title='Độ phổ biến theo Mood',
-                           labels={'avg_popularity': 'Độ phổ biến TB', 'mood': 'Mood'},
-                           color='avg_popularity',
-                           color_continuous_scale='Greens',
-                           text='avg_popularity')
-                fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_mood, 
+                               x='mood', 
+                               y='avg_popularity',
+                               title='Độ phổ biến theo Mood',
+                               labels={'avg_popularity': 'Độ phổ biến TB', 'mood': 'Mood'},
+                               color='avg_popularity',
+                               color_continuous_scale='Greens',
+                               text='avg_popularity')
+                    fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
+                    return fig
+                render_chart('mood_popularity', data_version, build)
         
         st.markdown("---")
         
@@ -856,24 +1216,30 @@ def main():
             col1, col2 = st.columns(2)
             
             with col1:
-                fig = px.pie(df_explicit, 
-                           values='num_songs', 
-                           names='type',
-                           title='Tỷ lệ Explicit vs Non-Explicit',
-                           color_discrete_sequence=['#FF6B6B', '#4ECDC4'])
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.pie(df_explicit, 
+                               values='num_songs', 
+                               names='type',
+                               title='Tỷ lệ Explicit vs Non-Explicit',
+                               color_discrete_sequence=['#FF6B6B', '#4ECDC4'])
+                    return fig
+                render_chart('explicit_share', data_version, build)
             
             with col2:
-                fig = px.bar(df_explicit, 
-                           x='type', 
-                           y='avg_popularity',
-                           title='So sánh Độ phổ biến',
-                           labels={'avg_popularity': 'Độ phổ biến TB', 'type': 'Loại'},
-                           color='avg_popularity',
-                           color_continuous_scale='Oranges',
-                           text='avg_popularity')
-                fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-                st.plotly_chart(fig, width='stretch')
+                def build():
+                    import plotly.express as px
+                    fig = px.bar(df_explicit, 
+                               x='type', 
+                               y='avg_popularity',
+                               title='So sánh Độ phổ biến',
+                               labels={'avg_popularity': 'Độ phổ biến TB', 'type': 'Loại'},
+                               color='avg_popularity',
+                               color_continuous_scale='Oranges',
+                               text='avg_popularity')
+                    fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
+                    return fig
+                render_chart('explicit_popularity', data_version, build)
         
         st.markdown("---")
         
@@ -882,16 +1248,24 @@ def main():
         df_duration = execute_query(conn, ALL_QUERIES['duration_analysis'])
         
         if df_duration is not None and not df_duration.empty:
-            fig = px.bar(df_duration, 
-                       x='duration_category', 
-                       y='avg_popularity',
-                       title='Độ phổ biến theo Độ dài Bài hát',
-                       labels={'avg_popularity': 'Độ phổ biến TB', 'duration_category': 'Độ dài'},
-                       color='num_songs',
-                       color_continuous_scale='Purples',
-                       text='avg_popularity')
-            fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-            st.plotly_chart(fig, width='stretch')
+            def build():
+                import plotly.express as px
+                fig = px.bar(df_duration, 
+                           x='duration_category', 
+                           y='avg_popularity',
+                           title='Độ phổ biến theo Độ dài Bài hát',
+                           labels={'avg_popularity': 'Độ phổ biến TB', 'duration_category': 'Độ dài'},
+                           color='num_songs',
+                           color_continuous_scale='Purples',
+                           text='avg_popularity')
+                fig.update_traces(texttemplate='%{text:.1f}', textposition='outside')
+                return fig
+            render_chart('duration_popularity', data_version, build)
+    
+    # TAB 7: Performance (admin)
+    if show_admin:
+        with tabs[6]:
+            render_performance_panel()
     
     # Footer
     st.markdown("---")
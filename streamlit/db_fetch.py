@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Các cách lấy kết quả query từ PostgreSQL về DataFrame
+Mỗi hàm trả về (DataFrame, stats) với stats là thời gian từng bước (ms)
+
+- fetch_rows: fetch qua cursor, tạo tuple Python cho từng dòng (nhanh với kết quả nhỏ)
+- fetch_copy: COPY (query) TO STDOUT vào buffer rồi parse một lần bằng pyarrow
+  thành bảng có kiểu (nhanh hơn nhiều với kết quả lớn)
+- fetch_dataframe: tự chọn COPY khi số dòng ước lượng (EXPLAIN) >= FAST_FETCH_MIN_ROWS
+- fetch_batches: stream kết quả qua named (server-side) cursor, yield từng DataFrame
+  STREAM_ITERSIZE dòng => bộ nhớ phía client không phụ thuộc kích thước kết quả
+"""
+
+import io
+import json
+import os
+import tempfile
+import time
+import uuid
+import weakref
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Số dòng ước lượng tối thiểu để dùng COPY (0 = tắt chọn tự động)
+FAST_FETCH_MIN_ROWS = int(os.getenv("FAST_FETCH_MIN_ROWS", "10000"))
+
+# Số dòng mỗi lần FETCH (= mỗi batch) của server-side cursor
+STREAM_ITERSIZE = int(os.getenv("STREAM_ITERSIZE", "5000"))
+
+# OID kiểu PostgreSQL => kiểu Arrow (kiểu khác đọc thành string), dựng ở lần dùng đầu tiên
+# (pyarrow chỉ được import khi fetch bằng COPY)
+_pg_arrow_types = None
+
+def pg_arrow_types():
+    global _pg_arrow_types
+    if _pg_arrow_types is None:
+        import pyarrow as pa
+        _pg_arrow_types = {
+            16: pa.bool_(),          # boolean
+            20: pa.int64(),          # bigint
+            21: pa.int64(),          # smallint
+            23: pa.int64(),          # integer
+            700: pa.float64(),       # real
+            701: pa.float64(),       # double precision
+            1700: pa.float64(),      # numeric (giống coerce_float=True của đường cursor)
+            1082: pa.date32(),       # date
+            1114: pa.timestamp('us'),
+            1184: pa.timestamp('us', tz='UTC'),
+        }
+    return _pg_arrow_types
+
+def _strip(query):
+    return query.strip().rstrip(';')
+
+def estimate_rows(conn, query, params=None):
+    """Số dòng kết quả ước lượng theo planner (EXPLAIN, không thực thi query)"""
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN (FORMAT JSON) " + _strip(query), params)
+        result = cur.fetchone()[0]
+    plan = result[0] if isinstance(result, list) else json.loads(result)[0]
+    return int(plan['Plan']['Plan Rows'])
+
+def fetch_rows(conn, query, params=None):
+    """
+    Fetch thông thường qua cursor (tương đương pd.read_sql_query)
+    - execute_ms: thời gian server thực thi + truyền kết quả về client
+    - fetch_ms: thời gian tạo tuple Python và chuyển thành DataFrame
+    """
+    with conn.cursor() as cur:
+        start = time.perf_counter()
+        cur.execute(query, params)
+        executed = time.perf_counter()
+        rows = cur.fetchall()
+        columns = [col.name for col in cur.description]
+    df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+    done = time.perf_counter()
+    return df, {
+        'fetch_method': 'cursor',
+        'execute_ms': (executed - start) * 1000,
+        'fetch_ms': (done - executed) * 1000,
+    }
+
+def arrow_columns(cur, sql):
+    """Danh sách (tên cột, kiểu Arrow) của câu SELECT, lấy từ cursor.description của query bọc LIMIT 0"""
+    import pyarrow as pa
+    cur.execute(f"SELECT * FROM ({sql}) AS q LIMIT 0")
+    types = pg_arrow_types()
+    return [(col.name, types.get(col.type_code, pa.string())) for col in cur.description]
+
+def csv_options(columns, block_size=None):
+    """
+    ReadOptions/ConvertOptions của pyarrow để parse output COPY ... (FORMAT csv)
+    block_size: số bytes mỗi batch khi đọc dạng stream (mặc định của pyarrow ~1MB)
+    """
+    import pyarrow.csv as pa_csv
+    read_options = pa_csv.ReadOptions(column_names=[name for name, _ in columns])
+    if block_size:
+        read_options.block_size = block_size
+    convert_options = pa_csv.ConvertOptions(
+        column_types=dict(columns),
+        # NULL của COPY CSV là ô rỗng không có ngoặc kép, chuỗi rỗng là ""
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=False,
+        true_values=['t'],
+        false_values=['f'],
+    )
+    return read_options, convert_options
+
+def fetch_arrow(conn, query, params=None):
+    """
+    Chạy query bằng COPY (...) TO STDOUT (CSV) và parse thành pyarrow.Table
+    - execute_ms: thời gian server thực thi + stream kết quả vào buffer
+    - fetch_ms: thời gian parse buffer thành bảng Arrow
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    with conn.cursor() as cur:
+        sql = cur.mogrify(_strip(query), params).decode('utf-8')
+        columns = arrow_columns(cur, sql)
+
+        start = time.perf_counter()
+        buffer = io.BytesIO()
+        cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, ENCODING 'UTF8')", buffer)
+        executed = time.perf_counter()
+
+    if buffer.tell() == 0:
+        table = pa.table({name: pa.array([], type=arrow_type) for name, arrow_type in columns})
+    else:
+        buffer.seek(0)
+        read_options, convert_options = csv_options(columns)
+        table = pa_csv.read_csv(buffer, read_options=read_options, convert_options=convert_options)
+    done = time.perf_counter()
+    return table, {
+        'fetch_method': 'copy',
+        'execute_ms': (executed - start) * 1000,
+        'fetch_ms': (done - executed) * 1000,
+        'copy_bytes': buffer.getbuffer().nbytes,
+    }
+
+def fetch_copy(conn, query, params=None):
+    """COPY => Arrow => DataFrame (ngày giữ dạng datetime.date như đường cursor)"""
+    table, stats = fetch_arrow(conn, query, params)
+    start = time.perf_counter()
+    df = table.to_pandas(date_as_object=True)
+    stats['fetch_ms'] += (time.perf_counter() - start) * 1000
+    return df, stats
+
+def choose_method(conn, query, params=None):
+    """
+    Chọn cách fetch theo số dòng ước lượng: 'copy' nếu >= FAST_FETCH_MIN_ROWS, ngược lại 'cursor'
+    Trả về (method, stats)
+    """
+    if FAST_FETCH_MIN_ROWS <= 0:
+        return 'cursor', {}
+    start = time.perf_counter()
+    estimated = estimate_rows(conn, query, params)
+    stats = {'estimated_rows': estimated, 'estimate_ms': (time.perf_counter() - start) * 1000}
+    return ('copy' if estimated >= FAST_FETCH_MIN_ROWS else 'cursor'), stats
+
+def fetch_dataframe(conn, query, params=None, method=None):
+    """
+    Fetch kết quả query thành DataFrame
+    method: 'cursor', 'copy' hoặc None (tự chọn theo số dòng ước lượng)
+    """
+    stats = {}
+    if method is None:
+        method, stats = choose_method(conn, query, params)
+    fetch = fetch_copy if method == 'copy' else fetch_rows
+    df, fetch_stats = fetch(conn, query, params)
+    stats.update(fetch_stats)
+    return df, stats
+
+def fetch_batches(conn, query, params=None, itersize=None, stats=None):
+    """
+    Stream kết quả query qua named cursor (DECLARE ... CURSOR phía server): mỗi lần FETCH
+    itersize dòng và yield 1 DataFrame, client chỉ giữ 1 batch tại một thời điểm
+    - Kết quả rỗng: yield 1 DataFrame rỗng có đủ cột
+    - Connection autocommit: cursor khai báo WITH HOLD để sống ngoài transaction
+    stats (dict, tùy chọn) được cập nhật khi stream xong: số dòng, số batch, thời gian, batch lớn nhất
+    """
+    itersize = itersize or STREAM_ITERSIZE
+    stats = {} if stats is None else stats
+    stats.update({'fetch_method': 'stream', 'itersize': itersize, 'rows': 0, 'batches': 0, 'max_batch_bytes': 0})
+    start = time.perf_counter()
+    with conn.cursor(name=f"stream_{uuid.uuid4().hex[:12]}", withhold=conn.autocommit) as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(itersize)
+            if not rows and stats['batches']:
+                break
+            columns = [col.name for col in cur.description]
+            df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            stats['rows'] += len(df)
+            stats['batches'] += 1
+            stats['max_batch_bytes'] = max(stats['max_batch_bytes'], int(df.memory_usage(deep=True).sum()))
+            yield df
+            if len(rows) < itersize:
+                break
+    stats['fetch_ms'] = (time.perf_counter() - start) * 1000
+
+def write_csv(batches, file=None):
+    """
+    Ghi các DataFrame batch (fetch_batches) ra CSV, header 1 lần
+    file: đường dẫn hoặc file-like dạng text; None => ghi vào file tạm rồi trả về file đó mở ở chế độ
+    đọc nhị phân (đưa thẳng cho st.download_button, CSV không nằm trong bộ nhớ khi đang ghi).
+    File tạm bị xóa ngay (POSIX) hoặc khi file được đóng
+    """
+    if file is None:
+        handle, path = tempfile.mkstemp(prefix='export_', suffix='.csv')
+        os.close(handle)
+        try:
+            write_csv(batches, path)
+            reader = open(path, 'rb')
+        except BaseException:
+            _remove_file(path)
+            raise
+        try:
+            os.remove(path)
+        except OSError:
+            weakref.finalize(reader, _remove_file, path)
+        return reader
+    handle = open(file, 'w', encoding='utf-8', newline='') if isinstance(file, str) else file
+    try:
+        for index, df in enumerate(batches):
+            df.to_csv(handle, index=False, header=index == 0)
+    finally:
+        if handle is not file:
+            handle.close()
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
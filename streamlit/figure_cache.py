@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Cache figure Plotly của dashboard (spec JSON đã serialize) trên đĩa
+- Mỗi panel lưu 1 file JSON trong FIGURE_CACHE_DIR, key = hash(tên panel + bộ tham số lọc) + data_version
+- Dữ liệu không đổi => panel render thẳng từ JSON, không chạy lại plotly.express trên DataFrame
+  (plotly.express chỉ được import khi có panel phải build lại)
+- Cũng như result_cache.py: data_version chỉ tăng nên khi có version mới thì xóa file của version cũ,
+  giới hạn dung lượng FIGURE_CACHE_MAX_MB (LRU)
+"""
+
+import hashlib
+import json
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cấu hình cache
+CACHE_DIR = os.getenv(
+    "FIGURE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".figure_cache")
+)
+CACHE_MAX_MB = float(os.getenv("FIGURE_CACHE_MAX_MB", "64"))
+
+def figure_key(panel, params=None):
+    """Hash ổn định của panel và bộ tham số lọc"""
+    payload = json.dumps([panel, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+def _cache_path(key, data_version):
+    return os.path.join(CACHE_DIR, f"{key}_{data_version}.json")
+
+def load_spec(panel, data_version, params=None):
+    """Đọc spec JSON của panel, trả về None nếu chưa có"""
+    path = _cache_path(figure_key(panel, params), data_version)
+    try:
+        with open(path, encoding='utf-8') as f:
+            spec = f.read()
+    except OSError:
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return spec
+
+def store_spec(panel, data_version, spec, params=None):
+    """Ghi spec JSON của panel, xóa các phiên bản cũ của cùng panel"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    key = figure_key(panel, params)
+    path = _cache_path(key, data_version)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(spec)
+        os.replace(tmp_path, path)
+    except OSError:
+        _remove(tmp_path)
+        return False
+
+    for name in os.listdir(CACHE_DIR):
+        if name.startswith(f"{key}_") and name.endswith('.json') and name != os.path.basename(path):
+            _remove(os.path.join(CACHE_DIR, name))
+
+    evict_lru()
+    return True
+
+def evict_lru(max_mb=None):
+    """Xóa các file ít được dùng nhất cho đến khi tổng dung lượng <= max_mb"""
+    max_bytes = (CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= size
+        removed += 1
+    return removed
+
+def clear_cache():
+    """Xóa toàn bộ figure cache"""
+    if not os.path.isdir(CACHE_DIR):
+        return
+    for name in os.listdir(CACHE_DIR):
+        _remove(os.path.join(CACHE_DIR, name))
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def cached_spec(panel, data_version, build, params=None):
+    """
+    Spec JSON của panel: hit => đọc file, miss => build() tạo figure rồi serialize và ghi cache
+    build: hàm không tham số trả về plotly Figure (chỉ được gọi khi miss)
+    """
+    spec = load_spec(panel, data_version, params)
+    if spec is None:
+        spec = build().to_json()
+        store_spec(panel, data_version, spec, params)
+    return spec
+
+def to_figure(spec):
+    """
+    Dựng lại Figure từ spec JSON để đưa vào st.plotly_chart.
+    Spec do chính Plotly serialize nên bỏ qua bước validate từng thuộc tính
+    (phần tốn thời gian nhất khi dựng Figure từ dict/JSON)
+    """
+    import plotly.graph_objects as go
+    return go.Figure(json.loads(spec), _validate=False)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Đo hiệu năng từng query của dashboard
+- Mỗi lần chạy query ghi 1 dòng JSON vào QUERY_METRICS_LOG: thời gian execute,
+  thời gian fetch/deserialize, số dòng, dung lượng, cache hit/miss
+- Lấy mẫu EXPLAIN (ANALYZE, BUFFERS) với tỉ lệ QUERY_EXPLAIN_SAMPLE_RATE (chỉ khi miss)
+- Dữ liệu được hiển thị ở tab "Performance" của dashboard (chế độ admin)
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+import pandas as pd
+from dotenv import load_dotenv
+from sql_queries import ALL_QUERIES
+
+load_dotenv()
+
+# Cấu hình
+METRICS_LOG = os.getenv(
+    "QUERY_METRICS_LOG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".query_metrics.jsonl")
+)
+EXPLAIN_SAMPLE_RATE = float(os.getenv("QUERY_EXPLAIN_SAMPLE_RATE", "0"))
+
+# Các giá trị của trường 'cache'
+CACHE_MEMORY = 'memory'   # Hit st.cache_data trong bộ nhớ
+CACHE_DISK = 'disk'       # Hit result cache Parquet trên đĩa
+CACHE_MISS = 'miss'       # Chạy trên database
+CACHE_SERVICE = 'service' # Lấy qua query service dùng chung (query_service.py)
+CACHE_ERROR = 'error'     # Query lỗi
+
+# Tra tên query từ câu SQL
+_QUERY_NAMES = {query: name for name, query in ALL_QUERIES.items()}
+
+# Các metric gần nhất của process hiện tại
+RECENT = deque(maxlen=1000)
+
+_lock = threading.Lock()
+_local = threading.local()
+
+def query_name(query):
+    """Tên query trong ALL_QUERIES, hoặc adhoc_<hash> nếu không có"""
+    name = _QUERY_NAMES.get(query)
+    if name is None:
+        name = 'adhoc_' + hashlib.md5(query.encode('utf-8')).hexdigest()[:8]
+    return name
+
+def dataframe_bytes(df):
+    """Dung lượng DataFrame trong bộ nhớ (bytes)"""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def begin():
+    """Đánh dấu bắt đầu một lần gọi query trên thread hiện tại"""
+    _local.recorded = False
+
+def was_recorded():
+    """True nếu từ lần begin() gần nhất đã có metric được ghi (tức là không hit cache bộ nhớ)"""
+    return getattr(_local, 'recorded', False)
+
+def last_cache():
+    """Giá trị 'cache' của metric gần nhất được ghi trên thread hiện tại (None nếu chưa có)"""
+    return getattr(_local, 'cache', None) if was_recorded() else None
+
+def record(name, cache, **fields):
+    """Ghi 1 metric vào bộ nhớ và file JSON-lines"""
+    entry = {
+        'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'query': name,
+        'cache': cache,
+    }
+    entry.update({key: round(value, 3) if isinstance(value, float) else value
+                  for key, value in fields.items() if value is not None})
+    _local.recorded = True
+    _local.cache = cache
+    RECENT.append(entry)
+    try:
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with _lock:
+            with open(METRICS_LOG, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+    except OSError:
+        # Không ghi được log thì vẫn không được làm hỏng dashboard
+        pass
+    return entry
+
+def should_explain():
+    """Quyết định có lấy mẫu EXPLAIN ANALYZE cho lần chạy này không"""
+    return EXPLAIN_SAMPLE_RATE > 0 and random.random() < EXPLAIN_SAMPLE_RATE
+
+def explain_analyze(conn, query, params=None):
+    """
+    Chạy EXPLAIN (ANALYZE, BUFFERS) và trả về tóm tắt + plan đầy đủ
+    Lưu ý: ANALYZE thực thi query thêm một lần nữa
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+            result = cur.fetchone()[0]
+    except Exception as e:
+        conn.rollback()
+        return {'explain_error': str(e)}
+
+    explain = result[0] if isinstance(result, list) else json.loads(result)[0]
+    plan = explain.get('Plan', {})
+    return {
+        'explain_planning_ms': explain.get('Planning Time'),
+        'explain_execution_ms': explain.get('Execution Time'),
+        'explain_shared_hit': plan.get('Shared Hit Blocks'),
+        'explain_shared_read': plan.get('Shared Read Blocks'),
+        'explain_temp_written': plan.get('Temp Written Blocks'),
+        'explain_plan': explain,
+    }
+
+def load_metrics(limit=5000):
+    """Đọc tối đa limit metric gần nhất từ file log thành DataFrame"""
+    if not os.path.exists(METRICS_LOG):
+        return pd.DataFrame(list(RECENT))
+    with open(METRICS_LOG, 'r', encoding='utf-8') as f:
+        lines = deque(f, maxlen=limit)
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return pd.DataFrame(entries)
+
+def summarize(df_metrics):
+    """Tổng hợp metric theo query: số lần chạy, tỉ lệ hit, p50/p95 thời gian"""
+    if df_metrics.empty:
+        return df_metrics
+    df = df_metrics.copy()
+    for col in ['total_ms', 'execute_ms', 'fetch_ms', 'rows', 'bytes']:
+        if col not in df:
+            df[col] = None
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    grouped = df.groupby('query')
+    summary = pd.DataFrame({
+        'runs': grouped.size(),
+        'memory_hits': grouped['cache'].apply(lambda s: (s == CACHE_MEMORY).sum()),
+        'disk_hits': grouped['cache'].apply(lambda s: (s == CACHE_DISK).sum()),
+        'misses': grouped['cache'].apply(lambda s: (s == CACHE_MISS).sum()),
+        'service_calls': grouped['cache'].apply(lambda s: (s == CACHE_SERVICE).sum()),
+        'errors': grouped['cache'].apply(lambda s: (s == CACHE_ERROR).sum()),
+        'p50_total_ms': grouped['total_ms'].median(),
+        'p95_total_ms': grouped['total_ms'].quantile(0.95),
+    })
+    misses = df[df['cache'] == CACHE_MISS].groupby('query')
+    summary['avg_execute_ms'] = misses['execute_ms'].mean()
+    summary['avg_fetch_ms'] = misses['fetch_ms'].mean()
+    summary['p95_miss_ms'] = misses['total_ms'].quantile(0.95)
+    if 'fetch_method' in df:
+        summary['copy_fetches'] = misses['fetch_method'].apply(lambda s: (s == 'copy').sum())
+    summary['rows'] = grouped['rows'].max()
+    summary['bytes'] = grouped['bytes'].max()
+    return summary.reset_index().sort_values('p95_miss_ms', ascending=False, na_position='last')
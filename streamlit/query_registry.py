@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Thực thi các query có tham số trong QUERY_REGISTRY (sql_queries.py)
+- Tham số được kiểm tra/chuẩn hóa theo kiểu đã khai báo
+- Mỗi query chạy dưới dạng prepared statement (PREPARE một lần mỗi connection,
+  sau đó chỉ EXECUTE với giá trị tham số)
+- Kết quả được cache theo từng bộ tham số trong result cache
+- Query có phiên bản 'sketch' đếm distinct bằng HyperLogLog (distinct_sketch.py),
+  trừ khi DISTINCT_COUNT_MODE=exact
+- stream_registered_query: stream kết quả lớn theo batch qua server-side cursor
+  (không qua result cache, dùng cho export / drill-down)
+"""
+
+import hashlib
+import re
+import time
+from datetime import date, datetime
+import pandas as pd
+from sql_queries import QUERY_REGISTRY
+import db_fetch
+import distinct_sketch
+import query_metrics
+import result_cache
+
+PLACEHOLDER_PATTERN = re.compile(r'%\((\w+)\)s')
+
+# Các statement đã PREPARE theo từng session PostgreSQL (backend pid)
+_prepared = {}
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return pd.to_datetime(value).date()
+
+def _to_text_list(value):
+    if isinstance(value, str):
+        value = [value]
+    values = sorted({str(v) for v in value if v is not None and str(v) != ''})
+    # Danh sách rỗng = không lọc
+    return values or None
+
+# Kiểu PostgreSQL => hàm chuẩn hóa giá trị Python
+PARAM_TYPES = {
+    'date': _to_date,
+    'text[]': _to_text_list,
+    'integer': int,
+    'numeric': float,
+}
+
+def bind_params(name, values=None):
+    """Kiểm tra và chuẩn hóa tham số theo khai báo của query, điền giá trị mặc định"""
+    if name not in QUERY_REGISTRY:
+        raise KeyError(f"Query '{name}' không có trong QUERY_REGISTRY")
+    spec = QUERY_REGISTRY[name]['params']
+    values = dict(values or {})
+
+    unknown = set(values) - {param for param, _, _ in spec}
+    if unknown:
+        raise ValueError(f"Query '{name}' không có tham số: {', '.join(sorted(unknown))}")
+
+    bound = {}
+    for param, pg_type, default in spec:
+        value = values.get(param, default)
+        try:
+            bound[param] = None if value is None else PARAM_TYPES[pg_type](value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Tham số '{param}' của query '{name}' phải có kiểu {pg_type}: {e}")
+    return bound
+
+def registry_sql(name, params):
+    """
+    Chọn SQL để thực thi: 'wide_sql' (bảng phi chuẩn hóa wide_song_daily) khi query có
+    phiên bản này và đang lọc theo khoảng ngày, ngược lại 'sql'
+    """
+    entry = QUERY_REGISTRY[name]
+    if entry.get('wide_sql') and (params.get('start_date') or params.get('end_date')):
+        return entry['wide_sql']
+    return entry['sql']
+
+def sketch_spec(name, distinct_mode=None):
+    """Phiên bản sketch của query (None nếu query không có hoặc đang ở chế độ exact)"""
+    if (distinct_mode or distinct_sketch.DISTINCT_COUNT_MODE) != 'sketch':
+        return None
+    return QUERY_REGISTRY[name].get('sketch')
+
+def cache_sql(name, distinct_mode=None):
+    """SQL dùng làm cache key: kết quả sketch và exact được cache riêng"""
+    spec = sketch_spec(name, distinct_mode)
+    return spec['sql'] if spec else QUERY_REGISTRY[name]['sql']
+
+def prepared_statement(name, sql=None):
+    """Trả về (tên statement, câu lệnh PREPARE) cho query trong registry"""
+    entry = QUERY_REGISTRY[name]
+    order = [param for param, _, _ in entry['params']]
+    sql = PLACEHOLDER_PATTERN.sub(lambda m: f"${order.index(m.group(1)) + 1}", sql or entry['sql'])
+    sql = sql.strip().rstrip(';')
+    types = ', '.join(pg_type for _, pg_type, _ in entry['params'])
+    # Hash của SQL trong tên statement: sửa query thì tự PREPARE lại
+    digest = hashlib.md5(sql.encode('utf-8')).hexdigest()[:8]
+    statement = f"reg_{name}_{digest}"
+    return statement, f"PREPARE {statement} ({types}) AS {sql}"
+
+def metric_name(name):
+    """Tên query trong log hiệu năng (phân biệt với query cùng tên trong ALL_QUERIES)"""
+    return f"{name} [registry]"
+
+def execute_prepared(conn, name, params, with_stats=False, distinct_mode=None):
+    """
+    Thực thi query trong registry bằng prepared statement, trả về DataFrame
+    distinct_mode: 'sketch'/'exact' (mặc định theo DISTINCT_COUNT_MODE)
+    """
+    import psycopg2
+    spec = sketch_spec(name, distinct_mode)
+    sql = spec['sql'] if spec else registry_sql(name, params)
+    statement, prepare_sql = prepared_statement(name, sql)
+    order = [param for param, _, _ in QUERY_REGISTRY[name]['params']]
+    execute_sql = f"EXECUTE {statement} ({', '.join(['%s'] * len(order))})" if order else f"EXECUTE {statement}"
+    values = [params[param] for param in order]
+
+    pid = conn.get_backend_pid()
+    prepared = _prepared.setdefault(pid, set())
+    for attempt in range(2):
+        try:
+            if statement not in prepared:
+                with conn.cursor() as cur:
+                    cur.execute(prepare_sql)
+                prepared.add(statement)
+            # Kết quả lớn: COPY không chạy được EXECUTE nên dùng SQL gốc với tham số đã bind
+            # (query sketch trả về mảng bytea theo nhóm, luôn nhỏ => fetch qua cursor)
+            method, stats = ('cursor', {}) if spec else db_fetch.choose_method(conn, execute_sql, values)
+            if method == 'copy':
+                df, fetch_stats = db_fetch.fetch_copy(conn, sql, params)
+            else:
+                df, fetch_stats = db_fetch.fetch_rows(conn, execute_sql, values)
+            stats.update(fetch_stats)
+            if spec:
+                merge_start = time.perf_counter()
+                df = distinct_sketch.finalize(df, spec, params)
+                stats['distinct_mode'] = 'sketch'
+                stats['sketch_merge_ms'] = (time.perf_counter() - merge_start) * 1000
+            if query_metrics.should_explain():
+                stats.update(query_metrics.explain_analyze(conn, execute_sql, values))
+            return (df, stats) if with_stats else df
+        except psycopg2.errors.InvalidSqlStatementName:
+            # Session mới trùng pid với session cũ => statement chưa tồn tại, PREPARE lại
+            conn.rollback()
+            prepared.discard(statement)
+            if attempt:
+                raise
+        except Exception:
+            conn.rollback()
+            raise
+
+def run_registered_query(conn, name, data_version, values=None, refresh=False):
+    """Chạy query có tham số qua result cache (cache riêng cho từng bộ tham số)"""
+    params = bind_params(name, values)
+    sql = cache_sql(name)
+    start = time.perf_counter()
+    if not refresh:
+        df = result_cache.load_result(sql, data_version, params)
+        if df is not None:
+            query_metrics.record(
+                metric_name(name), query_metrics.CACHE_DISK, params=params,
+                total_ms=(time.perf_counter() - start) * 1000,
+                rows=len(df), bytes=query_metrics.dataframe_bytes(df)
+            )
+            return df
+
+    try:
+        df, stats = execute_prepared(conn, name, params, with_stats=True)
+    except Exception as e:
+        query_metrics.record(metric_name(name), query_metrics.CACHE_ERROR, params=params,
+                             total_ms=(time.perf_counter() - start) * 1000, error=str(e))
+        raise
+
+    write_start = time.perf_counter()
+    result_cache.store_result(sql, data_version, df, params)
+    query_metrics.record(
+        metric_name(name), query_metrics.CACHE_MISS, params=params,
+        total_ms=(time.perf_counter() - start) * 1000,
+        cache_write_ms=(time.perf_counter() - write_start) * 1000,
+        rows=len(df), bytes=query_metrics.dataframe_bytes(df),
+        **stats
+    )
+    return df
+
+def stream_registered_query(conn, name, values=None, itersize=None):
+    """
+    Stream kết quả query trong registry thành các DataFrame batch (db_fetch.fetch_batches)
+    Luôn chạy SQL exact (sketch cần cả kết quả để gộp) và không ghi result cache;
+    metric được ghi khi stream xong (hoặc lỗi)
+    """
+    params = bind_params(name, values)
+    sql = registry_sql(name, params)
+    stats = {}
+    start = time.perf_counter()
+    try:
+        yield from db_fetch.fetch_batches(conn, sql, params, itersize, stats)
+    except Exception as e:
+        conn.rollback()
+        query_metrics.record(metric_name(name), query_metrics.CACHE_ERROR, params=params,
+                             total_ms=(time.perf_counter() - start) * 1000, error=str(e))
+        raise
+    query_metrics.record(
+        metric_name(name), query_metrics.CACHE_MISS, params=params,
+        total_ms=(time.perf_counter() - start) * 1000, **stats
+    )
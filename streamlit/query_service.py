@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""
+Query service dùng chung cho nhiều replica dashboard
+Mỗi process Streamlit có st.cache_data và connection riêng => N replica sau load balancer chạy lại
+mọi query N lần. Service này (1 process, HTTP của thư viện chuẩn, qua TCP hoặc Unix socket) giữ:
+- Pool connection PostgreSQL (psycopg2.pool.ThreadedConnectionPool)
+- Cache kết quả dạng Arrow IPC trong bộ nhớ (LRU theo dung lượng, theo data_version),
+  phía sau là result cache trên đĩa như dashboard (result_cache.py / query_registry.py)
+- Single-flight: các request giống nhau đến cùng lúc chỉ chạy 1 query, các request còn lại chờ kết quả
+Kết quả trả về dạng Arrow IPC stream, client đọc thẳng thành DataFrame (không qua JSON)
+
+Chỉ chạy các query có tên trong ALL_QUERIES / QUERY_REGISTRY (không nhận SQL tùy ý):
+    GET  /version                                   => {"data_version": ...}
+    POST /query  {"query": "<tên trong ALL_QUERIES>"} => Arrow IPC
+    POST /query  {"registry": "<tên>", "values": {...}}
+    GET  /stats                                     => số request, cache hit, số query đã chạy, ...
+
+Chạy:        python streamlit/query_service.py --listen 127.0.0.1:8765 --pool-size 4
+             python streamlit/query_service.py --listen unix:/tmp/spotify_query.sock
+Dashboard:   QUERY_BACKEND=service QUERY_SERVICE_URL=http://127.0.0.1:8765 (hoặc unix:/tmp/spotify_query.sock)
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from sql_queries import ALL_QUERIES
+import query_metrics
+
+load_dotenv()
+
+# Database configuration
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASS = os.getenv("DB_PASS")
+
+# Phía service
+SERVICE_LISTEN = os.getenv("QUERY_SERVICE_LISTEN", "127.0.0.1:8765")
+POOL_SIZE = int(os.getenv("QUERY_SERVICE_POOL", "4"))
+CACHE_MAX_MB = float(os.getenv("QUERY_SERVICE_CACHE_MB", "256"))
+# data_version được đọc lại tối đa mỗi VERSION_TTL giây (không phải mỗi request)
+VERSION_TTL = float(os.getenv("QUERY_SERVICE_VERSION_TTL", "2"))
+
+# Phía client (dashboard)
+SERVICE_URL = os.getenv("QUERY_SERVICE_URL", "http://127.0.0.1:8765")
+SERVICE_TIMEOUT = float(os.getenv("QUERY_SERVICE_TIMEOUT", "300"))
+
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+
+# Cách service lấy được kết quả (header X-Query-Cache)
+SERVED_MEMORY = 'memory'   # Cache Arrow IPC trong bộ nhớ của service
+SERVED_SHARED = 'shared'   # Chờ request giống hệt đang chạy (single-flight)
+
+# ========================================
+# ARROW IPC
+# ========================================
+
+def to_ipc(df):
+    """DataFrame => bytes Arrow IPC stream"""
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def from_ipc(body):
+    """bytes Arrow IPC stream => DataFrame (ngày giữ dạng datetime.date như đường cursor)"""
+    import pyarrow as pa
+    return pa.ipc.open_stream(body).read_all().to_pandas(date_as_object=True)
+
+# ========================================
+# CACHE + SINGLE-FLIGHT
+# ========================================
+
+def version_order(data_version):
+    """Thứ tự của data_version: số của PostgreSQL hoặc 'pq<số>' của bản export Parquet"""
+    return int(str(data_version).removeprefix('pq'))
+
+class ResultCache:
+    """LRU các kết quả Arrow IPC theo dung lượng; chỉ giữ kết quả của data_version mới nhất"""
+
+    def __init__(self, max_mb=None):
+        self.max_bytes = (CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+        self.entries = OrderedDict()
+        self.total = 0
+        self.data_version = None
+        self.lock = threading.Lock()
+
+    def get(self, key, data_version):
+        with self.lock:
+            if data_version != self.data_version:
+                return None
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, data_version, body):
+        with self.lock:
+            if self.data_version is not None and version_order(data_version) < version_order(self.data_version):
+                # Query chậm của version cũ xong sau version mới: không xóa cache của version mới
+                return
+            if data_version != self.data_version:
+                # data_version chỉ tăng => kết quả của version cũ không bao giờ được đọc lại
+                self.entries.clear()
+                self.total = 0
+                self.data_version = data_version
+            if key in self.entries:
+                self.total -= len(self.entries.pop(key))
+            if len(body) > self.max_bytes:
+                return
+            self.entries[key] = body
+            self.total += len(body)
+            while self.total > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total -= len(evicted)
+
+class SingleFlight:
+    """Gộp các lời gọi cùng key đang chạy đồng thời: chỉ lời gọi đầu tiên thực thi"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Trả về (kết quả, True nếu dùng chung kết quả của lời gọi khác)"""
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+
+# ========================================
+# SERVICE
+# ========================================
+
+class QueryService:
+    """Chạy query theo tên qua pool connection, cache và single-flight"""
+
+    def __init__(self, pool_size=None, backend='postgres', cache_mb=None):
+        self.backend = backend
+        self.pool = None
+        pool_size = pool_size or POOL_SIZE
+        if backend == 'postgres':
+            from psycopg2 import pool
+            self.pool = pool.ThreadedConnectionPool(
+                1, pool_size,
+                host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS
+            )
+        # getconn() báo lỗi khi pool hết connection => giới hạn số thread mượn cùng lúc
+        self.slots = threading.BoundedSemaphore(pool_size)
+        self.cache = ResultCache(cache_mb)
+        self.flight = SingleFlight()
+        self.version = (None, 0.0)
+        self.version_lock = threading.Lock()
+        self.stats = {'requests': 0, SERVED_MEMORY: 0, SERVED_SHARED: 0, query_metrics.CACHE_DISK: 0,
+                      query_metrics.CACHE_MISS: 0, 'errors': 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, field):
+        with self.stats_lock:
+            self.stats[field] += 1
+
+    def with_connection(self, fn):
+        """Mượn 1 connection của pool; connection hỏng thì bị đóng thay vì trả lại pool"""
+        with self.slots:
+            conn = self.pool.getconn()
+            try:
+                return fn(conn)
+            finally:
+                self.pool.putconn(conn, close=bool(conn.closed))
+
+    def data_version(self):
+        """data_version hiện tại, đọc lại sau mỗi VERSION_TTL giây"""
+        with self.version_lock:
+            value, read_at = self.version
+            if value is None or time.monotonic() - read_at >= VERSION_TTL:
+                if self.backend == 'duckdb':
+                    import columnar_backend
+                    value = columnar_backend.get_data_version()
+                else:
+                    import result_cache
+                    value = self.with_connection(result_cache.get_data_version)
+                self.version = (value, time.monotonic())
+            return value
+
+    def request_key(self, request):
+        """Chuẩn hóa request => (key cache, hàm chạy query(data_version) -> DataFrame)"""
+        import query_registry
+        import result_cache
+        if self.backend == 'duckdb':
+            import columnar_backend
+        if 'registry' in request:
+            name = request['registry']
+            params = query_registry.bind_params(name, request.get('values'))
+            key = ('registry', name, json.dumps(params, sort_keys=True, default=str))
+            if self.backend == 'duckdb':
+                return key, lambda version: columnar_backend.run_registered_query(name, version, params)
+            return key, lambda version: self.with_connection(
+                lambda conn: query_registry.run_registered_query(conn, name, version, params))
+        name = request.get('query')
+        if name not in ALL_QUERIES:
+            raise KeyError(f"Query '{name}' không có trong ALL_QUERIES")
+        if self.backend == 'duckdb':
+            return ('query', name), lambda version: columnar_backend.run_cached_query(ALL_QUERIES[name], version)
+        return ('query', name), lambda version: self.with_connection(
+            lambda conn: result_cache.run_cached_query(conn, ALL_QUERIES[name], version))
+
+    def execute(self, request):
+        """Trả về (bytes Arrow IPC, data_version, nguồn kết quả)"""
+        self.count('requests')
+        key, run = self.request_key(request)
+        version = self.data_version()
+        body = self.cache.get(key, version)
+        if body is not None:
+            self.count(SERVED_MEMORY)
+            return body, version, SERVED_MEMORY
+
+        def load():
+            # Request trước có thể vừa ghi cache xong
+            cached = self.cache.get(key, version)
+            if cached is not None:
+                return cached, SERVED_MEMORY
+            query_metrics.begin()
+            df = run(version)
+            body = to_ipc(df)
+            self.cache.put(key, version, body)
+            return body, query_metrics.last_cache() or query_metrics.CACHE_MISS
+
+        try:
+            (body, served), shared = self.flight.do((key, version), load)
+        except Exception:
+            self.count('errors')
+            raise
+        served = SERVED_SHARED if shared else served
+        self.count(served)
+        return body, version, served
+
+    def snapshot(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats.update({'backend': self.backend, 'data_version': self.version[0],
+                      'cache_entries': len(self.cache.entries),
+                      'cache_mb': round(self.cache.total / 1024 / 1024, 3)})
+        return stats
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.closeall()
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    service = None
+
+    def address_string(self):
+        # Unix socket không có địa chỉ client
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8'))
+
+    def do_GET(self):
+        try:
+            if self.path == '/version':
+                self.send_json(200, {'data_version': self.service.data_version()})
+            elif self.path == '/stats':
+                self.send_json(200, self.service.snapshot())
+            else:
+                self.send_json(404, {'error': f"Không có {self.path}"})
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+
+    def do_POST(self):
+        if self.path != '/query':
+            self.send_json(404, {'error': f"Không có {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            body, version, served = self.service.execute(request)
+        except (KeyError, ValueError, TypeError) as e:
+            self.send_json(400, {'error': str(e.args[0]) if e.args else str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_body(200, body, ARROW_STREAM, {'X-Data-Version': version, 'X-Query-Cache': served})
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def make_server(listen=None, service=None):
+    """listen: 'host:port' hoặc 'unix:/đường/dẫn.sock'"""
+    listen = listen or SERVICE_LISTEN
+    unix = listen.startswith('unix:')
+    # TCP: header và body được ghi bằng 2 lần send => tắt Nagle để không bị trễ ~40ms do delayed ACK
+    handler = type('Handler', (RequestHandler,), {'service': service or QueryService(),
+                                                  'disable_nagle_algorithm': not unix})
+    if unix:
+        path = listen[len('unix:'):]
+        if os.path.exists(path):
+            os.remove(path)
+        return ThreadingUnixHTTPServer(path, handler)
+    host, _, port = listen.rpartition(':')
+    return ThreadingHTTPServer((host or '127.0.0.1', int(port)), handler)
+
+# ========================================
+# CLIENT (dashboard)
+# ========================================
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+_local = threading.local()
+
+def _connection():
+    """Connection keep-alive tới service, mỗi thread 1 connection"""
+    if getattr(_local, 'conn', None) is None:
+        if SERVICE_URL.startswith('unix:'):
+            _local.conn = UnixHTTPConnection(SERVICE_URL[len('unix:'):], SERVICE_TIMEOUT)
+        else:
+            url = urlsplit(SERVICE_URL)
+            _local.conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=SERVICE_TIMEOUT)
+    return _local.conn
+
+def _request(method, path, payload=None):
+    """Gửi request (thử lại 1 lần nếu connection keep-alive đã bị đóng), trả về (response, body)"""
+    body = None if payload is None else json.dumps(payload, default=str).encode('utf-8')
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    for attempt in range(2):
+        conn = _connection()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            break
+        except (ConnectionError, http.client.HTTPException, OSError):
+            conn.close()
+            _local.conn = None
+            if attempt:
+                raise
+    if response.status != 200:
+        raise RuntimeError(f"Query service: {json.loads(data).get('error', response.reason)}")
+    return response, data
+
+def get_data_version():
+    """data_version mà service đang dùng"""
+    _, data = _request('GET', '/version')
+    return json.loads(data)['data_version']
+
+def fetch(name, request, params=None):
+    """Gọi service, ghi metric (cache = 'service', service_cache = nguồn kết quả phía service)"""
+    start = time.perf_counter()
+    try:
+        response, body = _request('POST', '/query', request)
+    except Exception as e:
+        query_metrics.record(name, query_metrics.CACHE_ERROR, params=params,
+                             total_ms=(time.perf_counter() - start) * 1000, error=str(e))
+        raise
+    received = time.perf_counter()
+    df = from_ipc(body)
+    query_metrics.record(
+        name, query_metrics.CACHE_SERVICE, params=params,
+        total_ms=(time.perf_counter() - start) * 1000,
+        fetch_ms=(time.perf_counter() - received) * 1000,
+        service_cache=response.getheader('X-Query-Cache'), ipc_bytes=len(body),
+        rows=len(df), bytes=query_metrics.dataframe_bytes(df)
+    )
+    return df
+
+def run_query(query):
+    """Query trong ALL_QUERIES (theo câu SQL như dashboard gọi) qua service"""
+    name = query_metrics.query_name(query)
+    if name not in ALL_QUERIES:
+        raise KeyError(f"Query service chỉ chạy các query trong ALL_QUERIES ({name})")
+    return fetch(name, {'query': name})
+
+def run_registered_query(name, values=None):
+    """Query có tham số trong QUERY_REGISTRY qua service"""
+    values = dict(values or {})
+    return fetch(f"{name} [registry]", {'registry': name, 'values': values}, params=values)
+
+def service_stats():
+    _, data = _request('GET', '/stats')
+    return json.loads(data)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query service dùng chung cho các replica dashboard")
+    parser.add_argument('--listen', default=SERVICE_LISTEN, help="host:port hoặc unix:/đường/dẫn.sock")
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE, help="Số connection PostgreSQL tối đa")
+    parser.add_argument('--cache-mb', type=float, default=CACHE_MAX_MB, help="Dung lượng cache Arrow trong bộ nhớ")
+    parser.add_argument('--backend', choices=['postgres', 'duckdb'], default='postgres',
+                        help="Nơi chạy query (duckdb: bản export Parquet, xem columnar_backend.py)")
+    args = parser.parse_args()
+    service = QueryService(args.pool_size, args.backend, args.cache_mb)
+    server = make_server(args.listen, service)
+    print(f"🛰️  Query service ({args.backend}, pool {args.pool_size}) đang nghe tại {args.listen}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Result cache trên đĩa cho các truy vấn của dashboard
+- Kết quả query được lưu thành file Parquet (Arrow) trong RESULT_CACHE_DIR
+- Cache key = hash(query) + data_version của kho dữ liệu (bảng etl_metadata)
+- ETL tăng data_version mỗi lần commit => cache chỉ hết hạn khi có dữ liệu mới
+- Giới hạn dung lượng RESULT_CACHE_MAX_MB, vượt quá thì xóa file ít dùng nhất (LRU)
+"""
+
+import hashlib
+import json
+import os
+import time
+import pandas as pd
+from dotenv import load_dotenv
+import db_fetch
+import query_metrics
+
+load_dotenv()
+
+# Cấu hình cache
+CACHE_DIR = os.getenv(
+    "RESULT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".result_cache")
+)
+CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "512"))
+
+# Khi kho dữ liệu chưa có etl_metadata (ETL phiên bản cũ) thì quay về
+# cơ chế hết hạn theo thời gian như @st.cache_data(ttl=600) trước đây
+FALLBACK_TTL = 600
+
+def get_data_version(conn):
+    """Đọc data_version hiện tại của kho dữ liệu từ etl_metadata"""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT meta_value FROM etl_metadata WHERE meta_key = 'data_version'")
+            row = cur.fetchone()
+        if row is not None:
+            return str(row[0])
+    except Exception:
+        # Bảng chưa tồn tại: rollback để connection không kẹt ở transaction lỗi
+        conn.rollback()
+    return f"ttl{int(time.time() // FALLBACK_TTL)}"
+
+def query_hash(query, params=None):
+    """Hash ổn định của câu query (và bộ tham số nếu có)"""
+    payload = json.dumps([query, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+def _cache_path(qhash, data_version):
+    return os.path.join(CACHE_DIR, f"{qhash}_{data_version}.parquet")
+
+def load_result(query, data_version, params=None):
+    """Đọc kết quả từ cache, trả về None nếu chưa có"""
+    path = _cache_path(query_hash(query, params), data_version)
+    if not os.path.exists(path):
+        return None
+    try:
+        df = pd.read_parquet(path)
+    except Exception:
+        # File hỏng (ví dụ process bị kill khi đang ghi) => bỏ đi, coi như miss
+        _remove(path)
+        return None
+    # Cập nhật mtime để đánh dấu file vừa được dùng (LRU)
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return df
+
+def store_result(query, data_version, df, params=None):
+    """Ghi kết quả vào cache, xóa các phiên bản cũ của cùng query"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    qhash = query_hash(query, params)
+    path = _cache_path(qhash, data_version)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    except Exception:
+        # Một số kiểu dữ liệu không ghi được ra Parquet => chỉ bỏ qua cache
+        _remove(tmp_path)
+        return False
+
+    # data_version chỉ tăng nên kết quả của version khác sẽ không bao giờ được đọc lại
+    for name in os.listdir(CACHE_DIR):
+        if name.startswith(f"{qhash}_") and name.endswith('.parquet') and name != os.path.basename(path):
+            _remove(os.path.join(CACHE_DIR, name))
+
+    evict_lru()
+    return True
+
+def evict_lru(max_mb=None):
+    """Xóa các file ít được dùng nhất cho đến khi tổng dung lượng <= max_mb"""
+    max_bytes = (CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith('.parquet'):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= size
+        removed += 1
+    return removed
+
+def clear_cache():
+    """Xóa toàn bộ result cache"""
+    if not os.path.isdir(CACHE_DIR):
+        return
+    for name in os.listdir(CACHE_DIR):
+        _remove(os.path.join(CACHE_DIR, name))
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def run_cached_query(conn, query, data_version, params=None, refresh=False, name=None, fetch=None):
+    """
+    Thực thi query qua result cache trên đĩa
+    Hit => đọc Parquet, Miss => chạy trên PostgreSQL rồi ghi cache
+    refresh=True: bỏ qua cache đang có, chạy lại và ghi đè
+    fetch: hàm fetch(query, params) -> (DataFrame, stats) dùng thay PostgreSQL
+    (ví dụ backend DuckDB trong columnar_backend.py), khi đó conn có thể là None
+    """
+    name = name or query_metrics.query_name(query)
+    start = time.perf_counter()
+    if not refresh:
+        df = load_result(query, data_version, params)
+        if df is not None:
+            query_metrics.record(
+                name, query_metrics.CACHE_DISK, params=params,
+                total_ms=(time.perf_counter() - start) * 1000,
+                rows=len(df), bytes=query_metrics.dataframe_bytes(df)
+            )
+            return df
+
+    try:
+        if fetch is not None:
+            df, stats = fetch(query, params)
+        else:
+            df, stats = db_fetch.fetch_dataframe(conn, query, params)
+    except Exception as e:
+        if conn is not None:
+            conn.rollback()
+        query_metrics.record(name, query_metrics.CACHE_ERROR, params=params,
+                             total_ms=(time.perf_counter() - start) * 1000, error=str(e))
+        raise
+    explain = {}
+    if fetch is None and query_metrics.should_explain():
+        explain = query_metrics.explain_analyze(conn, query, params)
+
+    write_start = time.perf_counter()
+    store_result(query, data_version, df, params)
+    query_metrics.record(
+        name, query_metrics.CACHE_MISS, params=params,
+        total_ms=(time.perf_counter() - start) * 1000,
+        cache_write_ms=(time.perf_counter() - write_start) * 1000,
+        rows=len(df), bytes=query_metrics.dataframe_bytes(df),
+        **stats, **explain
+    )
+    return df
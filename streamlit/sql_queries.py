@@ -5,6 +5,19 @@ Cấu trúc database: dim_song, dim_artist không có quan hệ trực tiếp
 Cần join qua fact_artist_stats để lấy thông tin nghệ sĩ
 """
 
+# Nhãn của các mã nhóm audio trong dim_audio_features (audio_band_codes trong ETL):
+# query GROUP BY theo mã SMALLINT rồi mới gán nhãn cho các dòng đã gộp, nhãn thứ i+1 ứng với mã i
+BAND_LABELS = "(ARRAY['Low', 'Medium', 'High'])"
+ENERGY_BAND_LABELS = "(ARRAY['Low Energy', 'Medium Energy', 'High Energy'])"
+DANCE_BAND_LABELS = "(ARRAY['Low Dance', 'Medium Dance', 'High Dance'])"
+VALENCE_BAND_LABELS = "(ARRAY['Sad', 'Neutral', 'Happy'])"
+TEMPO_BAND_LABELS = "(ARRAY['Slow', 'Medium', 'Fast', 'Very Fast'])"
+GENRE_LABELS = "(ARRAY['High Energy Dance', 'High Energy', 'Dance', 'Acoustic', 'Positive', 'Melancholic', 'Balanced'])"
+MOOD_TRENDING_LABELS = "(ARRAY['Energetic', 'Happy', 'Sad', 'Neutral'])"
+MOOD_REGIONAL_LABELS = "(ARRAY['Happy & Energetic', 'Happy', 'Energetic', 'Melancholic', 'Neutral'])"
+MOOD_PROFILE_LABELS = "(ARRAY['Happy', 'Calm', 'Energetic', 'Sad', 'Neutral'])"
+MOOD_QUADRANT_LABELS = "(ARRAY['Happy', 'Calm', 'Energetic', 'Sad', 'Neutral'])"
+
 # ============================================
 # 1. XU HƯỚNG ÂM NHẠC TOÀN CẦU
 # ============================================
@@ -28,107 +41,75 @@ ORDER BY avg_popularity DESC, num_countries DESC
 LIMIT 20;
 """
 
-# 1.2 Xu hướng bài hát theo thời gian (30 ngày gần nhất)
+# 1.2 Xu hướng bài hát (snapshot ngày mới nhất của trend_song_daily, rolling 30 ngày)
 QUERY_TRENDING_SONGS = """
-WITH recent_data AS (
-    SELECT 
-        s.song_name,
-        STRING_AGG(DISTINCT a.artist_name, ', ') as artist_name,
-        d.full_date as date,
-        AVG(fsd.daily_rank) as avg_rank,
-        AVG(fsd.popularity_score) as avg_popularity
-    FROM fact_song_daily fsd
-    JOIN dim_song s ON fsd.song_id = s.song_id
-    LEFT JOIN fact_artist_stats fas ON fsd.song_id = fas.song_id AND fsd.date_id = fas.date_id
-    LEFT JOIN dim_artist a ON fas.artist_id = a.artist_id
-    JOIN dim_date d ON fsd.date_id = d.date_id
-    WHERE d.full_date >= CURRENT_DATE - INTERVAL '30 days'
-    GROUP BY s.song_name, d.full_date
-)
 SELECT 
-    song_name,
-    artist_name,
-    date,
-    avg_rank,
-    avg_popularity,
-    LAG(avg_rank) OVER (PARTITION BY song_name ORDER BY date) as prev_rank,
-    avg_rank - LAG(avg_rank) OVER (PARTITION BY song_name ORDER BY date) as rank_change
-FROM recent_data
-ORDER BY date DESC, avg_popularity DESC
+    t.song_name,
+    t.artist_name,
+    t.full_date as date,
+    t.avg_rank,
+    t.avg_popularity,
+    t.prev_rank,
+    t.rank_change,
+    t.rank_delta_7d,
+    t.rank_30d as window_avg_rank,
+    t.popularity_30d as window_avg_popularity,
+    t.num_countries
+FROM trend_song_daily t
+WHERE t.full_date = (SELECT MAX(full_date) FROM trend_song_daily)
+ORDER BY t.avg_popularity DESC, t.song_name
 LIMIT 50;
 """
 
 # 1.3 Phân tích xu hướng theo đặc điểm âm thanh (thay thế genre)
-QUERY_GENRE_TRENDS = """
+QUERY_GENRE_TRENDS = f"""
 WITH audio_categories AS (
     SELECT 
-        CASE 
-            WHEN faa.energy > 0.7 AND faa.danceability > 0.7 THEN 'High Energy Dance'
-            WHEN faa.energy > 0.7 THEN 'High Energy'
-            WHEN faa.danceability > 0.7 THEN 'Dance'
-            WHEN faa.acousticness > 0.5 THEN 'Acoustic'
-            WHEN faa.valence > 0.6 THEN 'Positive'
-            WHEN faa.valence < 0.4 THEN 'Melancholic'
-            ELSE 'Balanced'
-        END as music_category,
-        fsd.song_id,
-        fsd.popularity_score,
-        fsd.daily_rank,
-        fsd.rank_points
+        daf.genre_code,
+        COUNT(DISTINCT fsd.song_id) as num_songs,
+        AVG(fsd.popularity_score) as avg_popularity,
+        AVG(fsd.daily_rank) as avg_rank,
+        SUM(fsd.rank_points) as total_rank_points
     FROM fact_song_daily fsd
     JOIN fact_audio_analysis faa ON fsd.song_id = faa.song_id
+    JOIN dim_audio_features daf ON faa.features_id = daf.features_id
+    GROUP BY daf.genre_code
 )
 SELECT 
-    music_category,
-    COUNT(DISTINCT song_id) as num_songs,
-    AVG(popularity_score) as avg_popularity,
-    AVG(daily_rank) as avg_rank,
-    SUM(rank_points) as total_rank_points
+    {GENRE_LABELS}[genre_code + 1] as music_category,
+    num_songs,
+    avg_popularity,
+    avg_rank,
+    total_rank_points
 FROM audio_categories
-GROUP BY music_category
 ORDER BY avg_popularity DESC
 LIMIT 15;
 """
 
 # 1.4 Đặc điểm âm thanh của bài hát trending
-QUERY_AUDIO_FEATURES_TRENDING = """
+QUERY_AUDIO_FEATURES_TRENDING = f"""
 WITH audio_levels AS (
     SELECT 
-        CASE 
-            WHEN faa.energy < 0.3 THEN 'Low Energy'
-            WHEN faa.energy < 0.7 THEN 'Medium Energy'
-            ELSE 'High Energy'
-        END as energy_level,
-        CASE 
-            WHEN faa.danceability < 0.3 THEN 'Low Dance'
-            WHEN faa.danceability < 0.7 THEN 'Medium Dance'
-            ELSE 'High Dance'
-        END as danceability_level,
-        CASE 
-            WHEN faa.valence < 0.3 THEN 'Sad'
-            WHEN faa.valence < 0.7 THEN 'Neutral'
-            ELSE 'Happy'
-        END as valence_level,
-        CASE 
-            WHEN faa.valence > 0.6 AND faa.energy > 0.6 THEN 'Energetic'
-            WHEN faa.valence > 0.6 THEN 'Happy'
-            WHEN faa.valence < 0.4 AND faa.energy < 0.4 THEN 'Sad'
-            ELSE 'Neutral'
-        END as mood,
-        fsd.popularity_score
+        daf.energy_band,
+        daf.danceability_band,
+        daf.valence_band,
+        daf.mood_trending,
+        COUNT(*) as song_count,
+        AVG(fsd.popularity_score) as avg_popularity
     FROM fact_song_daily fsd
     JOIN fact_audio_analysis faa ON fsd.song_id = faa.song_id
+    JOIN dim_audio_features daf ON faa.features_id = daf.features_id
     WHERE fsd.popularity_score >= 70
+    GROUP BY daf.energy_band, daf.danceability_band, daf.valence_band, daf.mood_trending
 )
 SELECT 
-    energy_level,
-    danceability_level,
-    valence_level,
-    mood,
-    COUNT(*) as song_count,
-    AVG(popularity_score) as avg_popularity
+    {ENERGY_BAND_LABELS}[energy_band + 1] as energy_level,
+    {DANCE_BAND_LABELS}[danceability_band + 1] as danceability_level,
+    {VALENCE_BAND_LABELS}[valence_band + 1] as valence_level,
+    {MOOD_TRENDING_LABELS}[mood_trending + 1] as mood,
+    song_count,
+    avg_popularity
 FROM audio_levels
-GROUP BY energy_level, danceability_level, valence_level, mood
 ORDER BY song_count DESC
 LIMIT 20;
 """
@@ -168,31 +149,18 @@ ORDER BY num_countries DESC, avg_popularity DESC
 LIMIT 20;
 """
 
-# 2.3 Nghệ sĩ đang trending (tăng trưởng nhanh)
+# 2.3 Nghệ sĩ đang trending: độ phổ biến TB 7 ngày so với TB 60 ngày (snapshot ngày mới nhất)
 QUERY_TRENDING_ARTISTS = """
-WITH artist_metrics AS (
-    SELECT 
-        a.artist_name,
-        d.week_of_year as week,
-        d.year,
-        AVG(fas.song_popularity) as avg_popularity,
-        COUNT(DISTINCT fas.song_id) as num_songs_chart
-    FROM fact_artist_stats fas
-    JOIN dim_artist a ON fas.artist_id = a.artist_id
-    JOIN dim_date d ON fas.date_id = d.date_id
-    WHERE d.full_date >= CURRENT_DATE - INTERVAL '60 days'
-    GROUP BY a.artist_name, d.week_of_year, d.year
-)
 SELECT 
-    artist_name,
-    MAX(avg_popularity) as current_popularity,
-    MIN(avg_popularity) as starting_popularity,
-    MAX(avg_popularity) - MIN(avg_popularity) as popularity_growth,
-    AVG(num_songs_chart) as avg_songs_in_chart
-FROM artist_metrics
-GROUP BY artist_name
-HAVING MAX(avg_popularity) - MIN(avg_popularity) > 5
-ORDER BY popularity_growth DESC
+    t.artist_name,
+    t.popularity_7d as current_popularity,
+    t.popularity_60d as baseline_popularity,
+    t.popularity_7d - t.popularity_60d as popularity_growth,
+    t.songs_60d as avg_songs_in_chart
+FROM trend_artist_daily t
+WHERE t.full_date = (SELECT MAX(full_date) FROM trend_artist_daily)
+    AND t.popularity_7d - t.popularity_60d > 0
+ORDER BY popularity_growth DESC, t.artist_name
 LIMIT 20;
 """
 
@@ -228,7 +196,7 @@ WITH ranked_songs AS (
         s.song_name,
         STRING_AGG(DISTINCT a.artist_name, ', ') as artist_name,
         AVG(fsd.popularity_score) as avg_popularity,
-        ROW_NUMBER() OVER (PARTITION BY c.country_name ORDER BY AVG(fsd.popularity_score) DESC) as rank
+        ROW_NUMBER() OVER (PARTITION BY c.country_name ORDER BY AVG(fsd.popularity_score) DESC, s.song_name) as rank
     FROM fact_song_daily fsd
     JOIN dim_country c ON fsd.country_id = c.country_id
     JOIN dim_song s ON fsd.song_id = s.song_id
@@ -280,41 +248,29 @@ LIMIT 25;
 """
 
 # 3.4 Sở thích âm nhạc theo khu vực (audio features)
-QUERY_REGIONAL_MUSIC_PREFERENCES = """
+QUERY_REGIONAL_MUSIC_PREFERENCES = f"""
 WITH regional_audio AS (
     SELECT 
-        c.country_name as region,
-        CASE 
-            WHEN faa.valence > 0.6 AND faa.energy > 0.6 THEN 'Happy & Energetic'
-            WHEN faa.valence > 0.6 THEN 'Happy'
-            WHEN faa.energy > 0.6 THEN 'Energetic'
-            WHEN faa.valence < 0.4 THEN 'Melancholic'
-            ELSE 'Neutral'
-        END as mood,
-        CASE 
-            WHEN faa.energy < 0.3 THEN 'Low'
-            WHEN faa.energy < 0.7 THEN 'Medium'
-            ELSE 'High'
-        END as energy_level,
-        CASE 
-            WHEN faa.danceability < 0.3 THEN 'Low'
-            WHEN faa.danceability < 0.7 THEN 'Medium'
-            ELSE 'High'
-        END as danceability_level,
-        fsd.popularity_score
+        fsd.country_id,
+        daf.mood_regional,
+        daf.energy_band,
+        daf.danceability_band,
+        COUNT(*) as song_count,
+        AVG(fsd.popularity_score) as avg_popularity
     FROM fact_song_daily fsd
-    JOIN dim_country c ON fsd.country_id = c.country_id
     JOIN fact_audio_analysis faa ON fsd.song_id = faa.song_id
+    JOIN dim_audio_features daf ON faa.features_id = daf.features_id
+    GROUP BY fsd.country_id, daf.mood_regional, daf.energy_band, daf.danceability_band
 )
 SELECT 
-    region,
-    mood,
-    energy_level,
-    danceability_level,
-    COUNT(*) as song_count,
-    AVG(popularity_score) as avg_popularity
-FROM regional_audio
-GROUP BY region, mood, energy_level, danceability_level
+    c.country_name as region,
+    {MOOD_REGIONAL_LABELS}[ra.mood_regional + 1] as mood,
+    {BAND_LABELS}[ra.energy_band + 1] as energy_level,
+    {BAND_LABELS}[ra.danceability_band + 1] as danceability_level,
+    ra.song_count,
+    ra.avg_popularity
+FROM regional_audio ra
+JOIN dim_country c ON ra.country_id = c.country_id
 ORDER BY region, song_count DESC
 LIMIT 100;
 """
@@ -323,18 +279,17 @@ LIMIT 100;
 # 4. PHÂN TÍCH THEO THỜI GIAN
 # ============================================
 
-# 4.1 Xu hướng theo ngày trong tuần
+# 4.1 Xu hướng theo ngày trong tuần (đọc bảng phi chuẩn hóa wide_song_daily, không cần join dim_date)
 QUERY_POPULARITY_BY_WEEKDAY = """
 SELECT 
-    d.day_of_week,
-    d.day_name,
-    COUNT(DISTINCT fsd.song_id) as num_songs,
-    AVG(fsd.popularity_score) as avg_popularity,
-    AVG(fsd.daily_rank) as avg_rank
-FROM fact_song_daily fsd
-JOIN dim_date d ON fsd.date_id = d.date_id
-GROUP BY d.day_of_week, d.day_name
-ORDER BY d.day_of_week;
+    w.day_of_week,
+    w.day_name,
+    COUNT(DISTINCT w.song_id) as num_songs,
+    AVG(w.popularity_score) as avg_popularity,
+    AVG(w.daily_rank) as avg_rank
+FROM wide_song_daily w
+GROUP BY w.day_of_week, w.day_name
+ORDER BY w.day_of_week;
 """
 
 # 4.2 Xu hướng theo tháng
@@ -450,92 +405,61 @@ ORDER BY al.release_year DESC;
 # ============================================
 
 # 6.1 Mối quan hệ giữa đặc điểm âm thanh và độ phổ biến
-QUERY_AUDIO_FEATURES_POPULARITY = """
+QUERY_AUDIO_FEATURES_POPULARITY = f"""
 WITH audio_categories AS (
     SELECT 
-        CASE 
-            WHEN faa.energy < 0.3 THEN 'Low'
-            WHEN faa.energy < 0.7 THEN 'Medium'
-            ELSE 'High'
-        END as energy_level,
-        CASE 
-            WHEN faa.danceability < 0.3 THEN 'Low'
-            WHEN faa.danceability < 0.7 THEN 'Medium'
-            ELSE 'High'
-        END as danceability_level,
-        CASE 
-            WHEN faa.valence < 0.3 THEN 'Low'
-            WHEN faa.valence < 0.7 THEN 'Medium'
-            ELSE 'High'
-        END as valence_level,
-        CASE 
-            WHEN faa.acousticness < 0.3 THEN 'Low'
-            WHEN faa.acousticness < 0.7 THEN 'Medium'
-            ELSE 'High'
-        END as acousticness_level,
-        CASE 
-            WHEN faa.tempo < 90 THEN 'Slow'
-            WHEN faa.tempo < 120 THEN 'Medium'
-            WHEN faa.tempo < 150 THEN 'Fast'
-            ELSE 'Very Fast'
-        END as tempo_category,
-        CASE 
-            WHEN faa.valence > 0.6 AND faa.energy > 0.6 THEN 'Happy'
-            WHEN faa.valence > 0.6 THEN 'Calm'
-            WHEN faa.valence < 0.4 AND faa.energy > 0.6 THEN 'Energetic'
-            WHEN faa.valence < 0.4 THEN 'Sad'
-            ELSE 'Neutral'
-        END as mood,
-        fsd.popularity_score,
-        s.duration_ms
+        daf.energy_band,
+        daf.danceability_band,
+        daf.valence_band,
+        daf.acousticness_band,
+        daf.tempo_band,
+        daf.mood_profile,
+        COUNT(*) as song_count,
+        AVG(fsd.popularity_score) as avg_popularity,
+        AVG(s.duration_ms / 1000.0 / 60.0) as avg_duration_minutes
     FROM fact_song_daily fsd
     JOIN fact_audio_analysis faa ON fsd.song_id = faa.song_id
+    JOIN dim_audio_features daf ON faa.features_id = daf.features_id
     JOIN dim_song s ON fsd.song_id = s.song_id
+    GROUP BY daf.energy_band, daf.danceability_band, daf.valence_band, 
+             daf.acousticness_band, daf.tempo_band, daf.mood_profile
 )
 SELECT 
-    energy_level,
-    danceability_level,
-    valence_level,
-    acousticness_level,
-    tempo_category,
-    mood,
-    COUNT(*) as song_count,
-    AVG(popularity_score) as avg_popularity,
-    AVG(duration_ms / 1000.0 / 60.0) as avg_duration_minutes
+    {BAND_LABELS}[energy_band + 1] as energy_level,
+    {BAND_LABELS}[danceability_band + 1] as danceability_level,
+    {BAND_LABELS}[valence_band + 1] as valence_level,
+    {BAND_LABELS}[acousticness_band + 1] as acousticness_level,
+    {TEMPO_BAND_LABELS}[tempo_band + 1] as tempo_category,
+    {MOOD_PROFILE_LABELS}[mood_profile + 1] as mood,
+    song_count,
+    avg_popularity,
+    avg_duration_minutes
 FROM audio_categories
-GROUP BY energy_level, danceability_level, valence_level, 
-         acousticness_level, tempo_category, mood
 ORDER BY avg_popularity DESC
 LIMIT 30;
 """
 
 # 6.2 Phân tích mood của bài hát phổ biến
-QUERY_MOOD_ANALYSIS = """
+QUERY_MOOD_ANALYSIS = f"""
 WITH mood_categories AS (
     SELECT 
-        CASE 
-            WHEN faa.valence > 0.6 AND faa.energy > 0.6 THEN 'Happy'
-            WHEN faa.valence > 0.6 AND faa.energy < 0.4 THEN 'Calm'
-            WHEN faa.valence < 0.4 AND faa.energy > 0.6 THEN 'Energetic'
-            WHEN faa.valence < 0.4 AND faa.energy < 0.4 THEN 'Sad'
-            ELSE 'Neutral'
-        END as mood,
-        fsd.song_id,
-        fsd.popularity_score,
-        fsd.daily_rank,
-        fsd.country_id
+        daf.mood_quadrant,
+        COUNT(DISTINCT fsd.song_id) as num_songs,
+        AVG(fsd.popularity_score) as avg_popularity,
+        AVG(fsd.daily_rank) as avg_rank,
+        COUNT(DISTINCT fsd.country_id) as num_countries
     FROM fact_song_daily fsd
     JOIN fact_audio_analysis faa ON fsd.song_id = faa.song_id
+    JOIN dim_audio_features daf ON faa.features_id = daf.features_id
+    GROUP BY daf.mood_quadrant
 )
 SELECT 
-    mood,
-    COUNT(DISTINCT song_id) as num_songs,
-    AVG(popularity_score) as avg_popularity,
-    AVG(daily_rank) as avg_rank,
-    COUNT(DISTINCT country_id) as num_countries
+    {MOOD_QUADRANT_LABELS}[mood_quadrant + 1] as mood,
+    num_songs,
+    avg_popularity,
+    avg_rank,
+    num_countries
 FROM mood_categories
-WHERE mood IS NOT NULL
-GROUP BY mood
 ORDER BY avg_popularity DESC;
 """
 
@@ -593,6 +517,27 @@ GROUP BY duration_category
 ORDER BY avg_popularity DESC;
 """
 
+# ============================================
+# 8. BỘ LỌC DASHBOARD
+# ============================================
+
+# 8.1 Khoảng ngày có dữ liệu
+QUERY_DATE_BOUNDS = """
+SELECT 
+    MIN(full_date) as min_date,
+    MAX(full_date) as max_date
+FROM dim_date;
+"""
+
+# 8.2 Danh sách quốc gia
+QUERY_COUNTRY_LIST = """
+SELECT 
+    country_code,
+    country_name
+FROM dim_country
+ORDER BY country_code;
+"""
+
 # Dictionary chứa tất cả queries để dễ truy cập
 ALL_QUERIES = {
     # Xu hướng âm nhạc
@@ -631,4 +576,472 @@ ALL_QUERIES = {
     # Summary
     'summary_stats': QUERY_SUMMARY_STATS,
     'duration_analysis': QUERY_DURATION_ANALYSIS,
+    
+    # Bộ lọc dashboard
+    'date_bounds': QUERY_DATE_BOUNDS,
+    'country_list': QUERY_COUNTRY_LIST,
+}
+
+# ============================================
+# 9. QUERY CÓ THAM SỐ (FILTER PUSHDOWN)
+# ============================================
+# Các query dưới đây là phiên bản có tham số của các query ở trên: khoảng ngày,
+# danh sách quốc gia, top-N... được bind phía server (placeholder %(name)s)
+# thay vì hard-code, để PostgreSQL lọc bằng index ngay trong query.
+# Tham số có giá trị NULL nghĩa là không lọc theo tham số đó.
+
+# Điều kiện lọc dùng chung (yêu cầu query có alias d = dim_date, c = dim_country)
+DATE_RANGE_FILTER = """(%(start_date)s::date IS NULL OR d.full_date >= %(start_date)s::date)
+    AND (%(end_date)s::date IS NULL OR d.full_date <= %(end_date)s::date)"""
+COUNTRY_FILTER = """(%(countries)s::text[] IS NULL OR c.country_code = ANY(%(countries)s::text[]))"""
+
+# Điều kiện lọc tương tự cho bảng phi chuẩn hóa (alias w = wide_song_daily)
+WIDE_DATE_RANGE_FILTER = DATE_RANGE_FILTER.replace('d.full_date', 'w.full_date')
+WIDE_COUNTRY_FILTER = COUNTRY_FILTER.replace('c.country_code', 'w.country_code')
+
+# Khai báo tham số: (tên, kiểu PostgreSQL, giá trị mặc định)
+DATE_RANGE_PARAMS = [('start_date', 'date', None), ('end_date', 'date', None)]
+COUNTRY_PARAMS = [('countries', 'text[]', None)]
+
+def top_n_param(default):
+    return ('top_n', 'integer', default)
+
+# 9.1 Top bài hát phổ biến nhất
+PQUERY_TOP_SONGS_GLOBAL = f"""
+SELECT 
+    s.song_name,
+    STRING_AGG(DISTINCT a.artist_name, ', ') as artist_name,
+    COUNT(DISTINCT c.country_name) as num_countries,
+    AVG(fsd.popularity_score) as avg_popularity,
+    AVG(fsd.daily_rank) as avg_rank,
+    MAX(fsd.popularity_score) as max_popularity
+FROM fact_song_daily fsd
+JOIN dim_song s ON fsd.song_id = s.song_id
+JOIN dim_date d ON fsd.date_id = d.date_id
+JOIN dim_country c ON fsd.country_id = c.country_id
+LEFT JOIN fact_artist_stats fas ON fsd.song_id = fas.song_id AND fsd.date_id = fas.date_id
+LEFT JOIN dim_artist a ON fas.artist_id = a.artist_id
+WHERE {DATE_RANGE_FILTER}
+    AND {COUNTRY_FILTER}
+GROUP BY s.song_name
+ORDER BY avg_popularity DESC, num_countries DESC
+LIMIT %(top_n)s;
+"""
+
+# 9.2 Xu hướng bài hát: snapshot của trend_song_daily tại end_date (NULL => ngày mới nhất có dữ liệu)
+# Rolling window được ETL tính sẵn cho 7/30/60 ngày, window_days chọn cửa sổ gần nhất (<= 7, <= 30, còn lại 60)
+PQUERY_TRENDING_SONGS = """
+WITH anchor AS (
+    SELECT MAX(full_date) as snapshot_date
+    FROM trend_song_daily
+    WHERE %(end_date)s::date IS NULL OR full_date <= %(end_date)s::date
+)
+SELECT 
+    t.song_name,
+    t.artist_name,
+    t.full_date as date,
+    t.avg_rank,
+    t.avg_popularity,
+    t.prev_rank,
+    t.rank_change,
+    t.rank_delta_7d,
+    CASE 
+        WHEN %(window_days)s::integer <= 7 THEN t.rank_7d
+        WHEN %(window_days)s::integer <= 30 THEN t.rank_30d
+        ELSE t.rank_60d
+    END as window_avg_rank,
+    CASE 
+        WHEN %(window_days)s::integer <= 7 THEN t.popularity_7d
+        WHEN %(window_days)s::integer <= 30 THEN t.popularity_30d
+        ELSE t.popularity_60d
+    END as window_avg_popularity,
+    t.num_countries
+FROM trend_song_daily t
+JOIN anchor ON t.full_date = anchor.snapshot_date
+ORDER BY t.avg_popularity DESC, t.song_name
+LIMIT %(top_n)s;
+"""
+
+# 9.3 Top nghệ sĩ phổ biến nhất
+PQUERY_TOP_ARTISTS = f"""
+SELECT 
+    a.artist_name,
+    COUNT(DISTINCT fas.song_id) as total_songs,
+    COUNT(DISTINCT fas.country_id) as countries_present,
+    AVG(fas.artist_score) as avg_artist_score,
+    AVG(fas.song_popularity) as avg_popularity
+FROM fact_artist_stats fas
+JOIN dim_artist a ON fas.artist_id = a.artist_id
+JOIN dim_date d ON fas.date_id = d.date_id
+JOIN dim_country c ON fas.country_id = c.country_id
+WHERE {DATE_RANGE_FILTER}
+    AND {COUNTRY_FILTER}
+GROUP BY a.artist_name
+ORDER BY avg_artist_score DESC, countries_present DESC
+LIMIT %(top_n)s;
+"""
+
+# 9.4 Nghệ sĩ có độ phủ sóng quốc tế cao nhất (có mặt ở >= min_countries quốc gia)
+PQUERY_ARTISTS_GLOBAL_REACH = f"""
+SELECT 
+    a.artist_name,
+    COUNT(DISTINCT c.country_name) as num_countries,
+    COUNT(DISTINCT fas.song_id) as num_songs,
+    AVG(fas.song_popularity) as avg_popularity
+FROM fact_artist_stats fas
+JOIN dim_artist a ON fas.artist_id = a.artist_id
+JOIN dim_date d ON fas.date_id = d.date_id
+JOIN dim_country c ON fas.country_id = c.country_id
+WHERE {DATE_RANGE_FILTER}
+    AND {COUNTRY_FILTER}
+GROUP BY a.artist_name
+HAVING COUNT(DISTINCT c.country_name) >= %(min_countries)s
+ORDER BY num_countries DESC, avg_popularity DESC
+LIMIT %(top_n)s;
+"""
+
+# 9.5 Nghệ sĩ đang trending tại end_date: độ phổ biến TB 7 ngày so với TB window_days ngày
+# (window_days <= 30 => cửa sổ 30 ngày, còn lại 60 ngày)
+PQUERY_TRENDING_ARTISTS = """
+WITH anchor AS (
+    SELECT MAX(full_date) as snapshot_date
+    FROM trend_artist_daily
+    WHERE %(end_date)s::date IS NULL OR full_date <= %(end_date)s::date
+),
+artist_trends AS (
+    SELECT 
+        t.artist_name,
+        t.popularity_7d as current_popularity,
+        CASE WHEN %(window_days)s::integer <= 30 THEN t.popularity_30d ELSE t.popularity_60d END as baseline_popularity,
+        CASE WHEN %(window_days)s::integer <= 30 THEN t.songs_30d ELSE t.songs_60d END as avg_songs_in_chart
+    FROM trend_artist_daily t
+    JOIN anchor ON t.full_date = anchor.snapshot_date
+)
+SELECT 
+    artist_name,
+    current_popularity,
+    baseline_popularity,
+    current_popularity - baseline_popularity as popularity_growth,
+    avg_songs_in_chart
+FROM artist_trends
+WHERE current_popularity - baseline_popularity > %(min_growth)s
+ORDER BY popularity_growth DESC, artist_name
+LIMIT %(top_n)s;
+"""
+
+# 9.6 So sánh độ phổ biến giữa các quốc gia
+PQUERY_POPULARITY_BY_CONTINENT = f"""
+SELECT 
+    c.country_name as region,
+    COUNT(DISTINCT fsd.song_id) as unique_songs,
+    COUNT(DISTINCT fas.artist_id) as unique_artists,
+    AVG(fsd.popularity_score) as avg_popularity,
+    MAX(fsd.popularity_score) as max_popularity
+FROM fact_song_daily fsd
+JOIN dim_date d ON fsd.date_id = d.date_id
+JOIN dim_country c ON fsd.country_id = c.country_id
+LEFT JOIN fact_artist_stats fas ON fsd.song_id = fas.song_id AND fsd.date_id = fas.date_id
+WHERE {DATE_RANGE_FILTER}
+    AND {COUNTRY_FILTER}
+GROUP BY c.country_name
+ORDER BY avg_popularity DESC
+LIMIT %(top_n)s;
+"""
+
+# 9.7 Thị trường âm nhạc lớn nhất
+PQUERY_BIGGEST_MUSIC_MARKETS = f"""
+SELECT 
+    c.country_name,
+    COUNT(DISTINCT fsd.song_id) as unique_songs_in_chart,
+    COUNT(DISTINCT fas.artist_id) as unique_artists,
+    AVG(fsd.popularity_score) as avg_popularity,
+    SUM(fsd.rank_points) as total_rank_points
+FROM fact_song_daily fsd
+JOIN dim_date d ON fsd.date_id = d.date_id
+JOIN dim_country c ON fsd.country_id = c.country_id
+LEFT JOIN fact_artist_stats fas ON fsd.song_id = fas.song_id AND fsd.date_id = fas.date_id
+WHERE {DATE_RANGE_FILTER}
+    AND {COUNTRY_FILTER}
+GROUP BY c.country_name
+ORDER BY unique_songs_in_chart DESC, avg_popularity DESC
+LIMIT %(top_n)s;
+"""
+
+# 9.8 Sở thích âm nhạc theo quốc gia
+PQUERY_REGIONAL_MUSIC_PREFERENCES = f"""
+WITH regional_audio AS (
+    SELECT 
+        fsd.country_id,
+        daf.mood_regional,
+        daf.energy_band,
+        daf.danceability_band,
+        COUNT(*) as song_count,
+        AVG(fsd.popularity_score) as avg_popularity
+    FROM fact_song_daily fsd
+    JOIN dim_date d ON fsd.date_id = d.date_id
+    JOIN dim_country c ON fsd.country_id = c.country_id
+    JOIN fact_audio_analysis faa ON fsd.song_id = faa.song_id
+    JOIN dim_audio_features daf ON faa.features_id = daf.features_id
+    WHERE {DATE_RANGE_FILTER}
+        AND {COUNTRY_FILTER}
+    GROUP BY fsd.country_id, daf.mood_regional, daf.energy_band, daf.danceability_band
+)
+SELECT 
+    c.country_name as region,
+    {MOOD_REGIONAL_LABELS}[ra.mood_regional + 1] as mood,
+    {BAND_LABELS}[ra.energy_band + 1] as energy_level,
+    {BAND_LABELS}[ra.danceability_band + 1] as danceability_level,
+    ra.song_count,
+    ra.avg_popularity
+FROM regional_audio ra
+JOIN dim_country c ON ra.country_id = c.country_id
+ORDER BY region, song_count DESC
+LIMIT %(max_rows)s;
+"""
+
+# Cùng query trên bảng phi chuẩn hóa: khi có lọc theo ngày, BRIN index trên full_date
+# chỉ đọc các block của khoảng ngày đó (dữ liệu được append theo thứ tự ngày)
+WQUERY_REGIONAL_MUSIC_PREFERENCES = f"""
+WITH regional_audio AS (
+    SELECT 
+        w.country_id,
+        daf.mood_regional,
+        daf.energy_band,
+        daf.danceability_band,
+        COUNT(*) as song_count,
+        AVG(w.popularity_score) as avg_popularity
+    FROM wide_song_daily w
+    JOIN dim_audio_features daf ON w.features_id = daf.features_id
+    WHERE {WIDE_DATE_RANGE_FILTER}
+        AND {WIDE_COUNTRY_FILTER}
+    GROUP BY w.country_id, daf.mood_regional, daf.energy_band, daf.danceability_band
+)
+SELECT 
+    c.country_name as region,
+    {MOOD_REGIONAL_LABELS}[ra.mood_regional + 1] as mood,
+    {BAND_LABELS}[ra.energy_band + 1] as energy_level,
+    {BAND_LABELS}[ra.danceability_band + 1] as danceability_level,
+    ra.song_count,
+    ra.avg_popularity
+FROM regional_audio ra
+JOIN dim_country c ON ra.country_id = c.country_id
+ORDER BY region, song_count DESC
+LIMIT %(max_rows)s;
+"""
+
+# 9.9 Xu hướng theo tháng
+PQUERY_POPULARITY_BY_MONTH = f"""
+SELECT 
+    d.year,
+    d.month,
+    d.month_name,
+    COUNT(DISTINCT fsd.song_id) as num_songs,
+    AVG(fsd.popularity_score) as avg_popularity,
+    COUNT(DISTINCT fas.artist_id) as num_artists
+FROM fact_song_daily fsd
+JOIN dim_date d ON fsd.date_id = d.date_id
+JOIN dim_country c ON fsd.country_id = c.country_id
+LEFT JOIN fact_artist_stats fas ON fsd.song_id = fas.song_id AND fsd.date_id = fas.date_id
+WHERE {DATE_RANGE_FILTER}
+    AND {COUNTRY_FILTER}
+GROUP BY d.year, d.month, d.month_name
+ORDER BY d.year, d.month;
+"""
+
+# 9.10 Bài hát giữ vị trí #1 lâu nhất
+PQUERY_LONGEST_NUMBER_ONE = f"""
+SELECT 
+    s.song_name,
+    STRING_AGG(DISTINCT a.artist_name, ', ') as artist_name,
+    c.country_name,
+    COUNT(*) as days_at_number_one,
+    MIN(d.full_date) as first_date,
+    MAX(d.full_date) as last_date
+FROM fact_song_daily fsd
+JOIN dim_song s ON fsd.song_id = s.song_id
+LEFT JOIN fact_artist_stats fas ON fsd.song_id = fas.song_id AND fsd.date_id = fas.date_id
+LEFT JOIN dim_artist a ON fas.artist_id = a.artist_id
+JOIN dim_country c ON fsd.country_id = c.country_id
+JOIN dim_date d ON fsd.date_id = d.date_id
+WHERE fsd.daily_rank = 1
+    AND {DATE_RANGE_FILTER}
+    AND {COUNTRY_FILTER}
+GROUP BY s.song_name, c.country_name
+ORDER BY days_at_number_one DESC
+LIMIT %(top_n)s;
+"""
+
+# 9.11 Tổng quan thống kê
+PQUERY_SUMMARY_STATS = f"""
+SELECT 
+    COUNT(DISTINCT s.song_id) as total_songs,
+    COUNT(DISTINCT a.artist_id) as total_artists,
+    COUNT(DISTINCT c.country_name) as total_countries,
+    COUNT(DISTINCT al.album_id) as total_albums,
+    AVG(fsd.popularity_score) as avg_popularity,
+    MAX(fsd.popularity_score) as max_popularity
+FROM fact_song_daily fsd
+JOIN dim_date d ON fsd.date_id = d.date_id
+LEFT JOIN dim_song s ON fsd.song_id = s.song_id
+LEFT JOIN fact_artist_stats fas ON fsd.song_id = fas.song_id AND fsd.date_id = fas.date_id
+LEFT JOIN dim_artist a ON fas.artist_id = a.artist_id
+LEFT JOIN dim_country c ON fsd.country_id = c.country_id
+LEFT JOIN dim_album al ON fsd.album_id = al.album_id
+WHERE {DATE_RANGE_FILTER}
+    AND {COUNTRY_FILTER};
+"""
+
+# ============================================
+# 10. ĐẾM DISTINCT BẰNG SKETCH (HYPERLOGLOG)
+# ============================================
+# Phiên bản của các query 9.6, 9.7, 9.9, 9.11 đọc bảng sketch_daily_country (1 dòng mỗi
+# ngày × quốc gia) thay vì join fact_song_daily với fact_artist_stats:
+# - cột đếm distinct trả về ARRAY_AGG các sketch của nhóm, distinct_sketch.finalize gộp
+#   và ước lượng (phải sort/LIMIT sau bước này nếu thứ tự phụ thuộc vào số đếm)
+# - row_weight/popularity_sum/rank_points_sum đã tính theo cùng phép LEFT JOIN
+#   fact_artist_stats của query gốc nên AVG/SUM khớp với chế độ exact
+
+# 10.1 So sánh độ phổ biến giữa các quốc gia
+SQUERY_POPULARITY_BY_CONTINENT = f"""
+SELECT 
+    c.country_name as region,
+    ARRAY_AGG(sk.song_sketch) as unique_songs,
+    ARRAY_AGG(sk.artist_sketch) as unique_artists,
+    (SUM(sk.popularity_sum) / SUM(sk.row_weight))::float as avg_popularity,
+    MAX(sk.max_popularity) as max_popularity
+FROM sketch_daily_country sk
+JOIN dim_date d ON sk.date_id = d.date_id
+JOIN dim_country c ON sk.country_id = c.country_id
+WHERE {DATE_RANGE_FILTER}
+    AND {COUNTRY_FILTER}
+GROUP BY c.country_name
+ORDER BY avg_popularity DESC
+LIMIT %(top_n)s;
+"""
+
+# 10.2 Thị trường âm nhạc lớn nhất (sort/LIMIT theo số bài hát ước lượng trong finalize)
+SQUERY_BIGGEST_MUSIC_MARKETS = f"""
+SELECT 
+    c.country_name,
+    ARRAY_AGG(sk.song_sketch) as unique_songs_in_chart,
+    ARRAY_AGG(sk.artist_sketch) as unique_artists,
+    (SUM(sk.popularity_sum) / SUM(sk.row_weight))::float as avg_popularity,
+    SUM(sk.rank_points_sum)::float as total_rank_points
+FROM sketch_daily_country sk
+JOIN dim_date d ON sk.date_id = d.date_id
+JOIN dim_country c ON sk.country_id = c.country_id
+WHERE {DATE_RANGE_FILTER}
+    AND {COUNTRY_FILTER}
+GROUP BY c.country_name;
+"""
+
+# 10.3 Xu hướng theo tháng
+SQUERY_POPULARITY_BY_MONTH = f"""
+SELECT 
+    d.year,
+    d.month,
+    d.month_name,
+    ARRAY_AGG(sk.song_sketch) as num_songs,
+    (SUM(sk.popularity_sum) / SUM(sk.row_weight))::float as avg_popularity,
+    ARRAY_AGG(sk.artist_sketch) as num_artists
+FROM sketch_daily_country sk
+JOIN dim_date d ON sk.date_id = d.date_id
+JOIN dim_country c ON sk.country_id = c.country_id
+WHERE {DATE_RANGE_FILTER}
+    AND {COUNTRY_FILTER}
+GROUP BY d.year, d.month, d.month_name
+ORDER BY d.year, d.month;
+"""
+
+# 10.4 Tổng quan thống kê (số quốc gia đếm chính xác: bảng sketch có 1 dòng mỗi quốc gia/ngày)
+SQUERY_SUMMARY_STATS = f"""
+SELECT 
+    ARRAY_AGG(sk.song_sketch) as total_songs,
+    ARRAY_AGG(sk.artist_sketch) as total_artists,
+    COUNT(DISTINCT c.country_name) as total_countries,
+    ARRAY_AGG(sk.album_sketch) as total_albums,
+    (SUM(sk.popularity_sum) / SUM(sk.row_weight))::float as avg_popularity,
+    MAX(sk.max_popularity) as max_popularity
+FROM sketch_daily_country sk
+JOIN dim_date d ON sk.date_id = d.date_id
+LEFT JOIN dim_country c ON sk.country_id = c.country_id
+WHERE {DATE_RANGE_FILTER}
+    AND {COUNTRY_FILTER};
+"""
+
+# Registry: mỗi query khai báo SQL và danh sách tham số có kiểu
+# (thứ tự tham số = thứ tự $1, $2, ... của prepared statement)
+# 'wide_sql' (tùy chọn): SQL tương đương trên wide_song_daily, được dùng khi có lọc theo
+# khoảng ngày (nhanh hơn nhờ BRIN index); không lọc thì scan bảng fact hẹp nhanh hơn
+# 'sketch' (tùy chọn): query đếm distinct bằng HyperLogLog (mục 10) với 'columns' là các cột
+# sketch, 'sort'/'limit' để sắp xếp giảm dần và cắt top-N sau khi ước lượng, 'keys' là các
+# cột nhóm dùng để so sánh với kết quả exact (python distinct_sketch.py --compare)
+QUERY_REGISTRY = {
+    'top_songs_global': {
+        'sql': PQUERY_TOP_SONGS_GLOBAL,
+        'params': DATE_RANGE_PARAMS + COUNTRY_PARAMS + [top_n_param(20)],
+    },
+    'trending_songs': {
+        'sql': PQUERY_TRENDING_SONGS,
+        'params': [('end_date', 'date', None), ('window_days', 'integer', 30), top_n_param(50)],
+    },
+    'top_artists': {
+        'sql': PQUERY_TOP_ARTISTS,
+        'params': DATE_RANGE_PARAMS + COUNTRY_PARAMS + [top_n_param(20)],
+    },
+    'artists_global_reach': {
+        'sql': PQUERY_ARTISTS_GLOBAL_REACH,
+        'params': DATE_RANGE_PARAMS + COUNTRY_PARAMS + [('min_countries', 'integer', 5), top_n_param(20)],
+    },
+    'trending_artists': {
+        'sql': PQUERY_TRENDING_ARTISTS,
+        'params': [('end_date', 'date', None), ('window_days', 'integer', 60),
+                   ('min_growth', 'numeric', 0), top_n_param(20)],
+    },
+    'popularity_by_continent': {
+        'sql': PQUERY_POPULARITY_BY_CONTINENT,
+        'sketch': {
+            'sql': SQUERY_POPULARITY_BY_CONTINENT,
+            'columns': ['unique_songs', 'unique_artists'],
+            'keys': ['region'],
+        },
+        'params': DATE_RANGE_PARAMS + COUNTRY_PARAMS + [top_n_param(15)],
+    },
+    'biggest_music_markets': {
+        'sql': PQUERY_BIGGEST_MUSIC_MARKETS,
+        'sketch': {
+            'sql': SQUERY_BIGGEST_MUSIC_MARKETS,
+            'columns': ['unique_songs_in_chart', 'unique_artists'],
+            'sort': ['unique_songs_in_chart', 'avg_popularity'],
+            'limit': 'top_n',
+            'keys': ['country_name'],
+        },
+        'params': DATE_RANGE_PARAMS + COUNTRY_PARAMS + [top_n_param(25)],
+    },
+    'regional_music_preferences': {
+        'sql': PQUERY_REGIONAL_MUSIC_PREFERENCES,
+        'wide_sql': WQUERY_REGIONAL_MUSIC_PREFERENCES,
+        'params': DATE_RANGE_PARAMS + COUNTRY_PARAMS + [('max_rows', 'integer', 100)],
+    },
+    'popularity_by_month': {
+        'sql': PQUERY_POPULARITY_BY_MONTH,
+        'sketch': {
+            'sql': SQUERY_POPULARITY_BY_MONTH,
+            'columns': ['num_songs', 'num_artists'],
+            'keys': ['year', 'month'],
+        },
+        'params': DATE_RANGE_PARAMS + COUNTRY_PARAMS,
+    },
+    'longest_number_one': {
+        'sql': PQUERY_LONGEST_NUMBER_ONE,
+        'params': DATE_RANGE_PARAMS + COUNTRY_PARAMS + [top_n_param(20)],
+    },
+    'summary_stats': {
+        'sql': PQUERY_SUMMARY_STATS,
+        'sketch': {
+            'sql': SQUERY_SUMMARY_STATS,
+            'columns': ['total_songs', 'total_artists', 'total_albums'],
+        },
+        'params': DATE_RANGE_PARAMS + COUNTRY_PARAMS,
+    },
 }
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Cache warmer: chạy trước toàn bộ ALL_QUERIES (và các query trong QUERY_REGISTRY
+với bộ tham số mặc định của dashboard) rồi ghi kết quả vào result cache,
+để lần mở dashboard đầu tiên sau khi load dữ liệu không phải chờ các query lạnh.
+
+Chạy độc lập:   python streamlit/warm_cache.py --workers 4
+Hoặc từ ETL:    python etl/create_warehouse.py --warm-cache
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+from dotenv import load_dotenv
+from sql_queries import ALL_QUERIES, QUERY_REGISTRY
+import result_cache
+import query_registry
+
+load_dotenv()
+
+# Database configuration
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASS = os.getenv("DB_PASS")
+
+def connect():
+    """Tạo kết nối mới đến PostgreSQL"""
+    return psycopg2.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASS
+    )
+
+def warm_cache(max_workers=4, queries=None, force=False, registry=True):
+    """
+    Thực thi các query với tối đa max_workers query song song (mỗi worker
+    một connection riêng) và lưu kết quả vào result cache.
+    Trả về danh sách kết quả từng query: name, status, seconds, rows
+    """
+    queries = ALL_QUERIES if queries is None else queries
+    registry_names = list(QUERY_REGISTRY) if registry else []
+
+    conn = connect()
+    try:
+        data_version = result_cache.get_data_version(conn)
+    finally:
+        conn.close()
+
+    print(f"\n🔥 WARM CACHE: {len(queries) + len(registry_names)} queries, "
+          f"{max_workers} workers, data_version = {data_version}")
+
+    local = threading.local()
+    connections = []
+    connections_lock = threading.Lock()
+
+    def worker_connection():
+        if getattr(local, 'conn', None) is None:
+            local.conn = connect()
+            with connections_lock:
+                connections.append(local.conn)
+        return local.conn
+
+    def warm_one(name, query, params, run):
+        start = time.perf_counter()
+        try:
+            if not force:
+                df = result_cache.load_result(query, data_version, params)
+                if df is not None:
+                    return {'name': name, 'status': 'cached', 'seconds': time.perf_counter() - start, 'rows': len(df)}
+            df = run(worker_connection())
+            return {'name': name, 'status': 'warmed', 'seconds': time.perf_counter() - start, 'rows': len(df)}
+        except Exception as e:
+            return {'name': name, 'status': f'error: {e}', 'seconds': time.perf_counter() - start, 'rows': 0}
+
+    tasks = []
+    for name, query in queries.items():
+        run = lambda conn, query=query: result_cache.run_cached_query(conn, query, data_version, refresh=True)
+        tasks.append((name, query, None, run))
+    for name in registry_names:
+        run = lambda conn, name=name: query_registry.run_registered_query(conn, name, data_version, refresh=True)
+        tasks.append((f"{name} [registry]", query_registry.cache_sql(name), query_registry.bind_params(name), run))
+
+    total_start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(warm_one, *task) for task in tasks]
+            results = [future.result() for future in futures]
+    finally:
+        for conn in connections:
+            conn.close()
+    total = time.perf_counter() - total_start
+
+    print("-" * 80)
+    for r in sorted(results, key=lambda r: r['seconds'], reverse=True):
+        print(f"  {r['name']:.<40} {r['seconds']:>8.2f}s {r['rows']:>10,} rows  {r['status']}")
+    print("-" * 80)
+    print(f"✅ WARM CACHE: Hoàn thành trong {total:.2f}s "
+          f"(tổng thời gian query {sum(r['seconds'] for r in results):.2f}s)")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Warm result cache cho dashboard")
+    parser.add_argument('--workers', type=int, default=4, help="Số query chạy song song (mặc định 4)")
+    parser.add_argument('--force', action='store_true', help="Chạy lại cả các query đã có trong cache")
+    parser.add_argument('--no-registry', action='store_true', help="Chỉ warm ALL_QUERIES, bỏ qua QUERY_REGISTRY")
+    args = parser.parse_args()
+    warm_cache(max_workers=args.workers, force=args.force, registry=not args.no_registry)
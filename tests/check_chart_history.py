@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra ChartHistory (etl/chart_history.py) trên dữ liệu nhỏ, kết quả tính tay:
+- ngày đến không theo thứ tự (trong cửa sổ) và ngày cũ hơn cửa sổ
+- chuỗi ngày trong BXH dài hơn cửa sổ, chuỗi bị ngắt
+- dòng trùng (key, ngày): dòng đầu được ghi
+- lưu / đọc lại trạng thái qua etl_chart_history (cần database trong .env, transaction được rollback)
+
+    python tests/check_chart_history.py
+"""
+import os
+import sys
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl'))
+from chart_history import ChartHistory, HISTORY_DDL
+
+load_dotenv()
+
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASS = os.getenv("DB_PASS")
+
+# Cửa sổ nhỏ nhất (WEEK + 1) để chuỗi / dữ liệu cũ vượt cửa sổ sau vài ngày
+N_DAYS = 8
+SONG, COUNTRY = 1, 1
+
+def apply_day(history, day, rank, song=SONG, country=COUNTRY):
+    """Ghi 1 dòng, trả về (rank hôm trước, rank 7 ngày trước, streak)"""
+    previous, week, streak = history.apply([song], [country], [day], [rank])
+    return int(previous[0]), int(week[0]), int(streak[0])
+
+def test_streak_longer_than_window():
+    """30 ngày liên tiếp (rank = ngày + 1) rồi nghỉ 1 ngày: streak đếm cả các ngày đã rời cửa sổ"""
+    history = ChartHistory(N_DAYS)
+    for day in range(30):
+        assert apply_day(history, day, day + 1) == (day if day >= 1 else 0, day - 6 if day >= 7 else 0, day + 1), day
+    # Ngày 30 không có trong BXH => ngày 31 bắt đầu chuỗi mới
+    assert apply_day(history, 31, 5) == (0, 25, 1)
+    assert apply_day(history, 32, 4) == (5, 26, 2)
+
+    # Cùng dữ liệu trong 1 lần apply (nhiều khối ngày) cho kết quả như từng ngày
+    days = np.array([day for day in range(33) if day != 30])
+    ranks = np.where(days < 30, days + 1, np.where(days == 31, 5, 4))
+    previous, week, streak = ChartHistory(N_DAYS).apply(np.full(len(days), SONG), np.full(len(days), COUNTRY), days, ranks)
+    assert streak.tolist() == list(range(1, 31)) + [1, 2]
+    assert previous.tolist() == [0] + list(range(1, 30)) + [0, 5]
+    assert week.tolist() == [0] * 7 + list(range(1, 24)) + [25, 26]
+    print("   ✓ chuỗi dài hơn cửa sổ / chuỗi bị ngắt")
+
+def test_out_of_order_days():
+    """Ngày 10 đến trước ngày 9: dòng ngày 9 thấy ngày 8, ngày 11 thấy đủ chuỗi"""
+    history = ChartHistory(N_DAYS)
+    for day in range(9):
+        apply_day(history, day, 20 + day)
+    # Lúc ghi ngày 10 chưa biết ngày 9 => chuỗi bắt đầu lại
+    assert apply_day(history, 10, 3) == (0, 23, 1)
+    # Ngày 9 (trong cửa sổ 3..10): rank hôm trước = ngày 8, ngày 2 đã rời cửa sổ (0), chuỗi 0..9
+    assert apply_day(history, 9, 7) == (28, 0, 10)
+    # Ngày 11: ngày 10 và cả chuỗi 0..10 đã có trong trạng thái
+    assert apply_day(history, 11, 2) == (3, 24, 12)
+    print("   ✓ ngày đến không theo thứ tự")
+
+def test_older_than_window():
+    """Ngày cũ hơn cửa sổ: không biết gì (0) và trạng thái không đổi"""
+    history = ChartHistory(N_DAYS)
+    for day in range(20, 30):
+        apply_day(history, day, day)
+    ranks, streak_before, end_day = history.ranks.copy(), history.streak_before.copy(), history.end_day
+    assert apply_day(history, 5, 1) == (0, 0, 0)
+    # Ngày 21: ngay trước cửa sổ 22..29
+    assert apply_day(history, 21, 1) == (0, 0, 0)
+    assert history.end_day == end_day
+    assert np.array_equal(history.ranks, ranks) and np.array_equal(history.streak_before, streak_before)
+
+    # Trong apply_to_rows: dòng cũ giữ previous_rank / movement / chart_streak của CSV
+    row = (SONG, 1, COUNTRY, 10, 12, 2, -3, True, False, 5, 0.5, 4, np.datetime64('1970-01-06', 'D').astype(object))
+    rows, _ = history.apply_to_rows([row])
+    assert rows[0][4:7] == (12, 2, -3) and rows[0][11] == 4
+    print("   ✓ ngày cũ hơn cửa sổ")
+
+def test_duplicate_rows():
+    """Dòng trùng (key, ngày) trong cùng lần apply hoặc lần sau: giữ rank ghi đầu tiên (như ON CONFLICT DO NOTHING)"""
+    history = ChartHistory(N_DAYS)
+    history.apply([SONG, SONG], [COUNTRY, COUNTRY], [0, 0], [4, 9])
+    apply_day(history, 0, 6)
+    assert apply_day(history, 1, 1) == (4, 0, 2)
+    print("   ✓ dòng trùng")
+
+def test_save_load_round_trip():
+    """save() rồi load() cho cùng trạng thái; 2 trạng thái tính tiếp ra cùng kết quả"""
+    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
+    try:
+        cur = conn.cursor()
+        cur.execute(HISTORY_DDL)
+        history = ChartHistory(N_DAYS)
+        rng = np.random.default_rng(0)
+        days = np.repeat(np.arange(40), 30)
+        songs, countries = rng.integers(1, 20, len(days)), rng.integers(1, 4, len(days))
+        history.apply(songs, countries, days, rng.integers(1, 51, len(days)))
+        history.save(cur)
+
+        loaded = ChartHistory.load(cur, N_DAYS)
+        assert loaded.end_day == history.end_day and len(loaded) == len(history)
+        for name in ('song_ids', 'country_ids', 'ranks', 'streak_before'):
+            assert np.array_equal(getattr(loaded, name), getattr(history, name)), name
+
+        days = np.repeat(np.arange(38, 45), 30)
+        batch = (rng.integers(1, 20, len(days)), rng.integers(1, 4, len(days)), days, rng.integers(1, 51, len(days)))
+        for expected, actual in zip(history.apply(*batch), loaded.apply(*batch)):
+            assert np.array_equal(expected, actual)
+        print("   ✓ lưu / đọc lại trạng thái")
+    finally:
+        conn.rollback()
+        conn.close()
+
+if __name__ == '__main__':
+    print("🧪 ChartHistory:")
+    test_streak_longer_than_window()
+    test_out_of_order_days()
+    test_older_than_window()
+    test_duplicate_rows()
+    test_save_load_round_trip()
+    print("✅ Tất cả kiểm tra đều đạt")
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra ingest_files.py (nhiều worker, file theo ngày) cho cùng kho dữ liệu với create_warehouse.py (1 file):
+- dữ liệu giả lập nhỏ, một số bài có audio features khác nhau giữa các ngày (bài thắng phải là dòng ngày sớm nhất)
+- so sánh fact_audio_analysis (theo spotify_id), số dòng các bảng fact và các query của dashboard
+
+Chạy trên database riêng <DB_NAME>_check (tạo nếu chưa có), không đụng kho dữ liệu trong .env
+
+    python tests/check_ingest_files.py
+"""
+import contextlib
+import io
+import os
+import re
+import sys
+import tempfile
+import pandas as pd
+import psycopg2
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'etl'))
+sys.path.insert(0, os.path.join(ROOT, 'streamlit'))
+
+load_dotenv()
+
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASS = os.getenv("DB_PASS")
+CHECK_DB_NAME = os.getenv("CHECK_DB_NAME", f"{DB_NAME}_check")
+
+# Worker của ingest_files (spawn, chạy lại file này khi khởi động) đọc DB_NAME từ môi trường
+os.environ['CHECK_DB_NAME'] = os.environ['DB_NAME'] = CHECK_DB_NAME
+import create_warehouse
+import ingest_files
+import generate_synthetic_data
+from sql_queries import ALL_QUERIES
+
+N_DAYS = 4
+N_CONFLICTS = 40
+
+def connect(dbname=CHECK_DB_NAME):
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=dbname, user=DB_USER, password=DB_PASS)
+
+def ensure_database():
+    conn = connect(DB_NAME)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (CHECK_DB_NAME,))
+        if cur.fetchone() is None:
+            cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(CHECK_DB_NAME)))
+    conn.close()
+
+def write_data(folder):
+    """
+    CSV giả lập N_DAYS ngày + 1 file mỗi ngày; N_CONFLICTS bài có energy / valence khác nhau giữa các ngày.
+    Các ngày sau chỉ giữ dòng của các bài đó: file ngày đầu lớn nhất nên ghi fact_audio_analysis sau cùng
+    nếu mỗi worker tự ghi (dòng của ngày sau sẽ thắng)
+    Trả về (file gộp, thư mục file theo ngày, spotify_id của các bài bị đổi)
+    """
+    path = os.path.join(folder, 'universal_top_spotify_songs.csv')
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate_synthetic_data.generate(N_DAYS * generate_synthetic_data.ROWS_PER_DAY, path, seed=7, dirty_rate=0)
+    df = pd.read_csv(path, keep_default_na=False, dtype=str)
+    days = df.groupby('spotify_id')['snapshot_date'].nunique()
+    songs = days[days > 1].index[:N_CONFLICTS]
+    first = df.groupby('spotify_id')['snapshot_date'].transform('min')
+    df = df[(df['snapshot_date'] == first.min()) | df['spotify_id'].isin(songs)].copy()
+    first = df.groupby('spotify_id')['snapshot_date'].transform('min')
+    later = df['spotify_id'].isin(songs) & (df['snapshot_date'] > first)
+    # Ngày sau: mood / mức năng lượng khác hẳn; 1 nửa bị thiếu energy (ETL thay bằng 0.5)
+    df.loc[later, 'valence'] = '0.05'
+    df.loc[later, 'energy'] = ['' if i % 2 else '0.95' for i in range(later.sum())]
+    df.to_csv(path, index=False)
+
+    daily = os.path.join(folder, 'daily')
+    os.makedirs(daily)
+    for day, rows in df.groupby('snapshot_date'):
+        rows.to_csv(os.path.join(daily, f'{day}.csv'), index=False)
+    return path, daily, list(songs)
+
+def snapshot(cur):
+    """
+    fact_audio_analysis theo spotify_id, số dòng các bảng fact và kết quả các query
+    (bỏ LIMIT cuối: các dòng bằng nhau ở biên LIMIT có thể ra khác nhau giữa 2 lần chạy)
+    """
+    cur.execute("""
+        SELECT s.spotify_id, a.energy, a.valence, a.mood_score, f.mood_category, f.energy_level
+        FROM fact_audio_analysis a
+        JOIN dim_song s ON s.song_id = a.song_id
+        LEFT JOIN dim_audio_features f ON f.features_id = a.features_id
+        ORDER BY s.spotify_id
+    """)
+    audio = cur.fetchall()
+    counts = {}
+    for table in ('fact_song_daily', 'fact_artist_stats', 'fact_chart_position', 'fact_audio_analysis',
+                  'fact_streaming_metrics', 'wide_song_daily'):
+        cur.execute(f"SELECT COUNT(*) FROM {table}")
+        counts[table] = cur.fetchone()[0]
+    results = {}
+    for name, query in ALL_QUERIES.items():
+        cur.execute(re.sub(r'\s+LIMIT\s+\d+\s*;?\s*$', '', query))
+        results[name] = sorted(map(repr, cur.fetchall()))
+    return audio, counts, results
+
+def test_split_files_match_single_file():
+    ensure_database()
+    with tempfile.TemporaryDirectory() as folder:
+        path, daily, songs = write_data(folder)
+        assert len(songs) == N_CONFLICTS
+
+        # 1 file, tuần tự (create_warehouse.py đọc file trong thư mục hiện tại)
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                create_warehouse.main()
+        finally:
+            os.chdir(cwd)
+        conn = connect()
+        expected = snapshot(conn.cursor())
+        conn.close()
+
+        # Mỗi ngày 1 file, 4 worker, cả 4 file cùng 1 lô
+        with contextlib.redirect_stdout(io.StringIO()):
+            ingest_files.ingest(daily, workers=4, rebuild=True)
+        conn = connect()
+        actual = snapshot(conn.cursor())
+        conn.close()
+
+    expected_audio = dict((row[0], row) for row in expected[0])
+    actual_audio = dict((row[0], row) for row in actual[0])
+    for song in songs:
+        assert actual_audio[song] == expected_audio[song], (song, expected_audio[song], actual_audio[song])
+    assert actual[0] == expected[0]
+    assert actual[1] == expected[1], (expected[1], actual[1])
+    different = [name for name in ALL_QUERIES if actual[2][name] != expected[2][name]]
+    assert not different, different
+    print(f"   ✓ {len(songs)} bài có audio khác nhau giữa các ngày, {len(ALL_QUERIES)} query giống nhau")
+
+if __name__ == '__main__':
+    print(f"🧪 ingest_files.py (nhiều file) so với create_warehouse.py (1 file), database {CHECK_DB_NAME}:")
+    test_split_files_match_single_file()
+    print("✅ Tất cả kiểm tra đều đạt")